@@ -0,0 +1 @@
+# this is just so the test_ in this directory can work appropriately
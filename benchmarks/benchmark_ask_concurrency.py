@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Benchmark `/ask` throughput as the number of in-flight requests grows.
+
+This uses a fake LLM chain which takes `--llm_latency_seconds` to respond so the
+numbers reflect how well a single worker overlaps slow LLM calls (rather than
+how fast any particular provider is).
+
+Example run:
+
+    poetry run python ./benchmarks/benchmark_ask_concurrency.py --llm_latency_seconds 0.5
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+import click
+import httpx
+from langchain_classic.chains.base import Chain
+
+from gen3discoveryai import config
+from gen3discoveryai.main import get_app
+from gen3discoveryai.topic_chains.base import TopicChain
+
+
+class FakeSlowChain(Chain):
+    """
+    Chain which sleeps instead of calling out to an LLM
+    """
+
+    latency_seconds: float = 0.5
+
+    @property
+    def input_keys(self) -> List[str]:
+        return ["query"]
+
+    @property
+    def output_keys(self) -> List[str]:
+        return ["result", "source_documents"]
+
+    def _call(self, inputs: Dict[str, Any], run_manager: Optional[Any] = None):
+        time.sleep(self.latency_seconds)
+        return {"result": "fake answer", "source_documents": []}
+
+    async def _acall(self, inputs: Dict[str, Any], run_manager: Optional[Any] = None):
+        await asyncio.sleep(self.latency_seconds)
+        return {"result": "fake answer", "source_documents": []}
+
+
+class FakeSyncOnlyChain(FakeSlowChain):
+    """
+    Chain without a native async implementation
+    """
+
+    _acall = Chain._acall
+
+
+async def _measure(app, in_flight: int, total_requests: int) -> float:
+    """
+    Send `total_requests` to `/ask` keeping `in_flight` outstanding at a time
+
+    Returns:
+        float: requests per second
+    """
+    semaphore = asyncio.Semaphore(in_flight)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://benchmark"
+    ) as client:
+
+        async def _one_request():
+            async with semaphore:
+                response = await client.post("/ask", json={"query": "benchmark"})
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(_one_request() for _ in range(total_requests)))
+        elapsed = time.perf_counter() - start
+
+    return total_requests / elapsed
+
+
+@click.command()
+@click.option(
+    "--llm_latency_seconds",
+    type=float,
+    default=0.5,
+    help="How long the fake LLM takes to respond.",
+)
+@click.option(
+    "--in_flight",
+    type=str,
+    default="1,2,4,8,16,32,64",
+    help="Comma-separated list of concurrent request counts to measure.",
+)
+@click.option(
+    "--requests_per_level",
+    type=int,
+    default=64,
+    help="Number of requests to send at each concurrency level.",
+)
+def main(llm_latency_seconds, in_flight, requests_per_level):
+    """
+    Print requests/second for native async and sync-only (thread pool) chains
+    """
+    config.DEBUG_SKIP_AUTH = True
+    app = get_app()
+
+    chains = {
+        "native async": FakeSlowChain(latency_seconds=llm_latency_seconds),
+        "sync-only (thread pool)": FakeSyncOnlyChain(
+            latency_seconds=llm_latency_seconds
+        ),
+    }
+
+    print(f"fake LLM latency: {llm_latency_seconds}s")
+    print(f"thread pool size: {config.TOPIC_CHAIN_THREAD_POOL_MAX_WORKERS}")
+    print(f"{'chain':<26}{'in flight':>10}{'req/s':>10}{'speedup':>10}")
+
+    for chain_label, chain in chains.items():
+        config.topics = {
+            "default": {
+                "topic_chain": TopicChain(
+                    name="benchmark", topic="default", chain=chain
+                )
+            }
+        }
+        baseline = None
+        for level in [int(item) for item in in_flight.split(",")]:
+            rps = asyncio.run(_measure(app, level, max(requests_per_level, level)))
+            baseline = baseline or rps
+            print(f"{chain_label:<26}{level:>10}{rps:>10.2f}{rps / baseline:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
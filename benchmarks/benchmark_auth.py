@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of the auth dependency chain for an AI request (authorization, then
+getting the user's ID for the route and usage limits) with and without caching
+verified token claims and Arborist decisions across requests.
+
+Runs fully offline: tokens are real RS256 JWTs signed with a generated key whose
+public key is preloaded as the issuer's JWKS, and Arborist is a local fake which
+answers after a configurable latency.
+
+Example run:
+
+    poetry run python ./benchmarks/benchmark_auth.py --requests 2000 --users 20 --arborist_latency_ms 5
+"""
+
+import asyncio
+import statistics
+import time
+from typing import Any, Dict, List
+
+import click
+import jwt
+from authutils.token import core as authutils_core
+from authutils.token import fastapi as authutils_fastapi
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from starlette.requests import Request
+
+from gen3discoveryai import auth, auth_cache, config
+
+ISSUER = "https://commons.example.org/user"
+KEY_ID = "benchmark-key"
+
+
+class FakeArborist:
+    """
+    Stand-in for the Arborist client which allows everything after `latency` seconds
+    """
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.calls = 0
+
+    async def auth_request(self, *args, **kwargs) -> bool:
+        """Answer an authorization request."""
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return True
+
+
+def create_tokens(users: int) -> List[str]:
+    """
+    Generate a signing key, preload its public key as the issuer's JWKS, and return
+    a signed access token for each user
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = (
+        private_key.public_key()
+        .public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        .decode()
+    )
+    public_keys = asyncio.get_running_loop().create_future()
+    public_keys.set_result({KEY_ID: public_pem})
+    authutils_fastapi._jwt_public_keys[ISSUER] = public_keys
+
+    now = int(time.time())
+    return [
+        jwt.encode(
+            {
+                "sub": str(user),
+                "iss": ISSUER,
+                "aud": ["gen3"],
+                "scope": ["user", "openid"],
+                "pur": "access",
+                "iat": now,
+                "exp": now + 3600,
+            },
+            private_key,
+            algorithm="RS256",
+            headers={"kid": KEY_ID},
+        )
+        for user in range(users)
+    ]
+
+
+def create_request(token: str) -> Request:
+    """
+    Minimal incoming `/ask` request with the token in the Authorization header
+    """
+    return Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "path": "/ask",
+            "query_string": b"",
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+        }
+    )
+
+
+async def run_auth_dependency_chain(request: Request) -> None:
+    """
+    The auth work a single `/ask` request does
+    """
+    await auth.authorize_request(
+        request=request,
+        authz_access_method="read",
+        authz_resources=["/gen3_discovery_ai/ask/default"],
+    )
+    # the route's user ID and the usage limit's user ID
+    await auth.get_user_id(request=request)
+    await auth.get_user_id(request=request)
+
+
+async def benchmark(
+    tokens: List[str], requests: int, arborist_latency: float, cache_ttl: float
+) -> Dict[str, Any]:
+    """
+    Run the auth dependency chain for `requests` requests (cycling through the tokens)
+
+    Returns:
+        dict: latency percentiles and the Arborist calls and token verifications
+            per request
+    """
+    config.AUTH_CACHE_TTL_SECONDS = cache_ttl
+    auth_cache._auth_cache = None
+    arborist = FakeArborist(arborist_latency)
+    auth.arborist = arborist
+
+    verifications = 0
+    validate_jwt = authutils_core.validate_jwt
+
+    def _counting_validate_jwt(*args, **kwargs):
+        nonlocal verifications
+        verifications += 1
+        return validate_jwt(*args, **kwargs)
+
+    authutils_core.validate_jwt = _counting_validate_jwt
+    latencies = []
+    try:
+        for index in range(requests):
+            request = create_request(tokens[index % len(tokens)])
+            start = time.perf_counter()
+            await run_auth_dependency_chain(request)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        authutils_core.validate_jwt = validate_jwt
+
+    latencies.sort()
+    return {
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "arborist_calls_per_request": arborist.calls / requests,
+        "verifications_per_request": verifications / requests,
+    }
+
+
+async def run(requests: int, users: int, arborist_latency: float) -> Dict[str, Any]:
+    """
+    Benchmark without and with caching across requests
+    """
+    config.DEBUG_SKIP_AUTH = False
+    config.ALLOW_ANONYMOUS_ACCESS = False
+    tokens = create_tokens(users)
+    return {
+        "uncached": await benchmark(tokens, requests, arborist_latency, cache_ttl=0),
+        "cached": await benchmark(tokens, requests, arborist_latency, cache_ttl=60),
+    }
+
+
+@click.command()
+@click.option("--requests", default=1000, show_default=True, help="Requests to run")
+@click.option(
+    "--users", default=10, show_default=True, help="Distinct users (tokens) to cycle"
+)
+@click.option(
+    "--arborist_latency_ms",
+    default=5.0,
+    show_default=True,
+    help="Simulated latency of each Arborist call",
+)
+def main(requests, users, arborist_latency_ms):
+    """
+    Benchmark the auth dependency chain with a fake Arborist
+    """
+    results = asyncio.run(run(requests, users, arborist_latency_ms / 1000))
+    for mode, result in results.items():
+        click.echo(
+            f"{mode}: mean={result['mean_ms']:.3f}ms p50={result['p50_ms']:.3f}ms "
+            f"p95={result['p95_ms']:.3f}ms "
+            f"arborist_calls/request={result['arborist_calls_per_request']:.3f} "
+            f"verifications/request={result['verifications_per_request']:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Benchmark of startup import time for the service, the knowledge loader, and each
+topic chain provider, with `python -X importtime`.
+
+Each scenario runs in a fresh interpreter, so nothing is already imported. Besides the
+total time, it reports which providers' heavy dependencies (langchain integrations and
+chromadb) were imported, since only the configured providers' chains should import
+them (topic chains are registered by dotted path and imported on first use).
+
+Example run:
+
+    poetry run python ./benchmarks/benchmark_import_time.py --repeat 3 --top 10
+"""
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+import click
+
+REPO_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# modules which should only be imported when a topic uses a chain needing them
+PROVIDER_MODULES = (
+    "langchain_openai",
+    "langchain_google_vertexai",
+    "langchain_ollama",
+    "chromadb",
+)
+
+# scenario -> code it times
+SCENARIOS = {
+    "service": "import gen3discoveryai.main",
+    "loader": "import bin.load_into_knowledge_store",
+    **{
+        f"chain:{chain_name}": (
+            "from gen3discoveryai.utils import get_topic_chain_factory\n"
+            f"get_topic_chain_factory().get_class({chain_name!r})"
+        )
+        for chain_name in [
+            "TopicChainOpenAiQuestionAnswerRAG",
+            "TopicChainGoogleQuestionAnswerRAG",
+            "TopicChainOllamaQuestionAnswerRAG",
+        ]
+    },
+}
+
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( +)(\S+)$")
+
+
+def measure(code: str) -> Dict[str, Any]:
+    """
+    Run the code in a fresh interpreter with `-X importtime`
+
+    Args:
+        code (str): Python code to run
+
+    Returns:
+        Dict[str, Any]: "total_ms" of all imports, "modules" (name -> (self ms,
+            cumulative ms)), and "provider_modules" imported
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_DIRECTORY,
+        env={**os.environ, "PYTHONPATH": REPO_DIRECTORY},
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if process.returncode:
+        raise RuntimeError(f"`{code}` failed: {process.stderr[-2000:]}")
+    return parse_import_times(process.stderr)
+
+
+def parse_import_times(output: str) -> Dict[str, Any]:
+    """
+    Parse the report `-X importtime` writes to stderr (see `measure`)
+    """
+    modules = {}
+    total_us = 0
+    for line in output.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules[name] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+        # modules imported directly, rather than by another module
+        if len(indent) == 1:
+            total_us += int(cumulative_us)
+
+    return {
+        "total_ms": total_us / 1000,
+        "modules": modules,
+        "provider_modules": [name for name in PROVIDER_MODULES if name in modules],
+    }
+
+
+def run(scenarios: List[str], repeat: int = 1) -> Dict[str, Dict[str, Any]]:
+    """
+    Measure each scenario `repeat` times
+
+    Returns:
+        Dict[str, Dict[str, Any]]: scenario -> "total_ms" (median), "provider_modules",
+            and "modules" (from the last run)
+    """
+    results = {}
+    for scenario in scenarios:
+        runs = [measure(SCENARIOS[scenario]) for _ in range(repeat)]
+        results[scenario] = {
+            **runs[-1],
+            "total_ms": statistics.median(result["total_ms"] for result in runs),
+        }
+    return results
+
+
+@click.command()
+@click.option(
+    "--scenario",
+    "scenarios",
+    type=click.Choice(list(SCENARIOS)),
+    multiple=True,
+    help="Scenario to time (can be repeated), defaults to all of them",
+)
+@click.option("--repeat", default=3, show_default=True, help="Runs per scenario")
+@click.option(
+    "--top", default=5, show_default=True, help="Slowest modules (self time) to list"
+)
+def main(scenarios, repeat, top):
+    """
+    Time the imports of the service, the loader, and each topic chain
+    """
+    results = run(list(scenarios or SCENARIOS), repeat)
+    for scenario, result in results.items():
+        click.echo(
+            f"{scenario}: {result['total_ms']:.0f}ms, provider modules: "
+            f"{', '.join(result['provider_modules']) or 'none'}"
+        )
+        slowest = sorted(
+            result["modules"].items(), key=lambda item: item[1][0], reverse=True
+        )
+        for name, (self_ms, cumulative_ms) in slowest[:top]:
+            click.echo(f"  {name}: {self_ms:.1f}ms self, {cumulative_ms:.1f}ms total")
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
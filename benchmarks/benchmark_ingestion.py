@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Benchmark knowledge ingestion throughput as the number of concurrent embedding
+requests grows.
+
+This uses a fake embedding function which takes `--embedding_latency_seconds` per
+request (plus a little per document) and an in-memory Chroma collection, so the
+numbers reflect how well ingestion overlaps slow embedding requests and writes
+(rather than how fast any particular provider is).
+
+Example run:
+
+    poetry run python ./benchmarks/benchmark_ingestion.py --embedding_latency_seconds 0.2
+"""
+
+import time
+import uuid
+from typing import List
+
+import chromadb
+import click
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from gen3discoveryai import ingestion
+from gen3discoveryai.ingestion import AdaptiveRateLimiter, embed_and_store
+
+
+class FakeSlowEmbeddings(Embeddings):
+    """
+    Embedding function which sleeps instead of calling out to a provider
+    """
+
+    def __init__(
+        self, latency_seconds: float, seconds_per_document: float, size: int
+    ) -> None:
+        self.latency_seconds = latency_seconds
+        self.seconds_per_document = seconds_per_document
+        self.size = size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency_seconds + self.seconds_per_document * len(texts))
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        value = float(hash(text) % 1000) / 1000
+        return [value] * self.size
+
+
+def _measure(
+    embeddings: Embeddings,
+    documents: List[Document],
+    batch_size: int,
+    concurrency: int,
+) -> float:
+    """
+    Embed and store all the documents in a new collection
+
+    Returns:
+        float: documents per second
+    """
+    vectorstore = Chroma(
+        collection_name=f"benchmark-{uuid.uuid4().hex}",
+        embedding_function=embeddings,
+        client=chromadb.EphemeralClient(),
+    )
+    ids = [str(uuid.uuid4()) for _ in documents]
+
+    start = time.perf_counter()
+    embed_and_store(
+        vectorstore, documents, ids, batch_size=batch_size, concurrency=concurrency
+    )
+    elapsed = time.perf_counter() - start
+
+    assert vectorstore._collection.count() == len(documents)
+    return len(documents) / elapsed
+
+
+@click.command()
+@click.option(
+    "--embedding_latency_seconds",
+    type=float,
+    default=0.2,
+    help="How long each fake embedding request takes, regardless of size.",
+)
+@click.option(
+    "--seconds_per_document",
+    type=float,
+    default=0.001,
+    help="Additional time the fake embedding request takes per document.",
+)
+@click.option(
+    "--documents",
+    type=int,
+    default=2000,
+    help="Number of documents to ingest at each concurrency level.",
+)
+@click.option(
+    "--batch_size",
+    type=int,
+    default=100,
+    help="Documents per embedding request.",
+)
+@click.option(
+    "--concurrency",
+    type=str,
+    default="1,2,4,8",
+    help="Comma-separated list of concurrent embedding request counts to measure.",
+)
+@click.option(
+    "--tokens_per_minute",
+    type=int,
+    default=0,
+    help="Rate limit for the fake provider (0 for none).",
+)
+def main(
+    embedding_latency_seconds,
+    seconds_per_document,
+    documents,
+    batch_size,
+    concurrency,
+    tokens_per_minute,
+):
+    """
+    Print documents/second ingested at each concurrency level
+    """
+    embeddings = FakeSlowEmbeddings(
+        embedding_latency_seconds, seconds_per_document, size=256
+    )
+    all_documents = [
+        Document(
+            page_content=f"study {i} " + "lorem ipsum dolor sit amet " * 20,
+            metadata={"source": str(i)},
+        )
+        for i in range(documents)
+    ]
+
+    print(
+        f"fake embedding latency: {embedding_latency_seconds}s + "
+        f"{seconds_per_document}s per document"
+    )
+    print(f"documents: {documents}, batch size: {batch_size}")
+    print(f"{'concurrency':>12}{'docs/s':>10}{'speedup':>10}")
+
+    baseline = None
+    for level in [int(item) for item in concurrency.split(",")]:
+        # a fresh limiter for each level so they're measured independently
+        ingestion._rate_limiters[type(embeddings).__name__] = AdaptiveRateLimiter(
+            tokens_per_minute
+        )
+        docs_per_second = _measure(embeddings, all_documents, batch_size, level)
+        baseline = baseline or docs_per_second
+        print(f"{level:>12}{docs_per_second:>10.1f}{docs_per_second / baseline:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+Benchmark peak memory (RSS) of loading a large TSV into the knowledge store.
+
+This writes a synthetic TSV with `--rows` rows and loads it with
+`bin/load_into_knowledge_store.py`'s TSV loader in a fresh process for each
+measurement. Documents go through the real pipeline (reading, splitting, ids,
+batching) but the vectorstore only counts what it's given instead of embedding, so
+the numbers reflect the memory used by the loader itself. For comparison, the
+documents for each topic can also be materialized in a list before storing them,
+like the loader used to.
+
+Example run:
+
+    poetry run python ./benchmarks/benchmark_ingestion_memory.py --rows 1000000
+"""
+
+import csv
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import click
+from langchain_core.documents import Document
+
+# the loader lives in the repo's `bin` folder, which isn't installed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from bin import load_into_knowledge_store  # noqa: E402
+from gen3discoveryai.topic_chains.base import TopicChain  # noqa: E402
+
+
+class CountingVectorStore:
+    """
+    Vectorstore which only counts the documents added to it
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def get(self, include: List[str]) -> Dict[str, Any]:
+        return {"ids": []}
+
+    def add_documents(self, documents: List[Document], ids: List[str]) -> None:
+        self.count += len(documents)
+
+    def delete(self, ids: List[str]) -> None:
+        pass
+
+
+class BenchmarkTopicChain(TopicChain):
+    """
+    Topic chain storing knowledge in a `CountingVectorStore`
+    """
+
+    def store_knowledge(self, documents, full_rebuild=False, manifest=None):
+        return self.update_documents_in_vectorstore(documents, full_rebuild)
+
+
+def _write_tsv(path: str, rows: int) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as file_out:
+        writer = csv.writer(file_out, delimiter="\t")
+        writer.writerow(["guid", "title", "description"])
+        for i in range(rows):
+            writer.writerow(
+                [
+                    f"dg.TEST/{i:08d}",
+                    f"Study {i} of something",
+                    f"Synthetic study {i} description. "
+                    + "Participants were followed for several years. " * 5,
+                ]
+            )
+
+
+def _peak_rss_mb() -> float:
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _load(
+    directory: str, splitter: str, materialize: bool, workers: int, results
+) -> None:
+    """
+    Load the TSVs in `directory` (run in a fresh process so peak RSS is its own)
+    """
+    if splitter == "character":
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        load_into_knowledge_store.get_text_splitter = (
+            lambda chunk_size: RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size * 4, chunk_overlap=0
+            )
+        )
+
+    if materialize:
+        store_documents_in_chain = load_into_knowledge_store._store_documents_in_chain
+        load_into_knowledge_store._store_documents_in_chain = (
+            lambda topic_chain, documents, *args: store_documents_in_chain(
+                topic_chain, list(documents), *args
+            )
+        )
+
+    vectorstore = CountingVectorStore()
+    topic_chain = BenchmarkTopicChain(
+        "benchmark", "default", chain=None, vectorstore=vectorstore
+    )
+    load_into_knowledge_store.get_topics_from_config = lambda: {
+        "default": {"topic_chain": topic_chain}
+    }
+
+    baseline_mb = _peak_rss_mb()
+    start = time.perf_counter()
+    load_into_knowledge_store.load_tsvs_from_dir(directory, workers=workers)
+    results.put(
+        (vectorstore.count, time.perf_counter() - start, baseline_mb, _peak_rss_mb())
+    )
+
+
+@click.command()
+@click.option(
+    "--rows",
+    type=str,
+    default="10000,100000,1000000",
+    help="Comma-separated list of TSV row counts to measure.",
+)
+@click.option(
+    "--splitter",
+    type=click.Choice(["tiktoken", "character"]),
+    default="tiktoken",
+    help="Use the loader's tiktoken splitter, or a character splitter if the "
+    "tiktoken encoding isn't available offline.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes to parse and split the TSV in (tiktoken splitter only).",
+)
+@click.option(
+    "--compare/--no-compare",
+    default=True,
+    help="Also measure materializing each topic's documents before storing them.",
+)
+def main(rows, splitter, workers, compare):
+    """
+    Print peak RSS for loading synthetic TSVs of increasing size
+    """
+    if splitter == "character" and workers > 1:
+        raise click.UsageError("the character splitter only works with 1 worker")
+
+    context = multiprocessing.get_context("spawn")
+    modes = ["streaming"] + (["materialized"] if compare else [])
+
+    print(f"splitter: {splitter}, workers: {workers}")
+    print(
+        f"{'mode':<14}{'rows':>10}{'chunks':>10}{'seconds':>10}"
+        f"{'baseline MB':>14}{'peak MB':>10}"
+    )
+
+    for row_count in [int(item) for item in rows.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            _write_tsv(os.path.join(directory, "default.tsv"), row_count)
+
+            for mode in modes:
+                results = context.Queue()
+                process = context.Process(
+                    target=_load,
+                    args=(
+                        directory,
+                        splitter,
+                        mode == "materialized",
+                        workers,
+                        results,
+                    ),
+                )
+                process.start()
+                chunks, seconds, baseline_mb, peak_mb = results.get()
+                process.join()
+                print(
+                    f"{mode:<14}{row_count:>10}{chunks:>10}{seconds:>10.1f}"
+                    f"{baseline_mb:>14.0f}{peak_mb:>10.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
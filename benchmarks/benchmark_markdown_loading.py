@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Benchmark parsing and splitting Markdown files with the loader's built-in section
+parser against `UnstructuredMarkdownLoader`.
+
+By default this generates `--files` synthetic documentation pages (headings, prose,
+lists, code blocks, and tables). Point `--directory` at a real corpus instead, like the
+uc-cdis docs library from `bin/download_files_from_github.py`. Each parser runs in a
+fresh process, so its time and peak RSS (including importing the parser) are its own.
+Nothing is embedded.
+
+Example run:
+
+    poetry run python ./benchmarks/benchmark_markdown_loading.py --directory ./library
+"""
+
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import click
+
+# the loader lives in the repo's `bin` folder, which isn't installed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from bin import load_into_knowledge_store  # noqa: E402
+
+PARAGRAPH = (
+    "Gen3 services expose metadata through the discovery API. Each study has a "
+    "unique identifier, a short name, and a description used for search. "
+)
+
+
+def _write_corpus(directory: str, files: int) -> None:
+    for i in range(files):
+        sections = [f"# Service {i}\n\n{PARAGRAPH * 3}\n"]
+        for j in range(8):
+            sections.append(
+                f"## Section {j}\n\n{PARAGRAPH * (j + 1)}\n\n"
+                f"- item one for {j}\n- item two for {j}\n\n"
+                f"```bash\n# run the service\n./run.py --port {8000 + j}\n```\n\n"
+                f"### Details {j}\n\n| field | value |\n|---|---|\n| id | {j} |\n"
+            )
+        path = os.path.join(directory, f"repo_{i % 20}", f"README_{i}.md")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file_out:
+            file_out.write("\n".join(sections))
+
+
+def _peak_rss_mb() -> float:
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _load(directory: str, parser: str, splitter: str, chunk_size: int, results) -> None:
+    """
+    Parse and split every file in `directory` (run in a fresh process so peak RSS is
+    its own)
+    """
+    if splitter == "character":
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        from gen3discoveryai import markdown_sections
+
+        def _get_text_splitter(chunk_size, *args):
+            return RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size * 4, chunk_overlap=0
+            )
+
+        load_into_knowledge_store.get_text_splitter = _get_text_splitter
+        markdown_sections.get_text_splitter = _get_text_splitter
+
+    files = sorted(
+        entry.path for entry in load_into_knowledge_store.scan_files(directory)
+    )
+    start = time.perf_counter()
+    chunks = 0
+    try:
+        for file in files:
+            chunks += len(
+                load_into_knowledge_store._split_markdown_file(file, chunk_size, parser)
+            )
+    except ImportError as exc:
+        results.put((len(files), None, None, None, str(exc)))
+        return
+    results.put((len(files), chunks, time.perf_counter() - start, _peak_rss_mb(), None))
+
+
+@click.command()
+@click.option(
+    "--directory",
+    type=str,
+    default=None,
+    help="Directory of Markdown files to load, defaults to a synthetic corpus.",
+)
+@click.option(
+    "--files",
+    type=int,
+    default=500,
+    help="Number of synthetic files to generate when no directory is provided.",
+)
+@click.option(
+    "--splitter",
+    type=click.Choice(["tiktoken", "character"]),
+    default="tiktoken",
+    help="Use the loader's tiktoken splitter, or a character splitter if the "
+    "tiktoken encoding isn't available offline.",
+)
+@click.option(
+    "--token_splitter_chunk_size",
+    type=int,
+    default=1000,
+    help="Number of tokens to chunk the content into per doc.",
+)
+def main(directory, files, splitter, token_splitter_chunk_size):
+    """
+    Print time, chunks, and peak RSS for each Markdown parser
+    """
+    with tempfile.TemporaryDirectory() as corpus_directory:
+        if directory is None:
+            directory = corpus_directory
+            _write_corpus(directory, files)
+
+        context = multiprocessing.get_context("spawn")
+        print(f"directory: {directory}, splitter: {splitter}")
+        print(f"{'parser':<14}{'files':>8}{'chunks':>10}{'seconds':>10}{'peak MB':>10}")
+
+        for parser in load_into_knowledge_store.MARKDOWN_PARSERS:
+            results = context.Queue()
+            process = context.Process(
+                target=_load,
+                args=(directory, parser, splitter, token_splitter_chunk_size, results),
+            )
+            process.start()
+            file_count, chunks, seconds, peak_mb, error = results.get()
+            process.join()
+            if error:
+                print(f"{parser:<14}{file_count:>8}  unavailable: {error}")
+                continue
+            print(
+                f"{parser:<14}{file_count:>8}{chunks:>10}{seconds:>10.2f}"
+                f"{peak_mb:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Benchmark the NumPy exact-search vectorstore (`vectorstore:numpy`) against Chroma's
+HNSW index as the number of documents in a topic grows.
+
+For each size, both stores are built from the same synthetic clustered vectors (like
+embeddings of related documents), then queried with vectors near stored ones through
+the same langchain interface the topic chains use. Reported for each:
+
+    - build: time to store all the vectors
+    - open: time to open the persisted store and answer the first query (what a
+      starting worker pays)
+    - p50/p95: query latency, excluding embedding the query
+    - recall@k: fraction of the exact top k (by cosine similarity) returned
+    - disk: size of the persisted store
+
+Example run:
+
+    poetry run python ./benchmarks/benchmark_vectorstores.py --documents 1000,10000,50000
+"""
+
+import os
+import statistics
+import tempfile
+import time
+from typing import List
+
+import chromadb
+import click
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+
+from gen3discoveryai.vectorstores import NumpyVectorStore
+
+CHROMA_SETTINGS = chromadb.Settings(anonymized_telemetry=False)
+# most documents Chroma accepts at once
+ADD_BATCH_SIZE = 5000
+
+
+class UnusedEmbeddings(Embeddings):
+    """
+    Queries are searched by vector, so nothing is ever embedded
+    """
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError()
+
+    def embed_query(self, text: str) -> List[float]:
+        raise NotImplementedError()
+
+
+def _get_vectors(
+    rng: np.random.Generator, count: int, dimensions: int, clusters: int
+) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dimensions))
+    vectors = centers[rng.integers(clusters, size=count)] + 0.5 * rng.standard_normal(
+        (count, dimensions)
+    )
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _open_chroma(directory: str) -> Chroma:
+    return Chroma(
+        client=chromadb.PersistentClient(path=directory, settings=CHROMA_SETTINGS),
+        collection_name="benchmark",
+        embedding_function=UnusedEmbeddings(),
+        collection_metadata={"hnsw:space": "cosine"},
+    )
+
+
+def _open_numpy(directory: str) -> NumpyVectorStore:
+    return NumpyVectorStore(directory, "benchmark", UnusedEmbeddings())
+
+
+def _get_size_mb(directory: str) -> float:
+    return (
+        sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(directory)
+            for name in names
+        )
+        / 1024**2
+    )
+
+
+def _measure(
+    name: str,
+    open_vectorstore,
+    directory: str,
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    exact: List[set],
+    k: int,
+) -> None:
+    vectorstore = open_vectorstore(directory)
+    texts = [f"Synthetic study {i} description." for i in range(len(vectors))]
+    start = time.perf_counter()
+    for batch_start in range(0, len(vectors), ADD_BATCH_SIZE):
+        batch = slice(batch_start, batch_start + ADD_BATCH_SIZE)
+        if isinstance(vectorstore, NumpyVectorStore):
+            vectorstore.add_vectors(
+                texts[batch],
+                vectors[batch],
+                ids=[str(i) for i in range(len(vectors))[batch]],
+            )
+        else:
+            vectorstore._collection.add(  # pylint: disable=protected-access
+                ids=[str(i) for i in range(len(vectors))[batch]],
+                embeddings=vectors[batch],
+                documents=texts[batch],
+            )
+    build_seconds = time.perf_counter() - start
+    del vectorstore
+    chromadb.api.shared_system_client.SharedSystemClient.clear_system_cache()
+
+    start = time.perf_counter()
+    vectorstore = open_vectorstore(directory)
+    vectorstore.similarity_search_by_vector(queries[0].tolist(), k=k)
+    open_seconds = time.perf_counter() - start
+
+    latencies = []
+    found = 0
+    for query, expected in zip(queries, exact):
+        start = time.perf_counter()
+        documents = vectorstore.similarity_search_by_vector(query.tolist(), k=k)
+        latencies.append(time.perf_counter() - start)
+        found += len(expected.intersection(document.id for document in documents))
+
+    latencies.sort()
+    print(
+        f"{name:<8}{len(vectors):>10}{build_seconds:>9.2f}s{open_seconds * 1000:>8.1f}ms"
+        f"{statistics.median(latencies) * 1000:>8.2f}ms"
+        f"{latencies[int(len(latencies) * 0.95)] * 1000:>8.2f}ms"
+        f"{found / (len(queries) * k):>10.3f}{_get_size_mb(directory):>9.1f}MB"
+    )
+
+
+@click.command()
+@click.option(
+    "--documents",
+    type=str,
+    default="1000,10000,50000",
+    help="Comma-separated list of numbers of documents to measure.",
+)
+@click.option("--dimensions", type=int, default=768, help="Dimensions of each vector.")
+@click.option("--queries", type=int, default=200, help="Queries for each measurement.")
+@click.option("--k", type=int, default=4, help="Documents retrieved for each query.")
+@click.option(
+    "--clusters", type=int, default=100, help="Clusters the vectors are drawn from."
+)
+def main(documents, dimensions, queries, k, clusters):
+    """
+    Print build, open, and query times, recall, and disk size for each vectorstore
+    """
+    print(f"dimensions: {dimensions}, queries: {queries}, k: {k}")
+    print(
+        f"{'store':<8}{'documents':>10}{'build':>10}{'open':>10}{'p50':>10}"
+        f"{'p95':>10}{'recall@k':>10}{'disk':>11}"
+    )
+    rng = np.random.default_rng(0)
+    for count in [int(item) for item in documents.split(",")]:
+        vectors = _get_vectors(rng, count, dimensions, clusters)
+        # near (but not exactly) stored vectors
+        queries_vectors = vectors[rng.integers(count, size=queries)] + (
+            0.05 * rng.standard_normal((queries, dimensions)).astype(np.float32)
+        )
+        similarities = queries_vectors.astype(np.float64) @ vectors.T.astype(np.float64)
+        exact = [{str(i) for i in np.argsort(-row)[:k]} for row in similarities]
+
+        for name, open_vectorstore in (
+            ("chroma", _open_chroma),
+            ("numpy", _open_numpy),
+        ):
+            with tempfile.TemporaryDirectory() as directory:
+                _measure(
+                    name,
+                    open_vectorstore,
+                    directory,
+                    vectors,
+                    queries_vectors,
+                    exact,
+                    k,
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""
+Benchmark memory per gunicorn worker and `/ask` throughput as the number of workers
+grows, with and without preloading the app in gunicorn's master process
+(`GUNICORN_PRELOAD_APP`).
+
+This runs the service with `gunicorn.conf.py` and a topic whose chain retrieves from
+a real persisted Chroma store of `--documents` synthetic vectors, but embeds queries
+with a hash instead of an embedding model and answers with a fake LLM, so the numbers
+reflect the service and its knowledge store rather than any provider.
+
+Memory is reported per worker as:
+    - RSS: resident memory, including pages shared with other processes
+    - PSS: resident memory with shared pages split between the processes sharing them
+    - USS: memory only this worker uses (what's freed if it exits)
+
+"total PSS" is the memory used by the master and all its workers together.
+
+Example run:
+
+    poetry run python ./benchmarks/benchmark_workers.py --workers 1,4,8 --documents 20000
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import chromadb
+import click
+import httpx
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_classic.chains import RetrievalQA
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake import FakeListLLM
+
+REPO_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# gunicorn imports this module (from the repo) as the app
+sys.path.insert(0, REPO_DIRECTORY)
+
+# pylint: disable=wrong-import-position
+from gen3discoveryai.knowledge import get_knowledge_store_directory  # noqa: E402
+from gen3discoveryai.main import app  # noqa: E402,F401 pylint: disable=unused-import
+from gen3discoveryai.topic_chains.base import TopicChain  # noqa: E402
+from gen3discoveryai.utils import TOPIC_CHAINS  # noqa: E402
+
+# the repo's gunicorn config, running as the current user instead of the image's
+GUNICORN_CONFIG = """
+import runpy
+
+globals().update(runpy.run_path({path!r}))
+user = {uid}
+group = {gid}
+"""
+
+CHROMA_SETTINGS = chromadb.Settings(anonymized_telemetry=False)
+# most documents Chroma accepts at once
+ADD_BATCH_SIZE = 5000
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Embeds text as a random unit vector seeded by its hash
+    """
+
+    def __init__(self, dimensions: int) -> None:
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8])
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+class BenchmarkTopicChain(TopicChain):
+    """
+    Topic chain retrieving from the topic's persisted Chroma store and answering with
+    a fake LLM
+    """
+
+    NAME = "BenchmarkTopicChain"
+
+    def __init__(self, topic: str, metadata: Dict[str, str] = None) -> None:
+        metadata = metadata or {}
+        vectorstore = Chroma(
+            client=chromadb.PersistentClient(
+                path=get_knowledge_store_directory(topic), settings=CHROMA_SETTINGS
+            ),
+            collection_name=topic,
+            embedding_function=HashEmbeddings(int(metadata.get("dimensions", 384))),
+            collection_metadata={"hnsw:space": "cosine"},
+        )
+        chain = RetrievalQA.from_chain_type(
+            FakeListLLM(responses=["fake answer"]),
+            retriever=vectorstore.as_retriever(search_kwargs={"k": 4}),
+            return_source_documents=True,
+        )
+        super().__init__(
+            name=self.NAME, topic=topic, chain=chain, vectorstore=vectorstore
+        )
+
+
+TOPIC_CHAINS[BenchmarkTopicChain.NAME] = f"{__name__}.{BenchmarkTopicChain.__name__}"
+
+
+def _create_knowledge_store(directory: str, documents: int, dimensions: int) -> None:
+    client = chromadb.PersistentClient(
+        path=os.path.join(directory, "knowledge", "default"), settings=CHROMA_SETTINGS
+    )
+    collection = client.create_collection("default", metadata={"hnsw:space": "cosine"})
+    rng = np.random.default_rng(0)
+    for start in range(0, documents, ADD_BATCH_SIZE):
+        count = min(ADD_BATCH_SIZE, documents - start)
+        vectors = rng.standard_normal((count, dimensions)).astype(np.float32)
+        collection.add(
+            ids=[str(start + i) for i in range(count)],
+            embeddings=vectors / np.linalg.norm(vectors, axis=1, keepdims=True),
+            documents=[
+                f"Synthetic study {start + i} description." for i in range(count)
+            ],
+        )
+
+
+def _get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_gunicorn(
+    directory: str, port: int, workers: int, preload: bool, dimensions: int
+) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "PYTHONPATH": REPO_DIRECTORY,
+        "TOPICS": "default",
+        "DEFAULT_CHAIN_NAME": BenchmarkTopicChain.NAME,
+        "DEFAULT_RAW_METADATA": f"dimensions:{dimensions}",
+        "DEBUG_SKIP_AUTH": "True",
+        "ASK_COALESCING_ENABLED": "False",
+        "KNOWLEDGE_VERSION_POLL_SECONDS": "0",
+        "TOPIC_CONFIG_POLL_SECONDS": "0",
+    }
+    config_path = os.path.join(directory, "gunicorn.conf.py")
+    with open(config_path, "w", encoding="utf-8") as config_out:
+        config_out.write(
+            GUNICORN_CONFIG.format(
+                path=os.path.join(REPO_DIRECTORY, "gunicorn.conf.py"),
+                uid=os.getuid(),
+                gid=os.getgid(),
+            )
+        )
+
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "benchmarks.benchmark_workers:app",
+        "-c",
+        config_path,
+        "-k",
+        "uvicorn.workers.UvicornWorker",
+        "--workers",
+        str(workers),
+        "--bind",
+        f"127.0.0.1:{port}",
+    ]
+    if preload:
+        command.append("--preload")
+    with open(os.path.join(directory, "gunicorn.log"), "w", encoding="utf-8") as log:
+        return subprocess.Popen(
+            command, cwd=directory, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+
+
+def _wait_for_workers(log_path: str, workers: int, timeout: float = 600) -> None:
+    """
+    Wait until every worker finished starting up (creating and warming up its topics)
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with open(log_path, encoding="utf-8") as log_in:
+                started = log_in.read().count("Application startup complete")
+        except FileNotFoundError:
+            started = 0
+        if started >= workers:
+            return
+        time.sleep(0.5)
+    raise TimeoutError(f"gunicorn workers didn't start, see {log_path}")
+
+
+def _get_worker_pids(master_pid: int) -> List[int]:
+    with open(f"/proc/{master_pid}/task/{master_pid}/children", encoding="utf-8") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def _get_memory_mb(pid: int) -> Dict[str, float]:
+    """
+    RSS, PSS, and USS of the process from `/proc/{pid}/smaps_rollup` (Linux only)
+    """
+    with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as smaps_in:
+        kilobytes = {
+            match.group(1): int(match.group(2))
+            for match in re.finditer(r"^(\w+):\s+(\d+) kB", smaps_in.read(), re.M)
+        }
+    return {
+        "rss": kilobytes["Rss"] / 1024,
+        "pss": kilobytes["Pss"] / 1024,
+        "uss": (kilobytes["Private_Clean"] + kilobytes["Private_Dirty"]) / 1024,
+    }
+
+
+async def _measure(port: int, in_flight: int, total_requests: int) -> float:
+    """
+    Send `total_requests` distinct queries to `/ask` keeping `in_flight` outstanding
+    at a time
+
+    Returns:
+        float: requests per second
+    """
+    semaphore = asyncio.Semaphore(in_flight)
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}",
+        timeout=300,
+        limits=httpx.Limits(max_connections=in_flight),
+    ) as client:
+
+        async def _one_request(i):
+            async with semaphore:
+                response = await client.post(
+                    "/ask", json={"query": f"benchmark query {i} {time.time()}"}
+                )
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(_one_request(i) for i in range(total_requests)))
+        elapsed = time.perf_counter() - start
+
+    return total_requests / elapsed
+
+
+@click.command()
+@click.option(
+    "--workers",
+    type=str,
+    default="1,4,8",
+    help="Comma-separated list of gunicorn worker counts to measure.",
+)
+@click.option(
+    "--documents",
+    type=int,
+    default=20000,
+    help="Number of vectors in the topic's knowledge store.",
+)
+@click.option("--dimensions", type=int, default=768, help="Dimensions of each vector.")
+@click.option(
+    "--in_flight",
+    type=int,
+    default=32,
+    help="Concurrent requests while measuring throughput.",
+)
+@click.option(
+    "--requests",
+    "total_requests",
+    type=int,
+    default=1000,
+    help="Number of requests to send for each measurement.",
+)
+def main(workers, documents, dimensions, in_flight, total_requests):
+    """
+    Print memory per worker and requests/second with and without preloading the app
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"creating a knowledge store of {documents} x {dimensions} vectors...")
+        _create_knowledge_store(directory, documents, dimensions)
+
+        print(f"cpus: {os.cpu_count()}, in flight: {in_flight}")
+        print(
+            f"{'preload':<9}{'workers':>8}{'req/s':>10}{'RSS/worker':>12}"
+            f"{'PSS/worker':>12}{'USS/worker':>12}{'total PSS':>12}"
+        )
+        for preload in (False, True):
+            for worker_count in [int(item) for item in workers.split(",")]:
+                log_path = os.path.join(directory, "gunicorn.log")
+                port = _get_free_port()
+                gunicorn = _start_gunicorn(
+                    directory, port, worker_count, preload, dimensions
+                )
+                try:
+                    _wait_for_workers(log_path, worker_count)
+                    # so every worker has answered queries before measuring
+                    asyncio.run(_measure(port, in_flight, worker_count * 20))
+                    rps = asyncio.run(_measure(port, in_flight, total_requests))
+
+                    worker_memory = [
+                        _get_memory_mb(pid) for pid in _get_worker_pids(gunicorn.pid)
+                    ]
+                    total_pss = _get_memory_mb(gunicorn.pid)["pss"] + sum(
+                        memory["pss"] for memory in worker_memory
+                    )
+                finally:
+                    gunicorn.send_signal(signal.SIGTERM)
+                    gunicorn.wait()
+
+                averages = {
+                    key: sum(memory[key] for memory in worker_memory)
+                    / len(worker_memory)
+                    for key in ("rss", "pss", "uss")
+                }
+                print(
+                    f"{str(preload):<9}{worker_count:>8}{rps:>10.1f}"
+                    f"{averages['rss']:>10.0f}MB{averages['pss']:>10.0f}MB"
+                    f"{averages['uss']:>10.0f}MB{total_pss:>10.0f}MB"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import asyncio
+
+from authutils.token import fastapi as authutils_fastapi
+
+from benchmarks.benchmark_auth import run
+from gen3discoveryai import auth, auth_cache, config
+
+
+def test_benchmark_auth(monkeypatch):
+    """
+    Test that the benchmark verifies real tokens against the fake Arborist and that
+    caching avoids repeated verifications and Arborist calls
+    """
+    # the benchmark changes these, restore them afterwards
+    monkeypatch.setattr(authutils_fastapi, "_jwt_public_keys", {})
+    monkeypatch.setattr(auth, "arborist", auth.arborist)
+    monkeypatch.setattr(auth_cache, "_auth_cache", None)
+    for name in ["AUTH_CACHE_TTL_SECONDS", "DEBUG_SKIP_AUTH", "ALLOW_ANONYMOUS_ACCESS"]:
+        monkeypatch.setattr(config, name, getattr(config, name))
+
+    results = asyncio.run(run(requests=20, users=2, arborist_latency=0))
+
+    assert results["uncached"]["arborist_calls_per_request"] == 1
+    assert results["uncached"]["verifications_per_request"] == 1
+    assert results["cached"]["arborist_calls_per_request"] == 0.1
+    assert results["cached"]["verifications_per_request"] == 0.1
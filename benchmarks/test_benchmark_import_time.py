@@ -0,0 +1,39 @@
+from benchmarks.benchmark_import_time import parse_import_times, run
+
+
+def test_benchmark_import_time():
+    """
+    Test that the service and loader don't import any provider's dependencies, and
+    that a topic chain only imports its own provider's (chromadb is imported once a
+    topic's vectorstore is created)
+    """
+    results = run(["service", "loader", "chain:TopicChainOllamaQuestionAnswerRAG"])
+
+    assert results["service"]["provider_modules"] == []
+    assert results["loader"]["provider_modules"] == []
+    assert results["chain:TopicChainOllamaQuestionAnswerRAG"]["provider_modules"] == [
+        "langchain_ollama"
+    ]
+    assert all(result["total_ms"] > 0 for result in results.values())
+
+
+def test_parse_import_times():
+    """
+    Test that only modules imported directly count towards the total
+    """
+    output = "\n".join(
+        [
+            "import time: self [us] | cumulative | imported package",
+            "import time:       100 |        100 |     chromadb.config",
+            "import time:       200 |        300 |   chromadb",
+            "import time:        50 |        350 | gen3discoveryai",
+            "import time:        20 |         20 | json",
+            "something else",
+        ]
+    )
+
+    result = parse_import_times(output)
+
+    assert result["total_ms"] == 0.37
+    assert result["modules"]["chromadb"] == (0.2, 0.3)
+    assert result["provider_modules"] == ["chromadb"]
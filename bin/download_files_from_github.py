@@ -1,100 +1,436 @@
+#!/usr/bin/env python
 """
-Quick example script that gets all Markdown for the uc-cdis GitHub org
-when the GH_TOKEN environment variable is set.
+Quick example script that syncs all Markdown for the uc-cdis GitHub org into a
+`library` folder when the GH_TOKEN environment variable is set.
 
-This dumps all the files into a `library` folder with the repo name
-afterward and then the files themselves from each repo.
+Files are written to `library/{repo}/{path in the repo}`. Downloads run in a pool of
+threads sharing a pooled HTTP session, and requests wait as GitHub's rate limit
+headers (`X-RateLimit-*`, `Retry-After`) ask. Syncing is incremental: a manifest
+(`library/GITHUB_MANIFEST.json`) records each file's blob sha and ETag, so files whose
+sha is unchanged aren't requested at all and others are fetched conditionally.
+Unchanged files aren't rewritten, so `./bin/load_into_knowledge_store.py markdown`
+skips the topic when nothing changed. That loader also reads the manifest to load
+only the synced files, with their GitHub URLs as each chunk's source.
 """
 
+import datetime
+import json
 import logging
 import os
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, Optional
 from urllib.parse import urlparse
 
+import click
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from werkzeug.utils import secure_filename
 
-URL = "https://api.github.com/search/code?q=org:uc-cdis+language:Markdown"
+GITHUB_API_URL = "https://api.github.com"
 GITHUB_TOKEN = str(os.environ.get("GH_TOKEN"))
-AUTH_HEADER = {"Authorization": f"Bearer {GITHUB_TOKEN}"}
 
+# written next to the synced files, see `sync_library`
+MANIFEST_FILENAME = "GITHUB_MANIFEST.json"
 
-def create_library():
+# GitHub code search returns at most 100 results per page and 1000 in total
+SEARCH_PER_PAGE = 100
+SEARCH_MAX_RESULTS = 1000
+
+# one request returns a file's content, rather than its metadata and a download URL
+RAW_CONTENT_TYPE = "application/vnd.github.raw+json"
+
+
+class GitHubRateLimiter:
     """
-    Process items by retrieving them from a URL, downloading files, and waiting for a delay.
+    Pauses requests to each GitHub API resource (e.g. "core" or "search", which have
+    separate limits) for as long as GitHub's rate limit headers ask, across threads.
 
-    Returns:
-        None
+    A response with `Retry-After` pauses for that long. A response with no requests
+    remaining (`X-RateLimit-Remaining: 0`) pauses until `X-RateLimit-Reset`. A rate
+    limited response without either (e.g. a secondary rate limit) pauses with
+    exponential backoff.
     """
-    per_page = 100
-    page = 0
-    results = 100
 
-    while results == per_page:
-        print(f"Processing page: {page}")
-        search_resp = requests.get(
-            URL, params={"page": page, "per_page": per_page}, headers=AUTH_HEADER
+    def __init__(
+        self,
+        backoff_seconds: float = 1,
+        max_backoff_seconds: float = 60,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # resource -> epoch time before which no requests are sent
+        self._resume_at: Dict[str, float] = {}
+        # resource -> rate limited responses in a row
+        self._rate_limited: Dict[str, int] = {}
+
+    def wait(self, resource: str) -> None:
+        """
+        Block until requests for the resource can be sent
+
+        Args:
+            resource (str): GitHub API resource the request is for
+        """
+        while True:
+            with self._lock:
+                delay = self._resume_at.get(resource, 0) - self._clock()
+            if delay <= 0:
+                return
+            logging.info(f"Waiting {delay:.1f}s for the GitHub {resource} rate limit")
+            self._sleep(delay)
+
+    def update(self, resource: str, response: requests.Response) -> bool:
+        """
+        Pause requests for the resource as the response's headers ask
+
+        Args:
+            resource (str): GitHub API resource the request was for
+            response (requests.Response): GitHub's response
+
+        Returns:
+            bool: whether the response was rate limited (so should be retried)
+        """
+        headers = response.headers
+        resource = headers.get("X-RateLimit-Resource", resource)
+        retry_after = headers.get("Retry-After")
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        rate_limited = response.status_code == 429 or (
+            response.status_code == 403
+            and (
+                retry_after is not None
+                or remaining == "0"
+                or "rate limit" in response.text.lower()
+            )
         )
-        print(search_resp)
-        assert search_resp.status_code == 200
 
-        items = search_resp.json()["items"]
-        results = len(items)
-        print(f"Number of items on page {page}: {results}")
+        with self._lock:
+            now = self._clock()
+            resume_at = None
+            if retry_after is not None:
+                resume_at = now + float(retry_after)
+            elif remaining == "0" and reset is not None:
+                # the reset time has second granularity
+                resume_at = float(reset) + 1
+            elif rate_limited:
+                attempts = self._rate_limited.get(resource, 0)
+                resume_at = now + min(
+                    self.backoff_seconds * 2**attempts, self.max_backoff_seconds
+                )
 
-        _download_items(items)
+            if rate_limited:
+                self._rate_limited[resource] = self._rate_limited.get(resource, 0) + 1
+            else:
+                self._rate_limited.pop(resource, None)
+            if resume_at is not None:
+                self._resume_at[resource] = max(
+                    self._resume_at.get(resource, 0), resume_at
+                )
 
-        print("Waiting for 7 seconds...")
-        time.sleep(7)  # API rate limit
+        return rate_limited
 
-        page += 1
 
+def get_session(token: str = None, pool_size: int = 10) -> requests.Session:
+    """
+    Create an HTTP session whose connections are reused across requests and threads,
+    retrying connection errors and server errors
+
+    Args:
+        token (str): GitHub token to authenticate with
+        pool_size (int): connections kept open per host (at least the concurrency)
 
-def _download_items(items):
+    Returns:
+        requests.Session: the session
     """
-    Download items from a list of JSON items.
+    session = requests.Session()
+    retries = Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["GET"],
+        # rate limits are waited for by `GitHubRateLimiter`, across threads
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept"] = "application/vnd.github+json"
+    if token:
+        session.headers["Authorization"] = f"Bearer {token}"
+    return session
+
+
+def sync_library(
+    output_directory: str = "library",
+    org: str = "uc-cdis",
+    session: requests.Session = None,
+    rate_limiter: GitHubRateLimiter = None,
+    api_url: str = GITHUB_API_URL,
+    concurrency: int = 8,
+) -> Dict[str, int]:
+    """
+    Download the Markdown files in the GitHub org which are new or changed since the
+    last sync, and write a manifest of all the synced files.
 
     Args:
-        items (list): A list of JSON items.
+        output_directory (str): where to write the files and manifest
+        org (str): GitHub org to search
+        session (requests.Session): session to make requests with, see `get_session`
+        rate_limiter (GitHubRateLimiter): shared rate limits
+        api_url (str): base URL of the GitHub API
+        concurrency (int): files downloaded at once
 
     Returns:
-        None
+        Dict[str, int]: number of files "downloaded", "unchanged", "failed", and
+            "removed" (no longer found, their files are left in place)
     """
-    for item in items:
-        repo = item["repository"]["name"]
-        file_name = item["name"]
-        output_path = f"library/{repo}"
-        url = str(item["url"])
+    # a connection for each download thread, and one for searching
+    session = session or get_session(GITHUB_TOKEN, pool_size=concurrency + 1)
+    rate_limiter = rate_limiter or GitHubRateLimiter()
+    previous_files = read_manifest(output_directory).get("files", {})
+    files = {}
+    counts = {"downloaded": 0, "unchanged": 0, "failed": 0, "removed": 0}
+    search = {"incomplete": False}
+
+    def _finish(done) -> None:
+        for future in done:
+            key, entry = future.result()
+            if entry is None:
+                counts["failed"] += 1
+                # keep what was synced before, so a failure doesn't remove it
+                if key in previous_files:
+                    files[key] = previous_files[key]
+            else:
+                counts["downloaded" if entry.pop("changed") else "unchanged"] += 1
+                files[key] = entry
+
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="github"
+    ) as executor:
+        pending = set()
+        for item in _search_markdown(session, rate_limiter, api_url, org, search):
+            key = f"{item['repository']['full_name']}/{item['path']}"
+            if key in files or any(future.key == key for future in pending):
+                continue
+
+            previous = previous_files.get(key)
+            if (
+                previous
+                and previous["sha"] == item["sha"]
+                and os.path.exists(os.path.join(output_directory, previous["path"]))
+            ):
+                files[key] = previous
+                counts["unchanged"] += 1
+                continue
 
-        _verify_github_api_url(url)
+            # bound the items waiting to be downloaded
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _finish(done)
 
-        print(f"Processing URL: {url}")
-        try:
-            search_res_resp = requests.get(
-                url, headers={"Authorization": f"Bearer {GITHUB_TOKEN}"}
+            future = executor.submit(
+                _download_item,
+                session,
+                rate_limiter,
+                api_url,
+                item,
+                previous,
+                output_directory,
             )
-        except Exception:
-            logging.error(f"ERROR. Unable to download: {file_name}. Skipping...")
-            continue
+            future.key = key
+            pending.add(future)
 
-        download_url = search_res_resp.json()["download_url"]
-        print(f"Download URL: {download_url}")
-        os.makedirs(output_path, exist_ok=True)
+        _finish(pending)
 
-        try:
-            download_resp = requests.get(download_url)
-        except Exception:
-            logging.error(f"ERROR. Unable to download: {file_name}. Skipping...")
+    for key, previous in previous_files.items():
+        if key in files:
             continue
+        if search["incomplete"]:
+            # GitHub didn't search everything, so it may still exist
+            files[key] = previous
+        else:
+            counts["removed"] += 1
+
+    write_manifest(output_directory, {"org": org, "files": files})
+    logging.info(f"Synced {len(files)} files into {output_directory}: {counts}")
+    return counts
+
+
+def read_manifest(output_directory: str) -> Dict[str, Any]:
+    """
+    Return the manifest of the files synced into the directory, empty if there isn't one
+
+    Args:
+        output_directory (str): directory files were synced into
 
-        with open(secure_filename(f"{output_path}/{file_name}"), "wb") as output_file:
-            output_file.write(download_resp.content)
-        print(f"File downloaded to: {output_path}/{file_name}")
-        print("------")  # Print a separator for better readability
+    Returns:
+        Dict[str, Any]: {"org": ..., "updated_at": ..., "files": {"{repo}/{path}": {
+            "path": path relative to the directory, "repository": ..., "remote_path": ...,
+            "sha": ..., "etag": ..., "html_url": ...}}}
+    """
+    try:
+        with open(
+            os.path.join(output_directory, MANIFEST_FILENAME), "r", encoding="utf-8"
+        ) as manifest_in:
+            return json.load(manifest_in)
+    except FileNotFoundError:
+        return {}
 
 
-def _verify_github_api_url(url):
-    expected_domain = "api.github.com"
+def write_manifest(output_directory: str, manifest: Dict[str, Any]) -> None:
+    """
+    Replace the manifest of the files synced into the directory
+
+    Args:
+        output_directory (str): directory files were synced into
+        manifest (Dict[str, Any]): see `read_manifest`
+    """
+    manifest = {
+        **manifest,
+        "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    _write_atomically(
+        os.path.join(output_directory, MANIFEST_FILENAME),
+        json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"),
+    )
+
+
+def _search_markdown(
+    session: requests.Session,
+    rate_limiter: GitHubRateLimiter,
+    api_url: str,
+    org: str,
+    search: Dict[str, bool],
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the code search results for Markdown files in the org, page by page.
+    `search["incomplete"]` is set if GitHub reports it didn't search everything.
+    """
+    page = 1
+    while (page - 1) * SEARCH_PER_PAGE < SEARCH_MAX_RESULTS:
+        response = _get(
+            session,
+            rate_limiter,
+            f"{api_url}/search/code",
+            "search",
+            params={
+                "q": f"org:{org} language:Markdown",
+                "page": page,
+                "per_page": SEARCH_PER_PAGE,
+            },
+        )
+        response.raise_for_status()
+        results = response.json()
+        items = results["items"]
+        search["incomplete"] = search["incomplete"] or results.get(
+            "incomplete_results", False
+        )
+        logging.info(f"Number of items on page {page}: {len(items)}")
+
+        yield from items
+
+        if len(items) < SEARCH_PER_PAGE:
+            return
+        page += 1
+
+
+def _download_item(
+    session: requests.Session,
+    rate_limiter: GitHubRateLimiter,
+    api_url: str,
+    item: Dict[str, Any],
+    previous: Optional[Dict[str, Any]],
+    output_directory: str,
+):
+    """
+    Download a search result's file unless its ETag matches the previous sync
+
+    Returns:
+        tuple: (manifest key, manifest entry with whether the file "changed", or None
+            if it couldn't be downloaded)
+    """
+    key = f"{item['repository']['full_name']}/{item['path']}"
+    path = os.path.join(
+        secure_filename(item["repository"]["name"]),
+        *[secure_filename(part) for part in item["path"].split("/")],
+    )
+    url = str(item["url"])
+    headers = {"Accept": RAW_CONTENT_TYPE}
+    if (
+        previous
+        and previous.get("etag")
+        and os.path.exists(os.path.join(output_directory, previous["path"]))
+    ):
+        headers["If-None-Match"] = previous["etag"]
+
+    try:
+        _verify_github_api_url(url, api_url)
+        response = _get(session, rate_limiter, url, "core", headers=headers)
+        if response.status_code == 304:
+            logging.debug(f"Unchanged: {key}")
+            return key, {**previous, "sha": item["sha"], "changed": False}
+        response.raise_for_status()
+        _write_atomically(os.path.join(output_directory, path), response.content)
+    except Exception as exc:
+        logging.error(f"ERROR. Unable to download: {key}. Skipping... {exc!r}")
+        return key, None
+
+    logging.info(f"File downloaded to: {os.path.join(output_directory, path)}")
+    return key, {
+        "path": path,
+        "repository": item["repository"]["full_name"],
+        "remote_path": item["path"],
+        "sha": item["sha"],
+        "etag": response.headers.get("ETag"),
+        "html_url": item.get("html_url"),
+        "changed": True,
+    }
+
+
+def _get(
+    session: requests.Session,
+    rate_limiter: GitHubRateLimiter,
+    url: str,
+    resource: str,
+    max_retries: int = 5,
+    **kwargs,
+) -> requests.Response:
+    """
+    GET the url once the resource's rate limit allows, retrying rate limited responses
+    """
+    for _ in range(max_retries):
+        rate_limiter.wait(resource)
+        response = session.get(url, timeout=30, **kwargs)
+        if not rate_limiter.update(resource, response):
+            return response
+    rate_limiter.wait(resource)
+    response = session.get(url, timeout=30, **kwargs)
+    rate_limiter.update(resource, response)
+    return response
+
+
+def _write_atomically(path: str, content: bytes) -> None:
+    """
+    Write then rename, so an interrupted sync never leaves a partially written file
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file_out:
+        file_out.write(content)
+    os.replace(tmp_path, path)
+
+
+def _verify_github_api_url(url, api_url=GITHUB_API_URL):
+    expected_domain = urlparse(api_url).netloc
 
     parsed_url = urlparse(url)
     domain = parsed_url.netloc
@@ -103,5 +439,27 @@ def _verify_github_api_url(url):
         raise ValueError(f"The URL domain is not {expected_domain}")
 
 
+@click.command()
+@click.option(
+    "--output_directory",
+    type=str,
+    default="library",
+    help="Directory to sync the files and manifest into.",
+)
+@click.option("--org", type=str, default="uc-cdis", help="GitHub org to search.")
+@click.option(
+    "--concurrency", type=int, default=8, help="Number of files downloaded at once."
+)
+@click.option(
+    "--api_url", type=str, default=GITHUB_API_URL, help="Base URL of the GitHub API."
+)
+def create_library(output_directory, org, concurrency, api_url):
+    """
+    Sync the Markdown files in a GitHub org into a local directory.
+    """
+    logging.basicConfig(level=logging.INFO)
+    sync_library(output_directory, org, api_url=api_url, concurrency=concurrency)
+
+
 if __name__ == "__main__":
     create_library()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Replay a query log through the semantic cache and report the hit rate for each
+similarity threshold, so a topic's `semantic_cache_similarity_threshold` can be
+chosen offline.
+
+The query log is either plain text (one query per line) or JSONL where each line is
+`{"query": "...", "intent": "..."}`. `intent` is optional, when provided queries with
+the same intent are considered to have the same answer and the precision of the cache
+hits is reported as well (e.g. how often a hit would have returned the right answer).
+
+By default, a fake hashing bag-of-words embedder is used so this runs offline without
+calling out to an embedding provider.
+
+Example run:
+
+    poetry run python ./bin/evaluate_semantic_cache.py ./queries.jsonl --thresholds 0.8,0.9,0.95
+"""
+
+import hashlib
+import json
+import re
+from typing import Any, Dict, List
+
+import click
+from langchain_core.embeddings import Embeddings
+
+from gen3discoveryai.semantic_cache import SemanticCacheIndex, normalize_vector
+
+
+class HashingBagOfWordsEmbeddings(Embeddings):
+    """
+    Deterministic fake embedder where each word is hashed into one of `size` dimensions.
+    Queries sharing most of their words are similar, which is a reasonable stand-in
+    for paraphrases when evaluating offline.
+    """
+
+    def __init__(self, size: int = 256) -> None:
+        self.size = size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for word in re.findall(r"\w+", text.casefold()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "big") % self.size] += 1.0
+        return vector
+
+
+def load_query_log(path: str) -> List[Dict[str, Any]]:
+    """
+    Load the query log (plain text or JSONL)
+
+    Args:
+        path (str): path to the query log
+
+    Returns:
+        List[dict]: entries with `query` and (optionally) `intent`
+    """
+    entries = []
+    with open(path, "r", encoding="utf-8") as query_log:
+        for line in query_log:
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith("{"):
+                entry = json.loads(line)
+            else:
+                entry = {"query": line}
+            entries.append(entry)
+    return entries
+
+
+def evaluate(
+    entries: List[Dict[str, Any]],
+    embeddings: Embeddings,
+    threshold: float,
+    max_entries: int = 1000,
+) -> Dict[str, Any]:
+    """
+    Replay the queries against an empty semantic cache index, caching an answer on
+    every miss like `/ask` does
+
+    Args:
+        entries (List[dict]): query log entries from `load_query_log`
+        embeddings (Embeddings): embedding function
+        threshold (float): minimum cosine similarity for a hit
+        max_entries (int): max queries remembered by the index
+
+    Returns:
+        dict: hit rate (and hit precision if intents are available)
+    """
+    index = SemanticCacheIndex(max_entries)
+    hits = 0
+    correct_hits = 0
+    has_intents = all("intent" in entry for entry in entries)
+
+    for position, entry in enumerate(entries):
+        vector = normalize_vector(embeddings.embed_query(entry["query"]))
+        answer, _ = index.lookup(vector, threshold)
+
+        if answer is None:
+            index.add(
+                vector,
+                {"response": f"answer {position}", "intent": entry.get("intent")},
+                ttl=float("inf"),
+            )
+            continue
+
+        hits += 1
+        if has_intents and answer["intent"] == entry["intent"]:
+            correct_hits += 1
+
+    results = {
+        "threshold": threshold,
+        "queries": len(entries),
+        "hits": hits,
+        "hit_rate": hits / len(entries) if entries else 0.0,
+    }
+    if has_intents:
+        results["hit_precision"] = correct_hits / hits if hits else 1.0
+    return results
+
+
+@click.command()
+@click.argument("query_log", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--thresholds",
+    default="0.8,0.85,0.9,0.95",
+    show_default=True,
+    help="Comma-separated cosine similarity thresholds to evaluate",
+)
+@click.option(
+    "--max_entries",
+    default=1000,
+    show_default=True,
+    help="Max previous queries remembered (e.g. `semantic_cache_max_entries`)",
+)
+@click.option(
+    "--dimensions",
+    default=256,
+    show_default=True,
+    help="Size of the fake embeddings",
+)
+def main(query_log, thresholds, max_entries, dimensions):
+    """
+    Report the semantic cache hit rate for each threshold on QUERY_LOG
+    """
+    entries = load_query_log(query_log)
+    embeddings = HashingBagOfWordsEmbeddings(size=dimensions)
+
+    for threshold in [float(item) for item in thresholds.split(",") if item]:
+        results = evaluate(entries, embeddings, threshold, max_entries=max_entries)
+        output = (
+            f"threshold={results['threshold']:.3f} queries={results['queries']} "
+            f"hits={results['hits']} hit_rate={results['hit_rate']:.1%}"
+        )
+        if "hit_precision" in results:
+            output += f" hit_precision={results['hit_precision']:.1%}"
+        click.echo(output)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -1,14 +1,63 @@
 #!/usr/bin/env python
-import glob
+import csv
+import fnmatch
+import functools
+import io
+import itertools
+import json
 import os
 
 import click
-from langchain_classic.text_splitter import TokenTextSplitter
 from langchain_community.document_loaders import UnstructuredMarkdownLoader
-from langchain_community.document_loaders.csv_loader import CSVLoader
-
-from gen3discoveryai import logging
+from langchain_core.documents import Document
+
+from gen3discoveryai import config, logging
+from gen3discoveryai.embeddings import get_embedding_model_id
+from gen3discoveryai.ingestion import (
+    INGESTION_COMPLETE,
+    IngestionManifest,
+    iter_prefetched,
+    map_in_processes,
+)
+from gen3discoveryai.knowledge import (
+    get_knowledge_version,
+    list_knowledge_topics,
+    read_ingestion_manifest,
+)
 from gen3discoveryai.main import get_topics_from_config
+from gen3discoveryai.markdown_sections import split_markdown_file
+from gen3discoveryai.tokenization import (
+    DEFAULT_ENCODING,
+    cache_encoding,
+    get_text_splitter,
+)
+from gen3discoveryai.vectorstores import get_vectorstore_backend
+
+# rows of a TSV parsed and split together in a worker process
+ROWS_PER_RANGE = 1000
+
+# files loaded when no `--include` patterns are provided (names with an extension)
+DEFAULT_INCLUDE = ("*.*",)
+
+# ways of parsing Markdown files, see `_split_markdown_file`
+MARKDOWN_PARSERS = ("sections", "unstructured")
+
+# manifest written by `bin/download_files_from_github.py` into the directory it syncs
+GITHUB_MANIFEST_FILENAME = "GITHUB_MANIFEST.json"
+
+include_option = click.option(
+    "--include",
+    type=str,
+    multiple=True,
+    help="Only load files matching this glob (can be repeated), matched against the "
+    "file name or its path relative to the directory. Defaults to '*.*'.",
+)
+exclude_option = click.option(
+    "--exclude",
+    type=str,
+    multiple=True,
+    help="Skip files and directories matching this glob (can be repeated).",
+)
 
 
 @click.group()
@@ -16,7 +65,12 @@ def cli():
     """
     Main entry point for the CLI.
     """
-    pass
+    # keep embedded vectors on disk, so a failed load can be resumed without
+    # embedding everything again
+    if not config.EMBEDDING_CACHE_SQLITE_PATH:
+        config.EMBEDDING_CACHE_SQLITE_PATH = (
+            config.INGESTION_EMBEDDING_CACHE_SQLITE_PATH
+        )
 
 
 @cli.command()
@@ -36,12 +90,50 @@ def cli():
 @click.option(
     "--delimiter", type=str, default="\t", help="Delimiter for the TSV/CSV-like file."
 )
-def tsvs(directory, source_column_name, token_splitter_chunk_size, delimiter):
+@click.option(
+    "--full-rebuild",
+    is_flag=True,
+    default=False,
+    help="Delete and re-embed all documents instead of only new or changed ones.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes to parse and split files in.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue the previous load if it didn't finish, skipping what it already stored.",
+)
+@include_option
+@exclude_option
+def tsvs(
+    directory,
+    source_column_name,
+    token_splitter_chunk_size,
+    delimiter,
+    full_rebuild,
+    workers,
+    resume,
+    include,
+    exclude,
+):
     """
     Load TSVs from a specified directory into the knowledge database.
     """
     load_tsvs_from_dir(
-        directory, source_column_name, token_splitter_chunk_size, delimiter
+        directory,
+        source_column_name,
+        token_splitter_chunk_size,
+        delimiter,
+        full_rebuild,
+        workers,
+        resume,
+        include,
+        exclude,
     )
 
 
@@ -59,11 +151,92 @@ def tsvs(directory, source_column_name, token_splitter_chunk_size, delimiter):
     default=1000,
     help="Number of tokens to chunk the content into per doc.",
 )
-def markdown(directory, topic, token_splitter_chunk_size):
+@click.option(
+    "--full-rebuild",
+    is_flag=True,
+    default=False,
+    help="Delete and re-embed all documents instead of only new or changed ones.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes to parse and split files in.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue the previous load if it didn't finish, skipping what it already stored.",
+)
+@include_option
+@exclude_option
+@click.option(
+    "--parser",
+    type=click.Choice(MARKDOWN_PARSERS),
+    default="sections",
+    help="'sections' splits files at their headings (keeping the headings in the chunks' "
+    "metadata), 'unstructured' uses langchain's UnstructuredMarkdownLoader (requires "
+    "the unstructured package).",
+)
+def markdown(
+    directory,
+    topic,
+    token_splitter_chunk_size,
+    full_rebuild,
+    workers,
+    resume,
+    include,
+    exclude,
+    parser,
+):
     """
     Load Markdown files from a specified directory into the knowledge database for the specified topic.
     """
-    load_markdown_from_dir(directory, topic, token_splitter_chunk_size)
+    load_markdown_from_dir(
+        directory,
+        topic,
+        token_splitter_chunk_size,
+        full_rebuild,
+        workers,
+        resume,
+        include,
+        exclude,
+        parser,
+    )
+
+
+@cli.command()
+@click.option(
+    "--topic",
+    "topics",
+    type=str,
+    multiple=True,
+    help="Topic to report on (can be repeated), defaults to all topics with knowledge.",
+)
+def status(topics):
+    """
+    Report the progress of the latest load into the knowledge database for each topic.
+    """
+    for topic in topics or list_knowledge_topics():
+        for line in _format_ingestion_status(topic, read_ingestion_manifest(topic)):
+            click.echo(line)
+
+
+@cli.command("cache-encoding")
+@click.argument("cache_dir", type=str)
+@click.option(
+    "--encoding",
+    type=str,
+    default=DEFAULT_ENCODING,
+    help="tiktoken encoding to cache.",
+)
+def cache_encoding_command(cache_dir, encoding):
+    """
+    Download the token encoding used to split documents into a directory, for hosts
+    without internet access to use as TIKTOKEN_CACHE_DIR.
+    """
+    cache_encoding(cache_dir, encoding)
 
 
 def load_tsvs_from_dir(
@@ -71,13 +244,22 @@ def load_tsvs_from_dir(
     source_column_name="guid",
     token_splitter_chunk_size=1000,
     delimiter="\t",
+    full_rebuild=False,
+    workers=1,
+    resume=False,
+    include=None,
+    exclude=(),
 ):
     """
     Load TSVs from specified directory in the knowledge database.
 
     This expects filenames to START with a configured topic and will aggregate
     documents from all files that begin with that topic name. This will recursively retrieve
-    all filenames in the directory and subdirectories.
+    all filenames in the directory and subdirectories. A file whose name starts with
+    more than one topic (e.g. "bdc" and "bdc_test") belongs to the longest one.
+
+    Topics whose files are all unchanged (by size and mtime) since their last complete
+    load with the same options are skipped, unless doing a full rebuild.
 
     In the following example, both TSVs starting with "default" would populate documents
     for the "default" topic knowledge store and the nested "anothertopic.tsv" would populate
@@ -93,136 +275,568 @@ def load_tsvs_from_dir(
         source_column_name (str): what column to get the "source" information from for the document
         token_splitter_chunk_size (int): how many tokens to chunk the content into per doc
         delimiter (str): \t or , or whatever else is delimited the TSV/CSV-like file
+        full_rebuild (bool): delete and re-embed all documents instead of only new or changed ones
+        workers (int): number of processes to parse and split files in (large files are split
+            into row ranges)
+        resume (bool): continue each topic's previous load if it didn't finish
+        include (Iterable[str]): globs of files to load, defaults to `DEFAULT_INCLUDE`
+        exclude (Iterable[str]): globs of files and directories to skip
     """
     logging.info(f"Loading TSVs for directory: {directory}")
     logging.info(f"TSV source_column_name: {source_column_name}")
     logging.info(f"token_splitter_chunk_size: {token_splitter_chunk_size}")
     logging.info(f"delimiter: {delimiter}")
 
-    files = glob.glob(f"{directory.rstrip('/')}/**/*.*", recursive=True)
     config_topics = get_topics_from_config()
-    topics = config_topics.keys()
-
-    logging.info(f"Loading {len(files)} TSVs for topics: {topics}")
-
-    topics_files = {}
+    topics_files, unmatched = assign_files_to_topics(
+        scan_files(directory, include, exclude), config_topics.keys()
+    )
+    options = {
+        "loader": "tsvs",
+        "source_column_name": source_column_name,
+        "token_splitter_chunk_size": token_splitter_chunk_size,
+        "delimiter": delimiter,
+    }
+    topics_options = _get_topics_options(options, topics_files, config_topics)
+    topics_files = _skip_unchanged_topics(
+        topics_files, unmatched, topics_options, full_rebuild
+    )
 
-    for topic in topics:
-        topics_files[topic] = []
-        for file in files:
-            if os.path.basename(file).startswith(topic):
-                topics_files[topic].append(file)
+    # 4097 is OpenAI's max, so if we split into 1000, we can get 4 results with
+    # 97 tokens left for the query?
+    # (built here first to fail early if there's no encoding, rather than in each worker)
+    get_text_splitter(token_splitter_chunk_size)
+    split_tsv_rows = functools.partial(
+        _split_tsv_rows,
+        source_column_name=source_column_name,
+        token_splitter_chunk_size=token_splitter_chunk_size,
+        delimiter=delimiter,
+    )
 
     for topic, files in topics_files.items():
-        topic_documents = []
-        for file in files:
-            logging.info(f"Loading data from file: {file}, for topic: {topic}")
-
-            # Load the document, split it into chunks, embed each chunk and load it into the vector store.
-
-            # TODO: check for source column and return a reusable error
-            loader = CSVLoader(
-                source_column=source_column_name,
-                file_path=file,
-                csv_args={
-                    "delimiter": delimiter,
-                    "quotechar": '"',
-                },
-            )
-            data = loader.load()
-
-            # 4097 is OpenAI's max, so if we split into 1000, we can get 4 results with
-            # 97 tokens left for the query?
-            try:
-                text_splitter = TokenTextSplitter.from_tiktoken_encoder(
-                    chunk_size=token_splitter_chunk_size, chunk_overlap=0
+        # rows are read and split lazily (in row ranges in the worker processes), so only
+        # a bounded number of chunks are in memory however large the files are. Results
+        # are in the same order for any number of workers
+        manifest = IngestionManifest(
+            topic, resume=resume, options=topics_options[topic]
+        )
+        row_ranges, split_row_ranges = itertools.tee(
+            _get_tsv_row_ranges(files, topic, delimiter)
+        )
+        topic_documents = _record_files_read(
+            manifest,
+            (
+                (file, end, documents)
+                for (file, _, _, end, _), documents in zip(
+                    row_ranges,
+                    map_in_processes(split_tsv_rows, split_row_ranges, workers),
                 )
-            except Exception as exc:
-                logging.error(
-                    "Unable to get a token splitter, "
-                    "this could be b/c we couldn't find or download the necessary "
-                    f"encoding file. Original exc: {exc}"
-                )
-                raise
-            documents = text_splitter.split_documents(data)
-
-            topic_documents.extend(documents)
-
-        logging.info(f"Storing {len(topic_documents)} documents for topic: {topic}")
-
-        if topic_documents:
-            _store_documents_in_chain(
-                config_topics[topic]["topic_chain"], topic_documents
-            )
+            ),
+        )
+        _store_documents_for_topic(
+            config_topics[topic]["topic_chain"], topic_documents, full_rebuild, manifest
+        )
 
 
 def load_markdown_from_dir(
     directory,
     topic,
     token_splitter_chunk_size=1000,
+    full_rebuild=False,
+    workers=1,
+    resume=False,
+    include=None,
+    exclude=(),
+    parser="sections",
 ):
     """
     Load Markdown files from specified directory in the knowledge database for the specified topic.
 
-    This expects filenames to START with a configured topic and will aggregate
-    documents from all files that begin with that topic name. This will recursively retrieve
-    all filenames in the directory and subdirectories.
+    All the files in the directory and its subdirectories (matching `include` and not
+    `exclude`) are loaded into the topic. The topic is skipped if they're unchanged (by
+    size and mtime) since its last complete load with the same options, unless doing
+    a full rebuild.
+
+    Files are split into a chunk per section at their headings by default (see
+    `gen3discoveryai.markdown_sections`), or parsed with `UnstructuredMarkdownLoader`
+    with the "unstructured" parser.
+
+    If the directory was synced by `bin/download_files_from_github.py`, only the files
+    in its manifest are loaded, with their GitHub URLs as their chunks' source.
     """
     logging.info(f"Loading Markdown for directory: {directory}")
     logging.info(f"token_splitter_chunk_size: {token_splitter_chunk_size}")
+    logging.info(f"parser: {parser}")
 
-    files = glob.glob(f"{directory.rstrip('/')}/**/*.*", recursive=True)
     config_topics = get_topics_from_config()
     topics = config_topics.keys()
 
     if topic not in topics:
         raise KeyError(f"{topic} not in configured topics: {topics}")
 
-    logging.info(f"Loading {len(files)} Markdown files for topic: {topic}")
-
-    topics_files = {topic: []}
+    options = {
+        "loader": "markdown",
+        "token_splitter_chunk_size": token_splitter_chunk_size,
+        "parser": parser,
+    }
+    entries = scan_files(
+        directory, include, tuple(exclude) + (GITHUB_MANIFEST_FILENAME,)
+    )
+    sources = _read_github_sources(directory)
+    if sources is not None:
+        logging.info(f"Loading the files in {GITHUB_MANIFEST_FILENAME}")
+        entries = (
+            entry for entry in entries if os.path.normpath(entry.path) in sources
+        )
+
+    topics_files = {topic: sorted(entries, key=_entry_path)}
+    topics_options = _get_topics_options(options, topics_files, config_topics)
+    topics_files = _skip_unchanged_topics(
+        topics_files, [], topics_options, full_rebuild
+    )
 
-    for file in files:
-        if os.path.isfile(file):
-            topics_files[topic].append(file)
+    get_text_splitter(token_splitter_chunk_size)
+    split_file = functools.partial(
+        _split_markdown_file,
+        token_splitter_chunk_size=token_splitter_chunk_size,
+        parser=parser,
+    )
 
     for topic, files in topics_files.items():
-        topic_documents = []
-        for file in files:
-            logging.info(f"Loading data from file: {file}, for topic: {topic}")
-
-            # Load the document, split it into chunks, embed each chunk and load it into the vector store.
-            loader = UnstructuredMarkdownLoader(file)
-            data = loader.load()
-
-            try:
-                text_splitter = TokenTextSplitter.from_tiktoken_encoder(
-                    chunk_size=token_splitter_chunk_size, chunk_overlap=0
+        manifest = IngestionManifest(
+            topic, resume=resume, options=topics_options[topic]
+        )
+        files, split_files = itertools.tee(_log_files(files, topic))
+        topic_documents = _record_files_read(
+            manifest,
+            (
+                (
+                    file,
+                    None,
+                    _set_source(documents, (sources or {}).get(os.path.normpath(file))),
                 )
-            except Exception as exc:
-                logging.error(
-                    "Unable to get a token splitter, "
-                    "this could be b/c we couldn't find or download the necessary "
-                    f"encoding file. Original exc: {exc}"
+                for file, documents in zip(
+                    files, map_in_processes(split_file, split_files, workers)
                 )
-                raise
-            documents = text_splitter.split_documents(data)
+            ),
+        )
+        _store_documents_for_topic(
+            config_topics[topic]["topic_chain"], topic_documents, full_rebuild, manifest
+        )
+
+
+def _read_github_sources(directory):
+    """
+    Read the manifest of files synced from GitHub into the directory, if there is one
+
+    Returns:
+        dict: normalized path of each synced file -> its URL on GitHub, or None if the
+            directory wasn't synced from GitHub
+    """
+    try:
+        with open(
+            os.path.join(directory, GITHUB_MANIFEST_FILENAME), "r", encoding="utf-8"
+        ) as manifest_in:
+            files = json.load(manifest_in).get("files", {})
+    except FileNotFoundError:
+        return None
+
+    return {
+        os.path.normpath(os.path.join(directory, file["path"])): file.get("html_url")
+        for file in files.values()
+    }
+
+
+def _set_source(documents, source):
+    """
+    Replace the source (a local path) of a file's documents, when it's known
+    """
+    if source:
+        for document in documents:
+            document.metadata["source"] = source
+    return documents
+
+
+class TopicPrefixTrie:
+    """
+    Prefix trie of topic names, to find the topic a file belongs to (the longest topic
+    its name starts with) in time proportional to the name's length, however many
+    topics there are
+    """
+
+    # key marking the end of a topic name in a node
+    _TOPIC = ""
+
+    def __init__(self, topics):
+        self._root = {}
+        for topic in topics:
+            node = self._root
+            for char in topic:
+                node = node.setdefault(char, {})
+            node[self._TOPIC] = topic
+
+    def match(self, name):
+        """
+        Return the longest topic which `name` starts with, None if there isn't one
+        """
+        node = self._root
+        topic = node.get(self._TOPIC)
+        for char in name:
+            node = node.get(char)
+            if node is None:
+                break
+            topic = node.get(self._TOPIC, topic)
+        return topic
+
+
+def scan_files(directory, include=None, exclude=()):
+    """
+    Walk the directory tree once with `os.scandir`, yielding the files matching any
+    `include` glob and no `exclude` glob. Globs match either the name or the path
+    relative to `directory`, and excluded directories aren't walked. Hidden files and
+    directories are skipped.
+
+    Yields:
+        os.DirEntry: each matching file (its `stat()` is cached)
+    """
+    include = include or DEFAULT_INCLUDE
+    directories = [directory]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                relative_path = os.path.relpath(entry.path, directory)
+                if _matches_any(entry.name, relative_path, exclude):
+                    continue
+                if entry.is_dir():
+                    directories.append(entry.path)
+                elif entry.is_file() and _matches_any(
+                    entry.name, relative_path, include
+                ):
+                    yield entry
+
+
+def assign_files_to_topics(entries, topics):
+    """
+    Assign each file to the longest topic its name starts with
+
+    Args:
+        entries (Iterable[os.DirEntry]): files to assign
+        topics (Iterable[str]): topic names
+
+    Returns:
+        tuple: (topic -> files sorted by path for every topic, paths of the files
+            without a topic)
+    """
+    topics = list(topics)
+    trie = TopicPrefixTrie(topics)
+    topics_files = {topic: [] for topic in topics}
+    unmatched = []
+    for entry in entries:
+        topic = trie.match(entry.name)
+        if topic is None:
+            unmatched.append(entry.path)
+        else:
+            topics_files[topic].append(entry)
+
+    for files in topics_files.values():
+        files.sort(key=_entry_path)
+    return topics_files, sorted(unmatched)
+
+
+def _matches_any(name, relative_path, patterns):
+    return any(
+        fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern)
+        for pattern in patterns
+    )
 
-            topic_documents.extend(documents)
 
-        logging.info(f"Storing {len(topic_documents)} documents for topic: {topic}")
+def _entry_path(entry):
+    return entry.path
+
+
+def _get_topics_options(options, topics_files, config_topics):
+    """
+    The load's options for each topic, along with the topic's settings which change
+    how its knowledge is stored (so changing them reloads the topic, e.g. switching
+    to a vectorstore backend which can't read the current knowledge store, or to an
+    embedding model whose vectors aren't stored yet)
+
+    Returns:
+        dict: topic -> options
+    """
+    return {
+        topic: {
+            **options,
+            "vectorstore": get_vectorstore_backend(config_topics[topic]),
+            "embedding_model": get_embedding_model_id(
+                config_topics[topic]["topic_chain"].embeddings
+            ),
+        }
+        for topic in topics_files
+    }
+
+
+def _skip_unchanged_topics(topics_files, unmatched, topics_options, reload_all=False):
+    """
+    Report which files go to which topic, and leave out the topics whose files are
+    unchanged since their last complete load with the same options (see
+    `_get_topics_options`), unless `reload_all`
+
+    Returns:
+        dict: topic -> paths of the files to load
+    """
+    to_load = {}
+    for topic, entries in topics_files.items():
+        unchanged = not reload_all and _is_unchanged(
+            topic, entries, topics_options[topic]
+        )
+        logging.info(
+            f"Topic {topic}: {len(entries)} files"
+            f"{', unchanged since the last load, skipping' if unchanged else ''}"
+        )
+        for entry in entries:
+            logging.info(f"  {entry.path} -> {topic}")
+        if not unchanged:
+            to_load[topic] = [entry.path for entry in entries]
+
+    for path in unmatched:
+        logging.info(f"  {path} -> no matching topic, skipping")
+    return to_load
+
+
+def _is_unchanged(topic, entries, options):
+    """
+    Whether the files are exactly the ones the topic's active knowledge was loaded
+    from, with the same sizes and mtimes, and with the same options
+    """
+    if not entries:
+        return False
+
+    manifest = read_ingestion_manifest(topic)
+    if (
+        manifest.get("status") != INGESTION_COMPLETE
+        or manifest.get("options") != options
+        or manifest.get("version") != get_knowledge_version(topic)
+    ):
+        return False
+
+    loaded = {
+        file: (progress["size"], progress["mtime"])
+        for file, progress in manifest.get("files", {}).items()
+    }
+    current = {
+        entry.path: (entry.stat().st_size, entry.stat().st_mtime) for entry in entries
+    }
+    return loaded == current
+
+
+def _get_tsv_row_ranges(files, topic, delimiter, rows_per_range=ROWS_PER_RANGE):
+    """
+    Scan the TSVs for the byte offsets of every `rows_per_range` rows, so the rows can
+    be parsed and split in separate processes. Quoted values spanning lines are kept
+    in the same range.
 
-        if topic_documents:
-            _store_documents_in_chain(
-                config_topics[topic]["topic_chain"], topic_documents
+    Yields:
+        tuple: (file, header, start offset, end offset, index of the first row)
+    """
+    for file in _log_files(files, topic):
+        with open(file, "rb") as file_in:
+            offset = 0
+
+            def _lines():
+                nonlocal offset
+                for line in file_in:
+                    offset += len(line)
+                    yield line.decode("utf-8")
+
+            # blank lines are skipped, like `csv.DictReader` does
+            reader = (
+                values
+                for values in csv.reader(_lines(), delimiter=delimiter, quotechar='"')
+                if values
             )
+            header = next(reader, None)
+            if header is None:
+                continue
+
+            start = offset
+            row = 0
+            rows_in_range = 0
+            for _ in reader:
+                rows_in_range += 1
+                if rows_in_range == rows_per_range:
+                    yield file, header, start, offset, row
+                    start = offset
+                    row += rows_in_range
+                    rows_in_range = 0
+
+            if rows_in_range:
+                yield file, header, start, offset, row
+
+
+def _read_tsv_rows(row_range, source_column_name, delimiter):
+    """
+    Parse a range of rows from a TSV into a document per row, formatted like
+    `CSVLoader` does.
+    """
+    file, header, start, end, first_row = row_range
+    with open(file, "rb") as file_in:
+        file_in.seek(start)
+        text = file_in.read(end - start).decode("utf-8")
+
+    reader = csv.DictReader(
+        io.StringIO(text, newline=""),
+        fieldnames=header,
+        delimiter=delimiter,
+        quotechar='"',
+    )
+    documents = []
+    for index, row in enumerate(reader, start=first_row):
+        # TODO: check for source column and return a reusable error
+        try:
+            source = row[source_column_name]
+        except KeyError as exc:
+            raise ValueError(
+                f"Source column '{source_column_name}' not found in CSV file: {file}"
+            ) from exc
+
+        content = "\n".join(
+            f"{key.strip() if key is not None else key}: {_format_tsv_value(value)}"
+            for key, value in row.items()
+        )
+        documents.append(
+            Document(page_content=content, metadata={"source": source, "row": index})
+        )
+    return documents
+
+
+def _format_tsv_value(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, list):
+        # extra values in a row without a column
+        return ",".join(map(str.strip, value))
+    return value
+
+
+def _split_tsv_rows(
+    row_range, source_column_name, token_splitter_chunk_size, delimiter
+):
+    """
+    Parse and split a range of rows from a TSV (run in the worker processes)
+    """
+    documents = _read_tsv_rows(row_range, source_column_name, delimiter)
+    return get_text_splitter(token_splitter_chunk_size).split_documents(documents)
+
+
+def _split_markdown_file(file, token_splitter_chunk_size, parser="sections"):
+    """
+    Parse and split a Markdown file (run in the worker processes)
+    """
+    if parser == "sections":
+        return split_markdown_file(file, token_splitter_chunk_size)
+
+    documents = UnstructuredMarkdownLoader(file).load()
+    return get_text_splitter(token_splitter_chunk_size).split_documents(documents)
+
+
+def _log_files(files, topic):
+    for file in files:
+        logging.info(f"Loading data from file: {file}, for topic: {topic}")
+        yield file
+
 
+def _record_files_read(manifest, files_documents):
+    """
+    Record how far each file was read in the manifest as its documents are produced
+
+    Args:
+        manifest (IngestionManifest): manifest of the topic's load
+        files_documents (Iterable[tuple]): (file, bytes read or None for all of it,
+            documents) for each file or part of one
+
+    Yields:
+        Document: the documents
+    """
+    for file, bytes_read, documents in files_documents:
+        manifest.record_file_read(file, bytes_read)
+        yield from documents
+
+
+def _format_ingestion_status(topic, manifest):
+    """
+    Lines describing the progress of a topic's load, from its manifest
+    """
+    if not manifest:
+        return [f"{topic}: no loads recorded"]
+
+    lines = [
+        f"{topic}: {manifest['status']} (version {manifest.get('version')}, "
+        f"attempt {manifest.get('attempts', 1)}"
+        f"{', full rebuild' if manifest.get('full_rebuild') else ''})",
+        f"  started: {manifest.get('started_at')}, updated: {manifest.get('updated_at')}",
+        f"  chunks embedded and stored: {manifest.get('stored', 0)}",
+    ]
+    for file, progress in manifest.get("files", {}).items():
+        percent = (
+            progress["bytes_read"] / progress["size"] * 100 if progress["size"] else 100
+        )
+        lines.append(
+            f"  {file}: {progress['bytes_read']}/{progress['size']} bytes read "
+            f"({percent:.0f}%)"
+        )
+    if manifest.get("counts"):
+        counts = manifest["counts"]
+        lines.append(
+            f"  added: {counts['added']}, removed: {counts['removed']}, "
+            f"unchanged: {counts['unchanged']}"
+        )
+    if manifest.get("error"):
+        lines.append(f"  error: {manifest['error']} (continue with --resume)")
+    return lines
+
+
+def _store_documents_for_topic(
+    topic_chain, topic_documents, full_rebuild=False, manifest=None
+):
+    """
+    Store the streamed documents for a topic. Reading and splitting happens in the
+    background while documents are embedded, with a bounded queue between them.
 
-def _store_documents_in_chain(topic_chain, topic_documents):
+    Topics without any documents are skipped, rather than removing everything from
+    their knowledge store.
+    """
+    topic_documents = iter_prefetched(topic_documents)
+    first_document = next(topic_documents, None)
+    if first_document is None:
+        topic_documents.close()
+        logging.info(f"No documents to store for topic: {topic_chain.topic}")
+        return
+
+    logging.info(f"Storing documents for topic: {topic_chain.topic}")
+    _store_documents_in_chain(
+        topic_chain,
+        itertools.chain([first_document], topic_documents),
+        full_rebuild,
+        manifest,
+    )
+
+
+def _store_documents_in_chain(
+    topic_chain, topic_documents, full_rebuild=False, manifest=None
+):
     """
     Tiny helper to store documents in the provided chain. This makes the testing/mocking simpler in unit tests
     """
-    topic_chain.store_knowledge(topic_documents)
+    counts = topic_chain.store_knowledge(
+        topic_documents, full_rebuild=full_rebuild, manifest=manifest
+    )
+    logging.info(
+        f"Documents for topic: {topic_chain.topic}, added: {counts['added']}, "
+        f"removed: {counts['removed']}, unchanged: {counts['unchanged']}"
+    )
 
 
 if __name__ == "__main__":
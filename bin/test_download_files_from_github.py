@@ -0,0 +1,319 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from bin import download_files_from_github
+from bin.download_files_from_github import (
+    MANIFEST_FILENAME,
+    GitHubRateLimiter,
+    get_session,
+    read_manifest,
+    sync_library,
+)
+
+
+class FakeGitHub:
+    """
+    Serves code search and file contents like the GitHub API, with ETags and rate
+    limit responses that can be queued up
+    """
+
+    def __init__(self):
+        # (repository, path) -> content
+        self.files = {}
+        # path of the request -> (status, headers) to respond with once
+        self.rate_limits = {}
+        self.requests = []
+        self.incomplete_results = False
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, request):
+        parsed = urlparse(request.path)
+        self.requests.append((parsed.path, request.headers.get("If-None-Match")))
+
+        rate_limit = self.rate_limits.pop(parsed.path, None)
+        if rate_limit:
+            status, headers = rate_limit
+            self._respond(request, status, b"API rate limit exceeded", headers)
+        elif parsed.path == "/search/code":
+            self._search(request, parse_qs(parsed.query))
+        else:
+            self._contents(request, parsed.path)
+
+    def _search(self, request, query):
+        assert query["q"] == ["org:uc-cdis language:Markdown"]
+        page = int(query["page"][0])
+        per_page = int(query["per_page"][0])
+        items = [
+            {
+                "path": path,
+                "sha": _sha(content),
+                "url": f"{self.url}/repos/uc-cdis/{repository}/contents/{path}",
+                "html_url": f"https://github.com/uc-cdis/{repository}/blob/master/{path}",
+                "repository": {
+                    "name": repository,
+                    "full_name": f"uc-cdis/{repository}",
+                },
+            }
+            for (repository, path), content in sorted(self.files.items())
+        ][(page - 1) * per_page : page * per_page]
+        body = {"incomplete_results": self.incomplete_results, "items": items}
+        self._respond(request, 200, json.dumps(body).encode())
+
+    def _contents(self, request, path):
+        _, _, _, repository, _, file_path = path.split("/", 5)
+        content = self.files.get((repository, file_path))
+        if content is None:
+            self._respond(request, 404, b"Not Found")
+            return
+
+        assert request.headers["Accept"] == "application/vnd.github.raw+json"
+        etag = _etag(content)
+        if request.headers.get("If-None-Match") == etag:
+            self._respond(request, 304, b"", {"ETag": etag})
+        else:
+            self._respond(request, 200, content.encode(), {"ETag": etag})
+
+    @staticmethod
+    def _respond(request, status, body, headers=None):
+        request.send_response(status)
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+class FakeClock:
+    """
+    Time which only passes when sleeping
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _sha(content):
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def _etag(content):
+    return f'"{_sha(content)}"'
+
+
+@pytest.fixture
+def github():
+    fake = FakeGitHub()
+    yield fake
+    fake.server.shutdown()
+    fake.server.server_close()
+
+
+def _sync(github, clock, output_directory):
+    session = get_session("token", pool_size=3)
+    # don't send requests for the local server through a proxy
+    session.trust_env = False
+    return sync_library(
+        str(output_directory),
+        session=session,
+        rate_limiter=GitHubRateLimiter(clock=clock.time, sleep=clock.sleep),
+        api_url=github.url,
+        concurrency=2,
+    )
+
+
+def test_sync_library(github, monkeypatch, tmp_path):
+    """
+    Test that files are downloaded into per-repo folders with a manifest, that
+    unchanged files are skipped without a request (or with a conditional one if only
+    the ETag is known), and that files no longer found are removed from the manifest
+    """
+    monkeypatch.setattr(download_files_from_github, "SEARCH_PER_PAGE", 2)
+    github.files = {
+        ("gen3-discovery-ai", "README.md"): "# Discovery AI\n",
+        ("gen3-discovery-ai", "docs/setup.md"): "# Setup\n",
+        ("fence", "README.md"): "# Fence\n",
+    }
+    clock = FakeClock()
+
+    counts = _sync(github, clock, tmp_path)
+
+    assert counts == {"downloaded": 3, "unchanged": 0, "failed": 0, "removed": 0}
+    assert (tmp_path / "gen3-discovery-ai" / "docs" / "setup.md").read_text() == (
+        "# Setup\n"
+    )
+    assert (tmp_path / "fence" / "README.md").read_text() == "# Fence\n"
+    files = read_manifest(str(tmp_path))["files"]
+    assert files["uc-cdis/gen3-discovery-ai/docs/setup.md"] == {
+        "path": os.path.join("gen3-discovery-ai", "docs", "setup.md"),
+        "repository": "uc-cdis/gen3-discovery-ai",
+        "remote_path": "docs/setup.md",
+        "sha": _sha("# Setup\n"),
+        "etag": _etag("# Setup\n"),
+        "html_url": "https://github.com/uc-cdis/gen3-discovery-ai/blob/master/"
+        "docs/setup.md",
+    }
+    # 2 pages of search results
+    assert [path for path, _ in github.requests].count("/search/code") == 2
+    assert clock.sleeps == []
+
+    # change a file, remove another, and forget a sha (so only the ETag is known)
+    github.files[("fence", "README.md")] = "# Fence v2\n"
+    del github.files[("gen3-discovery-ai", "docs/setup.md")]
+    manifest = read_manifest(str(tmp_path))
+    manifest["files"]["uc-cdis/gen3-discovery-ai/README.md"]["sha"] = "old"
+    with open(tmp_path / MANIFEST_FILENAME, "w", encoding="utf-8") as manifest_out:
+        json.dump(manifest, manifest_out)
+    github.requests.clear()
+
+    counts = _sync(github, clock, tmp_path)
+
+    assert counts == {"downloaded": 1, "unchanged": 1, "failed": 0, "removed": 1}
+    assert (tmp_path / "fence" / "README.md").read_text() == "# Fence v2\n"
+    assert sorted(
+        request for request in github.requests if request[0] != "/search/code"
+    ) == [
+        ("/repos/uc-cdis/fence/contents/README.md", _etag("# Fence\n")),
+        (
+            "/repos/uc-cdis/gen3-discovery-ai/contents/README.md",
+            _etag("# Discovery AI\n"),
+        ),
+    ]
+    files = read_manifest(str(tmp_path))["files"]
+    assert sorted(files) == [
+        "uc-cdis/fence/README.md",
+        "uc-cdis/gen3-discovery-ai/README.md",
+    ]
+    assert files["uc-cdis/gen3-discovery-ai/README.md"]["sha"] == _sha(
+        "# Discovery AI\n"
+    )
+
+    # nothing changed, so nothing is downloaded
+    github.requests.clear()
+    counts = _sync(github, clock, tmp_path)
+    assert counts == {"downloaded": 0, "unchanged": 2, "failed": 0, "removed": 0}
+    assert {path for path, _ in github.requests} == {"/search/code"}
+
+
+def test_sync_library_rate_limits_and_failures(github, tmp_path):
+    """
+    Test waiting as rate limited responses ask before retrying, and that files which
+    fail to download (or weren't searched) keep their previous manifest entries
+    """
+    github.files = {
+        ("fence", "README.md"): "# Fence\n",
+        ("arborist", "README.md"): "# Arborist\n",
+    }
+    clock = FakeClock()
+    _sync(github, clock, tmp_path)
+
+    github.files = {
+        ("fence", "README.md"): "# Fence v2\n",
+        ("arborist", "README.md"): "# Arborist v2\n",
+        ("indexd", "README.md"): "# Indexd\n",
+    }
+    github.rate_limits = {
+        "/search/code": (429, {"Retry-After": "30"}),
+        "/repos/uc-cdis/fence/contents/README.md": (
+            403,
+            {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1060"},
+        ),
+        # not a rate limit, so it isn't retried
+        "/repos/uc-cdis/indexd/contents/README.md": (404, {}),
+    }
+
+    counts = _sync(github, clock, tmp_path)
+
+    assert counts == {"downloaded": 2, "unchanged": 0, "failed": 1, "removed": 0}
+    assert clock.sleeps[0] == 30
+    # waited until after the reset
+    assert clock.now >= 1061
+    assert (tmp_path / "fence" / "README.md").read_text() == "# Fence v2\n"
+    assert not (tmp_path / "indexd").exists()
+    files = read_manifest(str(tmp_path))["files"]
+    assert sorted(files) == ["uc-cdis/arborist/README.md", "uc-cdis/fence/README.md"]
+
+    # a file that fails keeps its previous entry, as does one that wasn't searched
+    github.files = {("fence", "README.md"): "# Fence v3\n"}
+    github.rate_limits = {"/repos/uc-cdis/fence/contents/README.md": (404, {})}
+    github.incomplete_results = True
+
+    counts = _sync(github, clock, tmp_path)
+
+    assert counts == {"downloaded": 0, "unchanged": 0, "failed": 1, "removed": 0}
+    assert (tmp_path / "fence" / "README.md").read_text() == "# Fence v2\n"
+    assert read_manifest(str(tmp_path))["files"] == files
+
+
+def test_rate_limiter():
+    """
+    Test the waits for Retry-After, an exhausted rate limit, and rate limits without
+    either (exponential backoff), per resource
+    """
+    clock = FakeClock()
+    limiter = GitHubRateLimiter(
+        backoff_seconds=1, max_backoff_seconds=3, clock=clock.time, sleep=clock.sleep
+    )
+
+    def _response(status, headers=None):
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers or {})
+        response._content = b""
+        return response
+
+    assert not limiter.update("core", _response(200, {"X-RateLimit-Remaining": "9"}))
+    limiter.wait("core")
+    assert clock.sleeps == []
+
+    assert limiter.update("search", _response(429, {"Retry-After": "5"}))
+    limiter.wait("core")
+    assert clock.sleeps == []
+    limiter.wait("search")
+    assert clock.sleeps == [5]
+
+    # the request was allowed, but it was the last one until the reset
+    reset = str(int(clock.now) + 9)
+    assert not limiter.update(
+        "core",
+        _response(200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset}),
+    )
+    limiter.wait("core")
+    assert clock.sleeps == [5, 10]
+
+    # secondary rate limits back off exponentially up to the maximum, until a
+    # response isn't rate limited
+    clock.sleeps.clear()
+    for _ in range(3):
+        assert limiter.update("core", _response(429))
+        limiter.wait("core")
+    assert not limiter.update("core", _response(200))
+    assert limiter.update("core", _response(429))
+    limiter.wait("core")
+    assert clock.sleeps == [1, 2, 3, 1]
@@ -0,0 +1,54 @@
+from click.testing import CliRunner
+
+from bin.evaluate_semantic_cache import (
+    HashingBagOfWordsEmbeddings,
+    evaluate,
+    load_query_log,
+    main,
+)
+
+
+def test_evaluate_semantic_cache(tmp_path):
+    """
+    Test that replaying a query log reports hits for paraphrases and the precision of
+    those hits when intents are available
+    """
+    query_log = tmp_path / "queries.jsonl"
+    query_log.write_text(
+        '{"query": "what studies have covid data", "intent": "covid"}\n'
+        "\n"
+        '{"query": "which studies have covid data", "intent": "covid"}\n'
+        '{"query": "how do I download files", "intent": "download"}\n'
+    )
+
+    entries = load_query_log(str(query_log))
+    assert len(entries) == 3
+
+    results = evaluate(entries, HashingBagOfWordsEmbeddings(), threshold=0.7)
+    assert results["hits"] == 1
+    assert results["hit_precision"] == 1.0
+
+    results = evaluate(entries, HashingBagOfWordsEmbeddings(), threshold=0.99)
+    assert results["hits"] == 0
+
+    output = CliRunner().invoke(main, [str(query_log), "--thresholds", "0.7,0.99"])
+    assert output.exit_code == 0
+    assert "hit_rate=33.3%" in output.output
+    assert "hit_rate=0.0%" in output.output
+
+
+def test_load_plain_text_query_log(tmp_path):
+    """
+    Test that a plain text query log is one query per line without intents
+    """
+    query_log = tmp_path / "queries.txt"
+    query_log.write_text("what studies have covid data\nhow do I download files\n")
+
+    entries = load_query_log(str(query_log))
+    results = evaluate(entries, HashingBagOfWordsEmbeddings(), threshold=0.9)
+
+    assert [entry["query"] for entry in entries] == [
+        "what studies have covid data",
+        "how do I download files",
+    ]
+    assert "hit_precision" not in results
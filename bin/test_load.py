@@ -1,9 +1,42 @@
+import json
 import os
 from unittest.mock import MagicMock, patch
 
-from bin.load_into_knowledge_store import load_tsvs_from_dir
+import pytest
+from click.testing import CliRunner
+from langchain_community.document_loaders.csv_loader import CSVLoader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from bin.load_into_knowledge_store import (
+    TopicPrefixTrie,
+    _get_tsv_row_ranges,
+    _read_tsv_rows,
+    _record_files_read,
+    _store_documents_for_topic,
+    assign_files_to_topics,
+    cli,
+    load_markdown_from_dir,
+    load_tsvs_from_dir,
+    scan_files,
+)
 
 from gen3discoveryai import config
+from gen3discoveryai.ingestion import IngestionManifest
+from gen3discoveryai.knowledge import bump_knowledge_version
+
+TSVS_DIRECTORY = os.path.abspath(
+    os.path.dirname(os.path.abspath(__file__)).rstrip("/") + "/../tests/tsvs"
+)
+
+
+class FakeEmbeddings:
+    """
+    Embedding function which only identifies its model
+    """
+
+    def __init__(self, model):
+        self.model = model
 
 
 @patch("bin.load_into_knowledge_store._store_documents_in_chain")
@@ -18,12 +51,8 @@ def test_load_from_tsvs(config_topics, store_documents_in_chain):
         "bdc": {"topic_chain": MagicMock()},
     }
 
-    directory = os.path.abspath(
-        os.path.dirname(os.path.abspath(__file__)).rstrip("/") + "/../tests/tsvs"
-    )
-
     load_tsvs_from_dir(
-        directory=directory,
+        directory=TSVS_DIRECTORY,
         source_column_name="guid",
         token_splitter_chunk_size=1000,
         delimiter="\t",
@@ -33,6 +62,300 @@ def test_load_from_tsvs(config_topics, store_documents_in_chain):
     assert store_documents_in_chain.call_count == 2
 
     for item in store_documents_in_chain.call_args_list:
-        assert len(item.args[1]) > 0  # documents
+        assert len(list(item.args[1])) > 0  # documents
 
     config.TOPICS = "default"
+
+
+@patch("bin.load_into_knowledge_store._store_documents_in_chain")
+def test_store_documents_for_topic(store_documents_in_chain):
+    """
+    Test that documents are streamed to the topic chain, and that topics without
+    any documents are skipped rather than emptied.
+    """
+    topic_chain = MagicMock()
+    documents = (Document(page_content=f"row {i}") for i in range(10))
+
+    _store_documents_for_topic(topic_chain, documents)
+
+    assert store_documents_in_chain.call_count == 1
+    streamed = store_documents_in_chain.call_args.args[1]
+    assert not isinstance(streamed, list)
+    assert [document.page_content for document in streamed] == [
+        f"row {i}" for i in range(10)
+    ]
+
+    store_documents_in_chain.reset_mock()
+    _store_documents_for_topic(topic_chain, iter([]))
+    assert not store_documents_in_chain.called
+
+
+@pytest.mark.parametrize("rows_per_range", [1, 2, 1000])
+def test_read_tsv_row_ranges(tmp_path, rows_per_range):
+    """
+    Test that reading TSVs in row ranges (as the worker processes do) gives exactly the
+    same documents as `CSVLoader`, so chunk ids don't depend on the number of workers.
+    """
+    tsv = tmp_path / "default.tsv"
+    tsv.write_text(
+        "guid\ttitle\tdescription\n"
+        "1\tfirst\tone line\n"
+        "\n"
+        '2\t"quoted\ttitle"\t"spans\nlines"\n'
+        '3\t 5" tall \tmissing\n'
+        "4\textra\tvalues\tat\tthe end\n"
+    )
+    files = [str(tsv)] + [
+        os.path.join(TSVS_DIRECTORY, name)
+        for name in ["default.tsv", "bdc/bdc1.tsv", "bdc/bdc_2.tsv"]
+    ]
+
+    for file in files:
+        expected = CSVLoader(
+            source_column="guid",
+            file_path=file,
+            csv_args={"delimiter": "\t", "quotechar": '"'},
+        ).load()
+        row_ranges = list(_get_tsv_row_ranges([file], "default", "\t", rows_per_range))
+        documents = [
+            document
+            for row_range in row_ranges
+            for document in _read_tsv_rows(row_range, "guid", "\t")
+        ]
+
+        assert documents == expected
+        if file == str(tsv):
+            assert len(row_ranges) == -(-4 // rows_per_range)
+
+    with pytest.raises(ValueError):
+        _read_tsv_rows(row_ranges[0], "missing", "\t")
+
+
+def test_status(monkeypatch, tmp_path):
+    """
+    Test reporting the progress of each topic's load from its manifest
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_SQLITE_PATH", "")
+    tsv = tmp_path / "default.tsv"
+    tsv.write_text("guid\n" + "row\n" * 24)
+    os.makedirs(tmp_path / "knowledge" / "other")
+
+    manifest = IngestionManifest("default")
+    documents = _record_files_read(
+        manifest, [(str(tsv), 25, [Document(page_content="row")])]
+    )
+    assert len(list(documents)) == 1
+    manifest.start()
+    manifest.set_version("v1")
+    manifest.record_stored(7)
+    manifest.fail(ConnectionError("provider went away"))
+
+    result = CliRunner().invoke(cli, ["status"])
+
+    assert result.exit_code == 0
+    assert "default: failed (version v1, attempt 1)" in result.output
+    assert "chunks embedded and stored: 7" in result.output
+    assert f"{tsv}: 25/101 bytes read (25%)" in result.output
+    assert "provider went away" in result.output
+    assert "other: no loads recorded" in result.output
+    # loads keep embedded vectors on disk by default
+    assert config.EMBEDDING_CACHE_SQLITE_PATH == "./knowledge/embeddings.sqlite"
+
+
+def test_topic_prefix_trie():
+    """
+    Test that names match the longest topic they start with
+    """
+    trie = TopicPrefixTrie(["bdc", "bdc_test", "default", "b"])
+
+    assert trie.match("bdc_test_1.tsv") == "bdc_test"
+    assert trie.match("bdc_tes.tsv") == "bdc"
+    assert trie.match("bdc1.tsv") == "bdc"
+    assert trie.match("bd.tsv") == "b"
+    assert trie.match("default") == "default"
+    assert trie.match("other.tsv") is None
+    assert TopicPrefixTrie([]).match("bdc.tsv") is None
+
+
+def test_scan_and_assign_files(tmp_path):
+    """
+    Test scanning the tree once with include and exclude globs, and assigning each
+    file to exactly one topic
+    """
+    for path in [
+        "bdc1.tsv",
+        "nested/bdc_test_1.tsv",
+        "nested/deeper/default.tsv",
+        "nested/deeper/default.csv",
+        "archive/bdc_old.tsv",
+        "other.tsv",
+        "bdc_no_extension",
+        ".hidden/bdc.tsv",
+        ".bdc.tsv",
+    ]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("guid\n1\n")
+
+    def _relative(paths):
+        return [os.path.relpath(path, tmp_path) for path in paths]
+
+    topics_files, unmatched = assign_files_to_topics(
+        scan_files(str(tmp_path), exclude=["archive", "*.csv"]),
+        ["bdc", "bdc_test", "default", "empty"],
+    )
+
+    assert {
+        topic: _relative(entry.path for entry in entries)
+        for topic, entries in topics_files.items()
+    } == {
+        "bdc": ["bdc1.tsv"],
+        "bdc_test": ["nested/bdc_test_1.tsv"],
+        "default": ["nested/deeper/default.tsv"],
+        "empty": [],
+    }
+    assert _relative(unmatched) == ["other.tsv"]
+
+    included = scan_files(str(tmp_path), include=["nested/*", "bdc_no_extension"])
+    assert sorted(_relative(entry.path for entry in included)) == [
+        "bdc_no_extension",
+        "nested/bdc_test_1.tsv",
+        "nested/deeper/default.csv",
+        "nested/deeper/default.tsv",
+    ]
+
+
+@patch("bin.load_into_knowledge_store._store_documents_in_chain")
+@patch("bin.load_into_knowledge_store.get_topics_from_config")
+def test_load_skips_unchanged_topics(
+    config_topics, store_documents_in_chain, monkeypatch, tmp_path
+):
+    """
+    Test that topics whose files haven't changed since their last complete load (with
+    the same options, vectorstore backend, and embedding model) are skipped, unless
+    doing a full rebuild
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        "bin.load_into_knowledge_store.get_text_splitter",
+        lambda chunk_size: RecursiveCharacterTextSplitter(chunk_size=chunk_size),
+    )
+    config_topics.return_value = {
+        topic: {
+            "topic_chain": MagicMock(
+                topic=topic, embeddings=FakeEmbeddings(model="model-a")
+            )
+        }
+        for topic in ["default", "bdc"]
+    }
+    os.makedirs("tsvs")
+    for topic in ["default", "bdc"]:
+        with open(f"tsvs/{topic}.tsv", "w", encoding="utf-8") as tsv_out:
+            tsv_out.write(f"guid\ttitle\n{topic}_1\tstudy\n")
+
+    # a complete load of the default topic's file
+    manifest = IngestionManifest(
+        "default",
+        options={
+            "loader": "tsvs",
+            "source_column_name": "guid",
+            "token_splitter_chunk_size": 1000,
+            "delimiter": "\t",
+            "vectorstore": "chroma",
+            "embedding_model": "FakeEmbeddings:model-a",
+        },
+    )
+    manifest.start()
+    manifest.set_version(bump_knowledge_version("default"))
+    manifest.record_file_read("./tsvs/default.tsv")
+    manifest.finish({"added": 1, "removed": 0, "unchanged": 0})
+
+    def _loaded_topics():
+        topics = sorted(
+            item.args[0].topic for item in store_documents_in_chain.call_args_list
+        )
+        store_documents_in_chain.reset_mock()
+        return topics
+
+    load_tsvs_from_dir("./tsvs")
+    assert _loaded_topics() == ["bdc"]
+
+    load_tsvs_from_dir("./tsvs", full_rebuild=True)
+    assert _loaded_topics() == ["bdc", "default"]
+
+    # different options
+    load_tsvs_from_dir("./tsvs", token_splitter_chunk_size=500)
+    assert _loaded_topics() == ["bdc", "default"]
+
+    # the topic's knowledge store would be read with a different vectorstore backend
+    config_topics.return_value["default"]["vectorstore"] = "numpy"
+    load_tsvs_from_dir("./tsvs")
+    assert _loaded_topics() == ["bdc", "default"]
+    config_topics.return_value["default"].pop("vectorstore")
+
+    # the stored vectors are from a different embedding model
+    config_topics.return_value["default"]["topic_chain"].embeddings.model = "model-b"
+    load_tsvs_from_dir("./tsvs")
+    assert _loaded_topics() == ["bdc", "default"]
+    config_topics.return_value["default"]["topic_chain"].embeddings.model = "model-a"
+
+    os.utime("tsvs/default.tsv", (0, 0))
+    load_tsvs_from_dir("./tsvs")
+    assert _loaded_topics() == ["bdc", "default"]
+
+
+@patch("bin.load_into_knowledge_store._store_documents_in_chain")
+@patch("bin.load_into_knowledge_store.get_topics_from_config")
+def test_load_markdown_from_github_manifest(
+    config_topics, store_documents_in_chain, monkeypatch, tmp_path
+):
+    """
+    Test that only the files in a directory synced from GitHub are loaded, with their
+    GitHub URLs as their chunks' source
+    """
+    monkeypatch.chdir(tmp_path)
+    for module in [
+        "bin.load_into_knowledge_store",
+        "gen3discoveryai.markdown_sections",
+    ]:
+        monkeypatch.setattr(
+            f"{module}.get_text_splitter",
+            lambda chunk_size, *args: RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size
+            ),
+        )
+    config_topics.return_value = {"docs": {"topic_chain": MagicMock(topic="docs")}}
+    documents = []
+    store_documents_in_chain.side_effect = lambda chain, topic_documents, *args: (
+        documents.extend(topic_documents)
+    )
+    os.makedirs("library/fence")
+    for path in ["fence/README.md", "fence/stale.md"]:
+        with open(f"library/{path}", "w", encoding="utf-8") as markdown_out:
+            markdown_out.write(f"# {path}\n\nSome text.\n")
+    with open("library/GITHUB_MANIFEST.json", "w", encoding="utf-8") as manifest_out:
+        json.dump(
+            {
+                "files": {
+                    "uc-cdis/fence/README.md": {
+                        "path": "fence/README.md",
+                        "html_url": "https://github.com/uc-cdis/fence/blob/master/README.md",
+                    },
+                    # not synced yet
+                    "uc-cdis/fence/docs/new.md": {
+                        "path": "fence/docs/new.md",
+                        "html_url": "https://github.com/uc-cdis/fence/blob/master/docs/new.md",
+                    },
+                }
+            },
+            manifest_out,
+        )
+
+    load_markdown_from_dir("library/", "docs")
+
+    assert [document.metadata for document in documents] == [
+        {
+            "source": "https://github.com/uc-cdis/fence/blob/master/README.md",
+            "headings": "fence/README.md",
+        }
+    ]
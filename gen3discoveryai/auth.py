@@ -1,5 +1,7 @@
+import math
+
 from authutils.token.fastapi import access_token
-from fastapi import Depends, HTTPException, Request
+from fastapi import Depends, HTTPException, Request, Response
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from gen3authz.client.arborist.async_client import ArboristClient
 from starlette.status import HTTP_401_UNAUTHORIZED as HTTP_401_UNAUTHENTICATED
@@ -11,9 +13,23 @@ from starlette.status import (
 )
 
 from gen3discoveryai import config, logging
+from gen3discoveryai.auth_cache import (
+    JwksCache,
+    get_auth_cache,
+    get_request_memo,
+    set_request_memo,
+)
+from gen3discoveryai.concurrency import (
+    AdmissionController,
+    QueueFullError,
+    QueueTimeoutError,
+)
+from gen3discoveryai.usage_limits import get_usage_headers, get_usage_limiter
 
 get_bearer_token = HTTPBearer(auto_error=False)
 arborist = ArboristClient()
+_admission_controller = AdmissionController()
+_jwks_cache = JwksCache(ttl_seconds=config.JWKS_CACHE_TTL_SECONDS)
 
 
 async def authorize_request(
@@ -59,26 +75,46 @@ async def authorize_request(
     if not token:
         raise HTTPException(status_code=HTTP_401_UNAUTHENTICATED)
 
-    # try to get the ID so the debug log has more information
+    # try to get the ID so the debug log has more information (and the token's
+    # expiration so the decision can be cached)
     try:
-        user_id = await get_user_id(token, request)
+        token_claims = await _get_token_claims(token, request)
     except HTTPException as exc:
         logging.debug(
             f"Unable to determine user_id. Defaulting to `Unknown`. Exc: {exc}"
         )
-        user_id = "Unknown"
-
-    is_authorized = False
-    try:
-        is_authorized = await arborist.auth_request(
-            token.credentials,
-            service="gen3_discovery_ai",
-            methods=authz_access_method,
-            resources=authz_resources,
-        )
-    except Exception as exc:
-        logging.error(f"arborist.auth_request failed, exc: {exc}")
-        raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR) from exc
+        token_claims = {}
+    user_id = token_claims.get("sub", "Unknown")
+
+    auth_cache = get_auth_cache() if token_claims else None
+    cache_key = (
+        "authz",
+        token.credentials,
+        authz_access_method,
+        *sorted(authz_resources),
+    )
+    # the same request may be authorized more than once (e.g. before it's admitted
+    # and again by the route)
+    is_authorized = get_request_memo(request, cache_key)
+    if is_authorized is None and auth_cache:
+        is_authorized = auth_cache.get(cache_key)
+
+    if is_authorized is None:
+        try:
+            is_authorized = await arborist.auth_request(
+                token.credentials,
+                service="gen3_discovery_ai",
+                methods=authz_access_method,
+                resources=authz_resources,
+            )
+        except Exception as exc:
+            logging.error(f"arborist.auth_request failed, exc: {exc}")
+            raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR) from exc
+
+        if auth_cache:
+            auth_cache.set(cache_key, bool(is_authorized), token_claims.get("exp"))
+
+    set_request_memo(request, cache_key, bool(is_authorized))
 
     if not is_authorized:
         logging.debug(
@@ -124,46 +160,119 @@ async def get_user_id(
 async def raise_if_user_exceeded_maximum_artificial_intelligence_usage_limits(
     token: HTTPAuthorizationCredentials = Depends(get_bearer_token),
     request: Request = None,
+    response: Response = None,
+    topic: str = "default",
 ):
     """
     Checks if the user has exceeded certain limits which should prevent them from using the AI.
 
+    Uses one request from the user's budget for the topic and, once the response has
+    been sent, the LLM tokens used to answer it (which the route reports in
+    `request.state.llm_tokens_used`). The remaining quota is returned in
+    `X-RateLimit-*` response headers. See `gen3discoveryai.usage_limits`.
+
     Args:
         token (HTTPAuthorizationCredentials): an authorization token (optional, you can also provide request
             and this can be parsed from there). this has priority over any token from request.
         request (Request): The incoming HTTP request. Used to parse tokens from header.
+        response (Response): The outgoing HTTP response. Used to add quota headers.
+        topic (str): Query string `topic`, the topic the request is for
 
-    Returns:
-        bool: True if the user has exceeded limits; False otherwise.
+    Raises:
+        HTTPException: Raised if the user has exceeded limits.
+
+    Note:
+        Anonymous users (if `ALLOW_ANONYMOUS_ACCESS` is on or `DEBUG_SKIP_AUTH` is on and no
+        token is provided) are limited by their client address.
     """
-    user_limit_exceeded = False
+    usage_limiter = get_usage_limiter()
+    topic_config = config.topics.get(topic)
+    # the route rejects unknown topics, and counting them would create a budget for
+    # any string in the query
+    if not usage_limiter or not topic_config:
+        yield
+        return
 
     token = await _get_token(token, request)
+    try:
+        user_id = await get_user_id(token, request) if token else None
+    except HTTPException as exc:
+        # authorization will reject this request, so there's nothing to count
+        logging.debug(f"Unable to determine user_id, not limiting. Exc: {exc}")
+        yield
+        return
+
+    if not user_id:
+        client_host = request.client.host if request and request.client else "unknown"
+        user_id = f"anonymous:{client_host}"
 
-    # TODO logic to determine if it's been exceeded
-    #      make sure you try to handle the case where ALLOW_ANONYMOUS_ACCESS is on
+    decisions = usage_limiter.check(user_id, topic, topic_config)
+    headers = get_usage_headers(decisions)
 
-    if user_limit_exceeded:
-        logging.error("User has exceeded limits!")
+    if not all(decision.allowed for decision in decisions.values()):
+        logging.error(f"User `{user_id}` has exceeded limits for topic `{topic}`!")
+        retry_after = max(decision.reset_seconds for decision in decisions.values())
         raise HTTPException(
             HTTP_429_TOO_MANY_REQUESTS,
             "You've reached a limit for your user. Please try again later.",
+            headers={**headers, "Retry-After": str(math.ceil(retry_after))},
         )
 
+    if response is not None:
+        response.headers.update(headers)
+    if request is not None:
+        # for responses the route creates itself (e.g. streaming)
+        request.state.usage_headers = headers
+
+    yield
+
+    llm_tokens_used = getattr(request.state, "llm_tokens_used", 0) if request else 0
+    if llm_tokens_used:
+        usage_limiter.record_llm_tokens(user_id, topic, topic_config, llm_tokens_used)
+
 
-async def raise_if_overall_global_artificial_intelligence_limit_exceeded():
+async def raise_if_overall_global_artificial_intelligence_limit_exceeded(
+    topic: str = "default",
+    request: Request = None,
+):
     """
-    Checks and raises an exception if a global AI limit has been exceeded.
+    Checks and raises an exception if a global (or the topic's) AI limit has been exceeded.
+
+    Authorizes the request for the topic, then admits it through the topic's and the
+    global concurrency limits, waiting in a bounded queue if necessary, and holds the
+    slots until the response is sent. See `gen3discoveryai.concurrency`.
+
+    Args:
+        topic (str): Query string `topic`, the topic the request is for
+        request (Request): The incoming HTTP request
 
     Raises:
-        HTTPException: Raised if a global AI limit has been exceeded.
+        HTTPException: Raised if unauthorized or a global AI limit has been exceeded.
     """
-    global_limit_exceeded = False
-
-    # TODO logic to determine if it's been exceeded
+    # unauthorized requests shouldn't hold (or wait for) a slot
+    await authorize_request(
+        request=request,
+        authz_access_method="read",
+        authz_resources=[f"/gen3_discovery_ai/ask/{topic}"],
+    )
 
-    if global_limit_exceeded:
-        raise HTTPException(HTTP_503_SERVICE_UNAVAILABLE)
+    try:
+        async with _admission_controller.admit(topic, config.topics.get(topic)):
+            yield
+    except QueueFullError as exc:
+        retry_after = exc.queue_seconds
+        if retry_after is None:
+            retry_after = config.ASK_MAX_QUEUE_SECONDS
+        raise HTTPException(
+            HTTP_429_TOO_MANY_REQUESTS,
+            "Too many requests. Please try again later.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        ) from exc
+    except QueueTimeoutError as exc:
+        raise HTTPException(
+            HTTP_503_SERVICE_UNAVAILABLE,
+            "Service unavailable. Please try again later.",
+        ) from exc
 
 
 async def _get_token_claims(
@@ -173,6 +282,9 @@ async def _get_token_claims(
     """
     Retrieves and validates token claims from the provided token.
 
+    Claims are memoized on the request and cached across requests until the token
+    expires, see `gen3discoveryai.auth_cache`.
+
     Args:
         token (HTTPAuthorizationCredentials): an authorization token (optional, you can also provide request
             and this can be parsed from there). this has priority over any token from request.
@@ -198,25 +310,59 @@ async def _get_token_claims(
         )
         audience = None
 
-    try:
-        # NOTE: token can be None if no Authorization header was provided, we expect
-        #       this to cause a downstream exception since it is invalid
-        logging.debug(
-            f"checking access token for scopes: `user` and `openid` and audience: `{audience}`"
-        )
-        token_claims = await access_token(
-            "user", "openid", audience=audience, purpose="access"
-        )(token)
-    except Exception as exc:
-        logging.error(exc.detail if hasattr(exc, "detail") else exc, exc_info=True)
-        raise HTTPException(
-            HTTP_401_UNAUTHENTICATED,
-            "Could not verify, parse, and/or validate scope from provided access token.",
-        ) from exc
-
+    cache_key = ("claims", token.credentials, str(audience))
+    token_claims = get_request_memo(request, cache_key)
+    if token_claims is not None:
+        return token_claims
+
+    auth_cache = get_auth_cache()
+    token_claims = auth_cache.get(cache_key) if auth_cache else None
+    if token_claims is None:
+        try:
+            # NOTE: token can be None if no Authorization header was provided, we expect
+            #       this to cause a downstream exception since it is invalid
+            logging.debug(
+                f"checking access token for scopes: `user` and `openid` and audience: `{audience}`"
+            )
+            token_claims = await _verify_token(token, audience)
+        except Exception as exc:
+            logging.error(exc.detail if hasattr(exc, "detail") else exc, exc_info=True)
+            raise HTTPException(
+                HTTP_401_UNAUTHENTICATED,
+                "Could not verify, parse, and/or validate scope from provided access token.",
+            ) from exc
+
+        if auth_cache:
+            auth_cache.set(cache_key, token_claims, token_claims.get("exp"))
+
+    set_request_memo(request, cache_key, token_claims)
     return token_claims
 
 
+async def _verify_token(token: HTTPAuthorizationCredentials, audience: str = None):
+    """
+    Verifies the token's signature (against the issuer's public keys) and claims.
+    If the token was signed with a key we don't know, the public keys are refetched
+    (in case they were rotated) and it's verified again.
+
+    Args:
+        token (HTTPAuthorizationCredentials): an authorization token
+        audience (str): expected audience
+
+    Returns:
+        dict: The token claims.
+    """
+    _jwks_cache.expire()
+    verify = access_token("user", "openid", audience=audience, purpose="access")
+    try:
+        return await verify(token)
+    except HTTPException as exc:
+        if "kid not found" not in str(exc.detail) or not _jwks_cache.refresh():
+            raise
+        logging.info("token signed with an unknown key, refetching public keys")
+        return await verify(token)
+
+
 async def _get_token(token, request):
     """
     Retrieves the token from the request's Bearer header or if there's no request, returns token
@@ -0,0 +1,180 @@
+"""
+Caches for authentication and authorization.
+
+A single AI request needs the verified token claims several times (authorization,
+usage limits, and the route itself) and an Arborist decision. So:
+
+    - claims are memoized on the request, so the token is verified at most once
+      per request
+    - verified claims and Arborist decisions are cached across requests (per process)
+      for up to `AUTH_CACHE_TTL_SECONDS`, keyed by a hash of the token. Entries never
+      outlive the token's `exp` and tokens without an `exp` aren't cached.
+    - issuers' public keys (JWKS) are refetched every `JWKS_CACHE_TTL_SECONDS` and
+      when a token is signed with an unknown key (e.g. after key rotation)
+
+NOTE: a cached Arborist decision means policy changes can take up to
+`AUTH_CACHE_TTL_SECONDS` to apply to tokens which were already checked.
+"""
+
+import hashlib
+import time
+from typing import Any, Hashable, Optional, Tuple
+
+from authutils.token import fastapi as authutils_fastapi
+from fastapi import Request
+
+from gen3discoveryai import config, logging
+from gen3discoveryai.cache import InMemoryCacheBackend
+from gen3discoveryai.metrics import get_counter
+
+_auth_cache = None
+
+
+class AuthCache:
+    """
+    Per-process cache of verified token claims and authorization decisions
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.backend = InMemoryCacheBackend(max_entries)
+        self.hits = get_counter(
+            "auth_cache_hits_total",
+            "Token verifications or authorization decisions served from cache",
+        )
+        self.misses = get_counter(
+            "auth_cache_misses_total",
+            "Token verifications or authorization decisions not found in cache",
+        )
+
+    def get(self, key: Tuple[str, ...]) -> Optional[Any]:
+        """
+        Return the cached value (or None)
+
+        Args:
+            key (tuple): the kind of value (e.g. `claims`), the token, and anything
+                else the value depends on
+        """
+        entry = self.backend.get(_hash_key(key))
+        if entry is None:
+            self.misses.inc(cache=key[0])
+            return None
+
+        self.hits.inc(cache=key[0])
+        return entry["value"]
+
+    def set(
+        self, key: Tuple[str, ...], value: Any, expires_at: Optional[float]
+    ) -> None:
+        """
+        Cache the value until the token expires (at the latest)
+
+        Args:
+            key (tuple): the kind of value (e.g. `claims`), the token, and anything
+                else the value depends on
+            value: what to cache
+            expires_at (float): the token's `exp`, nothing is cached without one
+        """
+        if not expires_at:
+            return
+
+        ttl = min(self.ttl_seconds, float(expires_at) - time.time())
+        if ttl <= 0:
+            return
+
+        self.backend.set(_hash_key(key), key[0], {"value": value}, ttl)
+
+
+class JwksCache:
+    """
+    Expires the public keys `authutils` caches per issuer (which it otherwise keeps
+    for the life of the process) so they're refetched periodically, and refetches them
+    early (at most once every `min_refresh_seconds`) when a token has an unknown key.
+    """
+
+    def __init__(self, ttl_seconds: float, min_refresh_seconds: float = 60) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self._first_seen = {}
+        self._last_refresh = 0.0
+
+    def expire(self) -> None:
+        """
+        Forget public keys fetched more than `ttl_seconds` ago
+        """
+        now = time.time()
+        for issuer, keys in list(authutils_fastapi._jwt_public_keys.items()):
+            first_seen = self._first_seen.setdefault(issuer, now)
+            if self.ttl_seconds and now - first_seen >= self.ttl_seconds:
+                self._forget(issuer, keys)
+
+    def refresh(self) -> bool:
+        """
+        Forget all public keys so they're refetched, unless that was done recently
+
+        Returns:
+            bool: True if the keys will be refetched
+        """
+        now = time.time()
+        if now - self._last_refresh < self.min_refresh_seconds:
+            return False
+
+        self._last_refresh = now
+        for issuer, keys in list(authutils_fastapi._jwt_public_keys.items()):
+            self._forget(issuer, keys)
+        return True
+
+    def _forget(self, issuer: str, keys: Any) -> None:
+        # don't interrupt a fetch which is in progress
+        if keys.done():
+            logging.debug(f"expiring cached public keys for issuer: {issuer}")
+            authutils_fastapi._jwt_public_keys.pop(issuer, None)
+            self._first_seen.pop(issuer, None)
+
+
+def get_auth_cache() -> Optional[AuthCache]:
+    """
+    Return the configured auth cache (creating it if necessary) or None if caching
+    across requests is disabled.
+
+    Returns:
+        AuthCache: configured cache
+    """
+    global _auth_cache
+
+    if config.AUTH_CACHE_TTL_SECONDS <= 0:
+        return None
+
+    if _auth_cache is None:
+        _auth_cache = AuthCache(
+            ttl_seconds=config.AUTH_CACHE_TTL_SECONDS,
+            max_entries=config.AUTH_CACHE_MAX_ENTRIES,
+        )
+
+    return _auth_cache
+
+
+def get_request_memo(request: Optional[Request], key: Hashable) -> Optional[Any]:
+    """
+    Return what was memoized on the request for the key (or None)
+    """
+    if request is None:
+        return None
+    return getattr(request.state, "auth_memo", {}).get(key)
+
+
+def set_request_memo(request: Optional[Request], key: Hashable, value: Any) -> None:
+    """
+    Memoize the value on the request (so it's only computed once per request)
+    """
+    if request is None:
+        return
+
+    if not hasattr(request.state, "auth_memo"):
+        request.state.auth_memo = {}
+    request.state.auth_memo[key] = value
+
+
+def _hash_key(key: Tuple[str, ...]) -> str:
+    # tokens aren't kept in memory any longer than necessary
+    return hashlib.sha256("\0".join(str(part) for part in key).encode()).hexdigest()
@@ -0,0 +1,337 @@
+"""
+Exact-match cache of `/ask` answers.
+
+Answers are keyed by the topic, the normalized query text, a fingerprint of the
+topic's configuration (model, temperature, prompt, retrieval settings, etc.) and the
+topic's knowledge store version. So changing the configuration or re-storing
+knowledge automatically stops serving stale answers.
+
+Two backends are available:
+    - `memory`: per-process LRU dictionary
+    - `sqlite`: on-disk database which can be shared by all gunicorn workers
+"""
+
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from gen3discoveryai import config, logging
+from gen3discoveryai.knowledge import get_knowledge_version
+from gen3discoveryai.metrics import get_counter
+
+# topic config entries which don't affect the answer
+_NON_ANSWER_AFFECTING_TOPIC_CONFIG = ["topic_chain", "description"]
+
+_answer_cache = None
+
+
+class InMemoryCacheBackend:
+    """
+    Per-process LRU cache with per-entry expiration
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the unexpired value for the key (or None)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            _, value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            # copy so callers can't modify what's cached
+            return copy.deepcopy(value)
+
+    def set(self, key: str, topic: str, value: Dict[str, Any], ttl: float) -> None:
+        """
+        Store the value under the key, evicting the least recently used entries if full
+        """
+        with self._lock:
+            self._entries[key] = (topic, copy.deepcopy(value), time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_topic(self, topic: str) -> None:
+        """
+        Remove all entries for the topic
+        """
+        with self._lock:
+            for key in [
+                key
+                for key, (entry_topic, _, _) in self._entries.items()
+                if entry_topic == topic
+            ]:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """
+    On-disk LRU cache with per-entry expiration. Multiple processes can safely use
+    the same database file, so gunicorn workers share cached answers.
+    """
+
+    def __init__(self, path: str, max_entries: int) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(
+            path, timeout=10, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, topic TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_accessed REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS answers_last_accessed ON answers (last_accessed)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS answers_topic ON answers (topic)"
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the unexpired value for the key (or None)
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM answers WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._connection.execute(
+                "UPDATE answers SET last_accessed = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key: str, topic: str, value: Dict[str, Any], ttl: float) -> None:
+        """
+        Store the value under the key, evicting expired and then the least recently
+        used entries if full
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(key, topic, value, expires_at, last_accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, topic, json.dumps(value), now + ttl, now),
+            )
+            self._connection.execute(
+                "DELETE FROM answers WHERE expires_at <= ?", (now,)
+            )
+            self._connection.execute(
+                "DELETE FROM answers WHERE key IN ("
+                "SELECT key FROM answers ORDER BY last_accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def invalidate_topic(self, topic: str) -> None:
+        """
+        Remove all entries for the topic
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM answers WHERE topic = ?", (topic,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM answers").fetchone()[
+                0
+            ]
+
+
+class AnswerCache:
+    """
+    Exact-match cache of answers in front of the topic chains
+    """
+
+    def __init__(self, backend, ttl_seconds: float) -> None:
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.hits = get_counter(
+            "answer_cache_hits_total", "Answers served from the exact-match cache"
+        )
+        self.misses = get_counter(
+            "answer_cache_misses_total", "Answers not found in the exact-match cache"
+        )
+
+    @staticmethod
+    def get_key(topic: str, query: str, topic_config: Dict[str, Any]) -> str:
+        """
+        Build the cache key for a query against a topic
+
+        Args:
+            topic (str): topic name
+            query (str): user provided query
+            topic_config (dict): the topic's configuration from `config.topics`
+
+        Returns:
+            str: cache key
+        """
+        key_parts = {
+            "topic": topic,
+            "query": normalize_query(query),
+            "topic_config": get_topic_config_fingerprint(topic_config),
+            "knowledge_version": get_knowledge_version(topic),
+        }
+        return hashlib.sha256(
+            json.dumps(key_parts, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str, topic: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached answer for the key (or None), tracking hits and misses
+
+        Args:
+            key (str): cache key from `get_key`
+            topic (str): topic name (for metrics)
+        """
+        try:
+            value = self.backend.get(key)
+        except Exception as exc:
+            # the cache is an optimization, never fail a request b/c of it
+            logging.error(f"unable to read from answer cache, exc: {exc}")
+            value = None
+
+        if value is None:
+            self.misses.inc(topic=topic)
+        else:
+            self.hits.inc(topic=topic)
+        return value
+
+    def set(self, key: str, topic: str, value: Dict[str, Any]) -> None:
+        """
+        Cache the answer under the key
+
+        Args:
+            key (str): cache key from `get_key`
+            topic (str): topic name
+            value (dict): JSON-serializable answer
+        """
+        try:
+            self.backend.set(key, topic, value, self.ttl_seconds)
+        except Exception as exc:
+            logging.error(f"unable to write to answer cache, exc: {exc}")
+
+    def invalidate_topic(self, topic: str) -> None:
+        """
+        Remove all cached answers for the topic
+
+        Args:
+            topic (str): topic name
+        """
+        logging.debug(f"invalidating answer cache for topic: {topic}")
+        self.backend.invalidate_topic(topic)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize query text so trivially different queries share a cache entry
+    (unicode form, case, whitespace, and trailing punctuation).
+
+    Args:
+        query (str): user provided query
+
+    Returns:
+        str: normalized query
+    """
+    normalized = unicodedata.normalize("NFKC", query).casefold()
+    return " ".join(normalized.split()).rstrip("?!. ")
+
+
+def get_topic_config_fingerprint(topic_config: Dict[str, Any]) -> str:
+    """
+    Hash of everything in a topic's configuration that may affect the answer
+    (model name, temperature, number of docs, similarity threshold, system prompt, etc.)
+
+    Args:
+        topic_config (dict): the topic's configuration from `config.topics`
+
+    Returns:
+        str: fingerprint
+    """
+    answer_affecting_config = {
+        key: str(value)
+        for key, value in topic_config.items()
+        if key not in _NON_ANSWER_AFFECTING_TOPIC_CONFIG
+    }
+    answer_affecting_config["topic_chain"] = str(
+        getattr(topic_config.get("topic_chain"), "NAME", "")
+    )
+    return hashlib.sha256(
+        json.dumps(answer_affecting_config, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """
+    Return the configured answer cache (creating it if necessary) or None
+    if answer caching is disabled.
+
+    Returns:
+        AnswerCache: configured cache
+    """
+    global _answer_cache
+
+    if not config.ANSWER_CACHE_ENABLED:
+        return None
+
+    if _answer_cache is None:
+        if config.ANSWER_CACHE_BACKEND == "sqlite":
+            backend = SQLiteCacheBackend(
+                config.ANSWER_CACHE_SQLITE_PATH, config.ANSWER_CACHE_MAX_ENTRIES
+            )
+        elif config.ANSWER_CACHE_BACKEND == "memory":
+            backend = InMemoryCacheBackend(config.ANSWER_CACHE_MAX_ENTRIES)
+        else:
+            raise ValueError(
+                f"Unknown ANSWER_CACHE_BACKEND: {config.ANSWER_CACHE_BACKEND}. "
+                "Must be one of: memory, sqlite"
+            )
+
+        logging.info(f"using `{config.ANSWER_CACHE_BACKEND}` answer cache")
+        _answer_cache = AnswerCache(backend, config.ANSWER_CACHE_TTL_SECONDS)
+
+    return _answer_cache
+
+
+def _reset_after_fork() -> None:
+    """
+    Forked processes (e.g. gunicorn workers forked from a preloaded master) create
+    their own answer cache, since a SQLite connection can't be shared with them
+    """
+    global _answer_cache
+    _answer_cache = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,258 @@
+"""
+Admission control for AI requests.
+
+Limits how many requests run at once, per topic and globally (per process). Requests
+over a limit wait in a bounded queue for up to a maximum queue time. If the queue is
+full, or they've waited too long, they're rejected quickly instead of piling up until
+the server's timeout.
+
+Global limits are configured with `ASK_MAX_CONCURRENT_REQUESTS`, `ASK_MAX_QUEUED_REQUESTS`
+and `ASK_MAX_QUEUE_SECONDS`. Per-topic limits are configured in the topic's metadata
+(e.g. in `{TOPIC}_RAW_METADATA`):
+
+    - `max_concurrent_requests:8` max requests for the topic running at once
+      (default 0, unlimited)
+    - `max_queued_requests:16` max requests for the topic waiting to run
+    - `max_queue_seconds:10` max time a request for the topic waits to run
+"""
+
+import asyncio
+import collections
+import contextlib
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from gen3discoveryai import config, logging
+from gen3discoveryai.metrics import get_counter, get_histogram
+from gen3discoveryai.topic_chains.utils import get_from_cfg_metadata
+
+# topic -> (limits, ConcurrencyLimiter) so limiters are rebuilt if the config changes
+_topic_limiters = {}
+_global_limiter = None
+
+
+class QueueFullError(Exception):
+    """
+    Too many requests are already waiting
+    """
+
+    def __init__(self, message: str, queue_seconds: Optional[float] = None) -> None:
+        super().__init__(message)
+        # the max time requests wait in the queue which was full, so clients know
+        # when to retry
+        self.queue_seconds = queue_seconds
+
+
+class QueueTimeoutError(Exception):
+    """
+    Waited the maximum queue time without being admitted
+    """
+
+
+class ConcurrencyLimiter:
+    """
+    Semaphore with a bounded first-in-first-out wait queue. A `max_concurrent` of 0
+    means unlimited.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int,
+        max_queued: int,
+    ) -> None:
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.in_use = 0
+        self._waiters = collections.deque()
+
+    @property
+    def queued(self) -> int:
+        """
+        Number of requests currently waiting
+        """
+        return len(self._waiters)
+
+    async def acquire(self, timeout: Optional[float]) -> None:
+        """
+        Wait (up to `timeout` seconds) for a slot
+
+        Raises:
+            QueueFullError: if the wait queue is full
+            QueueTimeoutError: if a slot didn't become available in time
+        """
+        if not self.max_concurrent:
+            return
+
+        if self.in_use < self.max_concurrent and not self._waiters:
+            self.in_use += 1
+            return
+
+        if len(self._waiters) >= self.max_queued:
+            raise QueueFullError(f"{self.name} wait queue is full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            with contextlib.suppress(ValueError):
+                self._waiters.remove(waiter)
+
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed to this waiter just as it gave up
+                self.release()
+
+            if isinstance(exc, asyncio.TimeoutError):
+                raise QueueTimeoutError(f"timed out waiting for {self.name}") from exc
+            raise
+
+    def release(self) -> None:
+        """
+        Hand the slot to the next waiter (or free it)
+        """
+        if not self.max_concurrent:
+            return
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # in_use stays the same, the slot moves to the waiter
+                waiter.set_result(None)
+                return
+
+        self.in_use -= 1
+
+
+class AdmissionController:
+    """
+    Admits requests through a topic's limiter and then the global limiter, sharing one
+    queue time budget. The topic's limiter goes first so requests queued for a busy
+    topic don't hold global slots that other topics could use.
+    """
+
+    def __init__(self) -> None:
+        self.queue_depth = get_histogram(
+            "ask_queue_depth",
+            "Requests already waiting when a request arrived at a limiter",
+            buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500),
+        )
+        self.wait_seconds = get_histogram(
+            "ask_queue_wait_seconds", "Time requests waited to be admitted"
+        )
+        self.rejected = get_counter(
+            "ask_admission_rejected_total",
+            "Requests rejected because the wait queue was full or they waited too long",
+        )
+
+    @contextlib.asynccontextmanager
+    async def admit(
+        self, topic: str, topic_config: Optional[Dict[str, Any]]
+    ) -> AsyncIterator[None]:
+        """
+        Hold a slot for the topic (and globally) for the duration of the context
+
+        Args:
+            topic (str): topic name
+            topic_config (dict): the topic's configuration from `config.topics`
+                (or None if the topic doesn't exist)
+
+        Raises:
+            QueueFullError: if a wait queue is full
+            QueueTimeoutError: if slots didn't become available in time
+        """
+        limiters = [get_global_limiter()]
+        max_queue_seconds = config.ASK_MAX_QUEUE_SECONDS
+        if topic_config is not None:
+            topic_limiter, max_queue_seconds = get_topic_limiter(topic, topic_config)
+            limiters.insert(0, topic_limiter)
+
+        start_time = time.monotonic()
+        deadline = start_time + max_queue_seconds
+        acquired = []
+        try:
+            for limiter in limiters:
+                if limiter.max_concurrent:
+                    self.queue_depth.observe(limiter.queued, limiter=limiter.name)
+
+                await limiter.acquire(timeout=max(deadline - time.monotonic(), 0))
+                acquired.append(limiter)
+        except (QueueFullError, QueueTimeoutError) as exc:
+            reason = "timeout"
+            if isinstance(exc, QueueFullError):
+                reason = "queue_full"
+                exc.queue_seconds = max_queue_seconds
+            self.rejected.inc(topic=topic, reason=reason)
+            logging.warning(f"rejecting request for topic '{topic}': {exc}")
+            raise
+        finally:
+            if len(acquired) != len(limiters):
+                for limiter in acquired:
+                    limiter.release()
+
+        self.wait_seconds.observe(time.monotonic() - start_time, topic=topic)
+        try:
+            yield
+        finally:
+            for limiter in reversed(acquired):
+                limiter.release()
+
+
+def get_global_limiter() -> ConcurrencyLimiter:
+    """
+    Return the process's global limiter (creating it if necessary)
+    """
+    global _global_limiter
+    if _global_limiter is None:
+        _global_limiter = ConcurrencyLimiter(
+            "global",
+            max_concurrent=config.ASK_MAX_CONCURRENT_REQUESTS,
+            max_queued=config.ASK_MAX_QUEUED_REQUESTS,
+        )
+    return _global_limiter
+
+
+def get_topic_limiter(
+    topic: str, topic_config: Dict[str, Any]
+) -> tuple[ConcurrencyLimiter, float]:
+    """
+    Return the topic's limiter (creating it if necessary) and its max queue time
+
+    Args:
+        topic (str): topic name
+        topic_config (dict): the topic's configuration from `config.topics`
+
+    Returns:
+        tuple[ConcurrencyLimiter, float]: the limiter and max queue time in seconds
+    """
+    limits = (
+        get_from_cfg_metadata(
+            "max_concurrent_requests", topic_config, default=0, type_=int
+        ),
+        get_from_cfg_metadata(
+            "max_queued_requests",
+            topic_config,
+            default=config.ASK_MAX_QUEUED_REQUESTS,
+            type_=int,
+        ),
+        get_from_cfg_metadata(
+            "max_queue_seconds",
+            topic_config,
+            default=config.ASK_MAX_QUEUE_SECONDS,
+            type_=float,
+        ),
+    )
+
+    cached = _topic_limiters.get(topic)
+    if cached is None or cached[0] != limits:
+        # NOTE: requests holding slots in a replaced limiter release them there
+        cached = (
+            limits,
+            ConcurrencyLimiter(
+                f"topic:{topic}", max_concurrent=limits[0], max_queued=limits[1]
+            ),
+        )
+        _topic_limiters[topic] = cached
+
+    return cached[1], limits[2]
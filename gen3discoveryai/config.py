@@ -2,9 +2,12 @@ import cdislogging
 from starlette.config import Config
 from starlette.datastructures import Secret
 
-config = Config(".env")
+# settings are read from this file (settings in the environment take precedence)
+ENV_FILE = ".env"
+config = Config(ENV_FILE)
 if not config.file_values:
-    config = Config("env")
+    ENV_FILE = "env"
+    config = Config(ENV_FILE)
 
 DEBUG = config("DEBUG", cast=bool, default=False)
 VERBOSE_LLM_LOGS = config("VERBOSE_LLM_LOGS", cast=bool, default=False)
@@ -44,6 +47,158 @@ GOOGLE_APPLICATION_CREDENTIALS = config(
 OPENAI_API_KEY = config("OPENAI_API_KEY", cast=Secret, default=None)
 URL_PREFIX = config("URL_PREFIX", default=None)
 
+# topic chains are run natively async when the underlying chain supports it. Chains that
+# are sync-only get run in a bounded thread pool so they don't block the event loop,
+# this is the max number of threads in that pool (e.g. max sync-only chain executions in flight)
+TOPIC_CHAIN_THREAD_POOL_MAX_WORKERS = config(
+    "TOPIC_CHAIN_THREAD_POOL_MAX_WORKERS", cast=int, default=32
+)
+
+# verified token claims and Arborist authorization decisions are cached (per process)
+# for up to this many seconds, never past the token's expiration (0 disables)
+AUTH_CACHE_TTL_SECONDS = config("AUTH_CACHE_TTL_SECONDS", cast=float, default=60)
+AUTH_CACHE_MAX_ENTRIES = config("AUTH_CACHE_MAX_ENTRIES", cast=int, default=10000)
+
+# token issuers' public keys are refetched this often (and when a token is signed with
+# an unknown key)
+JWKS_CACHE_TTL_SECONDS = config("JWKS_CACHE_TTL_SECONDS", cast=float, default=3600)
+
+# admission control for AI requests (per process). At most ASK_MAX_CONCURRENT_REQUESTS run
+# at once (0 is unlimited), up to ASK_MAX_QUEUED_REQUESTS more wait for up to
+# ASK_MAX_QUEUE_SECONDS, and anything else is rejected quickly with a 429/503. Topics can
+# set their own limits in their metadata, see `gen3discoveryai.concurrency`
+ASK_MAX_CONCURRENT_REQUESTS = config(
+    "ASK_MAX_CONCURRENT_REQUESTS", cast=int, default=64
+)
+ASK_MAX_QUEUED_REQUESTS = config("ASK_MAX_QUEUED_REQUESTS", cast=int, default=128)
+ASK_MAX_QUEUE_SECONDS = config("ASK_MAX_QUEUE_SECONDS", cast=float, default=30)
+
+# per-user usage limits for AI requests. Each user gets USER_REQUEST_LIMIT requests and
+# USER_LLM_TOKEN_LIMIT LLM tokens per topic over a sliding window of
+# USER_LIMIT_WINDOW_SECONDS. Topics can set their own limits in their metadata, see
+# `gen3discoveryai.usage_limits`
+USER_LIMITS_ENABLED = config("USER_LIMITS_ENABLED", cast=bool, default=False)
+USER_REQUEST_LIMIT = config("USER_REQUEST_LIMIT", cast=int, default=500)
+USER_LLM_TOKEN_LIMIT = config("USER_LLM_TOKEN_LIMIT", cast=int, default=1000000)
+USER_LIMIT_WINDOW_SECONDS = config(
+    "USER_LIMIT_WINDOW_SECONDS", cast=float, default=86400
+)
+
+# where usage is counted: `memory` (per process), `sqlite` (a file shared by all workers
+# on a host) or `redis` (shared by all hosts, requires the `redis` package)
+USER_LIMITS_BACKEND = config("USER_LIMITS_BACKEND", cast=str, default="sqlite")
+USER_LIMITS_SQLITE_PATH = config(
+    "USER_LIMITS_SQLITE_PATH", cast=str, default="./usage_limits.sqlite"
+)
+USER_LIMITS_REDIS_URL = config(
+    "USER_LIMITS_REDIS_URL", cast=Secret, default="redis://localhost:6379/0"
+)
+
+# how stale (in seconds) each process's local view of a user's usage can be when
+# deciding without a round trip to the store (0 always uses the store)
+USER_LIMITS_LOCAL_SYNC_SECONDS = config(
+    "USER_LIMITS_LOCAL_SYNC_SECONDS", cast=float, default=1.0
+)
+
+# identical concurrent /ask queries (same topic and normalized query) await a single
+# shared topic chain execution instead of each calling the LLM
+ASK_COALESCING_ENABLED = config("ASK_COALESCING_ENABLED", cast=bool, default=True)
+
+# start retrieving documents for (authorized) /ask queries while the answer caches
+# are being checked (retrieval doesn't depend on them). Documents for cached answers
+# are discarded, so this trades some wasted retrievals for lower latency
+ASK_SPECULATIVE_RETRIEVAL_ENABLED = config(
+    "ASK_SPECULATIVE_RETRIEVAL_ENABLED", cast=bool, default=False
+)
+
+# exact-match cache of answers, keyed by topic, normalized query, topic configuration
+# and knowledge store version. Use the `sqlite` backend to share the cache between
+# all the workers on a host (the `memory` backend is per-process)
+ANSWER_CACHE_ENABLED = config("ANSWER_CACHE_ENABLED", cast=bool, default=False)
+ANSWER_CACHE_BACKEND = config("ANSWER_CACHE_BACKEND", cast=str, default="memory")
+ANSWER_CACHE_TTL_SECONDS = config("ANSWER_CACHE_TTL_SECONDS", cast=float, default=3600)
+ANSWER_CACHE_MAX_ENTRIES = config("ANSWER_CACHE_MAX_ENTRIES", cast=int, default=1000)
+ANSWER_CACHE_SQLITE_PATH = config(
+    "ANSWER_CACHE_SQLITE_PATH", cast=str, default="./cache/answers.sqlite"
+)
+
+# cache of embedding vectors keyed by embedding model and text, shared by query-time
+# retrieval, the semantic cache, and knowledge ingestion. The memory tier is a per-process
+# LRU, set a path to also persist vectors on disk (shared by all processes on a host)
+EMBEDDING_CACHE_ENABLED = config("EMBEDDING_CACHE_ENABLED", cast=bool, default=True)
+EMBEDDING_CACHE_MAX_ENTRIES = config(
+    "EMBEDDING_CACHE_MAX_ENTRIES", cast=int, default=10000
+)
+EMBEDDING_CACHE_SQLITE_PATH = config(
+    "EMBEDDING_CACHE_SQLITE_PATH", cast=str, default=""
+)
+# vectors kept in the on-disk tier, the least recently used are evicted over this
+# (0 for unlimited). Vectors are ~6-12KB each, depending on the embedding model
+EMBEDDING_CACHE_SQLITE_MAX_ENTRIES = config(
+    "EMBEDDING_CACHE_SQLITE_MAX_ENTRIES", cast=int, default=100000
+)
+
+# knowledge ingestion embeds documents in batches of this size with this many concurrent
+# requests, retrying transient failures (like rate limits) up to this many times
+INGESTION_BATCH_SIZE = config("INGESTION_BATCH_SIZE", cast=int, default=100)
+INGESTION_CONCURRENCY = config("INGESTION_CONCURRENCY", cast=int, default=4)
+INGESTION_MAX_RETRIES = config("INGESTION_MAX_RETRIES", cast=int, default=6)
+# documents read and split ahead of embedding while loading the knowledge library
+INGESTION_QUEUE_SIZE = config("INGESTION_QUEUE_SIZE", cast=int, default=1000)
+# embedding cache the knowledge loader uses when `EMBEDDING_CACHE_SQLITE_PATH` isn't set,
+# so vectors embedded before a failed load are reused when it's resumed ("" to disable)
+INGESTION_EMBEDDING_CACHE_SQLITE_PATH = config(
+    "INGESTION_EMBEDDING_CACHE_SQLITE_PATH",
+    cast=str,
+    default="./knowledge/embeddings.sqlite",
+)
+
+# estimated tokens per minute to send to each embedding provider during ingestion.
+# Lowered automatically when the provider rate limits anyway (0 for no limit until then)
+OPENAI_EMBEDDING_TOKENS_PER_MINUTE = config(
+    "OPENAI_EMBEDDING_TOKENS_PER_MINUTE", cast=int, default=1000000
+)
+GOOGLE_EMBEDDING_TOKENS_PER_MINUTE = config(
+    "GOOGLE_EMBEDDING_TOKENS_PER_MINUTE", cast=int, default=0
+)
+OLLAMA_EMBEDDING_TOKENS_PER_MINUTE = config(
+    "OLLAMA_EMBEDDING_TOKENS_PER_MINUTE", cast=int, default=0
+)
+
+# directory of cached tiktoken encodings used to split documents when loading the
+# knowledge library (for hosts without internet access, seed it with
+# `./bin/load_into_knowledge_store.py cache-encoding`)
+TIKTOKEN_CACHE_DIR = config("TIKTOKEN_CACHE_DIR", cast=str, default="")
+
+# knowledge is stored by building a new version alongside the live one and then switching
+# to it. This many previous versions are kept on disk for rollback. Running services check
+# for a newly activated version this often (0 to only switch through the admin endpoint)
+KNOWLEDGE_VERSIONS_TO_KEEP = config("KNOWLEDGE_VERSIONS_TO_KEEP", cast=int, default=2)
+KNOWLEDGE_VERSION_POLL_SECONDS = config(
+    "KNOWLEDGE_VERSION_POLL_SECONDS", cast=float, default=10
+)
+
+# when topics' chains are created: "eager" (before accepting requests), "background"
+# (while accepting requests, `/_status` responds 503 until they're all created), or
+# "lazy" (on each topic's first request). See `gen3discoveryai.topic_init`
+TOPIC_INIT_MODE = config("TOPIC_INIT_MODE", cast=str, default="eager")
+TOPIC_INIT_CONCURRENCY = config("TOPIC_INIT_CONCURRENCY", cast=int, default=8)
+# load each topic's vectorstore index before marking it ready, so the first request
+# doesn't wait for it
+TOPIC_WARM_UP = config("TOPIC_WARM_UP", cast=bool, default=True)
+# running services check ENV_FILE this often, and when it changed, rebuild the topics
+# whose configuration changed without a restart (0 to only reload through the admin
+# endpoint)
+TOPIC_CONFIG_POLL_SECONDS = config("TOPIC_CONFIG_POLL_SECONDS", cast=float, default=30)
+
+# gunicorn worker processes. With GUNICORN_PRELOAD_APP, the app and the configured
+# topics' chain modules (with their providers' dependencies) are imported once in
+# gunicorn's master process and shared copy-on-write by the workers forked from it,
+# instead of each worker importing them. Topics' chains are still created in each
+# worker (see `gen3discoveryai.topic_init.preload_topics`)
+GUNICORN_WORKERS = config("GUNICORN_WORKERS", cast=int, default=1)
+GUNICORN_PRELOAD_APP = config("GUNICORN_PRELOAD_APP", cast=bool, default=False)
+
 # csv strings for all topic names
 #
 # topics are a logical combination of the following:
@@ -0,0 +1,457 @@
+"""
+Caching wrapper for the embedding functions used by the topic chains.
+
+Some models embed the same text differently depending on whether it's a query or a
+document (e.g. Vertex AI uses the `RETRIEVAL_QUERY` and `RETRIEVAL_DOCUMENT` task
+types), so vectors are cached by (embedding model, role, task type, hash of the text),
+where the role is query or document. The same cache is used when embedding queries at
+request time (by the retriever and the semantic cache) and when embedding documents at
+ingestion time, so repeated queries and re-ingesting unchanged documents don't call
+out to the embedding provider again.
+
+Vectors are stored as float32 arrays in two tiers:
+    - memory: per-process LRU (`EMBEDDING_CACHE_MAX_ENTRIES`)
+    - disk: optional SQLite database (`EMBEDDING_CACHE_SQLITE_PATH`) which persists
+      across restarts and can be shared by all processes on a host, evicting the least
+      recently used vectors over `EMBEDDING_CACHE_SQLITE_MAX_ENTRIES`
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from gen3discoveryai import config, logging
+from gen3discoveryai.metrics import get_counter
+
+# what a text is being embedded as, which is part of the cache key
+EMBEDDING_ROLE_QUERY = "query"
+EMBEDDING_ROLE_DOCUMENT = "document"
+
+_memory_tier = None
+_disk_tier = None
+_tiers_lock = threading.Lock()
+
+
+class InMemoryVectorCache:
+    """
+    Per-process LRU cache of float32 vectors
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        Return the cached vectors for any of the keys which are cached
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+        return found
+
+    def set_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        """
+        Cache the vectors, evicting the least recently used if full
+        """
+        with self._lock:
+            for key, vector in vectors.items():
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteVectorCache:
+    """
+    On-disk cache of float32 vectors. Multiple processes can safely use the same
+    database file.
+
+    Once it holds more than `max_entries` vectors (0 for unlimited), the least recently
+    used are evicted. Each process prunes the cache when it's opened and after every
+    tenth of `max_entries` vectors it writes, so it can briefly exceed the limit.
+    """
+
+    # a vector's last use is only updated if it's older than this, so most reads
+    # don't write
+    LAST_USED_RESOLUTION_SECONDS = 3600
+
+    def __init__(self, path: str, max_entries: int = 0) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # vectors written since the cache was last pruned
+        self._written = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(
+            path, timeout=10, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "last_used INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._add_last_used_column()
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used "
+            "ON embeddings (last_used)"
+        )
+        self.prune()
+
+    def _add_last_used_column(self) -> None:
+        """
+        Caches created before eviction was supported don't track when vectors were
+        last used, their vectors are evicted first
+        """
+        columns = [
+            row[1] for row in self._connection.execute("PRAGMA table_info(embeddings)")
+        ]
+        if "last_used" in columns:
+            return
+
+        try:
+            self._connection.execute(
+                "ALTER TABLE embeddings "
+                "ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0"
+            )
+        except sqlite3.OperationalError as exc:
+            # another process added it first
+            if "duplicate column" not in str(exc):
+                raise
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        Return the cached vectors for any of the keys which are cached
+        """
+        found = {}
+        now = int(time.time())
+        with self._lock:
+            # stay well under SQLite's max number of query parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                rows = self._connection.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+
+                if rows:
+                    self._connection.execute(
+                        "UPDATE embeddings SET last_used = ? WHERE last_used < ? "
+                        f"AND key IN ({','.join('?' * len(rows))})",
+                        [
+                            now,
+                            now - self.LAST_USED_RESOLUTION_SECONDS,
+                            *(key for key, _ in rows),
+                        ],
+                    )
+        return found
+
+    def set_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        """
+        Cache the vectors, evicting the least recently used if full
+        """
+        now = int(time.time())
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) "
+                "VALUES (?, ?, ?)",
+                [(key, vector.tobytes(), now) for key, vector in vectors.items()],
+            )
+            self._written += len(vectors)
+            should_prune = self.max_entries and self._written >= max(
+                self.max_entries // 10, 1
+            )
+
+        if should_prune:
+            self.prune()
+
+    def prune(self) -> int:
+        """
+        Evict the least recently used vectors over `max_entries`
+
+        Returns:
+            int: number of vectors evicted
+        """
+        if not self.max_entries:
+            return 0
+
+        with self._lock:
+            self._written = 0
+            count = self._connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+            evicted = count - self.max_entries
+            if evicted <= 0:
+                return 0
+
+            self._connection.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (evicted,),
+            )
+
+        logging.debug(f"evicted {evicted} vectors from embedding cache: {self.path}")
+        return evicted
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps another embedding function and caches its vectors in the memory
+    (and optional disk) tier
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        memory_tier: InMemoryVectorCache,
+        disk_tier: Optional[SQLiteVectorCache] = None,
+        model_id: str = None,
+    ) -> None:
+        self.embeddings = embeddings
+        self.memory_tier = memory_tier
+        self.disk_tier = disk_tier
+        self.model_id = model_id or get_embedding_model_id(embeddings)
+        # models configured with a single task type (vs. one per role)
+        task_type = getattr(embeddings, "task_type", None)
+        self.task_type = task_type if isinstance(task_type, str) else ""
+        self.hits = get_counter(
+            "embedding_cache_hits_total", "Texts embedded from the embedding cache"
+        )
+        self.misses = get_counter(
+            "embedding_cache_misses_total",
+            "Texts embedded by calling the embedding provider",
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._get_key(text, EMBEDDING_ROLE_DOCUMENT) for text in texts]
+        vectors = self._get_cached(keys)
+
+        missing = _get_missing(texts, keys, vectors)
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            vectors.update(self._set_cached(list(missing.keys()), new_vectors))
+
+        return [vectors[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._get_key(text, EMBEDDING_ROLE_QUERY)
+        vector = self._get_cached([key]).get(key)
+
+        if vector is None:
+            new_vector = self.embeddings.embed_query(text)
+            vector = self._set_cached([key], [new_vector])[key]
+
+        return vector.tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._get_key(text, EMBEDDING_ROLE_DOCUMENT) for text in texts]
+        vectors = await self._aget_cached(keys)
+
+        missing = _get_missing(texts, keys, vectors)
+        if missing:
+            new_vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            vectors.update(await self._aset_cached(list(missing.keys()), new_vectors))
+
+        return [vectors[key].tolist() for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._get_key(text, EMBEDDING_ROLE_QUERY)
+        vector = (await self._aget_cached([key])).get(key)
+
+        if vector is None:
+            new_vector = await self.embeddings.aembed_query(text)
+            vector = (await self._aset_cached([key], [new_vector]))[key]
+
+        return vector.tolist()
+
+    def _get_key(self, text: str, role: str) -> str:
+        return hashlib.sha256(
+            f"{self.model_id}\0{role}\0{self.task_type}\0{text}".encode("utf-8")
+        ).hexdigest()
+
+    def _get_cached(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Look for the keys in the memory tier and then the disk tier, promoting
+        anything found on disk into memory
+        """
+        vectors = self.memory_tier.get_many(keys)
+        if self.disk_tier is not None and len(vectors) < len(keys):
+            vectors.update(self._get_from_disk(keys, vectors))
+
+        self._count(keys, vectors)
+        return vectors
+
+    async def _aget_cached(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Same as `_get_cached`, reading the disk tier in a thread so SQLite doesn't
+        block the event loop
+        """
+        vectors = self.memory_tier.get_many(keys)
+        if self.disk_tier is not None and len(vectors) < len(keys):
+            vectors.update(await asyncio.to_thread(self._get_from_disk, keys, vectors))
+
+        self._count(keys, vectors)
+        return vectors
+
+    def _get_from_disk(
+        self, keys: List[str], vectors: Dict[str, np.ndarray]
+    ) -> Dict[str, np.ndarray]:
+        """
+        Look for the keys not already found in the disk tier, promoting anything
+        found into memory
+        """
+        try:
+            from_disk = self.disk_tier.get_many(
+                [key for key in dict.fromkeys(keys) if key not in vectors]
+            )
+        except Exception as exc:
+            # the cache is an optimization, never fail b/c of it
+            logging.error(f"unable to read from embedding cache, exc: {exc}")
+            from_disk = {}
+        self.memory_tier.set_many(from_disk)
+        return from_disk
+
+    def _count(self, keys: List[str], vectors: Dict[str, np.ndarray]) -> None:
+        hits = sum(1 for key in keys if key in vectors)
+        self.hits.inc(hits, model=self.model_id)
+        self.misses.inc(len(keys) - hits, model=self.model_id)
+
+    def _set_cached(
+        self, keys: List[str], new_vectors: List[List[float]]
+    ) -> Dict[str, np.ndarray]:
+        vectors = _as_float32(keys, new_vectors)
+        self.memory_tier.set_many(vectors)
+        if self.disk_tier is not None:
+            self._set_on_disk(vectors)
+        return vectors
+
+    async def _aset_cached(
+        self, keys: List[str], new_vectors: List[List[float]]
+    ) -> Dict[str, np.ndarray]:
+        """
+        Same as `_set_cached`, writing the disk tier in a thread so SQLite doesn't
+        block the event loop
+        """
+        vectors = _as_float32(keys, new_vectors)
+        self.memory_tier.set_many(vectors)
+        if self.disk_tier is not None:
+            await asyncio.to_thread(self._set_on_disk, vectors)
+        return vectors
+
+    def _set_on_disk(self, vectors: Dict[str, np.ndarray]) -> None:
+        try:
+            self.disk_tier.set_many(vectors)
+        except Exception as exc:
+            logging.error(f"unable to write to embedding cache, exc: {exc}")
+
+
+def get_embedding_model_id(embeddings: Embeddings) -> str:
+    """
+    Identify the embedding model so vectors from different models never collide
+
+    Args:
+        embeddings (Embeddings): the embedding function
+
+    Returns:
+        str: e.g. `OpenAIEmbeddings:text-embedding-ada-002`
+    """
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings.model_id
+
+    model_name = getattr(embeddings, "model", None)
+    if not isinstance(model_name, str):
+        model_name = getattr(embeddings, "model_name", None)
+    if not isinstance(model_name, str):
+        model_name = ""
+    return f"{type(embeddings).__name__}:{model_name}"
+
+
+def get_cached_embeddings(embeddings: Embeddings) -> Embeddings:
+    """
+    Wrap the embedding function with the process's shared embedding cache
+    (or return it as-is if embedding caching is disabled)
+
+    Args:
+        embeddings (Embeddings): the embedding function
+
+    Returns:
+        Embeddings: the caching embedding function
+    """
+    global _memory_tier, _disk_tier
+
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return embeddings
+
+    with _tiers_lock:
+        if _memory_tier is None:
+            _memory_tier = InMemoryVectorCache(config.EMBEDDING_CACHE_MAX_ENTRIES)
+        if _disk_tier is None and config.EMBEDDING_CACHE_SQLITE_PATH:
+            logging.info(
+                f"using embedding cache at: {config.EMBEDDING_CACHE_SQLITE_PATH}"
+            )
+            _disk_tier = SQLiteVectorCache(
+                config.EMBEDDING_CACHE_SQLITE_PATH,
+                max_entries=config.EMBEDDING_CACHE_SQLITE_MAX_ENTRIES,
+            )
+
+    return CachedEmbeddings(embeddings, _memory_tier, _disk_tier)
+
+
+def _reset_after_fork() -> None:
+    """
+    SQLite connections can't be used from a forked process (e.g. a gunicorn worker
+    forked from a preloaded master), so forked processes open their own
+    """
+    global _disk_tier
+    _disk_tier = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _as_float32(
+    keys: List[str], new_vectors: List[List[float]]
+) -> Dict[str, np.ndarray]:
+    return {
+        key: np.asarray(vector, dtype=np.float32)
+        for key, vector in zip(keys, new_vectors)
+    }
+
+
+def _get_missing(
+    texts: List[str], keys: List[str], vectors: Dict[str, np.ndarray]
+) -> Dict[str, str]:
+    """
+    Unique key to text for the texts which still need to be embedded
+    """
+    return {key: text for key, text in zip(keys, texts) if key not in vectors}
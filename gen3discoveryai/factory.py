@@ -1,10 +1,18 @@
-from typing import Any
+import importlib
+import threading
+from typing import Any, Union
 
 
 class Factory:
     """
     Simple object-oriented factory to register classes and
     get instances based on a string name input.
+
+    Classes can be registered by their dotted path (e.g. "package.module.ClassName")
+    instead of the class itself, in which case their module is only imported the
+    first time an instance is requested. This keeps modules with heavy dependencies
+    (like the providers' langchain integrations) from being imported unless they're
+    used.
     """
 
     def __init__(self) -> None:
@@ -12,14 +20,16 @@ class Factory:
         Sets up the internal dict for storing the mappings
         """
         self._classes = {}
+        self._lock = threading.Lock()
 
-    def register(self, class_name: str, class_def: object) -> None:
+    def register(self, class_name: str, class_def: Union[object, str]) -> None:
         """
         Add a class to the registry under the provided name.
 
         Args:
             class_name (str): Provided name for the class
-            class_def (object): Actual class definition object
+            class_def (object | str): Actual class definition object, or its dotted
+                path to import on first use
         """
         self._classes[class_name] = class_def
 
@@ -42,7 +52,46 @@ class Factory:
         Raises:
             ValueError: No registered class exists with provided name
         """
+        class_def = self.get_class(class_name)
+        return class_def(*args, **kwargs)
+
+    def get_class(self, class_name: str) -> Any:
+        """
+        Get the class registered under the name, importing it if it was registered
+        by its dotted path.
+
+        Args:
+            class_name (str): Provided name for the class
+
+        Returns:
+            object: registered class definition for the name specified
+
+        Raises:
+            ValueError: No registered class exists with provided name
+            ImportError: The class's module (or one of its dependencies) can't be
+                imported
+        """
         class_def = self._classes.get(class_name)
         if not class_def:
             raise ValueError(class_name)
-        return class_def(*args, **kwargs)
+
+        if isinstance(class_def, str):
+            # topics can be created concurrently, so only import once
+            with self._lock:
+                class_def = self._classes[class_name]
+                if isinstance(class_def, str):
+                    class_def = _import_class(class_def)
+                    self._classes[class_name] = class_def
+
+        return class_def
+
+
+def _import_class(dotted_path: str) -> Any:
+    """
+    Import a class from its dotted path, e.g. "package.module.ClassName"
+    """
+    module_path, _, attribute = dotted_path.rpartition(".")
+    try:
+        return getattr(importlib.import_module(module_path), attribute)
+    except AttributeError as exc:
+        raise ImportError(f"{module_path} has no {attribute}") from exc
@@ -0,0 +1,834 @@
+"""
+Embedding documents and storing them in a topic's knowledge store.
+
+Documents are embedded in batches (`INGESTION_BATCH_SIZE`) by a pool of concurrent
+workers (`INGESTION_CONCURRENCY`) and each batch of vectors is written to the
+vectorstore in bulk as soon as it's produced, so large loads overlap slow embedding
+requests without holding every vector in memory. Documents are consumed lazily, so
+loaders can stream them in (see `iter_prefetched`) and peak memory stays flat however
+large the input is.
+
+Requests to each embedding provider (OpenAI, Google, Ollama) share an
+`AdaptiveRateLimiter`, which keeps the estimated tokens per minute under the provider's
+limit (`{PROVIDER}_EMBEDDING_TOKENS_PER_MINUTE`). Whenever the provider rate limits
+anyway, the limit is lowered and then slowly raised again as requests succeed.
+Failed batches are retried with exponential backoff and jitter.
+
+Loads are resumable. An `IngestionManifest` next to the topic's knowledge store records
+the version being built, the input files and how far they were read, and how many chunks
+were embedded and stored. If a load fails, the partially built version is kept, and
+resuming the load builds on it: chunks are identified by a hash of their source and
+content, so the ones already stored are skipped, and vectors embedded before the failure
+are reused from the embedding cache.
+"""
+
+import datetime
+import itertools
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from gen3discoveryai import config, logging
+from gen3discoveryai.embeddings import CachedEmbeddings
+from gen3discoveryai.knowledge import (
+    delete_knowledge_version,
+    get_knowledge_version,
+    list_knowledge_versions,
+    read_ingestion_manifest,
+    write_ingestion_manifest,
+)
+from gen3discoveryai.metrics import get_counter
+from gen3discoveryai.usage_limits import estimate_tokens
+from gen3discoveryai.vectorstores import NumpyVectorStore
+
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+
+# embedding function class name -> provider sharing a rate limit
+EMBEDDING_PROVIDERS = {
+    "OpenAIEmbeddings": "openai",
+    "AzureOpenAIEmbeddings": "openai",
+    "VertexAIEmbeddings": "google",
+    "OllamaEmbeddings": "ollama",
+}
+
+# errors from provider clients which are worth retrying
+_RETRYABLE_ERROR_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "ConnectError",
+    "DeadlineExceeded",
+    "InternalServerError",
+    "ReadTimeout",
+    "ServiceUnavailable",
+}
+_RATE_LIMIT_ERROR_NAMES = {"RateLimitError", "ResourceExhausted", "TooManyRequests"}
+
+# status of a load in its `IngestionManifest`
+INGESTION_IN_PROGRESS = "in_progress"
+INGESTION_FAILED = "failed"
+INGESTION_COMPLETE = "complete"
+
+# how often progress is written to the manifest during a load
+MANIFEST_SAVE_INTERVAL_SECONDS = 5
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket limiting the estimated tokens per minute sent to a provider. The rate
+    is halved (down to a minimum) every time the provider rate limits, and raised by a
+    fraction of the configured rate after every successful request.
+
+    Without a configured rate, requests aren't limited until the provider rate limits,
+    at which point the rate is learned from the tokens used in the last minute.
+    """
+
+    def __init__(
+        self,
+        tokens_per_minute: float,
+        min_tokens_per_minute: float = 1000,
+        decrease_factor: float = 0.5,
+        increase_fraction: float = 0.05,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.max_tokens_per_minute = (
+            tokens_per_minute if tokens_per_minute > 0 else None
+        )
+        # None is unlimited
+        self.tokens_per_minute = self.max_tokens_per_minute
+        self.min_tokens_per_minute = min_tokens_per_minute
+        self.decrease_factor = decrease_factor
+        self.increase_fraction = increase_fraction
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._available = self.tokens_per_minute or 0
+        self._updated_at = clock()
+        # (time, tokens) acquired in the last minute
+        self._recent = deque()
+
+    def acquire(self, tokens: int) -> None:
+        """
+        Block until `tokens` can be sent without exceeding the current rate. Requests
+        for more than a minute's worth of tokens wait for a full bucket.
+
+        Args:
+            tokens (int): estimated tokens for the request
+        """
+        while True:
+            with self._lock:
+                now = self._clock()
+                if self.tokens_per_minute is None:
+                    self._record(now, tokens)
+                    return
+
+                self._refill(now)
+                needed = min(tokens, self.tokens_per_minute)
+                if self._available >= needed:
+                    self._available -= tokens
+                    self._record(now, tokens)
+                    return
+
+                wait_seconds = (needed - self._available) / self.tokens_per_minute * 60
+
+            self._sleep(wait_seconds)
+
+    def on_rate_limited(self) -> None:
+        """
+        Lower the rate after the provider rejected a request for exceeding its limit
+        """
+        with self._lock:
+            now = self._clock()
+            if self.tokens_per_minute is None:
+                self._record(now, 0)
+                current = sum(tokens for _, tokens in self._recent)
+            else:
+                self._refill(now)
+                current = self.tokens_per_minute
+
+            self.tokens_per_minute = max(
+                current * self.decrease_factor, self.min_tokens_per_minute
+            )
+            # nothing more is sent until the bucket refills at the lower rate
+            self._available = min(self._available, 0)
+            self._updated_at = now
+
+        logging.warning(
+            f"embedding provider rate limited, lowered to {self.tokens_per_minute:.0f} "
+            "tokens per minute"
+        )
+
+    def on_success(self) -> None:
+        """
+        Raise the rate (up to the configured rate) after a successful request
+        """
+        with self._lock:
+            if self.tokens_per_minute is None:
+                return
+
+            increase = (
+                self.max_tokens_per_minute or self.tokens_per_minute
+            ) * self.increase_fraction
+            self.tokens_per_minute += increase
+            if self.max_tokens_per_minute:
+                self.tokens_per_minute = min(
+                    self.tokens_per_minute, self.max_tokens_per_minute
+                )
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._available = min(
+            self.tokens_per_minute,
+            self._available + elapsed * self.tokens_per_minute / 60,
+        )
+
+    def _record(self, now: float, tokens: int) -> None:
+        self._recent.append((now, tokens))
+        while self._recent and now - self._recent[0][0] > 60:
+            self._recent.popleft()
+
+
+def get_rate_limiter(provider: str) -> AdaptiveRateLimiter:
+    """
+    Return the rate limiter shared by all requests to the embedding provider in this
+    process (creating it if necessary)
+
+    Args:
+        provider (str): embedding provider, e.g. `openai`
+
+    Returns:
+        AdaptiveRateLimiter: limited to `{PROVIDER}_EMBEDDING_TOKENS_PER_MINUTE`
+            (unlimited if not configured)
+    """
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            tokens_per_minute = getattr(
+                config, f"{provider.upper()}_EMBEDDING_TOKENS_PER_MINUTE", 0
+            )
+            _rate_limiters[provider] = AdaptiveRateLimiter(tokens_per_minute)
+        return _rate_limiters[provider]
+
+
+def get_embedding_provider(embeddings: Optional[Embeddings]) -> str:
+    """
+    Identify the provider of the embedding function, so requests to the same provider
+    share a rate limit
+
+    Args:
+        embeddings (Embeddings): the embedding function (possibly cached)
+
+    Returns:
+        str: e.g. `openai`, or the embedding function's class name if unknown
+    """
+    while isinstance(embeddings, CachedEmbeddings):
+        embeddings = embeddings.embeddings
+
+    name = type(embeddings).__name__
+    return EMBEDDING_PROVIDERS.get(name, name)
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """
+    Whether the error is a provider rejecting a request for exceeding its rate limit
+    """
+    for error in (exc, exc.__cause__):
+        if error is None:
+            continue
+        if type(error).__name__ in _RATE_LIMIT_ERROR_NAMES:
+            return True
+        if _get_status_code(error) == 429:
+            return True
+    return False
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """
+    Whether the error is likely transient (rate limits, timeouts, server errors)
+    """
+    if is_rate_limit_error(exc):
+        return True
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    if type(exc).__name__ in _RETRYABLE_ERROR_NAMES:
+        return True
+    status_code = _get_status_code(exc)
+    return isinstance(status_code, int) and status_code >= 500
+
+
+def call_with_retries(
+    func: Callable[[], Any],
+    rate_limiter: AdaptiveRateLimiter,
+    tokens: int,
+    max_retries: int = None,
+    backoff_seconds: float = 1,
+    max_backoff_seconds: float = 60,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Any:
+    """
+    Call `func` once the rate limiter allows `tokens`, retrying transient errors with
+    exponential backoff and full jitter
+
+    Args:
+        func (Callable): request to make
+        rate_limiter (AdaptiveRateLimiter): limiter for the provider the request is to
+        tokens (int): estimated tokens for the request
+        max_retries (int): retries before giving up, defaults to `INGESTION_MAX_RETRIES`
+        backoff_seconds (float): max delay before the first retry, doubled for each retry
+        max_backoff_seconds (float): max delay before any retry
+        sleep (Callable): called with the delay before retrying
+
+    Returns:
+        Any: what `func` returns
+    """
+    if max_retries is None:
+        max_retries = config.INGESTION_MAX_RETRIES
+
+    retries = get_counter(
+        "ingestion_embedding_retries_total",
+        "Embedding requests retried during knowledge ingestion",
+    )
+
+    attempt = 0
+    while True:
+        rate_limiter.acquire(tokens)
+        try:
+            result = func()
+        except Exception as exc:
+            if attempt >= max_retries or not is_retryable_error(exc):
+                raise
+
+            rate_limited = is_rate_limit_error(exc)
+            if rate_limited:
+                rate_limiter.on_rate_limited()
+
+            delay = random.uniform(
+                0, min(max_backoff_seconds, backoff_seconds * 2**attempt)
+            )
+            attempt += 1
+            retries.inc(rate_limited=str(rate_limited).lower())
+            logging.warning(
+                f"embedding request failed ({type(exc).__name__}: {exc}), "
+                f"retry {attempt}/{max_retries} in {delay:.1f}s"
+            )
+            sleep(delay)
+        else:
+            rate_limiter.on_success()
+            return result
+
+
+def embed_and_store(
+    vectorstore: VectorStore,
+    documents: Iterable[Tuple[str, Document]],
+    batch_size: int = None,
+    concurrency: int = None,
+    on_stored: Callable[[int], None] = None,
+) -> int:
+    """
+    Embed the documents in concurrent batches and write them to the vectorstore in bulk
+    as each batch is embedded.
+
+    Documents are consumed lazily and only a bounded number of batches are in memory
+    at once, so documents can be streamed in from a generator of any length.
+
+    For Chroma and NumPy vectorstores, vectors are written directly. Other vectorstores
+    embed each batch themselves (still concurrently, with the same rate limiting and
+    retries).
+
+    Args:
+        vectorstore (VectorStore): where to store the documents
+        documents (Iterable[Tuple[str, Document]]): id and document for each document
+            to embed and store
+        batch_size (int): documents per embedding request, defaults to `INGESTION_BATCH_SIZE`
+        concurrency (int): concurrent embedding requests, defaults to `INGESTION_CONCURRENCY`
+        on_stored (Callable[[int], None]): called with the number of documents in each
+            batch once it's stored (e.g. to record progress)
+
+    Returns:
+        int: number of documents stored
+    """
+    batch_size = max(batch_size or config.INGESTION_BATCH_SIZE, 1)
+    concurrency = max(concurrency or config.INGESTION_CONCURRENCY, 1)
+
+    embeddings = None
+    if _is_chroma(vectorstore) or isinstance(vectorstore, NumpyVectorStore):
+        embeddings = vectorstore.embeddings
+    provider = get_embedding_provider(
+        embeddings or getattr(vectorstore, "embeddings", None)
+    )
+    rate_limiter = get_rate_limiter(provider)
+
+    def _embed(batch_documents: List[Document], batch_ids: List[str]):
+        texts = [document.page_content for document in batch_documents]
+        tokens = estimate_tokens(*texts)
+        if embeddings is None:
+            call_with_retries(
+                lambda: vectorstore.add_documents(batch_documents, ids=batch_ids),
+                rate_limiter,
+                tokens,
+            )
+            return batch_ids, None
+
+        vectors = call_with_retries(
+            lambda: embeddings.embed_documents(texts), rate_limiter, tokens
+        )
+        return batch_ids, (batch_documents, batch_ids, vectors)
+
+    def _store(done) -> None:
+        for future in done:
+            batch_ids, embedded = future.result()
+            if embedded is not None and isinstance(vectorstore, NumpyVectorStore):
+                _add_into_numpy(vectorstore, *embedded)
+            elif embedded is not None:
+                _upsert_into_chroma(vectorstore, *embedded)
+            if on_stored:
+                on_stored(len(batch_ids))
+
+    logging.info(
+        f"Embedding documents with {provider} in batches of {batch_size} "
+        f"with {concurrency} concurrent requests..."
+    )
+    start_time = time.perf_counter()
+    stored = 0
+
+    documents = iter(documents)
+    executor = ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="ingestion"
+    )
+    try:
+        pending = set()
+        while batch := list(itertools.islice(documents, batch_size)):
+            # bound the batches in memory, writing what's done as it finishes
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _store(done)
+
+            batch_ids = [id_ for id_, _ in batch]
+            batch_documents = [document for _, document in batch]
+            pending.add(executor.submit(_embed, batch_documents, batch_ids))
+            stored += len(batch)
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            _store(done)
+    finally:
+        # on error, don't start any more batches
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    logging.info(
+        f"Embedded and stored {stored} documents in "
+        f"{time.perf_counter() - start_time:.1f}s"
+    )
+    return stored
+
+
+def iter_prefetched(iterable: Iterable[Any], max_items: int = None) -> Iterator[Any]:
+    """
+    Iterate over `iterable` while it's consumed in a background thread, so producing
+    items (e.g. reading and splitting files) overlaps with consuming them (e.g.
+    embedding). At most `max_items` are produced ahead of the consumer, so memory
+    stays bounded however long the iterable is.
+
+    Errors producing items are raised to the consumer, and production stops if the
+    consumer stops iterating.
+
+    Args:
+        iterable (Iterable[Any]): items to produce
+        max_items (int): items produced ahead, defaults to `INGESTION_QUEUE_SIZE`
+
+    Yields:
+        Any: each item of `iterable`, in order
+    """
+    items = queue.Queue(maxsize=max(max_items or config.INGESTION_QUEUE_SIZE, 1))
+    stopped = threading.Event()
+    done = object()
+
+    def _put(item: Any) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce() -> None:
+        try:
+            for item in iterable:
+                if not _put((item, None)):
+                    return
+        except BaseException as exc:  # pylint: disable=broad-exception-caught
+            _put((done, exc))
+            return
+        _put((done, None))
+
+    producer = threading.Thread(target=_produce, name="ingestion-reader", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, exc = items.get()
+            if item is done:
+                if exc is not None:
+                    raise exc
+                return
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def map_in_processes(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    workers: int,
+    max_pending: int = None,
+) -> Iterator[Any]:
+    """
+    Apply `func` to each item in a pool of `workers` processes (for CPU-bound work
+    like parsing and tokenizing), yielding the results in the same order as `items`
+    so the output is deterministic however many workers there are.
+
+    Items are submitted lazily with at most `max_pending` outstanding, so results
+    don't pile up in memory if they're consumed slowly.
+
+    Args:
+        func (Callable): module-level (picklable) function to apply
+        items (Iterable[Any]): picklable arguments for `func`
+        workers (int): processes in the pool, 1 or fewer to apply `func` in this process
+        max_pending (int): items submitted ahead of the results consumed, defaults to
+            twice the workers
+
+    Yields:
+        Any: `func(item)` for each item, in order
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+
+    max_pending = max(max_pending or workers * 2, 1)
+    # spawn rather than fork, since the calling process can have threads running
+    # (like `iter_prefetched`'s)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        try:
+            for item in items:
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(func, item))
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class IngestionManifest:
+    """
+    Progress of loading a topic's knowledge, saved next to its knowledge store (see
+    `gen3discoveryai.knowledge.read_ingestion_manifest`) so an interrupted load can be
+    resumed and its progress reported from another process.
+
+    The manifest records the knowledge version being built, each input file (with its
+    size and mtime) and how many bytes of it were read, and how many chunks were
+    embedded and stored. The chunks themselves are in the version being built, keyed by
+    a hash of their source and content.
+
+    Nothing is written until the load starts (`start`), progress is written at most
+    every `save_interval_seconds`, and the outcome is always written.
+    """
+
+    def __init__(
+        self,
+        topic: str,
+        resume: bool = False,
+        options: Dict[str, Any] = None,
+        save_interval_seconds: float = MANIFEST_SAVE_INTERVAL_SECONDS,
+    ) -> None:
+        """
+        Args:
+            topic (str): topic being loaded
+            resume (bool): whether to continue building the version from a previous
+                load which didn't finish
+            options (Dict[str, Any]): how the input is turned into documents (e.g. the
+                chunk size), recorded so later loads can tell if it changed
+            save_interval_seconds (float): minimum time between writing progress
+        """
+        self.topic = topic
+        self.resume = resume
+        self.options = options or {}
+        self.save_interval_seconds = save_interval_seconds
+        self.data: Dict[str, Any] = {}
+        # files are read in a different thread than documents are stored in
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    @property
+    def version(self) -> Optional[str]:
+        """
+        The knowledge version being built, None before it's created
+        """
+        return self.data.get("version")
+
+    def start(self, full_rebuild: bool = False) -> Optional[str]:
+        """
+        Start the load, resuming the previous one if requested and possible. A previous
+        load's unfinished version which isn't resumed is deleted.
+
+        Args:
+            full_rebuild (bool): whether the load re-embeds all documents, a previous
+                load is only resumed if it was the same kind of load
+
+        Returns:
+            str: the unfinished version to continue building, None to build a new one
+                (see `set_version`)
+        """
+        previous = read_ingestion_manifest(self.topic)
+        previous_version = previous.get("version")
+        unfinished = (
+            previous.get("status") in (INGESTION_IN_PROGRESS, INGESTION_FAILED)
+            and previous_version in list_knowledge_versions(self.topic)
+            and previous_version != get_knowledge_version(self.topic)
+        )
+        resumable = unfinished and previous.get("full_rebuild", False) == full_rebuild
+
+        with self._lock:
+            if self.resume and resumable:
+                logging.info(
+                    f"Resuming load of knowledge for {self.topic} into version "
+                    f"{previous_version}, {previous.get('stored', 0)} chunks were "
+                    "already stored"
+                )
+                self.data = previous
+                self.data["attempts"] = previous.get("attempts", 1) + 1
+            else:
+                if self.resume:
+                    logging.info(
+                        f"No unfinished {'full rebuild' if full_rebuild else 'load'} "
+                        f"of knowledge to resume for {self.topic}, starting a new one"
+                    )
+                if unfinished:
+                    logging.info(
+                        f"Discarding unfinished knowledge version for {self.topic}: "
+                        f"{previous_version}"
+                    )
+                    delete_knowledge_version(self.topic, previous_version)
+                self.data = {
+                    "topic": self.topic,
+                    "version": None,
+                    "full_rebuild": full_rebuild,
+                    "started_at": _now(),
+                    "attempts": 1,
+                    "stored": 0,
+                }
+            self.data.update(
+                {
+                    "status": INGESTION_IN_PROGRESS,
+                    "error": None,
+                    "options": self.options,
+                }
+            )
+
+        self.save(force=True)
+        return self.version
+
+    def set_version(self, version: str) -> None:
+        """
+        Record the new knowledge version being built
+
+        Args:
+            version (str): the version
+        """
+        with self._lock:
+            self.data["version"] = version
+        self.save(force=True)
+
+    def record_file_read(self, file: str, bytes_read: int = None) -> None:
+        """
+        Record how far an input file was read
+
+        Args:
+            file (str): path to the file
+            bytes_read (int): bytes read from the start of the file, defaults to all
+        """
+        with self._lock:
+            progress = self._files.get(file)
+            if progress is None:
+                stat = os.stat(file)
+                progress = self._files[file] = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "bytes_read": 0,
+                }
+            progress["bytes_read"] = (
+                progress["size"] if bytes_read is None else bytes_read
+            )
+        self.save()
+
+    def record_stored(self, count: int) -> None:
+        """
+        Record that a batch of chunks was embedded and stored
+
+        Args:
+            count (int): chunks in the batch
+        """
+        with self._lock:
+            self.data["stored"] = self.data.get("stored", 0) + count
+        self.save()
+
+    def finish(self, counts: Dict[str, int], version: str = None) -> None:
+        """
+        Record that the load completed
+
+        Args:
+            counts (Dict[str, int]): number of documents "added", "removed", and "unchanged"
+            version (str): the knowledge version the load ended with, if not the one
+                it built (e.g. it was discarded since nothing changed)
+        """
+        with self._lock:
+            self.data.update(
+                {"status": INGESTION_COMPLETE, "finished_at": _now(), "counts": counts}
+            )
+            if version is not None:
+                self.data["version"] = version
+        self.save(force=True)
+
+    def fail(self, exc: BaseException) -> None:
+        """
+        Record that the load failed, so it can be resumed
+
+        Args:
+            exc (BaseException): why it failed
+        """
+        with self._lock:
+            self.data.update({"status": INGESTION_FAILED, "error": repr(exc)})
+        self.save(force=True)
+        logging.error(
+            f"Loading knowledge for {self.topic} failed, run it again with --resume "
+            f"to continue building version {self.version}: {exc!r}"
+        )
+
+    def save(self, force: bool = False) -> None:
+        """
+        Write the manifest, unless it was written less than `save_interval_seconds`
+        ago or the load hasn't started
+
+        Args:
+            force (bool): write it regardless of when it was last written
+        """
+        with self._lock:
+            if not self.data:
+                return
+            now = time.monotonic()
+            if not force and now - self._saved_at < self.save_interval_seconds:
+                return
+            self._saved_at = now
+            manifest = {
+                **self.data,
+                "files": {
+                    file: dict(progress) for file, progress in self._files.items()
+                },
+                "updated_at": _now(),
+            }
+            # written under the lock so an older snapshot never replaces a newer one
+            write_ingestion_manifest(self.topic, manifest)
+
+
+def _is_chroma(vectorstore: VectorStore) -> bool:
+    """
+    Whether the vectorstore is Chroma, without importing `langchain_chroma` (it can only
+    be Chroma if that's already imported)
+    """
+    chroma = sys.modules.get("langchain_chroma")
+    return chroma is not None and isinstance(vectorstore, chroma.Chroma)
+
+
+def _upsert_into_chroma(
+    vectorstore: "Chroma",
+    documents: List[Document],
+    ids: List[str],
+    vectors: List[List[float]],
+) -> None:
+    """
+    Write already embedded documents to the Chroma collection in one request per
+    group (Chroma rejects empty metadata, so documents without any are written
+    separately, like `Chroma.add_texts` does)
+    """
+    groups: Dict[bool, Dict[str, list]] = {}
+    for document, id_, vector in zip(documents, ids, vectors):
+        group = groups.setdefault(
+            bool(document.metadata),
+            {"ids": [], "embeddings": [], "documents": [], "metadatas": []},
+        )
+        group["ids"].append(id_)
+        group["embeddings"].append(vector)
+        group["documents"].append(document.page_content)
+        group["metadatas"].append(document.metadata)
+
+    for has_metadata, group in groups.items():
+        if not has_metadata:
+            group.pop("metadatas")
+        vectorstore._collection.upsert(**group)  # pylint: disable=protected-access
+
+
+def _add_into_numpy(
+    vectorstore: NumpyVectorStore,
+    documents: List[Document],
+    ids: List[str],
+    vectors: List[List[float]],
+) -> None:
+    """
+    Write already embedded documents to the NumPy vectorstore
+    """
+    vectorstore.add_vectors(
+        [document.page_content for document in documents],
+        vectors,
+        metadatas=[document.metadata for document in documents],
+        ids=ids,
+    )
+
+
+def _get_status_code(exc: BaseException) -> Optional[int]:
+    for attribute in ("status_code", "code"):
+        value = getattr(exc, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
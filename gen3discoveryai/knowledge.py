@@ -0,0 +1,331 @@
+"""
+Helpers for tracking the state of each topic's knowledge store on disk.
+
+Every time a topic's knowledge is rewritten a new version identifier is written
+next to it. Anything derived from the knowledge store (like cached answers) can
+include the version so it's automatically invalidated, even across processes.
+
+Knowledge is updated blue/green: a new version of the store is built in its own
+directory alongside the live one and the version file is then atomically replaced to
+point at it. Services switch to the new version without readers ever seeing a
+partially built store, and previous versions are kept around for rollback:
+
+    ./knowledge/{topic}/
+        KNOWLEDGE_VERSION       <- the active version
+        INGESTION_MANIFEST.json <- progress of the latest load (see `ingestion`)
+        versions/
+            20240101000000000000-1a2b3c4d/
+            20240102000000000000-5e6f7a8b/
+
+A topic without any versions (from before versioning) uses the store persisted
+directly in its knowledge directory.
+
+Each stored chunk of knowledge gets a deterministic id derived from its source and
+content, so reloading knowledge only needs to embed the chunks that changed.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from typing import Any, Dict, List
+
+from gen3discoveryai import config, logging
+
+KNOWLEDGE_DIRECTORY = "./knowledge"
+KNOWLEDGE_VERSION_FILENAME = "KNOWLEDGE_VERSION"
+INGESTION_MANIFEST_FILENAME = "INGESTION_MANIFEST.json"
+KNOWLEDGE_VERSIONS_DIRECTORY = "versions"
+
+# topic -> (mtime_ns of version file, version) so we only re-read when it changes
+_knowledge_versions = {}
+
+
+def get_knowledge_directory(topic: str) -> str:
+    """
+    Return the directory where the knowledge store for the topic is persisted
+
+    Args:
+        topic (str): topic name
+
+    Returns:
+        str: path to the directory
+    """
+    return f"{KNOWLEDGE_DIRECTORY}/{topic}"
+
+
+def list_knowledge_topics() -> List[str]:
+    """
+    Return the topics which have a knowledge directory on disk.
+
+    Returns:
+        List[str]: topic names, sorted
+    """
+    try:
+        return sorted(
+            entry.name for entry in os.scandir(KNOWLEDGE_DIRECTORY) if entry.is_dir()
+        )
+    except FileNotFoundError:
+        return []
+
+
+def get_knowledge_version(topic: str) -> str:
+    """
+    Return the current version of the knowledge store for the topic.
+
+    Args:
+        topic (str): topic name
+
+    Returns:
+        str: version identifier, empty string if the knowledge has never been stored
+    """
+    version_file = os.path.join(
+        get_knowledge_directory(topic), KNOWLEDGE_VERSION_FILENAME
+    )
+    try:
+        mtime_ns = os.stat(version_file).st_mtime_ns
+    except FileNotFoundError:
+        return ""
+
+    cached = _knowledge_versions.get(topic)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+
+    with open(version_file, "r", encoding="utf-8") as version_in:
+        version = version_in.read().strip()
+
+    _knowledge_versions[topic] = (mtime_ns, version)
+    return version
+
+
+def bump_knowledge_version(topic: str, version: str = None) -> str:
+    """
+    Record that the knowledge store for the topic has changed by writing a new version.
+
+    Args:
+        topic (str): topic name
+        version (str): version to write, defaults to a new unique identifier
+
+    Returns:
+        str: the new version identifier
+    """
+    directory = get_knowledge_directory(topic)
+    os.makedirs(directory, exist_ok=True)
+
+    version = version or uuid.uuid4().hex
+    version_file = os.path.join(directory, KNOWLEDGE_VERSION_FILENAME)
+    tmp_version_file = f"{version_file}.{version}.tmp"
+
+    # write then rename so readers never see a partially written version
+    with open(tmp_version_file, "w", encoding="utf-8") as version_out:
+        version_out.write(version)
+    os.replace(tmp_version_file, version_file)
+
+    logging.debug(f"knowledge version for topic '{topic}' is now: {version}")
+    return version
+
+
+def get_knowledge_store_directory(topic: str, version: str = None) -> str:
+    """
+    Return the directory where the provided version of the knowledge store for the topic
+    is persisted.
+
+    Args:
+        topic (str): topic name
+        version (str): version of the store, defaults to the active version
+
+    Returns:
+        str: path to the directory, the topic's knowledge directory itself if the
+            version doesn't have its own directory (e.g. stored before versioning)
+    """
+    if version is None:
+        version = get_knowledge_version(topic)
+
+    if version:
+        version_directory = os.path.join(
+            get_knowledge_directory(topic), KNOWLEDGE_VERSIONS_DIRECTORY, version
+        )
+        if os.path.isdir(version_directory):
+            return version_directory
+
+    return get_knowledge_directory(topic)
+
+
+def list_knowledge_versions(topic: str) -> List[str]:
+    """
+    Return all the versions of the knowledge store for the topic on disk.
+
+    Args:
+        topic (str): topic name
+
+    Returns:
+        List[str]: versions from oldest to newest
+    """
+    versions_directory = os.path.join(
+        get_knowledge_directory(topic), KNOWLEDGE_VERSIONS_DIRECTORY
+    )
+    try:
+        return sorted(
+            entry.name for entry in os.scandir(versions_directory) if entry.is_dir()
+        )
+    except FileNotFoundError:
+        return []
+
+
+def create_knowledge_version(topic: str, copy_active: bool = True) -> str:
+    """
+    Create a new (inactive) version of the knowledge store for the topic, starting
+    as a copy of the active version so it can be updated incrementally.
+
+    Args:
+        topic (str): topic name
+        copy_active (bool): whether to start from a copy of the active version,
+            otherwise the new version starts empty
+
+    Returns:
+        str: the new version identifier
+    """
+    # sortable by creation time
+    created = datetime.datetime.now(datetime.timezone.utc)
+    version = f"{created:%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+
+    knowledge_directory = get_knowledge_directory(topic)
+    active_directory = get_knowledge_store_directory(topic)
+    version_directory = os.path.join(
+        knowledge_directory, KNOWLEDGE_VERSIONS_DIRECTORY, version
+    )
+
+    if copy_active and os.path.isdir(active_directory):
+        ignore = None
+        if active_directory == knowledge_directory:
+            # don't copy the versioning files along with a pre-versioning store
+            ignore = shutil.ignore_patterns(
+                KNOWLEDGE_VERSIONS_DIRECTORY,
+                f"{KNOWLEDGE_VERSION_FILENAME}*",
+                f"{INGESTION_MANIFEST_FILENAME}*",
+            )
+        shutil.copytree(active_directory, version_directory, ignore=ignore)
+    else:
+        os.makedirs(version_directory)
+
+    logging.debug(f"created knowledge version for topic '{topic}': {version}")
+    return version
+
+
+def activate_knowledge_version(topic: str, version: str) -> None:
+    """
+    Atomically make the provided version the active knowledge store for the topic,
+    then remove all but the `KNOWLEDGE_VERSIONS_TO_KEEP` most recent other versions.
+
+    Args:
+        topic (str): topic name
+        version (str): version to activate
+
+    Raises:
+        KeyError: if the version doesn't exist
+    """
+    if version not in list_knowledge_versions(topic):
+        raise KeyError(f"knowledge version {version} not found for topic: {topic}")
+
+    bump_knowledge_version(topic, version)
+    logging.info(f"activated knowledge version for topic '{topic}': {version}")
+
+    previous_versions = [
+        previous_version
+        for previous_version in list_knowledge_versions(topic)
+        if previous_version != version
+    ]
+    number_to_remove = len(previous_versions) - max(
+        config.KNOWLEDGE_VERSIONS_TO_KEEP, 0
+    )
+    for previous_version in previous_versions[: max(number_to_remove, 0)]:
+        delete_knowledge_version(topic, previous_version)
+
+
+def delete_knowledge_version(topic: str, version: str) -> None:
+    """
+    Remove an inactive version of the knowledge store for the topic from disk.
+
+    Args:
+        topic (str): topic name
+        version (str): version to remove
+
+    Raises:
+        ValueError: if the version is the active one
+    """
+    if version == get_knowledge_version(topic):
+        raise ValueError(f"cannot delete active knowledge version for topic: {topic}")
+
+    logging.debug(f"deleting knowledge version for topic '{topic}': {version}")
+    shutil.rmtree(
+        os.path.join(
+            get_knowledge_directory(topic), KNOWLEDGE_VERSIONS_DIRECTORY, version
+        ),
+        ignore_errors=True,
+    )
+
+
+def read_ingestion_manifest(topic: str) -> Dict[str, Any]:
+    """
+    Return the manifest recording the progress of the latest load of the topic's
+    knowledge (see `gen3discoveryai.ingestion.IngestionManifest`).
+
+    Args:
+        topic (str): topic name
+
+    Returns:
+        Dict[str, Any]: the manifest, empty if knowledge was never loaded with one
+    """
+    manifest_file = os.path.join(
+        get_knowledge_directory(topic), INGESTION_MANIFEST_FILENAME
+    )
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as manifest_in:
+            return json.load(manifest_in)
+    except FileNotFoundError:
+        return {}
+
+
+def write_ingestion_manifest(topic: str, manifest: Dict[str, Any]) -> None:
+    """
+    Replace the manifest recording the progress of loading the topic's knowledge.
+
+    Args:
+        topic (str): topic name
+        manifest (Dict[str, Any]): the manifest
+    """
+    directory = get_knowledge_directory(topic)
+    os.makedirs(directory, exist_ok=True)
+
+    manifest_file = os.path.join(directory, INGESTION_MANIFEST_FILENAME)
+    tmp_manifest_file = f"{manifest_file}.{uuid.uuid4().hex}.tmp"
+
+    # write then rename so a crash never leaves a partially written manifest
+    with open(tmp_manifest_file, "w", encoding="utf-8") as manifest_out:
+        json.dump(manifest, manifest_out, indent=2)
+    os.replace(tmp_manifest_file, manifest_file)
+
+
+def get_document_id(document, model_id: str = "") -> str:
+    """
+    Return a deterministic id for a chunk of knowledge, derived from the embedding
+    model, a hash of its content, and its metadata (which includes its source). The
+    same chunk always gets the same id, so it can be diffed against what's already in
+    the knowledge store, while changing the embedding model or only the metadata
+    changes the id so the chunk is stored again.
+
+    Args:
+        document (langchain_core.documents.Document): chunk of knowledge
+        model_id (str): the embedding model the chunk is stored with (see
+            `gen3discoveryai.embeddings.get_embedding_model_id`)
+
+    Returns:
+        str: id for the document
+    """
+    content_hash = hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
+    metadata = json.dumps(document.metadata, sort_keys=True, default=str)
+    return hashlib.sha256(
+        f"{model_id}\0{content_hash}\0{metadata}".encode("utf-8")
+    ).hexdigest()
@@ -1,5 +1,6 @@
+import asyncio
+import contextlib
 import os
-import traceback
 from contextlib import asynccontextmanager
 from importlib.metadata import version
 
@@ -8,7 +9,17 @@ import yaml
 from fastapi import FastAPI
 
 from gen3discoveryai import config, logging
+from gen3discoveryai.knowledge import get_knowledge_version
 from gen3discoveryai.routes import root_router
+from gen3discoveryai.topic_init import (
+    TOPIC_INIT_BACKGROUND,
+    TOPIC_INIT_EAGER,
+    TopicInitializer,
+    get_topic_configs,
+    get_topic_initializer,
+    reload_topics,
+    set_topic_initializer,
+)
 from gen3discoveryai.utils import get_topic_chain_factory
 
 
@@ -68,17 +79,115 @@ async def lifespan(fastapi_app: fastapi.FastAPI, force_reload_config=False):
         logging.debug("No app context passed to lifespan, setup may fail")
 
     # read from config to get more options
-    config.topics = get_topics_from_config(force_reload_config)
+    config.topics = get_topics_from_config(
+        force_reload_config, init_mode=config.TOPIC_INIT_MODE
+    )
+
+    topic_init_task = None
+    if config.TOPIC_INIT_MODE == TOPIC_INIT_BACKGROUND:
+        topic_init_task = asyncio.create_task(
+            asyncio.to_thread(get_topic_initializer().initialize_all)
+        )
+
+    knowledge_version_watcher = None
+    if config.KNOWLEDGE_VERSION_POLL_SECONDS > 0:
+        knowledge_version_watcher = asyncio.create_task(
+            watch_knowledge_versions(config.KNOWLEDGE_VERSION_POLL_SECONDS)
+        )
+
+    topic_config_watcher = None
+    if config.TOPIC_CONFIG_POLL_SECONDS > 0:
+        topic_config_watcher = asyncio.create_task(
+            watch_topic_config(config.TOPIC_CONFIG_POLL_SECONDS)
+        )
 
     yield
 
+    for watcher in (knowledge_version_watcher, topic_config_watcher):
+        if watcher:
+            watcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await watcher
+
+    if topic_init_task:
+        # topics already being created finish in their threads
+        topic_init_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await topic_init_task
+
     config.topics.clear()
+    set_topic_initializer(None)
+
+
+async def watch_knowledge_versions(poll_seconds: float) -> None:
+    """
+    Periodically switch topics to their active knowledge version when a new one is
+    activated (e.g. by `bin/load_into_knowledge_store.py` or another worker's admin
+    request). Switching happens in a thread, so requests keep being answered from the
+    previous version until the new one is ready.
+
+    Args:
+        poll_seconds (float): how often to check for newly activated versions
+    """
+    while True:
+        await asyncio.sleep(poll_seconds)
+        for topic, topic_config in list(config.topics.items()):
+            topic_chain = topic_config.get("topic_chain")
+            if not getattr(topic_chain, "supports_knowledge_versions", False):
+                continue
+
+            try:
+                if get_knowledge_version(topic) != topic_chain.knowledge_version:
+                    await asyncio.to_thread(topic_chain.switch_knowledge_version)
+                topic_chain.release_retired_vectorstores()
+            except Exception as exc:
+                logging.error(
+                    f"Unable to switch `{topic}` to its active knowledge version. "
+                    f"Exception: {exc}"
+                )
+
+
+async def watch_topic_config(poll_seconds: float) -> None:
+    """
+    Periodically check whether the configuration file (see `ENV_FILE`) changed and if
+    so, reload the topics, rebuilding only the ones whose configuration changed (see
+    `gen3discoveryai.topic_init.reload_topics`).
+
+    Args:
+        poll_seconds (float): how often to check the configuration file
+    """
+    last_modified = _get_modified_time(config.ENV_FILE)
+    while True:
+        await asyncio.sleep(poll_seconds)
+        modified = _get_modified_time(config.ENV_FILE)
+        if modified == last_modified:
+            continue
+
+        last_modified = modified
+        logging.info(f"`{config.ENV_FILE}` changed, reloading topics")
+        try:
+            await reload_topics()
+        except Exception as exc:
+            logging.error(
+                f"Unable to reload topics, keeping the current ones. Exception: {exc}"
+            )
+
+
+def _get_modified_time(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
 
 
-def get_topics_from_config(force_reload_config=False):
+def get_topics_from_config(force_reload_config=False, init_mode=TOPIC_INIT_EAGER):
     """
     Get topics from configuration.
 
+    Topics' chains are created concurrently (see `gen3discoveryai.topic_init`). Unless
+    `init_mode` is "eager", they're not created yet, and are added to the topics once
+    created.
+
     Returns Dict: {
         "topicA": {
             "description": "description_config_value",
@@ -94,74 +203,27 @@ def get_topics_from_config(force_reload_config=False):
         return config.topics
 
     chain_factory = get_topic_chain_factory()
+    config_topics, chain_names, topic_raw_cfgs = get_topic_configs()
 
-    config_topics = {}
-
-    for topic in config.TOPICS.split(","):
-        description_config_key = f"{topic.upper()}_DESCRIPTION"
-        chain_config_key = f"{topic.upper()}_CHAIN_NAME"
-        system_prompt_config_key = f"{topic.upper()}_SYSTEM_PROMPT"
-        metadata_config_key = f"{topic.upper()}_METADATA"
-
-        description_config_value = getattr(config, description_config_key, "")
-        chain_config_value = getattr(config, chain_config_key, "")
-        system_prompt_config_value = getattr(config, system_prompt_config_key, "")
-        metadata_config_value = getattr(config, metadata_config_key, "")
-
-        topic_raw_cfg = {
-            "description": description_config_value,
-            "topic_chain": chain_config_value,
-            "system_prompt": system_prompt_config_value,
-            "metadata": metadata_config_value,
-        }
-
-        try:
-            config_topics[topic] = {
-                "description": topic_raw_cfg["description"],
-                "system_prompt": topic_raw_cfg["system_prompt"],
-            }
-            config_topics[topic].update(topic_raw_cfg["metadata"])
-
-            _create_and_register_topic_chain(
-                topic=topic,
-                topic_raw_cfg=topic_raw_cfg,
-                chain_factory=chain_factory,
-                config_topics=config_topics,
-            )
+    topic_initializer = TopicInitializer(
+        chain_factory, config_topics, chain_names, mode=init_mode
+    )
+    set_topic_initializer(topic_initializer)
 
-            logging.info(f"Added topic `{topic}`")
-            logging.debug(f"`{topic}` configuration: `{topic_raw_cfg}`")
-        except Exception as exc:
+    if init_mode == TOPIC_INIT_EAGER:
+        errors = topic_initializer.initialize_all()
+        for topic, exc in errors.items():
             logging.error(
-                f"Unable to load `{topic}` configuration with: {topic_raw_cfg}. "
-                f"Exception: {exc}. Traceback: {traceback.format_exc()}"
+                f"Unable to load `{topic}` configuration with: {topic_raw_cfgs[topic]}. "
+                f"Exception: {exc}"
             )
 
-            # we want to error early if this is the default topic, but if not, log the error and try to continue
-            if topic == "default":
-                raise
-
-            continue
+        # we want to error early if this is the default topic, but if not, the topic is
+        # retried on its next request
+        if "default" in errors:
+            raise errors["default"]
 
     return config_topics
 
 
-def _create_and_register_topic_chain(
-    topic, topic_raw_cfg, chain_factory, config_topics
-):
-    """
-    Small helper function to create instance of the topic chain and add to the config
-    """
-    chain_instance = chain_factory.get(
-        topic_raw_cfg["topic_chain"],
-        topic=topic,
-        metadata=config_topics[topic],
-    )
-    config_topics[topic].update(
-        {
-            "topic_chain": chain_instance,
-        }
-    )
-
-
 app = get_app()
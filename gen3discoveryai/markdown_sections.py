@@ -0,0 +1,180 @@
+"""
+Splitting Markdown files into sections at their headings when loading the knowledge
+library.
+
+Unlike `UnstructuredMarkdownLoader` (which needs the `unstructured` package and flattens
+a file into plain text), files are parsed in a single pass over their lines without any
+other dependencies. Every heading starts a new section, and each section becomes one
+chunk, unless it's longer than the chunk size, in which case it's split into chunks of
+at most that many tokens (with the shared token splitter, see `tokenization`).
+
+Chunks keep the path of their file (`source`) and the breadcrumbs of the headings
+they're under (`headings`, e.g. "Setup > Configuration > Topics") in their metadata.
+"""
+
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+from langchain_core.documents import Document
+
+from gen3discoveryai.tokenization import DEFAULT_ENCODING, get_text_splitter
+
+# joins the headings a section is under in its metadata
+HEADINGS_SEPARATOR = " > "
+
+_ATX_HEADING = re.compile(r"^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$")
+_SETEXT_UNDERLINE = re.compile(r"^ {0,3}(=+|-+)[ \t]*$")
+_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_LIST_ITEM = re.compile(r"^ {0,3}([-+*]|\d+[.)])[ \t]")
+
+
+def iter_markdown_sections(text: str) -> Iterator[Tuple[List[str], str]]:
+    """
+    Split Markdown into sections at its ATX (`## Heading`) and setext (underlined)
+    headings. Lines in fenced code blocks are never headings, and YAML front matter
+    is skipped. Sections without any content besides their heading are left out.
+
+    Args:
+        text (str): the Markdown
+
+    Yields:
+        Tuple[List[str], str]: titles of the headings the section is under (outermost
+            first, including its own) and the section's text (starting with its heading)
+    """
+    lines = text.splitlines()
+    start = _skip_front_matter(lines)
+
+    # (level, title) of the current heading and the ones it's nested under
+    headings: List[Tuple[int, str]] = []
+    section: List[str] = []
+    # lines of the section which are its heading
+    heading_lines = 0
+    fence = None
+
+    for line in lines[start:]:
+        if fence:
+            section.append(line)
+            if _closes_fence(line, fence):
+                fence = None
+            continue
+
+        fence_match = _FENCE.match(line)
+        if fence_match:
+            fence = fence_match.group(1)
+            section.append(line)
+            continue
+
+        atx_match = _ATX_HEADING.match(line)
+        if atx_match:
+            yield from _finish_section(headings, section, heading_lines)
+            headings = _nest(headings, len(atx_match.group(1)), atx_match.group(2))
+            section = [line]
+            heading_lines = 1
+            continue
+
+        setext_match = _SETEXT_UNDERLINE.match(line)
+        if setext_match and _can_be_setext_title(section, heading_lines):
+            title = section.pop()
+            yield from _finish_section(headings, section, heading_lines)
+            level = 1 if setext_match.group(1).startswith("=") else 2
+            headings = _nest(headings, level, title)
+            section = [title, line]
+            heading_lines = 2
+            continue
+
+        section.append(line)
+
+    yield from _finish_section(headings, section, heading_lines)
+
+
+def split_markdown(
+    text: str, source: str, chunk_size: int, encoding_name: str = DEFAULT_ENCODING
+) -> List[Document]:
+    """
+    Split Markdown into a chunk per section, splitting sections longer than
+    `chunk_size` tokens further. All the sections are tokenized in one call.
+
+    Args:
+        text (str): the Markdown
+        source (str): where it came from (e.g. the file's path), for the chunks' metadata
+        chunk_size (int): maximum tokens per chunk
+        encoding_name (str): tiktoken encoding to count tokens with
+
+    Returns:
+        List[langchain_core.documents.Document]: the chunks, in order
+    """
+    texts = []
+    metadatas = []
+    for titles, section in iter_markdown_sections(text):
+        texts.append(section)
+        metadatas.append(
+            {
+                "source": source,
+                "headings": HEADINGS_SEPARATOR.join(title for title in titles if title),
+            }
+        )
+
+    return get_text_splitter(chunk_size, 0, encoding_name).create_documents(
+        texts, metadatas
+    )
+
+
+def split_markdown_file(path: str, chunk_size: int) -> List[Document]:
+    """
+    Split a Markdown file into a chunk per section (see `split_markdown`)
+
+    Args:
+        path (str): path to the file, used as the chunks' source
+        chunk_size (int): maximum tokens per chunk
+
+    Returns:
+        List[langchain_core.documents.Document]: the chunks, in order
+    """
+    with open(path, "r", encoding="utf-8", errors="replace") as file_in:
+        text = file_in.read()
+    return split_markdown(text, path, chunk_size)
+
+
+def _skip_front_matter(lines: List[str]) -> int:
+    """
+    Index of the first line after the YAML front matter, 0 if there isn't any
+    """
+    if not lines or lines[0].strip() != "---":
+        return 0
+    for index, line in enumerate(lines[1:], start=1):
+        if line.strip() in ("---", "..."):
+            return index + 1
+    return 0
+
+
+def _closes_fence(line: str, fence: str) -> bool:
+    stripped = line.strip()
+    return (
+        len(stripped) >= len(fence)
+        and set(stripped) == {fence[0]}
+        and len(line) - len(line.lstrip(" ")) <= 3
+    )
+
+
+def _can_be_setext_title(section: List[str], heading_lines: int) -> bool:
+    """
+    Whether the last line of the section can be underlined into a heading: a line of
+    paragraph text (not blank, a list item, or a heading itself)
+    """
+    if len(section) <= heading_lines:
+        return False
+    title = section[-1]
+    return bool(title.strip()) and not _LIST_ITEM.match(title)
+
+
+def _nest(headings: Iterable[Tuple[int, str]], level: int, title: str):
+    return [heading for heading in headings if heading[0] < level] + [
+        (level, (title or "").strip())
+    ]
+
+
+def _finish_section(
+    headings: List[Tuple[int, str]], section: List[str], heading_lines: int
+) -> Iterator[Tuple[List[str], str]]:
+    if any(line.strip() for line in section[heading_lines:]):
+        yield [title for _, title in headings], "\n".join(section).strip()
@@ -0,0 +1,186 @@
+"""
+Minimal in-process metrics registry.
+
+Components register named metrics here and the `/_metrics` endpoint reports a
+snapshot of everything registered. Values are per-process (e.g. per gunicorn worker).
+"""
+
+import bisect
+import itertools
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Sequence
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Counter:
+    """
+    Monotonically increasing value, optionally broken down by labels
+    (e.g. `counter.inc(topic="default")`).
+    """
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, description: str = "") -> None:
+        self.name = name
+        self.description = description
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increase the counter for the provided labels
+
+        Args:
+            amount (float): how much to increase by
+            **labels: label names/values to break the counter down by
+        """
+        with self._lock:
+            self._values[_labels_key(labels)] += amount
+
+    def get(self, **labels) -> float:
+        """
+        Get the current value for the provided labels
+
+        Returns:
+            float: current value (0 if never increased)
+        """
+        return self._values.get(_labels_key(labels), 0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Serializable snapshot of this metric
+        """
+        with self._lock:
+            values = [
+                {"labels": dict(labels), "value": value}
+                for labels, value in self._values.items()
+            ]
+        return {"type": self.TYPE, "description": self.description, "values": values}
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets, optionally broken down by
+    labels (e.g. `histogram.observe(0.25, topic="default")`).
+    """
+
+    TYPE = "histogram"
+
+    DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(
+        self, name: str, description: str = "", buckets: Sequence[float] = None
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets or self.DEFAULT_BUCKETS))
+        # labels -> [count per bucket (+ one for values above all buckets), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Record an observed value for the provided labels
+
+        Args:
+            value (float): observed value
+            **labels: label names/values to break the histogram down by
+        """
+        key = _labels_key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0, 0)
+            )
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def get_count(self, **labels) -> int:
+        """
+        Get the number of observations for the provided labels
+        """
+        return self._values.get(_labels_key(labels), (None, 0, 0))[2]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Serializable snapshot of this metric, buckets are cumulative
+        (e.g. `{"le": 0.5, "count": 3}` means 3 values were <= 0.5)
+        """
+        with self._lock:
+            values = []
+            for labels, (counts, total, count) in self._values.items():
+                cumulative = list(itertools.accumulate(counts))
+                values.append(
+                    {
+                        "labels": dict(labels),
+                        "buckets": [
+                            {"le": bucket, "count": bucket_count}
+                            for bucket, bucket_count in zip(
+                                self.buckets + ("+Inf",), cumulative
+                            )
+                        ],
+                        "sum": total,
+                        "count": count,
+                    }
+                )
+        return {"type": self.TYPE, "description": self.description, "values": values}
+
+
+def get_counter(name: str, description: str = "") -> Counter:
+    """
+    Get (or create and register) the counter with the provided name
+
+    Args:
+        name (str): unique metric name
+        description (str): human-readable description
+
+    Returns:
+        Counter: the registered counter
+    """
+    return _get_or_register(Counter, name, description)
+
+
+def get_histogram(
+    name: str, description: str = "", buckets: Sequence[float] = None
+) -> Histogram:
+    """
+    Get (or create and register) the histogram with the provided name
+
+    Args:
+        name (str): unique metric name
+        description (str): human-readable description
+        buckets (Sequence[float]): upper bounds of the buckets (only used on creation)
+
+    Returns:
+        Histogram: the registered histogram
+    """
+    return _get_or_register(Histogram, name, description, buckets=buckets)
+
+
+def get_metrics_snapshot() -> Dict[str, Any]:
+    """
+    Return a serializable snapshot of all registered metrics
+
+    Returns:
+        dict: metric name to metric snapshot
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.to_dict() for metric in metrics}
+
+
+def _get_or_register(metric_class, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = metric_class(name, *args, **kwargs)
+            _registry[name] = metric
+        elif not isinstance(metric, metric_class):
+            raise ValueError(f"metric {name} is already registered as {metric.TYPE}")
+    return metric
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
@@ -1,12 +1,16 @@
+import asyncio
+import json
 import time
 import uuid
 from importlib.metadata import version
-from typing import Any
+from typing import Any, AsyncIterator, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from starlette.status import (
     HTTP_400_BAD_REQUEST,
     HTTP_404_NOT_FOUND,
+    HTTP_500_INTERNAL_SERVER_ERROR,
     HTTP_503_SERVICE_UNAVAILABLE,
 )
 
@@ -17,24 +21,40 @@ from gen3discoveryai.auth import (
     raise_if_overall_global_artificial_intelligence_limit_exceeded,
     raise_if_user_exceeded_maximum_artificial_intelligence_usage_limits,
 )
+from gen3discoveryai.cache import AnswerCache, get_answer_cache
+from gen3discoveryai.knowledge import (
+    activate_knowledge_version,
+    get_knowledge_version,
+    list_knowledge_versions,
+)
+from gen3discoveryai.metrics import get_metrics_snapshot
+from gen3discoveryai.semantic_cache import get_semantic_cache
+from gen3discoveryai.single_flight import SingleFlight
+from gen3discoveryai.speculation import Speculation
+from gen3discoveryai.topic_chains.base import TopicChain
 from gen3discoveryai.topic_chains.logging import LoggingCallbackHandler
+from gen3discoveryai.topic_init import get_topic_initializer, reload_topics
+from gen3discoveryai.usage_limits import LLMTokenUsageCallbackHandler, estimate_tokens
 
 root_router = APIRouter()
 
+# identical concurrent /ask queries share one topic chain execution
+_ask_single_flight = SingleFlight("ask")
+
 
 @root_router.post(
     "/ask/",
     dependencies=[
-        Depends(raise_if_overall_global_artificial_intelligence_limit_exceeded),
         Depends(raise_if_user_exceeded_maximum_artificial_intelligence_usage_limits),
+        Depends(raise_if_overall_global_artificial_intelligence_limit_exceeded),
     ],
 )
 @root_router.post(
     "/ask",
     include_in_schema=False,
     dependencies=[
-        Depends(raise_if_overall_global_artificial_intelligence_limit_exceeded),
         Depends(raise_if_user_exceeded_maximum_artificial_intelligence_usage_limits),
+        Depends(raise_if_overall_global_artificial_intelligence_limit_exceeded),
     ],
 )
 async def ask_route(
@@ -51,75 +71,222 @@ async def ask_route(
             existing conversation. Must match a valid conversation ID for this
             user AND topic must support conversation-based queries.
     """
-    await authorize_request(
-        request=request,
-        authz_access_method="read",
-        authz_resources=[f"/gen3_discovery_ai/ask/{topic}"],
+    retrieval = _start_speculative_retrieval(topic, data)
+    try:
+        user_id, query = await _validate_ask_request(
+            request, data, topic, conversation_id
+        )
+
+        topic_config = config.topics[topic]
+        await _get_topic_chain(topic, topic_config)
+        response, cache_context = await _get_cached_response(topic, query, topic_config)
+
+        start_time = time.time()
+        is_cached = response is not None
+        is_coalesced = False
+        if not is_cached:
+            response, llm_tokens_used, is_coalesced = await _answer_query(
+                topic, query, topic_config, cache_context, retrieval=retrieval
+            )
+            # the response may be shared with other concurrent requests
+            response = dict(response)
+            # counted against the user's usage limits after the response is sent
+            request.state.llm_tokens_used = llm_tokens_used
+    finally:
+        # invalid, cached, or answered by another request's execution
+        if retrieval:
+            retrieval.discard()
+
+    end_time = time.time()
+    logging.info(
+        "Gen3 Discovery AI Response. "
+        f"user_query={query}, topic={topic}, response={response['response']}, "
+        f"response_time_seconds={end_time - start_time} user_id={user_id} "
+        f"cached={is_cached} coalesced={is_coalesced}"
     )
-    user_id = await get_user_id(request=request)
 
-    if not config.topics.get(topic, None):
-        logging.debug(f"user provided topic not found: {topic}")
-        raise HTTPException(
-            status_code=HTTP_404_NOT_FOUND, detail=f"invalid topic {topic}, not found"
-        )
+    # TODO (PXP-11239)
+    if not conversation_id:
+        conversation_id = await _get_conversation_id()
+    await _store_conversation(user_id, conversation_id)
+    response.update({"conversation_id": conversation_id})
 
-    query = data.get("query")
+    logging.debug(response)
 
-    if not query:
-        raise HTTPException(
-            status_code=HTTP_400_BAD_REQUEST, detail="no query provided"
-        )
+    response.update({"topic": topic, "cached": is_cached})
+    return response
 
-    conversation = None
-    if conversation_id:
-        conversation = await _get_conversation_for_user(conversation_id, user_id)
-        # TODO (PXP-11239) handle conversation
 
-    logging.debug(f"conversation: {conversation}")
+@root_router.post(
+    "/ask/stream/",
+    dependencies=[
+        Depends(raise_if_user_exceeded_maximum_artificial_intelligence_usage_limits),
+        Depends(raise_if_overall_global_artificial_intelligence_limit_exceeded),
+    ],
+)
+@root_router.post(
+    "/ask/stream",
+    include_in_schema=False,
+    dependencies=[
+        Depends(raise_if_user_exceeded_maximum_artificial_intelligence_usage_limits),
+        Depends(raise_if_overall_global_artificial_intelligence_limit_exceeded),
+    ],
+)
+async def ask_stream_route(
+    request: Request, data: dict, topic: str = "default", conversation_id: str = None
+) -> StreamingResponse:
+    """
+    Ask about the provided (or default) topic with the query provided, streaming the
+    answer back as Server-Sent Events (SSE) as soon as each part is available.
+
+    Events sent (in order):
+        - `documents`: `{"documents": [...]}` the retrieved source documents
+        - `token`: `{"token": "..."}` the next piece of the LLM's response (sent many times)
+        - `end`: `{"response": "...", "conversation_id": "...", "topic": "...", "cached": false,
+          "timing": {...}}`
+
+    If an error occurs after the stream has started, an `error` event with a `detail`
+    is sent instead of the `end` event.
+
+    Args:
+        request (Request): FastAPI request (so we can check authorization)
+        data (dict): Body from the POST, should contain `query`
+        topic (str, optional): Query string `topic`, specific topic to ask about
+        conversation_id (str, optional): Previous conv ID to continue the
+            existing conversation. Must match a valid conversation ID for this
+            user AND topic must support conversation-based queries.
+    """
+    user_id, query = await _validate_ask_request(request, data, topic, conversation_id)
+
+    topic_config = config.topics[topic]
+    topic_chain = await _get_topic_chain(topic, topic_config)
+    cached_response, cache_context = await _get_cached_response(
+        topic, query, topic_config
+    )
+
+    return StreamingResponse(
+        _stream_ask_events(
+            topic_chain=topic_chain,
+            query=query,
+            topic=topic,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            cached_response=cached_response,
+            cache_context=cache_context,
+            request=request,
+        ),
+        media_type="text/event-stream",
+        headers={
+            **getattr(request.state, "usage_headers", {}),
+            "Cache-Control": "no-cache",
+            # ensure nginx doesn't buffer the stream
+            "X-Accel-Buffering": "no",
+        },
+    )
+
 
+async def _stream_ask_events(
+    topic_chain,
+    query,
+    topic,
+    user_id,
+    conversation_id,
+    cached_response=None,
+    cache_context=None,
+    request=None,
+) -> AsyncIterator[str]:
+    """
+    Run the topic chain in streaming mode and yield formatted Server-Sent Events.
+    A cached answer (if available) is sent as a single token.
+
+    The LLM tokens used are reported in `request.state.llm_tokens_used` (if a
+    request is provided) so they count against the user's usage limits.
+    """
     start_time = time.time()
+    timing = {}
+    response_text = ""
+    documents = []
+
+    is_cached = cached_response is not None
+
     try:
-        topic_config = config.topics[topic]
-        raw_response = topic_config["topic_chain"].run(
-            query=query, callbacks=[LoggingCallbackHandler()]
-        )
+        if is_cached:
+            events = _iter_cached_response_events(cached_response)
+        else:
+            token_usage = LLMTokenUsageCallbackHandler()
+            events = topic_chain.astream(
+                query=query, callbacks=[LoggingCallbackHandler(), token_usage]
+            )
+
+        async for event, payload in events:
+            if event == "documents":
+                timing["retrieval_seconds"] = time.time() - start_time
+                documents = payload if is_cached else _parse_documents(payload)
+                yield _format_sse_event("documents", {"documents": documents})
+            elif event == "token":
+                timing.setdefault(
+                    "time_to_first_token_seconds", time.time() - start_time
+                )
+                yield _format_sse_event("token", {"token": payload})
+            elif event == "result":
+                response_text = payload.get("result", "").strip()
     except Exception as exc:
         logging.error(
-            f"Returning service unavailable. Got unexpected error from chain: {exc}"
+            f"Ending stream with error. Got unexpected error from chain: {exc}"
         )
-        raise HTTPException(
-            HTTP_503_SERVICE_UNAVAILABLE,
-            "Service unavailable.",
-        ) from exc
-
-    documents = []
-    for doc in raw_response.get("source_documents"):
-        parsed_doc = {"page_content": doc.page_content, "metadata": doc.metadata}
-        documents.append(parsed_doc)
-
-    response = {
-        "response": raw_response.get("result", "").strip(),
-        "documents": documents,
-    }
+        detail = (
+            exc.detail if isinstance(exc, HTTPException) else "Service unavailable."
+        )
+        yield _format_sse_event("error", {"detail": detail})
+        return
 
-    end_time = time.time()
+    timing["response_time_seconds"] = time.time() - start_time
     logging.info(
         "Gen3 Discovery AI Response. "
-        f"user_query={query}, topic={topic}, response={response['response']}, "
-        f"response_time_seconds={end_time - start_time} user_id={user_id}"
+        f"user_query={query}, topic={topic}, response={response_text}, "
+        f"response_time_seconds={timing['response_time_seconds']} user_id={user_id} "
+        f"time_to_first_token_seconds={timing.get('time_to_first_token_seconds')} "
+        f"cached={is_cached}"
     )
 
+    if not is_cached:
+        if cache_context:
+            _cache_response(
+                cache_context, {"response": response_text, "documents": documents}
+            )
+        if request is not None:
+            request.state.llm_tokens_used = _get_llm_tokens_used(
+                token_usage, query, response_text, documents
+            )
+
     # TODO (PXP-11239)
     if not conversation_id:
         conversation_id = await _get_conversation_id()
     await _store_conversation(user_id, conversation_id)
-    response.update({"conversation_id": conversation_id})
 
-    logging.debug(response)
+    yield _format_sse_event(
+        "end",
+        {
+            "response": response_text,
+            "conversation_id": conversation_id,
+            "topic": topic,
+            "cached": is_cached,
+            "timing": timing,
+        },
+    )
 
-    response.update({"topic": topic})
-    return response
+
+async def _iter_cached_response_events(
+    cached_response: dict,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Produce the same events as `TopicChain.astream` from a cached response
+    (with already parsed documents)
+    """
+    yield "documents", cached_response.get("documents", [])
+    if cached_response.get("response"):
+        yield "token", cached_response["response"]
+    yield "result", {"result": cached_response.get("response", "")}
 
 
 @root_router.get("/topics/{provided_topic}/")
@@ -177,10 +344,13 @@ async def topics_route(request: Request, provided_topic: str = None) -> dict:
 
     output = {}
 
+    topic_initializer = get_topic_initializer()
     for topic, values in config.topics.items():
-        output[topic] = {
-            "topic_chain": getattr(values.get("topic_chain"), "NAME", "Unknown")
-        }
+        # topics which are created lazily may not have their chain yet
+        chain_name = getattr(values.get("topic_chain"), "NAME", None) or (
+            topic_initializer and topic_initializer.chain_names.get(topic)
+        )
+        output[topic] = {"topic_chain": chain_name or "Unknown"}
         output[topic]["description"] = values.get("description", "")
         output[topic]["system_prompt"] = values.get("system_prompt", "")
 
@@ -199,6 +369,150 @@ async def topics_route(request: Request, provided_topic: str = None) -> dict:
     }
 
 
+@root_router.post("/topics/reload/")
+@root_router.post("/topics/reload", include_in_schema=False)
+async def reload_topics_route(request: Request) -> dict:
+    """
+    Read the topic configuration again and rebuild the topics whose configuration
+    changed, without a restart. Each rebuilt topic is switched to once its new chain is
+    ready, and requests already in progress finish with the previous one. This process
+    reloads immediately, other processes reload on their next check of the
+    configuration file (see `TOPIC_CONFIG_POLL_SECONDS`).
+
+    Args:
+        request (Request): FastAPI request (so we can check authorization)
+
+    Returns:
+        dict: reloaded topics in format:
+            ```
+            {
+              "added": ["gen3docs"],
+              "changed": ["bdc"],
+              "removed": [],
+              "unchanged": ["default"],
+              "errors": {}
+            }
+            ```
+    """
+    await authorize_request(
+        request=request,
+        authz_access_method="update",
+        authz_resources=["/gen3_discovery_ai/topics"],
+    )
+
+    try:
+        return await reload_topics()
+    except Exception as exc:
+        logging.error(f"Unable to reload topics: {exc!r}")
+        raise HTTPException(
+            HTTP_500_INTERNAL_SERVER_ERROR,
+            "unable to reload the topic configuration, the current topics are unchanged",
+        ) from exc
+
+
+@root_router.get("/knowledge/{topic}/versions/")
+@root_router.get("/knowledge/{topic}/versions", include_in_schema=False)
+async def knowledge_versions_route(request: Request, topic: str) -> dict:
+    """
+    Get the versions of the topic's knowledge store on disk, which one is active,
+    and which one this process is currently answering from.
+
+    Args:
+        request (Request): FastAPI request (so we can check authorization)
+        topic (str): topic to get knowledge versions for
+
+    Returns:
+        dict: knowledge versions in format:
+            ```
+            {
+              "topic": "bdc",
+              "active_version": "20240102000000000000-5e6f7a8b",
+              "loaded_version": "20240102000000000000-5e6f7a8b",
+              "versions": ["20240101000000000000-1a2b3c4d", "20240102000000000000-5e6f7a8b"]
+            }
+            ```
+    """
+    await authorize_request(
+        request=request,
+        authz_access_method="read",
+        authz_resources=[f"/gen3_discovery_ai/knowledge/{topic}"],
+    )
+    topic_chain = await _get_versioned_topic_chain(topic)
+
+    return _get_knowledge_versions_info(topic, topic_chain)
+
+
+@root_router.post("/knowledge/{topic}/versions/{knowledge_version}/activate/")
+@root_router.post(
+    "/knowledge/{topic}/versions/{knowledge_version}/activate", include_in_schema=False
+)
+async def activate_knowledge_version_route(
+    request: Request, topic: str, knowledge_version: str
+) -> dict:
+    """
+    Make the provided version of the topic's knowledge store the active one (e.g. to
+    roll back to a previous version). This process switches to it immediately, other
+    processes switch on their next check (see `KNOWLEDGE_VERSION_POLL_SECONDS`).
+
+    Args:
+        request (Request): FastAPI request (so we can check authorization)
+        topic (str): topic to activate the knowledge version for
+        knowledge_version (str): version to activate
+
+    Returns:
+        dict: knowledge versions in the same format as `knowledge_versions_route`
+    """
+    await authorize_request(
+        request=request,
+        authz_access_method="update",
+        authz_resources=[f"/gen3_discovery_ai/knowledge/{topic}"],
+    )
+    topic_chain = await _get_versioned_topic_chain(topic)
+
+    try:
+        await asyncio.to_thread(activate_knowledge_version, topic, knowledge_version)
+    except KeyError as exc:
+        raise HTTPException(
+            status_code=HTTP_404_NOT_FOUND,
+            detail=f"knowledge version {knowledge_version} not found",
+        ) from exc
+
+    await asyncio.to_thread(topic_chain.switch_knowledge_version, knowledge_version)
+
+    return _get_knowledge_versions_info(topic, topic_chain)
+
+
+async def _get_versioned_topic_chain(topic: str) -> TopicChain:
+    """
+    Return the topic's chain, raising an HTTP error if the topic doesn't exist or
+    doesn't have a versioned knowledge store
+    """
+    topic_config = config.topics.get(topic)
+    if not topic_config:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"{topic} not found")
+
+    topic_chain = await _get_topic_chain(topic, topic_config)
+    if not topic_chain:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"{topic} not found")
+
+    if not getattr(topic_chain, "supports_knowledge_versions", False):
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail=f"{topic} doesn't have a versioned knowledge store",
+        )
+
+    return topic_chain
+
+
+def _get_knowledge_versions_info(topic: str, topic_chain: TopicChain) -> dict:
+    return {
+        "topic": topic,
+        "active_version": get_knowledge_version(topic),
+        "loaded_version": topic_chain.knowledge_version,
+        "versions": list_knowledge_versions(topic),
+    }
+
+
 @root_router.get("/_version/")
 @root_router.get("/_version", include_in_schema=False)
 async def get_version(request: Request) -> dict:
@@ -216,14 +530,313 @@ async def get_version(request: Request) -> dict:
 
 @root_router.get("/_status/")
 @root_router.get("/_status", include_in_schema=False)
-async def get_status() -> dict:
+async def get_status(response: Response) -> dict:
     """
-    Return the status of the running service
+    Return the status of the running service, including the readiness of each topic.
+
+    Responds 503 with status "INITIALIZING" until the topics are created (unless
+    they're created lazily on their first request, see `TOPIC_INIT_MODE`), so readiness
+    probes don't send traffic to a process which isn't ready for it.
 
     Returns:
-        dict: simple status and timestamp in format: `{"status": "OK", "timestamp": time.time()}`
+        dict: status, timestamp, and topics in format:
+            ```
+            {
+              "status": "OK",
+              "timestamp": 1700000000.0,
+              "topics": {
+                "bdc": {"status": "ready", "seconds": 1.25, "error": null}
+              }
+            }
+            ```
+    """
+    topic_initializer = get_topic_initializer()
+    if not topic_initializer:
+        return {"status": "OK", "timestamp": time.time(), "topics": {}}
+
+    status = "OK"
+    if not topic_initializer.is_ready():
+        status = "INITIALIZING"
+        response.status_code = HTTP_503_SERVICE_UNAVAILABLE
+
+    return {
+        "status": status,
+        "timestamp": time.time(),
+        "topics": topic_initializer.get_statuses(),
+    }
+
+
+@root_router.get("/_metrics/")
+@root_router.get("/_metrics", include_in_schema=False)
+async def get_metrics() -> dict:
+    """
+    Return metrics for this process of the running service (e.g. cache hits/misses)
+
+    Returns:
+        dict: metrics by name and timestamp in format: `{"metrics": {...}, "timestamp": time.time()}`
+    """
+    return {"metrics": get_metrics_snapshot(), "timestamp": time.time()}
+
+
+async def _validate_ask_request(
+    request: Request, data: dict, topic: str, conversation_id: str = None
+) -> Tuple[str, str]:
+    """
+    Authorize and validate an incoming ask request
+
+    Returns:
+        Tuple[str, str]: the user_id and query
+
+    Raises:
+        HTTPException: if unauthorized, the topic doesn't exist, or there's no query
+    """
+    await authorize_request(
+        request=request,
+        authz_access_method="read",
+        authz_resources=[f"/gen3_discovery_ai/ask/{topic}"],
+    )
+    user_id = await get_user_id(request=request)
+
+    if not config.topics.get(topic, None):
+        logging.debug(f"user provided topic not found: {topic}")
+        raise HTTPException(
+            status_code=HTTP_404_NOT_FOUND, detail=f"invalid topic {topic}, not found"
+        )
+
+    query = data.get("query")
+
+    if not query:
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST, detail="no query provided"
+        )
+
+    conversation = None
+    if conversation_id:
+        conversation = await _get_conversation_for_user(conversation_id, user_id)
+        # TODO (PXP-11239) handle conversation
+
+    logging.debug(f"conversation: {conversation}")
+
+    return user_id, query
+
+
+async def _answer_query(
+    topic: str,
+    query: str,
+    topic_config: dict,
+    cache_context: dict,
+    retrieval: Optional[Speculation] = None,
+) -> Tuple[dict, int, bool]:
+    """
+    Run the topic chain for the query and cache the response. Identical concurrent
+    queries (same topic, normalized query, configuration, and knowledge version) share
+    a single chain execution and all get its response (or its error).
+
+    If retrieval for the query was already started (see `_start_speculative_retrieval`),
+    only the generation stage of the topic chain is run on its documents. The chain
+    execution claims the retrieval when it starts, so if the request which started it
+    is cancelled (e.g. its client disconnected), requests coalesced on the same
+    execution still get its response.
+
+    Returns:
+        Tuple[dict, int, bool]: the response, the LLM tokens used for it (0 if it came
+            from another request's chain execution) and whether it came from another
+            request's chain execution
+    """
+
+    async def _run_topic_chain():
+        topic_chain = topic_config["topic_chain"]
+        token_usage = LLMTokenUsageCallbackHandler()
+        callbacks = [LoggingCallbackHandler(), token_usage]
+        try:
+            if retrieval:
+                documents = await retrieval.result()
+                raw_response = await topic_chain.agenerate(
+                    query, documents, callbacks=callbacks
+                )
+            else:
+                raw_response = await topic_chain.arun(query=query, callbacks=callbacks)
+        except Exception as exc:
+            logging.error(
+                f"Returning service unavailable. Got unexpected error from chain: {exc}"
+            )
+            raise HTTPException(
+                HTTP_503_SERVICE_UNAVAILABLE,
+                "Service unavailable.",
+            ) from exc
+
+        response = {
+            "response": raw_response.get("result", "").strip(),
+            "documents": _parse_documents(raw_response.get("source_documents")),
+        }
+        _cache_response(cache_context, response)
+        llm_tokens_used = _get_llm_tokens_used(
+            token_usage, query, response["response"], response["documents"]
+        )
+        return response, llm_tokens_used
+
+    if not config.ASK_COALESCING_ENABLED:
+        response, llm_tokens_used = await _run_topic_chain()
+        return response, llm_tokens_used, False
+
+    def _start_topic_chain():
+        # only called by the request whose execution is shared, the other requests'
+        # retrievals are discarded
+        if retrieval:
+            retrieval.claim()
+        return _run_topic_chain()
+
+    key = AnswerCache.get_key(topic, query, topic_config)
+    (response, llm_tokens_used), is_coalesced = await _ask_single_flight.run(
+        key, _start_topic_chain, topic=topic
+    )
+    # only the request which ran the chain pays for it
+    return response, 0 if is_coalesced else llm_tokens_used, is_coalesced
+
+
+async def _get_topic_chain(topic: str, topic_config: dict) -> TopicChain:
+    """
+    Return the topic's chain, creating it first if it doesn't exist yet (e.g. topics
+    are created lazily, or creating it failed before)
+
+    Raises:
+        HTTPException: 503 if the topic's chain can't be created
+    """
+    topic_chain = topic_config.get("topic_chain")
+    topic_initializer = get_topic_initializer()
+    if (
+        topic_chain is not None
+        or not topic_initializer
+        or topic not in topic_initializer.chain_names
+    ):
+        return topic_chain
+
+    try:
+        return await topic_initializer.ainitialize(topic)
+    except Exception as exc:
+        logging.error(f"Unable to create the chain for topic `{topic}`: {exc!r}")
+        raise HTTPException(
+            HTTP_503_SERVICE_UNAVAILABLE, f"topic {topic} is unavailable"
+        ) from exc
+
+
+def _start_speculative_retrieval(topic: str, data: Any) -> Optional[Speculation]:
+    """
+    If enabled, start retrieving documents for the query before the request is
+    validated and the answer caches are checked (retrieval doesn't depend on those),
+    so that latency overlaps. The documents are discarded if the request is rejected
+    or doesn't need the topic chain.
+
+    Requests are authorized before they're admitted, so this is only started for
+    authorized requests.
+
+    Returns:
+        Speculation: the retrieval (or None if not enabled or possible)
+    """
+    if not config.ASK_SPECULATIVE_RETRIEVAL_ENABLED:
+        return None
+
+    topic_config = config.topics.get(topic)
+    query = data.get("query") if isinstance(data, dict) else None
+    if not topic_config or not query or not isinstance(query, str):
+        return None
+
+    # the topic's chain may not be created yet
+    topic_chain = topic_config.get("topic_chain")
+    if not isinstance(topic_chain, TopicChain) or not topic_chain.supports_stages:
+        return None
+
+    return Speculation(
+        "ask_retrieval",
+        topic_chain.aretrieve(query, callbacks=[LoggingCallbackHandler()]),
+        topic=topic,
+    )
+
+
+async def _get_cached_response(
+    topic: str, query: str, topic_config: dict
+) -> Tuple[Optional[dict], dict]:
+    """
+    Look for a previous answer to the query in the exact-match cache and then in
+    the semantic cache (for topics which enable it).
+
+    Returns:
+        Tuple[dict, dict]: the cached response (or None) and the cache context to
+            provide to `_cache_response` to cache a new response
+    """
+    cache_context = {"topic": topic, "topic_config": topic_config}
+
+    answer_cache = get_answer_cache()
+    if answer_cache:
+        cache_context["key"] = answer_cache.get_key(topic, query, topic_config)
+        response = answer_cache.get(cache_context["key"], topic)
+        if response is not None:
+            return response, cache_context
+
+    response, cache_context["query_embedding"] = await get_semantic_cache().aget(
+        topic, query, topic_config
+    )
+    if response is not None and answer_cache:
+        # so the exact same query is found faster next time
+        answer_cache.set(cache_context["key"], topic, response)
+
+    return response, cache_context
+
+
+def _cache_response(cache_context: dict, response: dict) -> None:
+    """
+    Store a new response in the configured caches
+
+    Args:
+        cache_context (dict): from `_get_cached_response`
+        response (dict): JSON-serializable response with `response` and `documents`
+    """
+    answer_cache = get_answer_cache()
+    if answer_cache and cache_context.get("key"):
+        answer_cache.set(cache_context["key"], cache_context["topic"], response)
+
+    if cache_context.get("query_embedding") is not None:
+        get_semantic_cache().set(
+            cache_context["topic"],
+            cache_context["query_embedding"],
+            response,
+            cache_context["topic_config"],
+        )
+
+
+def _get_llm_tokens_used(
+    token_usage: LLMTokenUsageCallbackHandler,
+    query: str,
+    response_text: str,
+    documents: list[dict],
+) -> int:
+    """
+    LLM tokens reported by the provider, or an estimate if it didn't report any
+    """
+    if token_usage.total_tokens:
+        return token_usage.total_tokens
+
+    return estimate_tokens(
+        query, response_text, *[doc["page_content"] for doc in documents]
+    )
+
+
+def _parse_documents(source_documents) -> list[dict]:
+    """
+    Convert langchain documents into the JSON-serializable response format
+    """
+    documents = []
+    for doc in source_documents or []:
+        parsed_doc = {"page_content": doc.page_content, "metadata": doc.metadata}
+        documents.append(parsed_doc)
+    return documents
+
+
+def _format_sse_event(event: str, data: dict) -> str:
+    """
+    Format a single Server-Sent Event with a JSON `data` payload
     """
-    return {"status": "OK", "timestamp": time.time()}
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 async def _get_conversation_id() -> str:
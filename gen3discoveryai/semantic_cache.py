@@ -0,0 +1,283 @@
+"""
+Semantic cache of `/ask` answers which reuses answers for near-duplicate questions.
+
+This is opt-in per topic via the topic's metadata (e.g. in `{TOPIC}_RAW_METADATA`):
+
+    - `semantic_cache:true` enables it
+    - `semantic_cache_similarity_threshold:0.95` minimum cosine similarity between a new
+      query and a previous query to reuse the previous answer
+    - `semantic_cache_max_entries:1000` maximum number of previous queries to remember
+
+Queries are embedded with the topic's configured embedding function and compared
+against a small per-topic, per-process index of previous queries. Each index is
+cleared when the topic's knowledge store version or configuration changes.
+"""
+
+import copy
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from gen3discoveryai import config, logging
+from gen3discoveryai.cache import get_topic_config_fingerprint
+from gen3discoveryai.knowledge import get_knowledge_version
+from gen3discoveryai.metrics import get_counter
+from gen3discoveryai.topic_chains.utils import get_from_cfg_metadata
+
+_semantic_cache = None
+
+
+class SemanticCacheIndex:
+    """
+    Bounded index of normalized query embeddings and their answers. When full, the
+    least recently used entry is replaced.
+    """
+
+    def __init__(self, max_entries: int, version: str = "") -> None:
+        self.max_entries = max_entries
+        # anything which invalidates all entries (knowledge version, topic config)
+        self.version = version
+        self._vectors = None
+        self._answers = []
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._lock = threading.Lock()
+
+    def lookup(
+        self, vector: np.ndarray, threshold: float
+    ) -> Tuple[Optional[Dict[str, Any]], float]:
+        """
+        Find the most similar previous query
+
+        Args:
+            vector (np.ndarray): normalized query embedding
+            threshold (float): minimum cosine similarity to count as a match
+
+        Returns:
+            Tuple[dict, float]: the matched answer (or None) and the best similarity found
+        """
+        with self._lock:
+            count = len(self._answers)
+            if not count or self._vectors.shape[1] != vector.shape[0]:
+                return None, 0.0
+
+            now = time.time()
+            similarities = self._vectors[:count] @ vector
+            similarities[self._expires_at[:count] <= now] = -1.0
+            best = int(np.argmax(similarities))
+            best_similarity = float(similarities[best])
+
+            if best_similarity < threshold:
+                return None, best_similarity
+
+            self._last_used[best] = now
+            return copy.deepcopy(self._answers[best]), best_similarity
+
+    def add(self, vector: np.ndarray, answer: Dict[str, Any], ttl: float) -> None:
+        """
+        Remember the answer for the query embedding
+
+        Args:
+            vector (np.ndarray): normalized query embedding
+            answer (dict): JSON-serializable answer
+            ttl (float): seconds until the entry expires
+        """
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._vectors = np.zeros(
+                    (self.max_entries, vector.shape[0]), dtype=np.float32
+                )
+                self._answers = []
+
+            now = time.time()
+            if len(self._answers) < self.max_entries:
+                slot = len(self._answers)
+                self._answers.append(None)
+            else:
+                # expired entries have the oldest possible usage
+                last_used = np.where(self._expires_at <= now, -1.0, self._last_used)
+                slot = int(np.argmin(last_used))
+
+            self._vectors[slot] = vector
+            self._answers[slot] = copy.deepcopy(answer)
+            self._expires_at[slot] = now + ttl
+            self._last_used[slot] = now
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+
+class SemanticCache:
+    """
+    Per-topic semantic caches of answers
+    """
+
+    def __init__(self, ttl_seconds: float) -> None:
+        self.ttl_seconds = ttl_seconds
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.hits = get_counter(
+            "semantic_cache_hits_total",
+            "Answers served from the semantic cache for a similar previous query",
+        )
+        self.misses = get_counter(
+            "semantic_cache_misses_total",
+            "Answers not found in the semantic cache",
+        )
+
+    async def aget(
+        self, topic: str, query: str, topic_config: Dict[str, Any]
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+        """
+        Return a cached answer for a similar previous query (if the topic has semantic
+        caching enabled).
+
+        Args:
+            topic (str): topic name
+            query (str): user provided query
+            topic_config (dict): the topic's configuration from `config.topics`
+
+        Returns:
+            Tuple[dict, np.ndarray]: cached answer (or None) and the normalized
+                query embedding to provide to `set` (or None if not enabled)
+        """
+        embeddings = get_topic_embeddings(topic_config)
+        if not is_semantic_cache_enabled(topic_config) or embeddings is None:
+            return None, None
+
+        try:
+            vector = normalize_vector(await embeddings.aembed_query(query))
+        except Exception as exc:
+            # the cache is an optimization, never fail a request b/c of it
+            logging.error(f"unable to embed query for semantic cache, exc: {exc}")
+            return None, None
+
+        threshold = get_from_cfg_metadata(
+            "semantic_cache_similarity_threshold",
+            topic_config,
+            default=0.95,
+            type_=float,
+        )
+        answer, similarity = self._get_index(topic, topic_config).lookup(
+            vector, threshold
+        )
+
+        if answer is None:
+            self.misses.inc(topic=topic)
+        else:
+            logging.debug(
+                f"semantic cache hit for topic '{topic}' with similarity {similarity}"
+            )
+            self.hits.inc(topic=topic)
+
+        return answer, vector
+
+    def set(
+        self,
+        topic: str,
+        vector: np.ndarray,
+        answer: Dict[str, Any],
+        topic_config: Dict[str, Any],
+    ) -> None:
+        """
+        Remember the answer for the query embedding
+
+        Args:
+            topic (str): topic name
+            vector (np.ndarray): normalized query embedding from `aget`
+            answer (dict): JSON-serializable answer
+            topic_config (dict): the topic's configuration from `config.topics`
+        """
+        self._get_index(topic, topic_config).add(vector, answer, self.ttl_seconds)
+
+    def invalidate_topic(self, topic: str) -> None:
+        """
+        Forget all previous queries for the topic
+
+        Args:
+            topic (str): topic name
+        """
+        with self._lock:
+            self._indexes.pop(topic, None)
+
+    def _get_index(
+        self, topic: str, topic_config: Dict[str, Any]
+    ) -> SemanticCacheIndex:
+        """
+        Get the topic's index, replacing it if the knowledge or configuration changed
+        """
+        version = (
+            f"{get_knowledge_version(topic)}:"
+            f"{get_topic_config_fingerprint(topic_config)}"
+        )
+        with self._lock:
+            index = self._indexes.get(topic)
+            if index is None or index.version != version:
+                max_entries = get_from_cfg_metadata(
+                    "semantic_cache_max_entries", topic_config, default=1000, type_=int
+                )
+                index = SemanticCacheIndex(max_entries, version=version)
+                self._indexes[topic] = index
+        return index
+
+
+def is_semantic_cache_enabled(topic_config: Dict[str, Any]) -> bool:
+    """
+    Whether the topic opted in to semantic caching in its metadata
+
+    Args:
+        topic_config (dict): the topic's configuration from `config.topics`
+
+    Returns:
+        bool: True if enabled
+    """
+    enabled = get_from_cfg_metadata(
+        "semantic_cache", topic_config, default="false", type_=str
+    )
+    return enabled.strip().lower() in ("true", "1", "yes")
+
+
+def get_topic_embeddings(topic_config: Dict[str, Any]):
+    """
+    Return the topic's configured embedding function (or None if it doesn't have one)
+
+    Args:
+        topic_config (dict): the topic's configuration from `config.topics`
+
+    Returns:
+        langchain_core.embeddings.Embeddings: the embedding function
+    """
+    vectorstore = getattr(topic_config.get("topic_chain"), "vectorstore", None)
+    return getattr(vectorstore, "embeddings", None)
+
+
+def normalize_vector(vector: Sequence[float]) -> np.ndarray:
+    """
+    Convert to a unit length float32 array so a dot product is the cosine similarity
+
+    Args:
+        vector (Sequence[float]): embedding
+
+    Returns:
+        np.ndarray: normalized embedding
+    """
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    if norm:
+        array = array / norm
+    return array
+
+
+def get_semantic_cache() -> SemanticCache:
+    """
+    Return the process's semantic cache (creating it if necessary)
+
+    Returns:
+        SemanticCache: the cache
+    """
+    global _semantic_cache
+    if _semantic_cache is None:
+        _semantic_cache = SemanticCache(config.ANSWER_CACHE_TTL_SECONDS)
+    return _semantic_cache
@@ -0,0 +1,80 @@
+"""
+Single-flight execution of identical concurrent work.
+
+When many requests need the same result at the same time (e.g. the same query to the
+same topic), only the first one executes the work and the rest await its result.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from gen3discoveryai import logging
+from gen3discoveryai.metrics import get_counter
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls which share a key into a single execution. Every caller
+    gets the result (or the exception) of that one execution.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.executions = get_counter(
+            f"{name}_single_flight_executions_total",
+            f"Executions of {name} work shared with identical concurrent requests",
+        )
+        self.coalesced = get_counter(
+            f"{name}_single_flight_coalesced_total",
+            f"Requests for {name} which awaited an identical in-flight execution",
+        )
+
+    async def run(
+        self,
+        key: Hashable,
+        function: Callable[[], Awaitable[Any]],
+        **labels,
+    ) -> Tuple[Any, bool]:
+        """
+        Execute `function` unless an execution for the same key is already in flight,
+        in which case await that execution's result instead.
+
+        The execution is shielded from cancellation of any one caller, so a client
+        disconnecting doesn't fail everyone else awaiting the same result.
+
+        Args:
+            key (Hashable): identifies identical work
+            function (Callable): coroutine function with no arguments to execute
+            **labels: label names/values for the metrics
+
+        Returns:
+            Tuple[Any, bool]: result and whether it came from another caller's execution
+        """
+        task = self._in_flight.get(key)
+        coalesced = task is not None
+
+        if coalesced:
+            self.coalesced.inc(**labels)
+            logging.debug(f"awaiting in-flight {self.name} execution for key: {key}")
+        else:
+            self.executions.inc(**labels)
+            task = asyncio.ensure_future(function())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._on_done(key, done))
+
+        return await asyncio.shield(task), coalesced
+
+    def in_flight(self) -> int:
+        """
+        Number of executions currently in flight
+        """
+        return len(self._in_flight)
+
+    def _on_done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+        # mark the exception as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,64 @@
+"""
+Speculative execution of work which will probably be needed.
+
+Work (like retrieving documents for a query) is started early, concurrently with
+whatever decides whether it's needed (like the answer cache lookup). If it turns out
+to be needed, its result is awaited. Otherwise, it's discarded (cancelled if still
+running) and any error it raised is ignored.
+"""
+
+import asyncio
+from typing import Any, Awaitable
+
+from gen3discoveryai.metrics import get_counter
+
+
+class Speculation:
+    """
+    Work started before knowing whether its result will be used
+    """
+
+    def __init__(self, name: str, work: Awaitable[Any], **labels) -> None:
+        self.name = name
+        self.labels = labels
+        self.claimed = False
+        self._task = asyncio.ensure_future(work)
+        self._task.add_done_callback(_retrieve_exception)
+        self.outcomes = get_counter(
+            f"{name}_speculations_total",
+            f"Speculative {name} executions by whether their result was used",
+        )
+
+    def claim(self) -> None:
+        """
+        Claim the work, so it's no longer discarded (e.g. once whatever started it
+        hands it to work which outlives it)
+        """
+        if not self.claimed:
+            self.claimed = True
+            self.outcomes.inc(outcome="used", **self.labels)
+
+    async def result(self) -> Any:
+        """
+        Claim the work (so it's no longer discarded) and await its result
+        """
+        self.claim()
+        return await self._task
+
+    def discard(self) -> None:
+        """
+        Cancel the work unless it was claimed
+        """
+        if self.claimed:
+            return
+
+        self.claimed = True
+        self.outcomes.inc(outcome="discarded", **self.labels)
+        if not self._task.done():
+            self._task.cancel()
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    # mark the exception as retrieved since discarded work is never awaited
+    if not task.cancelled():
+        task.exception()
@@ -0,0 +1,178 @@
+"""
+Tokenizing and splitting text when loading the knowledge library.
+
+Text splitters are built once per (encoding, chunk size, overlap) in each process and
+reused for every file, and split whole batches of documents with a single tokenizer
+call (see `BatchTokenTextSplitter`). Worker processes build their own from the same
+arguments (splitters aren't picklable), which is cheap once the encoding is cached.
+
+tiktoken downloads an encoding's BPE files the first time it's used. Hosts without
+internet access can use a cache directory seeded elsewhere (`TIKTOKEN_CACHE_DIR`, see
+`cache_encoding`).
+"""
+
+import copy
+import functools
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+import tiktoken
+from langchain_classic.schema.document import Document
+from langchain_classic.text_splitter import (
+    Tokenizer,
+    TokenTextSplitter,
+    split_text_on_tokens,
+)
+
+from gen3discoveryai import config, logging
+
+# what `TokenTextSplitter.from_tiktoken_encoder` uses, so chunks (and their ids) are
+# unchanged from before splitters were shared
+DEFAULT_ENCODING = "gpt2"
+
+
+class BatchTokenTextSplitter(TokenTextSplitter):
+    """
+    `TokenTextSplitter` which tokenizes all the texts it's given in one (multithreaded)
+    call, rather than one call per text. Chunks are identical to `TokenTextSplitter`'s.
+    """
+
+    def create_documents(
+        self, texts: List[str], metadatas: Optional[List[Dict[Any, Any]]] = None
+    ) -> List[Document]:
+        if self._add_start_index:
+            return super().create_documents(texts, metadatas)
+
+        metadatas = metadatas or [{}] * len(texts)
+        all_token_ids = self._tokenizer.encode_batch(
+            list(texts),
+            allowed_special=self._allowed_special,
+            disallowed_special=self._disallowed_special,
+        )
+
+        documents = []
+        for token_ids, metadata in zip(all_token_ids, metadatas):
+            tokenizer = Tokenizer(
+                chunk_overlap=self._chunk_overlap,
+                tokens_per_chunk=self._chunk_size,
+                decode=self._tokenizer.decode,
+                encode=lambda _text, token_ids=token_ids: token_ids,
+            )
+            for chunk in split_text_on_tokens(text="", tokenizer=tokenizer):
+                documents.append(
+                    Document(page_content=chunk, metadata=copy.deepcopy(metadata))
+                )
+        return documents
+
+
+def configure_encoding_cache(cache_dir: str = None) -> Optional[str]:
+    """
+    Point tiktoken at the encoding cache directory. The setting is inherited by
+    worker processes started afterwards.
+
+    Args:
+        cache_dir (str): directory of cached encodings, defaults to `TIKTOKEN_CACHE_DIR`
+
+    Returns:
+        str: the cache directory tiktoken uses, None for its default
+    """
+    cache_dir = cache_dir or config.TIKTOKEN_CACHE_DIR
+    if cache_dir:
+        os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+    return os.environ.get("TIKTOKEN_CACHE_DIR")
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    """
+    Get the tiktoken encoding, loading it (from the cache directory if configured)
+    the first time it's used in this process
+
+    Args:
+        encoding_name (str): tiktoken encoding, e.g. `gpt2`
+
+    Returns:
+        tiktoken.Encoding: the encoding
+    """
+    cache_dir = configure_encoding_cache()
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as exc:
+        if cache_dir:
+            hint = (
+                f"make sure it's cached in TIKTOKEN_CACHE_DIR ({cache_dir}), e.g. with "
+                "`./bin/load_into_knowledge_store.py cache-encoding` on a host with "
+                "internet access."
+            )
+        else:
+            hint = (
+                "this could be b/c we couldn't download the necessary encoding file, "
+                "set TIKTOKEN_CACHE_DIR to use a pre-seeded cache."
+            )
+        logging.error(
+            f"Unable to get the {encoding_name} token encoding, {hint} "
+            f"Original exc: {exc}"
+        )
+        raise
+
+
+@functools.lru_cache(maxsize=None)
+def get_text_splitter(
+    chunk_size: int,
+    chunk_overlap: int = 0,
+    encoding_name: str = DEFAULT_ENCODING,
+) -> BatchTokenTextSplitter:
+    """
+    Get the splitter which chunks documents into `chunk_size` tokens, building it the
+    first time it's used in this process
+
+    Args:
+        chunk_size (int): tokens per chunk
+        chunk_overlap (int): tokens repeated from the end of the previous chunk
+        encoding_name (str): tiktoken encoding to count tokens with
+
+    Returns:
+        BatchTokenTextSplitter: the splitter
+    """
+    get_encoding(encoding_name)
+    return BatchTokenTextSplitter.from_tiktoken_encoder(
+        encoding_name=encoding_name,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+
+
+def count_tokens(
+    texts: Iterable[str], encoding_name: str = DEFAULT_ENCODING
+) -> List[int]:
+    """
+    Count the tokens in each text with a single (multithreaded) tokenizer call.
+    Special tokens are counted as ordinary text.
+
+    Args:
+        texts (Iterable[str]): texts to count
+        encoding_name (str): tiktoken encoding to count tokens with
+
+    Returns:
+        List[int]: number of tokens in each text
+    """
+    return [
+        len(token_ids)
+        for token_ids in get_encoding(encoding_name).encode_ordinary_batch(list(texts))
+    ]
+
+
+def cache_encoding(cache_dir: str, encoding_name: str = DEFAULT_ENCODING) -> None:
+    """
+    Download the encoding into the cache directory, so it can be copied to (or
+    mounted on) hosts without internet access and used from `TIKTOKEN_CACHE_DIR`
+
+    Args:
+        cache_dir (str): directory to cache the encoding in
+        encoding_name (str): tiktoken encoding to cache
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    configure_encoding_cache(cache_dir)
+    get_encoding.cache_clear()
+    get_encoding(encoding_name)
+    logging.info(f"Cached the {encoding_name} token encoding in: {cache_dir}")
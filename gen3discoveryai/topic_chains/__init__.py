@@ -1,11 +1,24 @@
-from gen3discoveryai.topic_chains.question_answer_google import (
-    TopicChainGoogleQuestionAnswerRAG,
-)
-from gen3discoveryai.topic_chains.question_answer_ollama import (
-    TopicChainOllamaQuestionAnswerRAG,
-)
-from gen3discoveryai.topic_chains.question_answer_openai import (
-    TopicChainOpenAiQuestionAnswerRAG,
-)
-
-# ... add more here
+import importlib
+
+# chain class -> module it's defined in. They're imported on first access, so importing
+# this package (e.g. for `topic_chains.base`) doesn't import every provider.
+_CHAIN_MODULES = {
+    "TopicChainGoogleQuestionAnswerRAG": (
+        "gen3discoveryai.topic_chains.question_answer_google"
+    ),
+    "TopicChainOllamaQuestionAnswerRAG": (
+        "gen3discoveryai.topic_chains.question_answer_ollama"
+    ),
+    "TopicChainOpenAiQuestionAnswerRAG": (
+        "gen3discoveryai.topic_chains.question_answer_openai"
+    ),
+    # ... add more here
+}
+
+__all__ = list(_CHAIN_MODULES)
+
+
+def __getattr__(name):
+    if name in _CHAIN_MODULES:
+        return getattr(importlib.import_module(_CHAIN_MODULES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
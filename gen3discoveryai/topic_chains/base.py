@@ -1,8 +1,87 @@
+import asyncio
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Tuple
+
+from langchain_classic.chains import RetrievalQA
 from langchain_classic.chains.base import Chain
 from langchain_classic.schema.document import Document
 from langchain_classic.vectorstores.base import VectorStore
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStoreRetriever
+
+from gen3discoveryai import config, ingestion, logging, semantic_cache
+from gen3discoveryai.cache import get_answer_cache
+from gen3discoveryai.embeddings import get_embedding_model_id
+from gen3discoveryai.knowledge import (
+    activate_knowledge_version,
+    bump_knowledge_version,
+    create_knowledge_version,
+    delete_knowledge_version,
+    get_document_id,
+    get_knowledge_store_directory,
+    get_knowledge_version,
+)
+from gen3discoveryai.vectorstores import (
+    VECTORSTORE_CHROMA,
+    close_vectorstore,
+    get_vectorstore,
+    warm_up_vectorstore,
+)
+
+# shared, bounded pool for running sync-only chains off of the event loop
+_sync_chain_executor = None
+
+# how long a vectorstore which was switched away from is kept open for requests still
+# using it
+RETIRED_VECTORSTORE_GRACE_SECONDS = 60
+
+# documents deleted from a vectorstore per request
+DELETE_BATCH_SIZE = 5000
+
 
-from gen3discoveryai import logging
+def get_sync_chain_executor() -> ThreadPoolExecutor:
+    """
+    Return the shared thread pool used to run sync-only chains (creating it if necessary).
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: bounded by `config.TOPIC_CHAIN_THREAD_POOL_MAX_WORKERS`
+    """
+    global _sync_chain_executor
+    if _sync_chain_executor is None:
+        _sync_chain_executor = ThreadPoolExecutor(
+            max_workers=config.TOPIC_CHAIN_THREAD_POOL_MAX_WORKERS,
+            thread_name_prefix="topic_chain",
+        )
+    return _sync_chain_executor
+
+
+def _reset_after_fork() -> None:
+    """
+    Forget what can't be used from a forked process (e.g. a gunicorn worker forked
+    from a preloaded master): the thread pool's threads don't exist in the child, and
+    Chroma hangs when using a client (or one cached for the same path) created before
+    the fork. Topic chains are created after the fork, see `GUNICORN_PRELOAD_APP`.
+    """
+    global _sync_chain_executor
+    _sync_chain_executor = None
+
+    shared_system_client = getattr(
+        sys.modules.get("chromadb.api.shared_system_client"),
+        "SharedSystemClient",
+        None,
+    )
+    if shared_system_client is not None:
+        shared_system_client.clear_system_cache()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 class TopicChain:
@@ -11,14 +90,25 @@ class TopicChain:
      - force a high-level name and topic for the chain
      - provide an easier interface for storing documents in the appropriately name-spaced vectorstore (likely by topic)
      - preconfigure the llm and prompt
+
+    Class Attributes:
+        CHROMA_COLLECTION_METADATA (dict): metadata new Chroma collections for the
+            topic are created with, like their distance function
     """
 
+    # We've heard the `cosine` distance function performs better
+    # https://docs.trychroma.com/usage-guide#changing-the-distance-function
+    CHROMA_COLLECTION_METADATA = {"hnsw:space": "cosine"}
+
     def __init__(
         self,
         name: str,
         topic: str,
         chain: Chain,
         vectorstore: VectorStore = None,
+        knowledge_version: str = "",
+        embeddings: Embeddings = None,
+        vectorstore_backend: str = VECTORSTORE_CHROMA,
     ) -> None:
         """
         Initialize the topic chain with provided name, topic, and langchain
@@ -27,6 +117,14 @@ class TopicChain:
             name (str): Description
             topic (str): Description
             chain (langchain.chains.base.Chain): Description
+            vectorstore (VectorStore): optional vectorstore the chain retrieves from
+            knowledge_version (str): version of the knowledge store the vectorstore
+                was loaded from
+            embeddings (Embeddings): embedding function for the topic's knowledge
+                store, topic chains which provide one support versioned knowledge
+                stores (see `create_vectorstore`)
+            vectorstore_backend (str): `chroma` or `numpy`, from the topic's
+                `vectorstore` metadata (see `gen3discoveryai.vectorstores`)
         """
         self.name = name
         self.topic = topic
@@ -34,17 +132,39 @@ class TopicChain:
         self.chain = chain
         # optional vectorstore, may be used if chain requires it
         self.vectorstore = vectorstore
+        self.knowledge_version = knowledge_version
+        self.embeddings = embeddings
+        self.vectorstore_backend = vectorstore_backend
+        # (time retired, vectorstore) for vectorstores that were switched away from
+        self._retired_vectorstores = []
+        self._knowledge_version_lock = threading.Lock()
 
-    def store_knowledge(self, documents: list[Document]) -> None:
+    def store_knowledge(
+        self,
+        documents: Iterable[Document],
+        full_rebuild: bool = False,
+        manifest: "ingestion.IngestionManifest" = None,
+    ) -> Dict[str, int]:
         """
-        Update knowledge store under the topic provided (or default if not provided)
-        with the provided documents.
+        Update the knowledge store under the topic provided (or default if not provided)
+        so it contains exactly the provided documents. Only new or changed documents
+        are embedded and documents no longer provided are removed. The update is built
+        as a new version of the knowledge store which queries switch to once complete
+        (see `store_knowledge_version`).
 
         Args:
-            documents (list[langchain_classic.schema.document.Document]): IDs to Documents to store in the knowledge
+            documents (Iterable[langchain_classic.schema.document.Document]): IDs to Documents to store in the knowledge
             store
+            full_rebuild (bool): delete and re-embed all documents instead of only the changed ones
+            manifest (gen3discoveryai.ingestion.IngestionManifest): records the progress of
+                the load, so it can be resumed if it fails
+
+        Returns:
+            Dict[str, int]: number of documents "added", "removed", and "unchanged"
         """
-        raise NotImplementedError()
+        if not self.supports_knowledge_versions:
+            raise NotImplementedError()
+        return self.store_knowledge_version(documents, full_rebuild, manifest)
 
     def insert_documents_into_vectorstore(self, documents: list[Document]) -> None:
         """
@@ -66,9 +186,322 @@ class TopicChain:
         logging.info(
             f"Recreating knowledge store collection for {self.topic} from documents..."
         )
-        self.vectorstore.add_documents(documents)
+        added = ingestion.embed_and_store(
+            self.vectorstore,
+            ((str(uuid.uuid4()), document) for document in documents),
+        )
+
+        logging.debug(f"Added {added} documents")
+
+    def update_documents_in_vectorstore(
+        self,
+        documents: Iterable[Document],
+        full_rebuild: bool = False,
+        vectorstore: VectorStore = None,
+        on_stored: Callable[[int], None] = None,
+    ) -> Dict[str, int]:
+        """
+        Make the vectorstore contain exactly the provided documents, only embedding
+        the ones which aren't already stored. Documents are identified by their
+        content, metadata, and the vectorstore's embedding model (see
+        `gen3discoveryai.knowledge.get_document_id`), so changed documents (or all of
+        them, if the embedding model changed) are added and any stored document not
+        provided is removed.
+
+        Args:
+            documents (Iterable[langchain_classic.schema.document.Document]): all documents
+                which should be in the knowledge store
+            full_rebuild (bool): delete and re-embed everything instead
+            vectorstore (VectorStore): vectorstore to update, defaults to `self.vectorstore`
+            on_stored (Callable[[int], None]): called with the number of documents in each
+                batch added to the vectorstore
+
+        Returns:
+            Dict[str, int]: number of documents "added", "removed", and "unchanged"
+        """
+        if vectorstore is None:
+            vectorstore = self.vectorstore
+        if vectorstore is None:
+            msg = (
+                f"Attempted to update documents in a TopicChain {self.name} "
+                f"for topic '{self.topic}' which doesn't have a configured vectorstore"
+            )
+            logging.error(msg)
+            raise Exception(msg)
+
+        # get all docs but don't include anything other than ids
+        existing_ids = set(vectorstore.get(include=[])["ids"])
+        removed = 0
+        if full_rebuild:
+            removed = self._delete_documents_from_vectorstore(vectorstore, existing_ids)
+            existing_ids = set()
+
+        embeddings = vectorstore.embeddings
+        model_id = get_embedding_model_id(embeddings) if embeddings is not None else ""
+        # documents are streamed through, only their ids are kept to find the
+        # stored documents which weren't provided
+        provided_ids = set()
+
+        def _documents_to_add():
+            for document in documents:
+                id_ = get_document_id(document, model_id)
+                # identical chunks (with the same metadata) only need to be stored once
+                if id_ in provided_ids:
+                    continue
+                provided_ids.add(id_)
+                if id_ not in existing_ids:
+                    yield id_, document
+
+        logging.info(
+            f"Adding new or changed documents to knowledge store collection "
+            f"for {self.topic}..."
+        )
+        added = ingestion.embed_and_store(
+            vectorstore, _documents_to_add(), on_stored=on_stored
+        )
+
+        if not full_rebuild:
+            removed = self._delete_documents_from_vectorstore(
+                vectorstore, existing_ids - provided_ids
+            )
+
+        counts = {
+            "added": added,
+            "removed": removed,
+            "unchanged": len(provided_ids) - added,
+        }
+        logging.info(f"Updated knowledge store for {self.topic}: {counts}")
+        return counts
+
+    def _delete_documents_from_vectorstore(
+        self, vectorstore: VectorStore, ids: Iterable[str]
+    ) -> int:
+        """
+        Delete the documents with the provided ids in batches (vectorstores limit how
+        many can be deleted at once)
+
+        Returns:
+            int: number of documents deleted
+        """
+        ids = list(ids)
+        if ids:
+            logging.debug(
+                f"Removing {len(ids)} documents from knowledge store "
+                f"collection for {self.topic}..."
+            )
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            vectorstore.delete(ids=ids[start : start + DELETE_BATCH_SIZE])
+        return len(ids)
+
+    def on_knowledge_updated(self, version: str = None) -> None:
+        """
+        Record that the knowledge store for this topic changed, so anything derived
+        from the previous knowledge (like cached answers) is no longer used.
+
+        Args:
+            version (str): the new version, defaults to a new unique identifier
+        """
+        bump_knowledge_version(self.topic, version)
+        self._invalidate_cached_answers()
+
+    def _invalidate_cached_answers(self) -> None:
+        answer_cache = get_answer_cache()
+        if answer_cache:
+            answer_cache.invalidate_topic(self.topic)
+
+        semantic_cache.get_semantic_cache().invalidate_topic(self.topic)
+
+    def warm_up(self) -> None:
+        """
+        Load what the first request would otherwise wait for, like the vectorstore's
+        index, before the topic is marked ready (see `gen3discoveryai.topic_init`).
+
+        The index is queried with a vector already stored in it, so warming up doesn't
+        call the embedding API.
+        """
+        if self.vectorstore is not None:
+            warm_up_vectorstore(self.vectorstore)
+
+    @property
+    def supports_knowledge_versions(self) -> bool:
+        """
+        Whether the topic chain can build and switch between versions of its
+        knowledge store (e.g. it provides `embeddings` or implements
+        `create_vectorstore`)
+        """
+        return (
+            self.embeddings is not None
+            or type(self).create_vectorstore is not TopicChain.create_vectorstore
+        )
+
+    def create_vectorstore(self, directory: str) -> VectorStore:
+        """
+        Create a vectorstore for this topic persisted in the provided directory, using
+        the topic's embeddings and configured backend
+
+        Args:
+            directory (str): path to persist the vectorstore in
+
+        Returns:
+            VectorStore: the vectorstore
+        """
+        if self.embeddings is None:
+            raise NotImplementedError()
+        return get_vectorstore(
+            self.topic,
+            self.embeddings,
+            directory,
+            self.vectorstore_backend,
+            chroma_collection_metadata=self.CHROMA_COLLECTION_METADATA,
+        )
+
+    def store_knowledge_version(
+        self,
+        documents: Iterable[Document],
+        full_rebuild: bool = False,
+        manifest: "ingestion.IngestionManifest" = None,
+    ) -> Dict[str, int]:
+        """
+        Store the documents in a new version of the knowledge store, built alongside
+        the live one, then atomically switch to it. Queries keep using the previous
+        version until the switch, so they never see a partially updated store.
+
+        The new version starts as a copy of the active one, so only new or changed
+        documents are embedded (see `update_documents_in_vectorstore`). If nothing
+        changed, the new version is discarded. A full rebuild starts from an empty
+        version instead.
+
+        Without a manifest, a version which fails to build is deleted. With one, it's
+        kept and recorded in the manifest, so the load can be resumed (see
+        `gen3discoveryai.ingestion.IngestionManifest`): the documents already stored in
+        it are skipped.
+
+        Args:
+            documents (Iterable[langchain_classic.schema.document.Document]): all documents
+                which should be in the knowledge store
+            full_rebuild (bool): re-embed all documents instead
+            manifest (gen3discoveryai.ingestion.IngestionManifest): records the progress of
+                the load
+
+        Returns:
+            Dict[str, int]: number of documents "added", "removed", and "unchanged"
+        """
+        version = manifest.start(full_rebuild) if manifest else None
+        if version is None:
+            version = create_knowledge_version(self.topic, copy_active=not full_rebuild)
+            if manifest:
+                manifest.set_version(version)
+
+        # everything in the active version is replaced by a full rebuild
+        replaced = 0
+        if full_rebuild and self.vectorstore is not None:
+            replaced = len(self.vectorstore.get(include=[])["ids"])
+
+        vectorstore = self.create_vectorstore(
+            get_knowledge_store_directory(self.topic, version)
+        )
+
+        try:
+            counts = self.update_documents_in_vectorstore(
+                documents,
+                vectorstore=vectorstore,
+                on_stored=manifest.record_stored if manifest else None,
+            )
+        except BaseException as exc:
+            close_vectorstore(vectorstore)
+            if manifest:
+                manifest.fail(exc)
+            else:
+                delete_knowledge_version(self.topic, version)
+            raise
+        counts["removed"] += replaced
+
+        if not counts["added"] and not counts["removed"]:
+            logging.info(
+                f"Knowledge for {self.topic} is unchanged, discarding {version}"
+            )
+            close_vectorstore(vectorstore)
+            delete_knowledge_version(self.topic, version)
+            version = get_knowledge_version(self.topic)
+        else:
+            activate_knowledge_version(self.topic, version)
+            self._use_vectorstore(vectorstore, version)
+            self._invalidate_cached_answers()
 
-        logging.debug(f"Added {len(documents)} documents")
+        if manifest:
+            manifest.finish(counts, version)
+        return counts
+
+    def switch_knowledge_version(self, version: str = None) -> bool:
+        """
+        Switch queries to use the provided version of the knowledge store. Queries
+        already in progress finish with the previous version, and none wait for
+        the switch.
+
+        Args:
+            version (str): version to switch to, defaults to the active version on disk
+
+        Returns:
+            bool: whether the version changed
+        """
+        if version is None:
+            version = get_knowledge_version(self.topic)
+
+        with self._knowledge_version_lock:
+            if version == self.knowledge_version:
+                return False
+
+            vectorstore = self.create_vectorstore(
+                get_knowledge_store_directory(self.topic, version)
+            )
+            # make sure the store can be read before switching to it
+            vectorstore.get(limit=1, include=[])
+            self._use_vectorstore(vectorstore, version)
+
+        # cached answers are keyed by knowledge version, so they don't need invalidating
+        logging.info(f"Switched {self.topic} to knowledge version: {version}")
+        self.release_retired_vectorstores()
+        return True
+
+    def release_retired_vectorstores(
+        self, grace_seconds: float = RETIRED_VECTORSTORE_GRACE_SECONDS
+    ) -> None:
+        """
+        Close vectorstores switched away from at least `grace_seconds` ago, so previous
+        knowledge versions don't stay in memory.
+
+        Args:
+            grace_seconds (float): how long to give requests using a vectorstore to finish
+        """
+        with self._knowledge_version_lock:
+            now = time.monotonic()
+            to_release = [
+                vectorstore
+                for retired_at, vectorstore in self._retired_vectorstores
+                if now - retired_at >= grace_seconds
+            ]
+            self._retired_vectorstores = [
+                (retired_at, vectorstore)
+                for retired_at, vectorstore in self._retired_vectorstores
+                if now - retired_at < grace_seconds
+            ]
+
+        for vectorstore in to_release:
+            close_vectorstore(vectorstore)
+
+    def _use_vectorstore(self, vectorstore: VectorStore, version: str) -> None:
+        """
+        Point the chain's retriever at the provided vectorstore. Each assignment is
+        atomic, so requests use either the previous or the new vectorstore.
+        """
+        retired = self.vectorstore
+        if isinstance(getattr(self.chain, "retriever", None), VectorStoreRetriever):
+            self.chain.retriever.vectorstore = vectorstore
+        self.vectorstore = vectorstore
+        self.knowledge_version = version
+
+        if retired is not None and retired is not vectorstore:
+            self._retired_vectorstores.append((time.monotonic(), retired))
 
     def run(self, query: str, *args, **kwargs):
         """
@@ -77,9 +510,201 @@ class TopicChain:
         Args:
             query (str): query to provide to chain
         """
+        kwargs = _callbacks_as_config(args, kwargs)
         return self.chain.invoke(
             {"query": query},
             *args,
             include_run_info=True,
             **kwargs,
         )
+
+    async def arun(self, query: str, *args, **kwargs):
+        """
+        Run the query on the underlying chain without blocking the event loop.
+
+        Chains with a native async implementation are awaited directly (so many
+        LLM calls can be in flight at once on a single worker). Sync-only chains
+        are run in a bounded thread pool instead.
+
+        Args:
+            query (str): query to provide to chain
+        """
+        if _supports_native_async(self.chain):
+            kwargs = _callbacks_as_config(args, kwargs)
+            return await self.chain.ainvoke(
+                {"query": query},
+                *args,
+                include_run_info=True,
+                **kwargs,
+            )
+
+        logging.debug(
+            f"chain for topic '{self.topic}' is sync-only, running in thread pool"
+        )
+        return await asyncio.get_running_loop().run_in_executor(
+            get_sync_chain_executor(),
+            functools.partial(self.run, query, *args, **kwargs),
+        )
+
+    @property
+    def supports_stages(self) -> bool:
+        """
+        Whether the query can be run as separate retrieve and generate stages
+        (e.g. the underlying chain is a `RetrievalQA` chain)
+        """
+        return isinstance(self.chain, RetrievalQA)
+
+    def retrieve(self, query: str, callbacks: list = None) -> list[Document]:
+        """
+        Run only the retrieval stage of the underlying chain (embedding the query and
+        searching the knowledge store). Requires `supports_stages`.
+
+        Args:
+            query (str): query to retrieve relevant documents for
+            callbacks (list): langchain callback handlers to attach to the run
+
+        Returns:
+            list[Document]: relevant documents
+        """
+        return self.chain.retriever.invoke(query, config={"callbacks": callbacks or []})
+
+    async def aretrieve(self, query: str, callbacks: list = None) -> list[Document]:
+        """
+        Run only the retrieval stage of the underlying chain without blocking the
+        event loop. Requires `supports_stages`.
+
+        Args:
+            query (str): query to retrieve relevant documents for
+            callbacks (list): langchain callback handlers to attach to the run
+
+        Returns:
+            list[Document]: relevant documents
+        """
+        return await self.chain.retriever.ainvoke(
+            query, config={"callbacks": callbacks or []}
+        )
+
+    def generate(
+        self, query: str, documents: list[Document], callbacks: list = None
+    ) -> dict:
+        """
+        Run only the generation stage of the underlying chain (prompting the LLM with
+        the query and already retrieved documents). Requires `supports_stages`.
+
+        Args:
+            query (str): query to provide to chain
+            documents (list[Document]): documents from the retrieval stage
+            callbacks (list): langchain callback handlers to attach to the run
+
+        Returns:
+            dict: same output as `run`
+        """
+        combine_documents_chain = self.chain.combine_documents_chain
+        output = combine_documents_chain.invoke(
+            {combine_documents_chain.input_key: documents, "question": query},
+            config={"callbacks": callbacks or []},
+        )
+        return self._get_stages_output(query, documents, output)
+
+    async def agenerate(
+        self, query: str, documents: list[Document], callbacks: list = None
+    ) -> dict:
+        """
+        Run only the generation stage of the underlying chain without blocking the
+        event loop. Requires `supports_stages`.
+
+        Args:
+            query (str): query to provide to chain
+            documents (list[Document]): documents from the retrieval stage
+            callbacks (list): langchain callback handlers to attach to the run
+
+        Returns:
+            dict: same output as `arun`
+        """
+        combine_documents_chain = self.chain.combine_documents_chain
+        if not _supports_native_async(combine_documents_chain):
+            return await asyncio.get_running_loop().run_in_executor(
+                get_sync_chain_executor(),
+                functools.partial(self.generate, query, documents, callbacks),
+            )
+
+        output = await combine_documents_chain.ainvoke(
+            {combine_documents_chain.input_key: documents, "question": query},
+            config={"callbacks": callbacks or []},
+        )
+        return self._get_stages_output(query, documents, output)
+
+    def _get_stages_output(
+        self, query: str, documents: list[Document], output: dict
+    ) -> dict:
+        """
+        Format the generation stage's output like the underlying chain's
+        """
+        return {
+            self.chain.input_key: query,
+            self.chain.output_key: output[
+                self.chain.combine_documents_chain.output_key
+            ],
+            "source_documents": documents,
+        }
+
+    async def astream(
+        self, query: str, callbacks: list = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Run the query on the underlying chain, yielding results as they become available.
+
+        Yields `(event, payload)` tuples where event is one of:
+            - "documents": payload is the list of retrieved source documents
+            - "token": payload is the next piece of text generated by the LLM
+            - "result": payload is the final chain output (same as what `run` returns)
+
+        Args:
+            query (str): query to provide to chain
+            callbacks (list): langchain callback handlers to attach to the run
+        """
+        async for event in self.chain.astream_events(
+            {"query": query},
+            config={"callbacks": callbacks or []},
+            version="v2",
+            include_run_info=True,
+        ):
+            event_type = event["event"]
+            if event_type == "on_retriever_end":
+                yield "documents", event["data"].get("output") or []
+            elif event_type in ("on_chat_model_stream", "on_llm_stream"):
+                token = event["data"]["chunk"].text
+                if token:
+                    yield "token", token
+            elif event_type == "on_chain_end" and not event.get("parent_ids"):
+                yield "result", event["data"].get("output") or {}
+
+
+def _callbacks_as_config(args: tuple, kwargs: dict) -> dict:
+    """
+    `invoke`/`ainvoke` only use callbacks provided in their `config` (a `callbacks`
+    keyword argument is silently ignored), so move them there if that's the only
+    configuration provided.
+    """
+    if "callbacks" in kwargs and not args and "config" not in kwargs:
+        kwargs = dict(kwargs)
+        kwargs["config"] = {"callbacks": kwargs.pop("callbacks")}
+    return kwargs
+
+
+def _supports_native_async(chain) -> bool:
+    """
+    Whether the provided chain implements its own async execution. `langchain`
+    Chains which don't override `_acall` just run `_call` in an unbounded executor,
+    so we treat those as sync-only.
+
+    Args:
+        chain: langchain chain or runnable
+
+    Returns:
+        bool: True if the chain's `ainvoke` is natively async
+    """
+    if isinstance(chain, Chain):
+        return type(chain)._acall is not Chain._acall
+
+    return inspect.iscoroutinefunction(getattr(chain, "ainvoke", None))
@@ -49,6 +49,8 @@ class LoggingCallbackHandler(BaseCallbackHandler):
         self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any
     ) -> None:
         """Print out that we are entering a chain."""
+        # not all runnables provide a serialized representation
+        serialized = serialized or {}
         class_name = serialized.get("name", serialized.get("id", ["<unknown>"])[-1])
         logging.debug(f"Entering new {class_name} chain...")
 
@@ -14,17 +14,20 @@ from __future__ import annotations
 
 from typing import Any, Dict
 
-import chromadb
 import langchain
-import langchain_classic
-from langchain_chroma import Chroma
 from langchain_classic.chains.retrieval_qa.base import RetrievalQA
 from langchain_classic.prompts import PromptTemplate
 from langchain_google_vertexai import ChatVertexAI, VertexAIEmbeddings
 
 from gen3discoveryai import logging
+from gen3discoveryai.embeddings import get_cached_embeddings
+from gen3discoveryai.knowledge import (
+    get_knowledge_store_directory,
+    get_knowledge_version,
+)
 from gen3discoveryai.topic_chains.base import TopicChain
 from gen3discoveryai.topic_chains.utils import get_from_cfg_metadata
+from gen3discoveryai.vectorstores import get_vectorstore, get_vectorstore_backend
 
 
 class TopicChainGoogleQuestionAnswerRAG(TopicChain):
@@ -42,6 +45,10 @@ class TopicChainGoogleQuestionAnswerRAG(TopicChain):
             gets setup in initialization
         chroma_client (chromadb.PersistentClient): Chromadb client initialized
             outside langchain for better configuration options
+        vectorstore_backend (str): `chroma` or `numpy`, from the topic's `vectorstore`
+            metadata (see `gen3discoveryai.vectorstores`)
+        embeddings (Embeddings): the provider's (cached) embedding function, which the
+            knowledge store is built with (see `TopicChain.create_vectorstore`)
         llm (langchain.llms.base.LLM): langchain `LLM`, gets setup in
             initialization
         chain (langchain.chains.base.Chain): langchain `chain`, gets setup in
@@ -106,29 +113,22 @@ class TopicChainGoogleQuestionAnswerRAG(TopicChain):
         similarity_score_threshold = get_from_cfg_metadata(
             "similarity_score_threshold", metadata, default=0.5, type_=float
         )
-        # langchain/chroma recommend a separate client per persisted path
-        # to avoid potential collisions. We will separate on topic
-        settings = chromadb.Settings(
-            migrations_hash_algorithm="sha256",
-            anonymized_telemetry=False,
+        vectorstore_backend = get_vectorstore_backend(metadata)
+        embeddings = get_cached_embeddings(
+            VertexAIEmbeddings(model_name=embedding_model_name)
         )
-
-        persistent_client = chromadb.PersistentClient(
-            path=f"./knowledge/{topic}", settings=settings
-        )
-        vectorstore = Chroma(
-            client=persistent_client,
-            collection_name=topic,
-            embedding_function=VertexAIEmbeddings(model_name=embedding_model_name),
-            # We've heard the `cosine` distance function performs better
-            # https://docs.trychroma.com/usage-guide#changing-the-distance-function
-            collection_metadata={"hnsw:space": "cosine"},
-            persist_directory=f"./knowledge/{topic}",
-            client_settings=settings,
+        knowledge_version = get_knowledge_version(topic)
+        vectorstore = get_vectorstore(
+            topic,
+            embeddings,
+            get_knowledge_store_directory(topic, knowledge_version),
+            vectorstore_backend,
+            chroma_collection_metadata=self.CHROMA_COLLECTION_METADATA,
         )
 
         logging.debug(
-            f"chroma vectorstore initialized from ./knowledge/{topic} with docs"
+            f"{vectorstore_backend} vectorstore initialized for knowledge version: "
+            f"{knowledge_version}"
         )
 
         retriever_cfg = {
@@ -152,27 +152,7 @@ class TopicChainGoogleQuestionAnswerRAG(TopicChain):
             topic=topic,
             chain=retrieval_qa_chain,
             vectorstore=vectorstore,
+            knowledge_version=knowledge_version,
+            embeddings=embeddings,
+            vectorstore_backend=vectorstore_backend,
         )
-
-    def store_knowledge(
-        self, documents: list[langchain_classic.schema.document.Document]
-    ) -> None:
-        """
-        Delete and replace knowledge store under the topic provided (or default if not provided)
-        with the provided documents.
-
-        https://api.python.langchain.com/en/latest/schema/langchain_classic.schema.document.Document.html#langchain-schema-document-document
-
-        Args:
-            documents (list[langchain_classic.schema.document.Document]): documents to store in the knowledge store
-        """
-        # try:
-        # get all docs but don't include anything other than ids
-        docs = self.vectorstore.get(include=[])
-        if docs["ids"]:
-            logging.debug(
-                f"Deleting current knowledge store collection for {self.topic}..."
-            )
-            self.vectorstore.delete(ids=docs["ids"])
-
-        self.insert_documents_into_vectorstore(documents)
@@ -12,21 +12,25 @@ The overall RAG process is the following:
 
 from __future__ import annotations
 
+from contextlib import contextmanager
 from typing import Any, Dict
 
-import chromadb
-import langchain_classic
 import openai
 from fastapi import HTTPException
-from langchain_chroma import Chroma
 from langchain_classic.chains import RetrievalQA
 from langchain_classic.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from starlette.status import HTTP_400_BAD_REQUEST, HTTP_429_TOO_MANY_REQUESTS
 
 from gen3discoveryai import config, logging
+from gen3discoveryai.embeddings import get_cached_embeddings
+from gen3discoveryai.knowledge import (
+    get_knowledge_store_directory,
+    get_knowledge_version,
+)
 from gen3discoveryai.topic_chains.base import TopicChain
 from gen3discoveryai.topic_chains.utils import get_from_cfg_metadata
+from gen3discoveryai.vectorstores import get_vectorstore, get_vectorstore_backend
 
 
 class TopicChainOpenAiQuestionAnswerRAG(TopicChain):
@@ -45,6 +49,10 @@ class TopicChainOpenAiQuestionAnswerRAG(TopicChain):
             gets setup in initialization
         chroma_client (chromadb.PersistentClient): Chromadb client initialized
             outside langchain for better configuration options
+        vectorstore_backend (str): `chroma` or `numpy`, from the topic's `vectorstore`
+            metadata (see `gen3discoveryai.vectorstores`)
+        embeddings (Embeddings): the provider's (cached) embedding function, which the
+            knowledge store is built with (see `TopicChain.create_vectorstore`)
         llm (langchain.llms.base.LLM): langchain `LLM`, gets setup in
             initialization
         chain (langchain.chains.base.Chain): langchain `chain`, gets setup in
@@ -91,28 +99,20 @@ class TopicChainOpenAiQuestionAnswerRAG(TopicChain):
         similarity_score_threshold = get_from_cfg_metadata(
             "similarity_score_threshold", metadata, default=0.5, type_=float
         )
-        # langchain/chroma recommend a separate client per persisted path
-        # to avoid potential collisions. We will separate on topic
-        settings = chromadb.Settings(
-            migrations_hash_algorithm="sha256",
-            anonymized_telemetry=False,
+        vectorstore_backend = get_vectorstore_backend(metadata)
+        embeddings = get_cached_embeddings(
+            OpenAIEmbeddings(api_key=str(config.OPENAI_API_KEY))
         )
-
-        persistent_client = chromadb.PersistentClient(
-            path=f"./knowledge/{topic}", settings=settings
-        )
-        vectorstore = Chroma(
-            client=persistent_client,
-            collection_name=topic,
-            embedding_function=OpenAIEmbeddings(api_key=str(config.OPENAI_API_KEY)),
-            # We've heard the `cosine` distance function performs better
-            # https://docs.trychroma.com/usage-guide#changing-the-distance-function
-            collection_metadata={"hnsw:space": "cosine"},
-            persist_directory=f"./knowledge/{topic}",
-            client_settings=settings,
+        knowledge_version = get_knowledge_version(topic)
+        vectorstore = get_vectorstore(
+            topic,
+            embeddings,
+            get_knowledge_store_directory(topic, knowledge_version),
+            vectorstore_backend,
+            chroma_collection_metadata=self.CHROMA_COLLECTION_METADATA,
         )
 
-        logging.debug("chroma vectorstore initialized")
+        logging.debug(f"{vectorstore_backend} vectorstore initialized")
 
         retriever_cfg = {
             "k": num_similar_docs_to_find,
@@ -135,48 +135,87 @@ class TopicChainOpenAiQuestionAnswerRAG(TopicChain):
             topic=topic,
             chain=retreival_qa_chain,
             vectorstore=vectorstore,
+            knowledge_version=knowledge_version,
+            embeddings=embeddings,
+            vectorstore_backend=vectorstore_backend,
         )
 
-    def store_knowledge(
-        self, documents: list[langchain_classic.schema.document.Document]
-    ) -> None:
+    def run(self, query: str, *args, **kwargs):
         """
-        Delete and replace knowledge store under the topic provided (or default if not provided)
-        with the provided documents.
+        Run the query on the underlying chain, overriding base to add OpenAI specific
+        error catching.
 
-        https://api.python.langchain.com/en/latest/schema/langchain_classic.schema.document.Document.html#langchain-schema-document-document
+        Args:
+            query (str): query to provide to chain
+        """
+        with _raise_for_openai_errors():
+            return super().run(query, *args, **kwargs)
+
+    async def arun(self, query: str, *args, **kwargs):
+        """
+        Run the query on the underlying chain asynchronously, overriding base to add
+        OpenAI specific error catching.
 
         Args:
-            documents (list[langchain_classic.schema.document.Document]): documents to store in the knowledge store
+            query (str): query to provide to chain
         """
-        # get all docs but don't include anything other than ids
-        docs = self.vectorstore.get(include=[])
-        if docs["ids"]:
-            logging.debug(
-                f"Deleting current knowledge store collection for {self.topic}..."
-            )
-            self.vectorstore.delete(ids=docs["ids"])
+        with _raise_for_openai_errors():
+            return await super().arun(query, *args, **kwargs)
 
-        self.insert_documents_into_vectorstore(documents)
+    async def aretrieve(self, query: str, callbacks: list = None):
+        """
+        Run only the retrieval stage asynchronously, overriding base to add OpenAI
+        specific error catching.
 
-    def run(self, query: str, *args, **kwargs):
+        Args:
+            query (str): query to retrieve relevant documents for
+            callbacks (list): langchain callback handlers to attach to the run
         """
-        Run the query on the underlying chain, overriding base to add OpenAI specific
-        error catching.
+        with _raise_for_openai_errors():
+            return await super().aretrieve(query, callbacks=callbacks)
+
+    async def agenerate(self, query: str, documents: list, callbacks: list = None):
+        """
+        Run only the generation stage asynchronously, overriding base to add OpenAI
+        specific error catching.
 
         Args:
             query (str): query to provide to chain
+            documents (list): documents from the retrieval stage
+            callbacks (list): langchain callback handlers to attach to the run
         """
-        try:
-            return super().run(query, *args, **kwargs)
-        except openai.RateLimitError as exc:
-            logging.debug("openai.RateLimitError")
-            raise HTTPException(
-                HTTP_429_TOO_MANY_REQUESTS, "Please try again later."
-            ) from exc
-        except openai.OpenAIError as exc:
-            logging.debug("openai.OpenAIError")
-            raise HTTPException(
-                HTTP_400_BAD_REQUEST,
-                "Error. You may have too much text in your query.",
-            ) from exc
+        with _raise_for_openai_errors():
+            return await super().agenerate(query, documents, callbacks=callbacks)
+
+    async def astream(self, query: str, callbacks: list = None):
+        """
+        Stream the query results from the underlying chain, overriding base to add
+        OpenAI specific error catching.
+
+        Args:
+            query (str): query to provide to chain
+            callbacks (list): langchain callback handlers to attach to the run
+        """
+        with _raise_for_openai_errors():
+            async for item in super().astream(query, callbacks=callbacks):
+                yield item
+
+
+@contextmanager
+def _raise_for_openai_errors():
+    """
+    Convert OpenAI errors raised within the context into appropriate HTTP errors
+    """
+    try:
+        yield
+    except openai.RateLimitError as exc:
+        logging.debug("openai.RateLimitError")
+        raise HTTPException(
+            HTTP_429_TOO_MANY_REQUESTS, "Please try again later."
+        ) from exc
+    except openai.OpenAIError as exc:
+        logging.debug("openai.OpenAIError")
+        raise HTTPException(
+            HTTP_400_BAD_REQUEST,
+            "Error. You may have too much text in your query.",
+        ) from exc
@@ -0,0 +1,539 @@
+"""
+Creating the configured topics' chains and tracking whether each topic is ready.
+
+Creating a topic chain is slow: it opens the topic's persisted vectorstore, and creates
+LLM and embedding clients (which may look up credentials). So chains are created
+concurrently in a pool of threads (`TOPIC_INIT_CONCURRENCY`), and a slow topic doesn't
+hold up the others. `TOPIC_INIT_MODE` controls when:
+
+    - "eager": all topics are created before the service starts accepting requests
+    - "background": the service starts right away while all topics are created, and
+      `/_status` responds 503 until they're done (so readiness probes hold traffic)
+    - "lazy": each topic is created on its first request
+
+Whatever the mode, a request to a topic which isn't ready waits for it to be created,
+and a topic which failed to be created is retried on its next request. Once created,
+each chain is warmed up (see `TopicChain.warm_up`) before its topic is marked ready,
+unless `TOPIC_WARM_UP` is disabled.
+
+Topics can be reconfigured without a restart (see `reload_topics`): the configuration is
+read again and only the topics whose configuration changed are rebuilt, each swapped in
+once its new chain is ready.
+"""
+
+import asyncio
+import gc
+import importlib.util
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from gen3discoveryai import config, logging
+from gen3discoveryai.factory import Factory
+from gen3discoveryai.metrics import get_counter, get_histogram
+from gen3discoveryai.utils import get_topic_chain_factory
+
+TOPIC_INIT_EAGER = "eager"
+TOPIC_INIT_BACKGROUND = "background"
+TOPIC_INIT_LAZY = "lazy"
+TOPIC_INIT_MODES = (TOPIC_INIT_EAGER, TOPIC_INIT_BACKGROUND, TOPIC_INIT_LAZY)
+
+# readiness of each topic
+TOPIC_PENDING = "pending"
+TOPIC_INITIALIZING = "initializing"
+TOPIC_READY = "ready"
+TOPIC_FAILED = "failed"
+
+# settings in `gen3discoveryai.config` for each topic
+_TOPIC_SETTING_SUFFIXES = (
+    "_CHAIN_NAME",
+    "_SYSTEM_PROMPT",
+    "_DESCRIPTION",
+    "_RAW_METADATA",
+    "_METADATA",
+)
+
+_topic_initializer: Optional["TopicInitializer"] = None
+
+
+class TopicInitializer:
+    """
+    Creates the chains for configured topics (at most once at a time per topic) and
+    records each topic's readiness.
+    """
+
+    def __init__(
+        self,
+        chain_factory: Factory,
+        config_topics: Dict[str, Dict[str, Any]],
+        chain_names: Dict[str, str],
+        mode: str = TOPIC_INIT_EAGER,
+        warm_up: bool = None,
+    ) -> None:
+        """
+        Args:
+            chain_factory (Factory): factory with the topic chains registered
+            config_topics (Dict[str, Dict[str, Any]]): each topic's configuration, which
+                its chain is added to (as "topic_chain") once created
+            chain_names (Dict[str, str]): name of each topic's chain in the factory
+            mode (str): one of `TOPIC_INIT_MODES`
+            warm_up (bool): whether to warm up chains before their topic is ready,
+                defaults to `TOPIC_WARM_UP`
+        """
+        if mode not in TOPIC_INIT_MODES:
+            raise ValueError(f"TOPIC_INIT_MODE must be one of {TOPIC_INIT_MODES}")
+
+        self.chain_factory = chain_factory
+        self.config_topics = config_topics
+        self.chain_names = chain_names
+        self.mode = mode
+        self.warm_up = config.TOPIC_WARM_UP if warm_up is None else warm_up
+        self._statuses = {
+            topic: {"status": TOPIC_PENDING, "seconds": None, "error": None}
+            for topic in chain_names
+        }
+        self._locks = {topic: threading.Lock() for topic in chain_names}
+        # one reload at a time
+        self._reload_lock = threading.Lock()
+        self.init_seconds = get_histogram(
+            "topic_init_seconds", "Time to create and warm up a topic's chain"
+        )
+        self.reloads = get_counter(
+            "topic_reloads_total", "Topics rebuilt, added, or removed by config reloads"
+        )
+
+    def initialize(self, topic: str) -> Any:
+        """
+        Create (and warm up) the topic's chain, unless it already exists. If the
+        topic is being created by another thread, this waits for it instead.
+
+        Args:
+            topic (str): the topic
+
+        Returns:
+            TopicChain: the topic's chain
+
+        Raises:
+            Exception: whatever creating or warming up the chain raised
+        """
+        with self._locks[topic]:
+            # the configuration may be replaced by a reload, but not while this is held
+            topic_config = self.config_topics[topic]
+            topic_chain = topic_config.get("topic_chain")
+            if topic_chain is not None:
+                return topic_chain
+
+            self._set_status(topic, TOPIC_INITIALIZING)
+            start = time.perf_counter()
+            try:
+                topic_chain = self._create_chain(
+                    topic, self.chain_names[topic], topic_config
+                )
+            except Exception as exc:
+                self._set_status(
+                    topic, TOPIC_FAILED, time.perf_counter() - start, repr(exc)
+                )
+                raise
+
+            seconds = time.perf_counter() - start
+            topic_config["topic_chain"] = topic_chain
+            self._set_status(topic, TOPIC_READY, seconds)
+            self.init_seconds.observe(seconds, topic=topic)
+            logging.info(f"Topic `{topic}` ready in {seconds:.2f}s")
+            return topic_chain
+
+    async def ainitialize(self, topic: str) -> Any:
+        """
+        Return the topic's chain, creating it in a thread first if necessary (see
+        `initialize`)
+        """
+        topic_chain = self.config_topics[topic].get("topic_chain")
+        if topic_chain is not None:
+            return topic_chain
+        return await asyncio.to_thread(self.initialize, topic)
+
+    def initialize_all(
+        self, topics: Iterable[str] = None, concurrency: int = None
+    ) -> Dict[str, Exception]:
+        """
+        Create the topics' chains concurrently, logging any which fail
+
+        Args:
+            topics (Iterable[str]): topics to create, defaults to all of them
+            concurrency (int): chains created at once, defaults to
+                `TOPIC_INIT_CONCURRENCY`
+
+        Returns:
+            Dict[str, Exception]: the error for each topic which failed
+        """
+        topics = list(self.chain_names if topics is None else topics)
+        _, errors = _run_concurrently(
+            self.initialize, {topic: (topic,) for topic in topics}, concurrency
+        )
+        for topic, exc in errors.items():
+            logging.error(
+                f"Unable to create the `{self.chain_names[topic]}` chain for "
+                f"topic `{topic}`. Exception: {exc!r}",
+                exc_info=exc,
+            )
+        return errors
+
+    def reload(
+        self,
+        config_topics: Dict[str, Dict[str, Any]],
+        chain_names: Dict[str, str],
+        concurrency: int = None,
+    ) -> Dict[str, Any]:
+        """
+        Switch to new topic configurations, rebuilding only the topics whose
+        configuration (or chain) changed.
+
+        New chains are created concurrently, and each is swapped in once it's ready,
+        so requests keep being answered by the current chain until then (and requests
+        already in progress finish with it). Unchanged topics keep their chains, along
+        with their open vectorstores and clients. A topic whose new chain can't be
+        created keeps its current configuration (and a new one isn't added).
+
+        When topics are created lazily, new topics and changed topics whose chain
+        hasn't been created yet are created on their first request instead. Otherwise
+        they're all created here, including changed topics which previously failed.
+
+        Args:
+            config_topics (Dict[str, Dict[str, Any]]): each topic's new configuration
+                (without a "topic_chain")
+            chain_names (Dict[str, str]): name of each topic's chain in the factory
+            concurrency (int): chains created at once, defaults to
+                `TOPIC_INIT_CONCURRENCY`
+
+        Returns:
+            Dict[str, Any]: topics which were "added", "changed", "removed", and
+                "unchanged", and the "errors" for those which couldn't be rebuilt
+        """
+        with self._reload_lock:
+            added = [topic for topic in chain_names if topic not in self.chain_names]
+            removed = [topic for topic in self.chain_names if topic not in chain_names]
+            changed = []
+            unchanged = []
+            for topic in chain_names:
+                if topic in added:
+                    continue
+                if (chain_names[topic], config_topics[topic]) == (
+                    self.chain_names[topic],
+                    _without_chain(self.config_topics.get(topic, {})),
+                ):
+                    unchanged.append(topic)
+                else:
+                    changed.append(topic)
+
+            new_configs = {
+                topic: dict(config_topics[topic]) for topic in added + changed
+            }
+            to_create = [
+                topic
+                for topic in added + changed
+                if self.mode != TOPIC_INIT_LAZY
+                or self.config_topics.get(topic, {}).get("topic_chain") is not None
+            ]
+            timed_chains, errors = _run_concurrently(
+                self._create_timed_chain,
+                {
+                    topic: (topic, chain_names[topic], new_configs[topic])
+                    for topic in to_create
+                },
+                concurrency,
+            )
+
+            for topic in removed:
+                self._remove_topic(topic)
+
+            for topic, topic_config in new_configs.items():
+                if topic in errors:
+                    logging.error(
+                        f"Unable to create the `{chain_names[topic]}` chain for "
+                        f"topic `{topic}`, keeping its current configuration. "
+                        f"Exception: {errors[topic]!r}",
+                        exc_info=errors[topic],
+                    )
+                    continue
+
+                topic_chain, seconds = timed_chains.get(topic, (None, None))
+                if topic_chain is not None:
+                    topic_config["topic_chain"] = topic_chain
+                    self.init_seconds.observe(seconds, topic=topic)
+                self._replace_topic(
+                    topic,
+                    topic_config,
+                    chain_names[topic],
+                    status=TOPIC_PENDING if topic_chain is None else TOPIC_READY,
+                    seconds=seconds,
+                )
+                self.reloads.inc(
+                    topic=topic, change="added" if topic in added else "changed"
+                )
+
+            for topic in removed:
+                self.reloads.inc(topic=topic, change="removed")
+
+        result = {
+            "added": [topic for topic in added if topic not in errors],
+            "changed": [topic for topic in changed if topic not in errors],
+            "removed": removed,
+            "unchanged": unchanged,
+            "errors": {topic: repr(exc) for topic, exc in errors.items()},
+        }
+        logging.info(f"Reloaded topics: {result}")
+        return result
+
+    def get_statuses(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Readiness of each topic
+
+        Returns:
+            Dict[str, Dict[str, Any]]: topic -> {"status": one of pending, initializing,
+                ready, or failed, "seconds": time it took to create (or fail), "error":
+                why it failed}
+        """
+        return {topic: dict(status) for topic, status in self._statuses.items()}
+
+    def is_ready(self) -> bool:
+        """
+        Whether the service is ready for traffic: every topic was created (or failed
+        to be), unless topics are created lazily on their first request
+        """
+        return self.mode == TOPIC_INIT_LAZY or all(
+            status["status"] in (TOPIC_READY, TOPIC_FAILED)
+            for status in self._statuses.values()
+        )
+
+    def _set_status(
+        self, topic: str, status: str, seconds: float = None, error: str = None
+    ) -> None:
+        self._statuses[topic] = {"status": status, "seconds": seconds, "error": error}
+
+    def _create_chain(
+        self, topic: str, chain_name: str, topic_config: Dict[str, Any]
+    ) -> Any:
+        topic_chain = self.chain_factory.get(
+            chain_name, topic=topic, metadata=topic_config
+        )
+        if self.warm_up and callable(getattr(topic_chain, "warm_up", None)):
+            topic_chain.warm_up()
+        return topic_chain
+
+    def _create_timed_chain(
+        self, topic: str, chain_name: str, topic_config: Dict[str, Any]
+    ) -> Tuple[Any, float]:
+        start = time.perf_counter()
+        topic_chain = self._create_chain(topic, chain_name, topic_config)
+        return topic_chain, time.perf_counter() - start
+
+    def _replace_topic(
+        self,
+        topic: str,
+        topic_config: Dict[str, Any],
+        chain_name: str,
+        status: str,
+        seconds: float = None,
+    ) -> None:
+        with self._locks.setdefault(topic, threading.Lock()):
+            # known before it's listed in the topics, so requests can create it
+            self.chain_names[topic] = chain_name
+            self._set_status(topic, status, seconds)
+            # requests in progress keep their reference to the previous configuration
+            self.config_topics[topic] = topic_config
+
+    def _remove_topic(self, topic: str) -> None:
+        with self._locks[topic]:
+            self.config_topics.pop(topic, None)
+            self.chain_names.pop(topic, None)
+            self._statuses.pop(topic, None)
+
+
+def get_topic_initializer() -> Optional[TopicInitializer]:
+    """
+    Return the initializer for the configured topics, None if topics haven't been
+    configured (see `gen3discoveryai.main.get_topics_from_config`)
+    """
+    return _topic_initializer
+
+
+def set_topic_initializer(topic_initializer: Optional[TopicInitializer]) -> None:
+    """
+    Set the initializer for the configured topics
+    """
+    global _topic_initializer
+    _topic_initializer = topic_initializer
+
+
+def preload_topics() -> None:
+    """
+    Import the configured topics' chains (and their providers' dependencies) without
+    creating them, e.g. in gunicorn's master process before its workers are forked
+    (see `GUNICORN_PRELOAD_APP`). The workers then share the imported modules' memory
+    copy-on-write instead of each importing them.
+
+    The chains themselves are created in each worker: their Chroma clients, HTTP
+    connection pools, and gRPC channels can't be used from a forked process (see
+    `gen3discoveryai.topic_chains.base._reset_after_fork`). Everything imported is
+    frozen, so the workers' garbage collection doesn't write to (and copy) the pages
+    it's on.
+    """
+    chain_factory = get_topic_chain_factory()
+    _, chain_names, _ = get_topic_configs()
+    for chain_name in sorted(set(chain_names.values())):
+        try:
+            chain_factory.get_class(chain_name)
+        except Exception as exc:
+            # workers report this when they create the topic
+            logging.warning(f"Unable to preload `{chain_name}`. Exception: {exc!r}")
+
+    gc.collect()
+    gc.freeze()
+    logging.info(f"Preloaded topic chains: {sorted(set(chain_names.values()))}")
+
+
+def get_topic_configs(
+    settings: ModuleType = config,
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str], Dict[str, Dict[str, Any]]]:
+    """
+    Get each topic's configuration (without its chain) from the settings.
+
+    Args:
+        settings (ModuleType): the configuration, `gen3discoveryai.config` or a
+            newer one from `read_config`
+
+    Returns:
+        Tuple[Dict[str, Dict[str, Any]], Dict[str, str], Dict[str, Dict[str, Any]]]:
+            each topic's configuration, the name of its chain, and its raw configuration
+    """
+    config_topics = {}
+    chain_names = {}
+    topic_raw_cfgs = {}
+
+    for topic in settings.TOPICS.split(","):
+        description_config_key = f"{topic.upper()}_DESCRIPTION"
+        chain_config_key = f"{topic.upper()}_CHAIN_NAME"
+        system_prompt_config_key = f"{topic.upper()}_SYSTEM_PROMPT"
+        metadata_config_key = f"{topic.upper()}_METADATA"
+
+        description_config_value = getattr(settings, description_config_key, "")
+        chain_config_value = getattr(settings, chain_config_key, "")
+        system_prompt_config_value = getattr(settings, system_prompt_config_key, "")
+        metadata_config_value = getattr(settings, metadata_config_key, "")
+
+        topic_raw_cfg = {
+            "description": description_config_value,
+            "topic_chain": chain_config_value,
+            "system_prompt": system_prompt_config_value,
+            "metadata": metadata_config_value,
+        }
+        topic_raw_cfgs[topic] = topic_raw_cfg
+
+        try:
+            config_topics[topic] = {
+                "description": topic_raw_cfg["description"],
+                "system_prompt": topic_raw_cfg["system_prompt"],
+            }
+            config_topics[topic].update(topic_raw_cfg["metadata"])
+            chain_names[topic] = topic_raw_cfg["topic_chain"]
+
+            logging.info(f"Added topic `{topic}`")
+            logging.debug(f"`{topic}` configuration: `{topic_raw_cfg}`")
+        except Exception as exc:
+            logging.error(
+                f"Unable to load `{topic}` configuration with: {topic_raw_cfg}. "
+                f"Exception: {exc}. Traceback: {traceback.format_exc()}"
+            )
+            config_topics.pop(topic, None)
+
+            # we want to error early if this is the default topic, but if not, log the error and try to continue
+            if topic == "default":
+                raise
+
+            continue
+
+    return config_topics, chain_names, topic_raw_cfgs
+
+
+def read_config() -> ModuleType:
+    """
+    Read the configuration again (e.g. after the `.env` file changed) without changing
+    the configuration in use
+
+    Returns:
+        ModuleType: a new module with the same settings as `gen3discoveryai.config`
+    """
+    spec = importlib.util.find_spec(config.__name__)
+    settings = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(settings)
+    return settings
+
+
+async def reload_topics() -> Dict[str, Any]:
+    """
+    Read the topic configuration again and switch to it, rebuilding only the topics
+    whose configuration changed (see `TopicInitializer.reload`). Creating chains
+    happens in threads, so requests keep being answered while they're created.
+
+    Returns:
+        Dict[str, Any]: topics which were "added", "changed", "removed", and
+            "unchanged", and the "errors" for those which couldn't be rebuilt
+
+    Raises:
+        RuntimeError: if topics haven't been configured yet
+        Exception: whatever reading the configuration raised (nothing is changed)
+    """
+    topic_initializer = get_topic_initializer()
+    if not topic_initializer:
+        raise RuntimeError("topics haven't been configured yet")
+
+    settings = await asyncio.to_thread(read_config)
+    config_topics, chain_names, _ = get_topic_configs(settings)
+    result = await asyncio.to_thread(
+        topic_initializer.reload, config_topics, chain_names
+    )
+
+    # so the configuration in use matches the topics
+    config.TOPICS = settings.TOPICS
+    for name in dir(settings):
+        if name.endswith(_TOPIC_SETTING_SUFFIXES):
+            setattr(config, name, getattr(settings, name))
+
+    return result
+
+
+def _without_chain(topic_config: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in topic_config.items() if key != "topic_chain"}
+
+
+def _run_concurrently(
+    func: Callable, args_by_topic: Dict[str, tuple], concurrency: int = None
+) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """
+    Call `func` for each topic in a pool of threads (at most `concurrency`, defaults to
+    `TOPIC_INIT_CONCURRENCY`), returning each topic's result and the errors raised
+    """
+    if not args_by_topic:
+        return {}, {}
+
+    concurrency = max(concurrency or config.TOPIC_INIT_CONCURRENCY, 1)
+    with ThreadPoolExecutor(
+        max_workers=min(concurrency, len(args_by_topic)),
+        thread_name_prefix="topic_init",
+    ) as executor:
+        futures = {
+            topic: executor.submit(func, *args) for topic, args in args_by_topic.items()
+        }
+
+    results = {}
+    errors = {}
+    for topic, future in futures.items():
+        exc = future.exception()
+        if exc is not None:
+            errors[topic] = exc
+        else:
+            results[topic] = future.result()
+    return results, errors
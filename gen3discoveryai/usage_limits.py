@@ -0,0 +1,637 @@
+"""
+Per-user usage limits for AI requests.
+
+Every user (the token's `sub`, or the client address for anonymous access) has two
+budgets per topic over a sliding window of `USER_LIMIT_WINDOW_SECONDS`:
+
+    - requests: the number of AI requests
+    - LLM tokens: the number of tokens the LLM used to answer their requests
+
+Topics can override the budgets in their metadata (e.g. in `{TOPIC}_RAW_METADATA`)
+with `user_request_limit` and `user_llm_token_limit`.
+
+Usage is counted with a sliding window counter (the current and previous fixed windows,
+weighted by how far we are into the current one) in a store shared by all workers:
+
+    - `memory`: per-process, for a single worker or local development
+    - `sqlite`: a database file shared by all workers on a host
+    - `redis`: any server speaking the Redis protocol, shared by all hosts
+
+Each process also keeps a local tier in front of the store. Users who are well under
+their limits are decided locally and their usage is flushed to the store in batches,
+and users who are over a limit are rejected locally until the window frees up, so
+most checks don't need a round trip to the store. This means limits can be exceeded
+slightly (by at most the unflushed usage of each process).
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_classic.callbacks.base import BaseCallbackHandler
+from langchain_classic.schema import LLMResult
+
+from gen3discoveryai import config, logging
+from gen3discoveryai.metrics import get_counter
+from gen3discoveryai.topic_chains.utils import get_from_cfg_metadata
+
+REQUESTS = "requests"
+LLM_TOKENS = "tokens"
+
+_usage_limiter = None
+
+
+class InMemoryCounterStore:
+    """
+    Per-process counters with expiration
+    """
+
+    def __init__(self) -> None:
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def sync(
+        self, increments: Dict[str, int], reads: List[str], ttl: int
+    ) -> Dict[str, int]:
+        """
+        Atomically increment counters and read the current value of others
+
+        Args:
+            increments (dict): counter key to amount to increment by
+            reads (list): counter keys to read
+            ttl (int): seconds until incremented counters expire
+
+        Returns:
+            dict: counter key to its current value for all provided keys
+        """
+        now = time.time()
+        values = {}
+        with self._lock:
+            for key, amount in increments.items():
+                value, expires_at = self._counters.get(key, (0, 0))
+                if expires_at <= now:
+                    value = 0
+                self._counters[key] = (value + amount, now + ttl)
+                values[key] = value + amount
+
+            for key in reads:
+                value, expires_at = self._counters.get(key, (0, 0))
+                values[key] = value if expires_at > now else 0
+
+            for key in [
+                key
+                for key, (_, expires_at) in self._counters.items()
+                if expires_at <= now
+            ]:
+                del self._counters[key]
+        return values
+
+
+class SQLiteCounterStore:
+    """
+    Counters with expiration in a database file. Multiple processes can safely use
+    the same file, so all gunicorn workers share usage.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(
+            path, timeout=10, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS counters_expires_at ON counters (expires_at)"
+        )
+
+    def sync(
+        self, increments: Dict[str, int], reads: List[str], ttl: int
+    ) -> Dict[str, int]:
+        """
+        Atomically increment counters and read the current value of others
+
+        Args:
+            increments (dict): counter key to amount to increment by
+            reads (list): counter keys to read
+            ttl (int): seconds until incremented counters expire
+
+        Returns:
+            dict: counter key to its current value for all provided keys
+        """
+        now = time.time()
+        keys = list(increments) + list(reads)
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "DELETE FROM counters WHERE expires_at <= ?", (now,)
+                )
+                self._connection.executemany(
+                    "INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET "
+                    "value = value + excluded.value, expires_at = excluded.expires_at",
+                    [(key, amount, now + ttl) for key, amount in increments.items()],
+                )
+                rows = self._connection.execute(
+                    "SELECT key, value FROM counters WHERE key IN "
+                    f"({','.join('?' * len(keys))})",
+                    keys,
+                ).fetchall()
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+        values = dict.fromkeys(keys, 0)
+        values.update(rows)
+        return values
+
+
+class RedisCounterStore:
+    """
+    Counters in a server speaking the Redis protocol, shared by all hosts.
+    Each sync is a single round trip (a MULTI/EXEC pipeline).
+
+    The client only needs `pipeline()` returning an object with `incrby`, `expire`,
+    `get`, and `execute` (e.g. `redis.Redis` or a local fake).
+    """
+
+    def __init__(self, client: Any) -> None:
+        self.client = client
+
+    def sync(
+        self, increments: Dict[str, int], reads: List[str], ttl: int
+    ) -> Dict[str, int]:
+        """
+        Atomically increment counters and read the current value of others
+
+        Args:
+            increments (dict): counter key to amount to increment by
+            reads (list): counter keys to read
+            ttl (int): seconds until incremented counters expire
+
+        Returns:
+            dict: counter key to its current value for all provided keys
+        """
+        pipeline = self.client.pipeline()
+        for key, amount in increments.items():
+            pipeline.incrby(key, amount)
+            pipeline.expire(key, ttl)
+        for key in reads:
+            pipeline.get(key)
+        results = pipeline.execute()
+
+        values = {}
+        for index, key in enumerate(increments):
+            values[key] = int(results[index * 2])
+        for index, key in enumerate(reads):
+            values[key] = int(results[len(increments) * 2 + index] or 0)
+        return values
+
+
+@dataclass
+class LimitDecision:
+    """
+    Outcome of checking a budget
+    """
+
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_seconds: float
+
+
+@dataclass
+class _LocalState:
+    """
+    What this process knows about a counter in the current window
+    """
+
+    window: int
+    current: int = 0
+    previous: int = 0
+    pending: int = 0
+    synced_at: float = 0.0
+    blocked_until: float = 0.0
+
+
+class SlidingWindowLimiter:
+    """
+    Sliding window counters in a shared store with a per-process local tier
+    """
+
+    def __init__(
+        self,
+        store: Any,
+        window_seconds: float,
+        local_sync_seconds: float = 1.0,
+        local_fraction: float = 0.8,
+    ) -> None:
+        self.store = store
+        self.window_seconds = window_seconds
+        # how stale the local view can be and how close to the limit (as a fraction)
+        # it can decide without syncing with the store
+        self.local_sync_seconds = local_sync_seconds
+        self.local_fraction = local_fraction
+        self._local = {}
+        # window the local tier was last pruned in
+        self._pruned_window = None
+        self._lock = threading.Lock()
+        self.store_syncs = get_counter(
+            "usage_limit_store_syncs_total",
+            "Usage limit checks which needed a round trip to the shared store",
+        )
+        self.local_decisions = get_counter(
+            "usage_limit_local_decisions_total",
+            "Usage limit checks decided by the in-process tier",
+        )
+
+    def check(
+        self, key: str, limit: int, amount: int = 1, now: float = None
+    ) -> LimitDecision:
+        """
+        Consume `amount` from the budget if the result stays within `limit`
+
+        Args:
+            key (str): identifies the budget (e.g. user, topic, and kind)
+            limit (int): max usage within a window
+            amount (int): usage to consume, 0 to only check there's budget left
+            now (float): current time (for testing)
+
+        Returns:
+            LimitDecision: whether it's allowed and what's remaining
+        """
+        now = now or time.time()
+        with self._lock:
+            state = self._get_state(key, now)
+
+            if state.blocked_until > now:
+                self.local_decisions.inc()
+                return self._decision(False, state, limit, amount, now)
+
+            usage = self._estimate(state, now) + amount
+            if (
+                now - state.synced_at < self.local_sync_seconds
+                and usage <= limit * self.local_fraction
+            ):
+                state.pending += amount
+                self.local_decisions.inc()
+                return self._decision(True, state, limit, 0, now)
+
+        self._sync(key, state, amount, now)
+        with self._lock:
+            usage = self._estimate(state, now)
+            # when only checking (amount 0), there must be something left
+            if usage <= limit if amount else usage < limit:
+                return self._decision(True, state, limit, 0, now)
+
+        # over the limit, give back what was consumed and reject locally until
+        # enough of the window has passed
+        if amount:
+            self._sync(key, state, -amount, now)
+        with self._lock:
+            decision = self._decision(False, state, limit, amount, now)
+            state.blocked_until = now + decision.reset_seconds
+        return decision
+
+    def record(self, key: str, limit: int, amount: int, now: float = None) -> None:
+        """
+        Consume `amount` from the budget regardless of the limit (e.g. LLM tokens
+        which are only known after the request)
+
+        Args:
+            key (str): identifies the budget
+            limit (int): max usage within a window
+            amount (int): usage to consume
+            now (float): current time (for testing)
+        """
+        now = now or time.time()
+        with self._lock:
+            state = self._get_state(key, now)
+            state.pending += amount
+            if (
+                now - state.synced_at < self.local_sync_seconds
+                and self._estimate(state, now) <= limit * self.local_fraction
+            ):
+                return
+
+        self._sync(key, state, 0, now)
+
+    def _get_state(self, key: str, now: float) -> _LocalState:
+        window = int(now // self.window_seconds)
+        if window != self._pruned_window:
+            self._prune(window)
+
+        state = self._local.get(key)
+        if state is None or state.window != window:
+            # pending usage from the previous window is lost, which is fine since
+            # it'd only count partially anyway
+            previous = state.current if state and state.window == window - 1 else 0
+            state = _LocalState(window=window, previous=previous)
+            self._local[key] = state
+        return state
+
+    def _prune(self, window: int) -> None:
+        """
+        Forget the local state of counters which weren't used in the current or the
+        previous window (e.g. anonymous users' addresses), since it's never read
+        again, so the local tier doesn't grow with every key ever seen
+        """
+        for key in [
+            key for key, state in self._local.items() if state.window < window - 1
+        ]:
+            del self._local[key]
+        self._pruned_window = window
+
+    def _sync(self, key: str, state: _LocalState, amount: int, now: float) -> None:
+        """
+        Flush pending usage (plus `amount`) to the store and refresh the local view
+        """
+        with self._lock:
+            increment = state.pending + amount
+            state.pending = 0
+
+        current_key = f"{key}:{state.window}"
+        previous_key = f"{key}:{state.window - 1}"
+        self.store_syncs.inc()
+        try:
+            values = self.store.sync(
+                {current_key: increment} if increment else {},
+                [previous_key] + ([] if increment else [current_key]),
+                ttl=math.ceil(self.window_seconds * 2),
+            )
+        except Exception as exc:
+            # limits are a safeguard, fall back to this process's view of usage
+            # rather than failing every request while the store is unavailable
+            logging.error(f"unable to sync usage with store, exc: {exc}")
+            with self._lock:
+                state.current += increment
+                state.synced_at = now
+            return
+
+        with self._lock:
+            state.current = values[current_key]
+            state.previous = values[previous_key]
+            state.synced_at = now
+
+    def _estimate(self, state: _LocalState, now: float) -> float:
+        elapsed = (now % self.window_seconds) / self.window_seconds
+        return state.previous * (1 - elapsed) + state.current + state.pending
+
+    def _decision(
+        self, allowed: bool, state: _LocalState, limit: int, amount: int, now: float
+    ) -> LimitDecision:
+        usage = self._estimate(state, now)
+        window_end = (state.window + 1) * self.window_seconds
+
+        if usage + amount <= limit:
+            reset_seconds = 0.0
+        else:
+            # when will the previous window's weight have dropped enough
+            needed = usage + amount - limit
+            reset_seconds = window_end - now
+            if state.previous and needed <= state.previous * (
+                1 - (now % self.window_seconds) / self.window_seconds
+            ):
+                reset_seconds = needed / state.previous * self.window_seconds
+
+        return LimitDecision(
+            allowed=allowed,
+            limit=limit,
+            remaining=max(int(limit - usage), 0),
+            reset_seconds=max(reset_seconds, 0.0),
+        )
+
+
+class UsageLimiter:
+    """
+    Checks and records each user's request and LLM token budgets for a topic
+    """
+
+    def __init__(self, limiter: SlidingWindowLimiter) -> None:
+        self.limiter = limiter
+        self.rejected = get_counter(
+            "usage_limit_rejected_total",
+            "Requests rejected because the user exceeded a usage limit",
+        )
+
+    def check(
+        self, user: str, topic: str, topic_config: Optional[Dict[str, Any]]
+    ) -> Dict[str, LimitDecision]:
+        """
+        Consume one request from the user's budget for the topic if they have both
+        requests and LLM tokens remaining
+
+        Args:
+            user (str): user identifier
+            topic (str): topic name
+            topic_config (dict): the topic's configuration from `config.topics`
+
+        Returns:
+            dict: budget kind (`REQUESTS`/`LLM_TOKENS`) to its decision
+        """
+        request_limit, token_limit = get_user_limits(topic_config)
+
+        # check tokens first (without consuming) so a request isn't used up if
+        # there are no tokens left to answer it
+        decisions = {
+            LLM_TOKENS: self.limiter.check(
+                _get_key(LLM_TOKENS, topic, user), token_limit, amount=0
+            )
+        }
+        if decisions[LLM_TOKENS].allowed:
+            decisions[REQUESTS] = self.limiter.check(
+                _get_key(REQUESTS, topic, user), request_limit, amount=1
+            )
+        else:
+            decisions[REQUESTS] = self.limiter.check(
+                _get_key(REQUESTS, topic, user), request_limit, amount=0
+            )
+            decisions[REQUESTS].allowed = False
+
+        for kind, decision in decisions.items():
+            if not decision.allowed:
+                self.rejected.inc(topic=topic, budget=kind)
+                break
+
+        return decisions
+
+    def record_llm_tokens(
+        self,
+        user: str,
+        topic: str,
+        topic_config: Optional[Dict[str, Any]],
+        tokens: int,
+    ) -> None:
+        """
+        Consume LLM tokens used to answer the user's request from their budget
+
+        Args:
+            user (str): user identifier
+            topic (str): topic name
+            topic_config (dict): the topic's configuration from `config.topics`
+            tokens (int): number of tokens used
+        """
+        _, token_limit = get_user_limits(topic_config)
+        self.limiter.record(_get_key(LLM_TOKENS, topic, user), token_limit, tokens)
+
+
+class LLMTokenUsageCallbackHandler(BaseCallbackHandler):
+    """
+    Adds up the tokens reported by the LLM provider for all LLM calls in a run
+    """
+
+    def __init__(self) -> None:
+        self.total_tokens = 0
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        """Add the tokens used by this LLM call."""
+        tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(
+                    getattr(generation, "message", None), "usage_metadata", None
+                )
+                if usage:
+                    tokens += usage.get("total_tokens", 0)
+
+        if not tokens:
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            tokens = token_usage.get("total_tokens", 0)
+
+        self.total_tokens += tokens
+
+
+def estimate_tokens(*texts: str) -> int:
+    """
+    Rough token count for when the provider doesn't report usage (~4 chars per token)
+
+    Args:
+        *texts (str): all text sent to and received from the LLM
+
+    Returns:
+        int: estimated number of tokens
+    """
+    return math.ceil(sum(len(text or "") for text in texts) / 4)
+
+
+def get_user_limits(topic_config: Optional[Dict[str, Any]]) -> Tuple[int, int]:
+    """
+    Return the request and LLM token budgets per window for the topic
+
+    Args:
+        topic_config (dict): the topic's configuration from `config.topics`
+
+    Returns:
+        Tuple[int, int]: request limit and LLM token limit
+    """
+    topic_config = topic_config or {}
+    return (
+        get_from_cfg_metadata(
+            "user_request_limit",
+            topic_config,
+            default=config.USER_REQUEST_LIMIT,
+            type_=int,
+        ),
+        get_from_cfg_metadata(
+            "user_llm_token_limit",
+            topic_config,
+            default=config.USER_LLM_TOKEN_LIMIT,
+            type_=int,
+        ),
+    )
+
+
+def get_usage_limiter() -> Optional[UsageLimiter]:
+    """
+    Return the configured usage limiter (creating it if necessary) or None if usage
+    limits are disabled.
+
+    Returns:
+        UsageLimiter: configured limiter
+    """
+    global _usage_limiter
+
+    if not config.USER_LIMITS_ENABLED:
+        return None
+
+    if _usage_limiter is None:
+        if config.USER_LIMITS_BACKEND == "sqlite":
+            store = SQLiteCounterStore(config.USER_LIMITS_SQLITE_PATH)
+        elif config.USER_LIMITS_BACKEND == "redis":
+            try:
+                import redis  # pylint: disable=import-outside-toplevel
+            except ImportError as exc:
+                raise ValueError(
+                    "USER_LIMITS_BACKEND is `redis` but the `redis` package is not "
+                    "installed. Install it with: pip install redis"
+                ) from exc
+            store = RedisCounterStore(
+                redis.Redis.from_url(str(config.USER_LIMITS_REDIS_URL))
+            )
+        elif config.USER_LIMITS_BACKEND == "memory":
+            store = InMemoryCounterStore()
+        else:
+            raise ValueError(
+                f"Unknown USER_LIMITS_BACKEND: {config.USER_LIMITS_BACKEND}. "
+                "Must be one of: memory, sqlite, redis"
+            )
+
+        logging.info(f"using `{config.USER_LIMITS_BACKEND}` usage limit store")
+        _usage_limiter = UsageLimiter(
+            SlidingWindowLimiter(
+                store,
+                window_seconds=config.USER_LIMIT_WINDOW_SECONDS,
+                local_sync_seconds=config.USER_LIMITS_LOCAL_SYNC_SECONDS,
+            )
+        )
+
+    return _usage_limiter
+
+
+def _reset_after_fork() -> None:
+    """
+    Forked processes (e.g. gunicorn workers forked from a preloaded master) create
+    their own usage limiter, since a SQLite connection can't be shared with them
+    """
+    global _usage_limiter
+    _usage_limiter = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_usage_headers(decisions: Dict[str, LimitDecision]) -> Dict[str, str]:
+    """
+    Response headers describing the remaining quota
+
+    Args:
+        decisions (dict): from `UsageLimiter.check`
+
+    Returns:
+        dict: header name to value
+    """
+    headers = {}
+    for kind, decision in decisions.items():
+        name = "Requests" if kind == REQUESTS else "Tokens"
+        headers[f"X-RateLimit-Limit-{name}"] = str(decision.limit)
+        headers[f"X-RateLimit-Remaining-{name}"] = str(decision.remaining)
+        headers[f"X-RateLimit-Reset-{name}"] = str(math.ceil(decision.reset_seconds))
+    return headers
+
+
+def _get_key(kind: str, topic: str, user: str) -> str:
+    return f"usage:{kind}:{topic}:{user}"
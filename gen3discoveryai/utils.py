@@ -1,11 +1,22 @@
 from gen3discoveryai.factory import Factory
-from gen3discoveryai.topic_chains import (
-    TopicChainGoogleQuestionAnswerRAG,
-    TopicChainOllamaQuestionAnswerRAG,
-    TopicChainOpenAiQuestionAnswerRAG,
-)
 
-# ... import more here as implemented
+# chain name -> dotted path of the chain class. Chains are registered by path so a
+# provider's dependencies are only imported when a topic uses one of its chains.
+TOPIC_CHAINS = {
+    "TopicChainOpenAiQuestionAnswerRAG": (
+        "gen3discoveryai.topic_chains.question_answer_openai."
+        "TopicChainOpenAiQuestionAnswerRAG"
+    ),
+    "TopicChainGoogleQuestionAnswerRAG": (
+        "gen3discoveryai.topic_chains.question_answer_google."
+        "TopicChainGoogleQuestionAnswerRAG"
+    ),
+    "TopicChainOllamaQuestionAnswerRAG": (
+        "gen3discoveryai.topic_chains.question_answer_ollama."
+        "TopicChainOllamaQuestionAnswerRAG"
+    ),
+    # ... add more here as implemented
+}
 
 
 def get_topic_chain_factory():
@@ -16,17 +27,6 @@ def get_topic_chain_factory():
         gen3discoveryai.factory.Factory: A factory class with all the allowed topic chains registered
     """
     chain_factory = Factory()
-    chain_factory.register(
-        TopicChainOpenAiQuestionAnswerRAG.NAME,
-        TopicChainOpenAiQuestionAnswerRAG,
-    )
-    chain_factory.register(
-        TopicChainGoogleQuestionAnswerRAG.NAME,
-        TopicChainGoogleQuestionAnswerRAG,
-    )
-    chain_factory.register(
-        TopicChainOllamaQuestionAnswerRAG.NAME,
-        TopicChainOllamaQuestionAnswerRAG,
-    )
-    # ... register more here as implemented
+    for chain_name, dotted_path in TOPIC_CHAINS.items():
+        chain_factory.register(chain_name, dotted_path)
     return chain_factory
@@ -0,0 +1,643 @@
+"""
+Vectorstore backends for topics' knowledge stores, selected per topic via the
+topic's metadata (e.g. in `{TOPIC}_RAW_METADATA`):
+
+    - `vectorstore:chroma` (default) a persisted Chroma collection with an HNSW index
+    - `vectorstore:numpy` an exact-search store of normalized float32 vectors in a
+      memory-mapped `.npy` file (see `NumpyVectorStore`)
+
+For small and medium topics (up to tens of thousands of chunks) comparing a query with
+every stored vector in one matrix product is fast, exact, and has nothing to build or
+load at startup. Since the vectors are memory-mapped, processes using the same knowledge
+store (like gunicorn workers) share one copy of them in the OS page cache.
+
+Topic chains create, warm up, and close their vectorstores with `get_vectorstore`,
+`warm_up_vectorstore`, and `close_vectorstore`, so they don't depend on the backend.
+"""
+
+import io
+import itertools
+import json
+import os
+import threading
+import uuid
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from gen3discoveryai import logging
+from gen3discoveryai.topic_chains.utils import get_from_cfg_metadata
+
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+
+VECTORSTORE_CHROMA = "chroma"
+VECTORSTORE_NUMPY = "numpy"
+VECTORSTORE_BACKENDS = (VECTORSTORE_CHROMA, VECTORSTORE_NUMPY)
+
+
+class _NumpyIndex(NamedTuple):
+    """
+    Everything a search reads, replaced as a whole when the store is written so
+    searches never see a partial update
+    """
+
+    vectors: np.ndarray
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[Dict[str, Any]]
+    # bytes of the documents file holding the rows in `vectors`
+    documents_size: int
+
+    def get_document(self, row: int) -> Document:
+        return Document(
+            id=self.ids[row],
+            page_content=self.documents[row],
+            metadata=dict(self.metadatas[row]),
+        )
+
+
+_EMPTY_INDEX = _NumpyIndex(np.zeros((0, 0), dtype=np.float32), [], [], [], 0)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Exact cosine similarity search over normalized float32 vectors, persisted in a
+    directory as:
+
+        {collection_name}.npy    <- vectors, one row per document (memory-mapped)
+        {collection_name}.jsonl  <- id, text, and metadata of each row, in order
+
+    Scores match a Chroma collection using the `cosine` space: searches with scores
+    return the cosine distance (`1 - similarity`), and searches with relevance scores
+    (like the `similarity_score_threshold` retriever) return the cosine similarity.
+
+    Added documents are appended to both files in place and become visible once the
+    `.npy` header is rewritten with the new number of rows, so an interrupted write
+    never leaves a partially visible document. Deleting rewrites both files.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        collection_name: str,
+        embedding_function: Embeddings,
+    ) -> None:
+        """
+        Args:
+            directory (str): path to persist the store in
+            collection_name (str): name of the store's files in the directory
+            embedding_function (Embeddings): embeds added texts and queries
+        """
+        self._directory = directory
+        self._collection_name = collection_name
+        self._embedding_function = embedding_function
+        self._vectors_path = os.path.join(directory, f"{collection_name}.npy")
+        self._documents_path = os.path.join(directory, f"{collection_name}.jsonl")
+        self._write_lock = threading.Lock()
+        self._index = self._read_index()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def __len__(self) -> int:
+        return len(self._index.ids)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """
+        Embed and store the texts, replacing any stored documents with the same ids
+
+        Args:
+            texts (Iterable[str]): texts to store
+            metadatas (List[Dict[str, Any]]): JSON-serializable metadata of each text
+            ids (List[str]): id of each text, defaults to new unique ids
+
+        Returns:
+            List[str]: ids of the stored texts
+        """
+        texts = list(texts)
+        vectors = self._embedding_function.embed_documents(texts)
+        return self.add_vectors(texts, vectors, metadatas=metadatas, ids=ids)
+
+    def add_vectors(
+        self,
+        texts: List[str],
+        vectors: List[List[float]],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        Store already embedded texts, replacing any stored documents with the same ids
+
+        Args:
+            texts (List[str]): texts to store
+            vectors (List[List[float]]): embedding of each text
+            metadatas (List[Dict[str, Any]]): JSON-serializable metadata of each text
+            ids (List[str]): id of each text, defaults to new unique ids
+
+        Returns:
+            List[str]: ids of the stored texts
+
+        Raises:
+            ValueError: the vectors' dimensions don't match the stored vectors'
+        """
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        if not texts:
+            return ids
+
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        records = "".join(
+            json.dumps({"id": id_, "document": text, "metadata": metadata or {}}) + "\n"
+            for id_, text, metadata in zip(ids, texts, metadatas)
+        ).encode("utf-8")
+
+        with self._write_lock:
+            index = self._index
+            replaced = set(ids).intersection(index.ids)
+            if replaced:
+                index = self._delete(index, replaced)
+
+            if not index.ids:
+                self._write(vectors, records)
+                self._index = self._read_index()
+                return ids
+
+            if vectors.shape[1] != index.vectors.shape[1]:
+                raise ValueError(
+                    f"can't add {vectors.shape[1]}-dimension vectors to "
+                    f"{self._vectors_path}, which has {index.vectors.shape[1]}"
+                )
+
+            self._append(index, vectors, records)
+            self._index = _NumpyIndex(
+                np.load(self._vectors_path, mmap_mode="r"),
+                index.ids + ids,
+                index.documents + texts,
+                index.metadatas + [metadata or {} for metadata in metadatas],
+                index.documents_size + len(records),
+            )
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> None:
+        """
+        Delete the documents with the provided ids
+
+        Args:
+            ids (List[str]): ids of the documents to delete
+        """
+        if not ids:
+            return
+        with self._write_lock:
+            self._index = self._delete(self._index, set(ids))
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Get stored documents, like `langchain_chroma.Chroma.get`
+
+        Args:
+            ids (List[str]): ids of the documents to get, defaults to all
+            limit (int): maximum number of documents to get
+            offset (int): number of documents to skip
+            include (List[str]): any of "embeddings", "metadatas", and "documents",
+                defaults to ["metadatas", "documents"]. Ids are always included.
+
+        Returns:
+            Dict[str, Any]: "ids", "embeddings", "metadatas", and "documents", the ones
+                not included are None
+        """
+        if include is None:
+            include = ["metadatas", "documents"]
+
+        index = self._index
+        if ids is None:
+            rows = range(len(index.ids))
+        else:
+            positions = {id_: row for row, id_ in enumerate(index.ids)}
+            rows = [positions[id_] for id_ in ids if id_ in positions]
+        start = offset or 0
+        rows = rows[start : None if limit is None else start + limit]
+
+        return {
+            "ids": [index.ids[row] for row in rows],
+            "embeddings": (
+                np.asarray(index.vectors[list(rows)])
+                if "embeddings" in include
+                else None
+            ),
+            "metadatas": (
+                [index.metadatas[row] for row in rows]
+                if "metadatas" in include
+                else None
+            ),
+            "documents": (
+                [index.documents[row] for row in rows]
+                if "documents" in include
+                else None
+            ),
+        }
+
+    def get_by_ids(self, ids, /) -> List[Document]:
+        index = self._index
+        positions = {id_: row for row, id_ in enumerate(index.ids)}
+        return [index.get_document(positions[id_]) for id_ in ids if id_ in positions]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            document
+            for document, _ in self.similarity_search_with_score(query, k, **kwargs)
+        ]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            document
+            for document, _ in self.similarity_search_with_score_by_vector(
+                embedding, k, **kwargs
+            )
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """
+        Find the stored documents most similar to the query
+
+        Args:
+            query (str): text to embed and search for
+            k (int): maximum number of documents to return
+
+        Returns:
+            List[Tuple[Document, float]]: documents and their cosine distance to the
+                query, closest first
+        """
+        return self.similarity_search_with_score_by_vector(
+            self._embedding_function.embed_query(query), k, **kwargs
+        )
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """
+        Find the stored documents most similar to the embedding, comparing it with
+        every stored vector
+
+        Args:
+            embedding (List[float]): vector to search for
+            k (int): maximum number of documents to return
+
+        Returns:
+            List[Tuple[Document, float]]: documents and their cosine distance to the
+                embedding, closest first
+
+        Raises:
+            ValueError: filtering is requested, which isn't supported
+        """
+        if kwargs.get("filter"):
+            raise ValueError("NumpyVectorStore doesn't support filtering searches")
+
+        index = self._index
+        k = min(k, len(index.ids))
+        if k <= 0:
+            return []
+
+        query = _normalize(np.asarray(embedding, dtype=np.float32)[np.newaxis])[0]
+        similarities = index.vectors @ query
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        return [
+            (index.get_document(row), float(1.0 - similarities[row])) for row in top
+        ]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    def warm_up(self) -> None:
+        """
+        Read every stored vector into the page cache by searching for the first one
+        """
+        index = self._index
+        if index.ids:
+            self.similarity_search_by_vector(index.vectors[0].tolist(), k=1)
+
+    def close(self) -> None:
+        """
+        Release the memory-mapped vectors
+        """
+        self._index = _EMPTY_INDEX
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        directory: str = None,
+        collection_name: str = "default",
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        """
+        Create a store in the directory containing the embedded texts
+
+        Raises:
+            ValueError: no directory is provided
+        """
+        if not directory:
+            raise ValueError("NumpyVectorStore requires a directory to persist in")
+        vectorstore = cls(directory, collection_name, embedding)
+        vectorstore.add_texts(texts, metadatas=metadatas, ids=ids)
+        return vectorstore
+
+    def _read_index(self) -> _NumpyIndex:
+        """
+        Memory-map the vectors and read the documents of the rows they have (any after
+        those are from a write which didn't finish)
+
+        A directory without the vectors is an empty store, but if it has other files
+        it was most likely built by another backend (e.g. the topic was switched from
+        Chroma without reloading its knowledge), so that's logged as an error rather
+        than raised: the topic's chain still has to be created to reload it.
+
+        Raises:
+            ValueError: the documents file has fewer documents than there are vectors
+        """
+        try:
+            vectors = np.load(self._vectors_path, mmap_mode="r")
+        except FileNotFoundError:
+            if os.path.isdir(self._directory) and os.listdir(self._directory):
+                logging.error(
+                    f"{self._directory} has no {os.path.basename(self._vectors_path)} "
+                    f"but isn't empty, it was likely built with another vectorstore "
+                    f"backend so nothing will be retrieved from it, the knowledge "
+                    f"store needs to be reloaded"
+                )
+            return _EMPTY_INDEX
+
+        ids, documents, metadatas = [], [], []
+        documents_size = 0
+        with open(self._documents_path, "rb") as documents_in:
+            for line in itertools.islice(documents_in, vectors.shape[0]):
+                record = json.loads(line)
+                ids.append(record["id"])
+                documents.append(record["document"])
+                metadatas.append(record["metadata"])
+                documents_size += len(line)
+
+        if len(ids) != vectors.shape[0]:
+            raise ValueError(
+                f"{self._documents_path} has {len(ids)} documents for "
+                f"{vectors.shape[0]} vectors, the knowledge store needs to be reloaded"
+            )
+        return _NumpyIndex(vectors, ids, documents, metadatas, documents_size)
+
+    def _write(self, vectors: np.ndarray, records: bytes) -> None:
+        """
+        Replace both files. The documents are replaced first, so if the vectors aren't,
+        the mismatch is detected when reading them.
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        suffix = f".{uuid.uuid4().hex}.tmp"
+
+        with open(self._documents_path + suffix, "wb") as documents_out:
+            documents_out.write(records)
+        with open(self._vectors_path + suffix, "wb") as vectors_out:
+            np.save(vectors_out, vectors)
+
+        os.replace(self._documents_path + suffix, self._documents_path)
+        os.replace(self._vectors_path + suffix, self._vectors_path)
+
+    def _append(self, index: _NumpyIndex, vectors: np.ndarray, records: bytes) -> None:
+        """
+        Write the new rows after the stored ones, then the `.npy` header counting them.
+        The header has room for the number of rows to grow (see `numpy.lib.format`),
+        if it ever doesn't the files are rewritten instead.
+        """
+        rows, dimensions = index.vectors.shape
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(
+            header,
+            {
+                "descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                "fortran_order": False,
+                "shape": (rows + len(vectors), dimensions),
+            },
+        )
+
+        with open(self._vectors_path, "r+b") as vectors_out:
+            version = np.lib.format.read_magic(vectors_out)
+            if version == (1, 0):
+                np.lib.format.read_array_header_1_0(vectors_out)
+            else:
+                np.lib.format.read_array_header_2_0(vectors_out)
+            data_offset = vectors_out.tell()
+
+            if version != (1, 0) or len(header.getvalue()) != data_offset:
+                self._write(
+                    np.concatenate([index.vectors, vectors]),
+                    _get_records(index) + records,
+                )
+                return
+
+            with open(self._documents_path, "r+b") as documents_out:
+                documents_out.seek(index.documents_size)
+                documents_out.write(records)
+                documents_out.truncate()
+
+            vectors_out.seek(data_offset + rows * dimensions * vectors.itemsize)
+            vectors_out.write(vectors.tobytes())
+            vectors_out.truncate()
+            vectors_out.flush()
+            vectors_out.seek(0)
+            vectors_out.write(header.getvalue())
+
+    def _delete(self, index: _NumpyIndex, ids: set) -> _NumpyIndex:
+        """
+        Rewrite the store without the documents with the provided ids
+
+        Returns:
+            _NumpyIndex: the store after deleting them
+        """
+        keep = [row for row, id_ in enumerate(index.ids) if id_ not in ids]
+        if len(keep) == len(index.ids):
+            return index
+
+        kept = _NumpyIndex(
+            np.asarray(index.vectors[keep], dtype=np.float32),
+            [index.ids[row] for row in keep],
+            [index.documents[row] for row in keep],
+            [index.metadatas[row] for row in keep],
+            0,
+        )
+        self._write(kept.vectors, _get_records(kept))
+        return self._read_index()
+
+
+def get_vectorstore_backend(metadata: Dict[str, Any]) -> str:
+    """
+    Return the vectorstore backend configured in the topic's metadata
+
+    Args:
+        metadata (Dict[str, Any]): topic's metadata
+
+    Returns:
+        str: one of `VECTORSTORE_BACKENDS`
+
+    Raises:
+        ValueError: the configured backend isn't supported
+    """
+    backend = get_from_cfg_metadata(
+        "vectorstore", metadata, default=VECTORSTORE_CHROMA, type_=str
+    ).lower()
+    if backend not in VECTORSTORE_BACKENDS:
+        raise ValueError(
+            f"unsupported vectorstore: {backend}, expected one of {VECTORSTORE_BACKENDS}"
+        )
+    return backend
+
+
+def get_vectorstore(
+    topic: str,
+    embeddings: Embeddings,
+    directory: str,
+    backend: str = VECTORSTORE_CHROMA,
+    chroma_collection_metadata: Optional[Dict[str, Any]] = None,
+) -> VectorStore:
+    """
+    Return the topic's vectorstore of the provided backend persisted in the provided
+    directory
+
+    Args:
+        topic (str): topic name, also the name of the collection
+        embeddings (Embeddings): embedding function for the topic's documents and queries
+        directory (str): path the vectorstore is persisted in
+        backend (str): one of `VECTORSTORE_BACKENDS`
+        chroma_collection_metadata (Dict[str, Any]): metadata new Chroma collections
+            are created with (e.g. their distance function)
+
+    Returns:
+        VectorStore: the vectorstore
+    """
+    if backend == VECTORSTORE_NUMPY:
+        return NumpyVectorStore(directory, topic, embeddings)
+    return _get_chroma_vectorstore(
+        topic, embeddings, directory, chroma_collection_metadata
+    )
+
+
+def warm_up_vectorstore(vectorstore: VectorStore) -> None:
+    """
+    Load the vectorstore's index (e.g. into the page cache) by querying it with a
+    vector already stored in it, so warming up doesn't call the embedding API
+
+    Args:
+        vectorstore (VectorStore): a vectorstore from `get_vectorstore`
+    """
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.warm_up()
+        return
+
+    collection = getattr(vectorstore, "_collection", None)
+    if collection is None:
+        return
+
+    stored = collection.get(limit=1, include=["embeddings"])
+    embeddings = stored.get("embeddings")
+    if embeddings is not None and len(embeddings):
+        collection.query(
+            query_embeddings=[embeddings[0]], n_results=1, include=["distances"]
+        )
+
+
+def close_vectorstore(vectorstore: VectorStore) -> None:
+    """
+    Release the resources (like an open persistent client or memory-mapped file) held
+    by the vectorstore
+
+    Args:
+        vectorstore (VectorStore): a vectorstore from `get_vectorstore`
+    """
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.close()
+        return
+
+    client = getattr(vectorstore, "_client", None)
+    if callable(getattr(client, "close", None)):
+        client.close()
+
+
+def _get_chroma_vectorstore(
+    topic: str,
+    embeddings: Embeddings,
+    directory: str,
+    collection_metadata: Optional[Dict[str, Any]] = None,
+) -> "Chroma":
+    """
+    Return a Chroma vectorstore for the topic persisted in the provided directory.
+    `chromadb` is only imported once a topic uses it.
+    """
+    import chromadb  # pylint: disable=import-outside-toplevel
+    from langchain_chroma import Chroma  # pylint: disable=import-outside-toplevel
+
+    # langchain/chroma recommend a separate client per persisted path
+    # to avoid potential collisions. We will separate on topic and knowledge version
+    settings = chromadb.Settings(
+        migrations_hash_algorithm="sha256",
+        anonymized_telemetry=False,
+    )
+
+    persistent_client = chromadb.PersistentClient(path=directory, settings=settings)
+    return Chroma(
+        client=persistent_client,
+        collection_name=topic,
+        embedding_function=embeddings,
+        collection_metadata=collection_metadata,
+        persist_directory=directory,
+        client_settings=settings,
+    )
+
+
+def _get_records(index: _NumpyIndex) -> bytes:
+    return "".join(
+        json.dumps({"id": id_, "document": document, "metadata": metadata}) + "\n"
+        for id_, document, metadata in zip(index.ids, index.documents, index.metadatas)
+    ).encode("utf-8")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale each row to unit length, so dot products are cosine similarities (rows of
+    zeros are left as is)
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
@@ -4,6 +4,7 @@ import cdislogging
 import gunicorn.glogging
 
 import gen3discoveryai.config
+import gen3discoveryai.topic_init
 
 
 class CDISLogger(gunicorn.glogging.Logger):
@@ -42,7 +43,10 @@ logger_class = CDISLogger
 
 wsgi_app = "gen3discoveryai.main:app"
 bind = "0.0.0.0:8000"
-workers = 1
+workers = gen3discoveryai.config.GUNICORN_WORKERS
+# import the app once in the master process and fork workers from it, see "Workers"
+# in the README
+preload_app = gen3discoveryai.config.GUNICORN_PRELOAD_APP
 user = "gen3"
 group = "gen3"
 
@@ -50,3 +54,13 @@ group = "gen3"
 # default was `30`
 timeout = 300
 graceful_timeout = 300
+
+
+def when_ready(server):
+    """
+    Before any workers are forked, import what they'd otherwise each import when
+    preloading the app. Everything that can't be used after a fork (like topics'
+    vectorstore and LLM clients) is created in each worker.
+    """
+    if server.cfg.preload_app:
+        gen3discoveryai.topic_init.preload_topics()
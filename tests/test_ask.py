@@ -78,10 +78,12 @@ def test_ask(
     ]
 
     mock_topic_chain = MagicMock()
-    mock_topic_chain.run.return_value = {
-        "result": topic_chain_response,
-        "source_documents": source_documents,
-    }
+    mock_topic_chain.arun = AsyncMock(
+        return_value={
+            "result": topic_chain_response,
+            "source_documents": source_documents,
+        }
+    )
     mock_config.topics = MagicMock()
     mock_config.topics.get.return_value = {"topic_chain": mock_topic_chain}
     mock_config.topics.__getitem__.return_value = {"topic_chain": mock_topic_chain}
@@ -107,9 +109,9 @@ def test_ask(
     if user_query:
         assert response.status_code == 200
 
-        assert mock_topic_chain.run.called
-        assert "query" in mock_topic_chain.run.call_args.kwargs
-        assert mock_topic_chain.run.call_args.kwargs["query"] == user_query
+        assert mock_topic_chain.arun.called
+        assert "query" in mock_topic_chain.arun.call_args.kwargs
+        assert mock_topic_chain.arun.call_args.kwargs["query"] == user_query
 
         assert "response" in response.json()
         assert "documents" in response.json()
@@ -127,7 +129,7 @@ def test_ask(
     else:
         # if no user query, except an error
         assert response.status_code == 400
-        assert not mock_topic_chain.run.called
+        assert not mock_topic_chain.arun.called
         assert response.json().get("detail")
         assert "response" not in response.json()
         assert "documents" not in response.json()
@@ -242,7 +244,7 @@ def test_ask_invalid_response_from_chain(mock_config, endpoint, client, monkeypa
     monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
 
     mock_topic_chain = MagicMock()
-    mock_topic_chain.run.side_effect = Exception("something bad happened!!")
+    mock_topic_chain.arun = AsyncMock(side_effect=Exception("something bad happened!!"))
 
     mock_config.topics = MagicMock()
     mock_config.topics.get.return_value = {"topic_chain": mock_topic_chain}
@@ -0,0 +1,184 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import langchain_classic.schema
+import pytest
+from fastapi import HTTPException
+from langchain_classic.chains import RetrievalQA
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+
+from gen3discoveryai import config
+from gen3discoveryai.topic_chains.base import TopicChain
+
+TEST_DOCUMENTS = [
+    langchain_classic.schema.Document(
+        page_content="fooA", metadata={"row": 120, "source": "phs000001.v1.p1.c1"}
+    ),
+    langchain_classic.schema.Document(
+        page_content="barB", metadata={"row": 59, "source": "phs000002.v2.p2.c2"}
+    ),
+]
+
+
+class FakeRetriever(BaseRetriever):
+    """
+    Retriever which always returns the test documents
+    """
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return TEST_DOCUMENTS
+
+
+def _parse_sse_events(text):
+    """
+    Parse a Server-Sent Events body into a list of (event, data) tuples
+    """
+    events = []
+    for raw_event in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in raw_event.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def _get_mock_topic_chain(events, error=None):
+    """
+    Return a mock topic chain which streams the provided events (and optionally raises after)
+    """
+
+    async def _astream(*args, **kwargs):
+        for event in events:
+            yield event
+        if error:
+            raise error
+
+    mock_topic_chain = MagicMock()
+    mock_topic_chain.astream = _astream
+    return mock_topic_chain
+
+
+@pytest.mark.parametrize("endpoint", ["/ask/stream", "/ask/stream/"])
+@patch("gen3discoveryai.routes.config")
+def test_ask_stream(mock_config, endpoint, client, monkeypatch):
+    """
+    Test the streaming ask endpoint sends documents, then tokens, then an end event
+    """
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+
+    mock_topic_chain = _get_mock_topic_chain(
+        [
+            ("documents", TEST_DOCUMENTS),
+            ("token", "y"),
+            ("token", "es"),
+            ("result", {"result": "yes", "source_documents": TEST_DOCUMENTS}),
+        ]
+    )
+    mock_config.topics = {"default": {"topic_chain": mock_topic_chain}}
+
+    response = client.post(
+        f"{endpoint}?conversation_id=foobar",
+        headers={"Authorization": "bearer this.is.valid"},
+        json={"query": "do you have covid data?"},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = _parse_sse_events(response.text)
+    assert [event for event, _ in events] == ["documents", "token", "token", "end"]
+
+    assert [doc["page_content"] for doc in events[0][1]["documents"]] == [
+        "fooA",
+        "barB",
+    ]
+    assert events[1][1] == {"token": "y"}
+    assert events[2][1] == {"token": "es"}
+
+    end = events[-1][1]
+    assert end["response"] == "yes"
+    assert end["conversation_id"] == "foobar"
+    assert end["topic"] == "default"
+    assert "retrieval_seconds" in end["timing"]
+    assert "time_to_first_token_seconds" in end["timing"]
+    assert "response_time_seconds" in end["timing"]
+
+
+@pytest.mark.parametrize(
+    "error,expected_detail",
+    [
+        (Exception("something bad happened!!"), "Service unavailable."),
+        (HTTPException(429, "Please try again later."), "Please try again later."),
+    ],
+)
+@patch("gen3discoveryai.routes.config")
+def test_ask_stream_chain_error(
+    mock_config, error, expected_detail, client, monkeypatch
+):
+    """
+    Test that when the chain errors mid-stream, an error event is sent instead of the end event
+    """
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+
+    mock_topic_chain = _get_mock_topic_chain(
+        [("documents", TEST_DOCUMENTS)], error=error
+    )
+    mock_config.topics = {"default": {"topic_chain": mock_topic_chain}}
+
+    response = client.post(
+        "/ask/stream",
+        headers={"Authorization": "bearer this.is.valid"},
+        json={"query": "do you have covid data?"},
+    )
+
+    assert response.status_code == 200
+
+    events = _parse_sse_events(response.text)
+    assert [event for event, _ in events] == ["documents", "error"]
+    assert events[-1][1] == {"detail": expected_detail}
+
+
+@pytest.mark.parametrize("post_body", [{}, {"query": ""}])
+def test_ask_stream_no_query(post_body, client, monkeypatch):
+    """
+    Test that the streaming endpoint validates the request before starting the stream
+    """
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+
+    response = client.post(
+        "/ask/stream",
+        headers={"Authorization": "bearer this.is.valid"},
+        json=post_body,
+    )
+
+    assert response.status_code == 400
+    assert response.json().get("detail")
+
+
+def test_ask_stream_no_token(client):
+    """
+    Test that the streaming endpoint returns a 401 when no token is provided
+    """
+    response = client.post("/ask/stream", json={"query": "do you have covid data?"})
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_topic_chain_astream():
+    """
+    Test that TopicChain.astream yields the retrieved documents, then the LLM tokens,
+    then the final result from a real RetrievalQA chain
+    """
+    chain = RetrievalQA.from_chain_type(
+        FakeListChatModel(responses=["yes"]),
+        retriever=FakeRetriever(),
+        return_source_documents=True,
+    )
+    topic_chain = TopicChain(name="test", topic="test", chain=chain)
+
+    events = [item async for item in topic_chain.astream("do you have covid data?")]
+
+    assert events[0] == ("documents", TEST_DOCUMENTS)
+    assert events[1:-1] == [("token", "y"), ("token", "e"), ("token", "s")]
+    assert events[-1][0] == "result"
+    assert events[-1][1]["result"] == "yes"
+    assert events[-1][1]["source_documents"] == TEST_DOCUMENTS
@@ -0,0 +1,210 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from starlette.requests import Request
+
+from gen3discoveryai import auth, auth_cache, config
+from gen3discoveryai.auth_cache import AuthCache, JwksCache
+
+
+@pytest.fixture
+def fresh_auth_cache(monkeypatch):
+    """
+    Fresh cross-request auth cache
+    """
+    monkeypatch.setattr(config, "AUTH_CACHE_TTL_SECONDS", 60)
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", False)
+    monkeypatch.setattr(config, "ALLOW_ANONYMOUS_ACCESS", False)
+    monkeypatch.setattr(auth_cache, "_auth_cache", None)
+
+
+def _request():
+    return Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "path": "/ask",
+            "query_string": b"",
+            "headers": [(b"authorization", b"Bearer some.access.token")],
+        }
+    )
+
+
+def test_auth_cache_bounded_by_token_expiration():
+    """
+    Test that entries don't outlive the token and tokens without `exp` aren't cached
+    """
+    cache = AuthCache(ttl_seconds=60, max_entries=10)
+
+    cache.set(("claims", "a"), {"sub": "a"}, expires_at=time.time() + 60)
+    cache.set(("claims", "b"), {"sub": "b"}, expires_at=None)
+    cache.set(("claims", "c"), {"sub": "c"}, expires_at=time.time() - 1)
+    cache.set(("claims", "d"), {"sub": "d"}, expires_at=time.time() + 0.01)
+
+    assert cache.get(("claims", "a")) == {"sub": "a"}
+    assert cache.get(("claims", "b")) is None
+    assert cache.get(("claims", "c")) is None
+    time.sleep(0.02)
+    assert cache.get(("claims", "d")) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cache_ttl", [0, 60])
+@patch("gen3discoveryai.auth.access_token")
+async def test_token_claims_memoized(access_token, cache_ttl, fresh_auth_cache):
+    """
+    Test that a token is verified once per request, and once across requests when
+    cached
+    """
+    auth_cache._auth_cache = None
+    config.AUTH_CACHE_TTL_SECONDS = cache_ttl
+    verify = AsyncMock(return_value={"sub": "user", "exp": time.time() + 3600})
+    access_token.return_value = verify
+
+    for _ in range(2):
+        request = _request()
+        assert await auth.get_user_id(request=request) == "user"
+        assert await auth.get_user_id(request=request) == "user"
+
+    assert verify.await_count == (2 if not cache_ttl else 1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("is_authorized", [True, False])
+@patch("gen3discoveryai.auth.access_token")
+@patch("gen3discoveryai.auth.arborist", new_callable=AsyncMock)
+async def test_authorize_request_decision_cached(
+    arborist, access_token, is_authorized, fresh_auth_cache
+):
+    """
+    Test that Arborist decisions are cached per token, access method, and resources
+    """
+    arborist.auth_request.return_value = is_authorized
+    access_token.return_value = AsyncMock(
+        return_value={"sub": "user", "exp": time.time() + 3600}
+    )
+
+    async def _authorize(resource):
+        try:
+            await auth.authorize_request(
+                request=_request(),
+                authz_access_method="read",
+                authz_resources=[resource],
+            )
+        except HTTPException as exc:
+            assert exc.status_code == 403
+            return False
+        return True
+
+    assert await _authorize("/a") is is_authorized
+    assert await _authorize("/a") is is_authorized
+    assert arborist.auth_request.await_count == 1
+
+    await _authorize("/b")
+    assert arborist.auth_request.await_count == 2
+
+
+@pytest.mark.asyncio
+@patch("gen3discoveryai.auth.access_token")
+@patch("gen3discoveryai.auth.arborist", new_callable=AsyncMock)
+async def test_authorize_request_decision_memoized(
+    arborist, access_token, fresh_auth_cache
+):
+    """
+    Test that a request is authorized once (e.g. before it's admitted and again by
+    the route) even when decisions aren't cached across requests
+    """
+    config.AUTH_CACHE_TTL_SECONDS = 0
+    arborist.auth_request.return_value = True
+    access_token.return_value = AsyncMock(
+        return_value={"sub": "user", "exp": time.time() + 3600}
+    )
+
+    for _ in range(2):
+        request = _request()
+        for _ in range(2):
+            await auth.authorize_request(
+                request=request, authz_access_method="read", authz_resources=["/a"]
+            )
+
+    assert arborist.auth_request.await_count == 2
+
+
+@pytest.mark.asyncio
+@patch("gen3discoveryai.auth.access_token")
+@patch("gen3discoveryai.auth.arborist", new_callable=AsyncMock)
+async def test_authorize_request_not_cached_without_verified_token(
+    arborist, access_token, fresh_auth_cache
+):
+    """
+    Test that decisions aren't cached when the token couldn't be verified
+    """
+    arborist.auth_request.return_value = True
+    access_token.side_effect = Exception("invalid")
+
+    for _ in range(2):
+        await auth.authorize_request(
+            token=HTTPAuthorizationCredentials(scheme="bearer", credentials="bad"),
+            authz_resources=["/a"],
+        )
+
+    assert arborist.auth_request.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_jwks_cache(monkeypatch):
+    """
+    Test that public keys are expired after the TTL, and refreshed early at most once
+    per interval
+    """
+    loop = asyncio.get_running_loop()
+    keys = loop.create_future()
+    keys.set_result({"kid": "key"})
+    fetching = loop.create_future()
+    public_keys = {"issuer": keys, "fetching": fetching}
+    monkeypatch.setattr("authutils.token.fastapi._jwt_public_keys", public_keys)
+
+    jwks_cache = JwksCache(ttl_seconds=0.01, min_refresh_seconds=60)
+    jwks_cache.expire()
+    assert "issuer" in public_keys
+    time.sleep(0.02)
+    jwks_cache.expire()
+    # in progress fetches are left alone
+    assert list(public_keys) == ["fetching"]
+
+    public_keys["issuer"] = keys
+    assert jwks_cache.refresh()
+    assert "issuer" not in public_keys
+    public_keys["issuer"] = keys
+    assert not jwks_cache.refresh()
+    assert "issuer" in public_keys
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("refreshed", [True, False])
+@patch("gen3discoveryai.auth.access_token")
+async def test_verify_token_unknown_key(access_token, refreshed, monkeypatch):
+    """
+    Test that a token signed with an unknown key is verified again after refetching
+    public keys (unless they were just refetched)
+    """
+    jwks_cache = MagicMock()
+    jwks_cache.refresh.return_value = refreshed
+    monkeypatch.setattr(auth, "_jwks_cache", jwks_cache)
+    access_token.return_value = AsyncMock(
+        side_effect=[
+            HTTPException(403, "Bad bearer token: kid not found in issuer: issuer"),
+            {"sub": "user"},
+        ]
+    )
+    token = HTTPAuthorizationCredentials(scheme="bearer", credentials="token")
+
+    if refreshed:
+        assert await auth._verify_token(token) == {"sub": "user"}
+    else:
+        with pytest.raises(HTTPException):
+            await auth._verify_token(token)
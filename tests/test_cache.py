@@ -0,0 +1,305 @@
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from gen3discoveryai import cache, config
+from gen3discoveryai.cache import (
+    AnswerCache,
+    InMemoryCacheBackend,
+    SQLiteCacheBackend,
+    get_answer_cache,
+    get_topic_config_fingerprint,
+    normalize_query,
+)
+from gen3discoveryai.knowledge import bump_knowledge_version, get_knowledge_version
+from gen3discoveryai.topic_chains.base import TopicChain
+
+TEST_RESPONSE = {
+    "response": "yes",
+    "documents": [{"page_content": "fooA", "metadata": {"source": "phs000001"}}],
+}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache_backend(request, tmp_path):
+    """
+    Each available answer cache backend with a small max size
+    """
+    if request.param == "sqlite":
+        return SQLiteCacheBackend(str(tmp_path / "answers.sqlite"), max_entries=2)
+    return InMemoryCacheBackend(max_entries=2)
+
+
+@pytest.fixture
+def answer_cache_enabled(monkeypatch, tmp_path):
+    """
+    Enable the answer cache (with a fresh in-memory backend) and isolate the knowledge dir
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_BACKEND", "memory")
+    monkeypatch.setattr(cache, "_answer_cache", None)
+    yield get_answer_cache()
+
+
+@pytest.mark.parametrize(
+    "query_a,query_b",
+    [
+        ("What datasets have WGS data?", "what datasets have wgs data"),
+        ("  what   datasets\thave WGS data ?", "What datasets have WGS data?"),
+        ("ｗｇｓ data", "wgs data"),
+    ],
+)
+def test_normalize_query(query_a, query_b):
+    """
+    Test that trivially different queries normalize to the same text
+    """
+    assert normalize_query(query_a) == normalize_query(query_b)
+
+
+def test_topic_config_fingerprint():
+    """
+    Test that only answer-affecting topic configuration changes the fingerprint
+    """
+    topic_config = {
+        "description": "foo",
+        "system_prompt": "be helpful",
+        "model_name": "gpt-5-mini",
+        "model_temperature": "0.3",
+        "topic_chain": MagicMock(NAME="SomeChain"),
+    }
+    fingerprint = get_topic_config_fingerprint(topic_config)
+
+    assert fingerprint == get_topic_config_fingerprint(
+        {
+            **topic_config,
+            "description": "bar",
+            "topic_chain": MagicMock(NAME="SomeChain"),
+        }
+    )
+    for key, value in [
+        ("system_prompt", "be terse"),
+        ("model_name", "gpt-5"),
+        ("model_temperature", "0.5"),
+        ("similarity_score_threshold", "0.5"),
+        ("topic_chain", MagicMock(NAME="AnotherChain")),
+    ]:
+        assert fingerprint != get_topic_config_fingerprint({**topic_config, key: value})
+
+
+def test_cache_backend_get_set(cache_backend):
+    """
+    Test basic storage and retrieval, and that retrieved values can't modify the cache
+    """
+    assert cache_backend.get("a") is None
+
+    cache_backend.set("a", "default", TEST_RESPONSE, ttl=60)
+    value = cache_backend.get("a")
+    assert value == TEST_RESPONSE
+
+    value["conversation_id"] = "foobar"
+    assert cache_backend.get("a") == TEST_RESPONSE
+
+
+def test_cache_backend_ttl(cache_backend):
+    """
+    Test that expired entries are not returned
+    """
+    cache_backend.set("a", "default", TEST_RESPONSE, ttl=0.01)
+    time.sleep(0.02)
+    assert cache_backend.get("a") is None
+
+
+def test_cache_backend_lru_eviction(cache_backend):
+    """
+    Test that the least recently used entry is evicted when full
+    """
+    cache_backend.set("a", "default", {"response": "a"}, ttl=60)
+    time.sleep(0.001)
+    cache_backend.set("b", "default", {"response": "b"}, ttl=60)
+    time.sleep(0.001)
+
+    # use `a` so `b` is least recently used
+    assert cache_backend.get("a")
+    time.sleep(0.001)
+
+    cache_backend.set("c", "default", {"response": "c"}, ttl=60)
+
+    assert len(cache_backend) == 2
+    assert cache_backend.get("a")
+    assert cache_backend.get("b") is None
+    assert cache_backend.get("c")
+
+
+def test_cache_backend_invalidate_topic(cache_backend):
+    """
+    Test that invalidating a topic only removes that topic's entries
+    """
+    cache_backend.set("a", "default", {"response": "a"}, ttl=60)
+    cache_backend.set("b", "bdc", {"response": "b"}, ttl=60)
+
+    cache_backend.invalidate_topic("default")
+
+    assert cache_backend.get("a") is None
+    assert cache_backend.get("b")
+
+
+def test_sqlite_cache_backend_shared(tmp_path):
+    """
+    Test that separate connections (e.g. separate workers) share the same entries
+    """
+    path = str(tmp_path / "answers.sqlite")
+    SQLiteCacheBackend(path, max_entries=10).set("a", "default", TEST_RESPONSE, 60)
+    assert SQLiteCacheBackend(path, max_entries=10).get("a") == TEST_RESPONSE
+
+
+def test_answer_cache_counts_hits_and_misses():
+    """
+    Test that the answer cache tracks hits and misses per topic
+    """
+    answer_cache = AnswerCache(InMemoryCacheBackend(10), ttl_seconds=60)
+    hits = answer_cache.hits.get(topic="counting")
+    misses = answer_cache.misses.get(topic="counting")
+
+    assert answer_cache.get("a", "counting") is None
+    answer_cache.set("a", "counting", TEST_RESPONSE)
+    assert answer_cache.get("a", "counting") == TEST_RESPONSE
+
+    assert answer_cache.hits.get(topic="counting") == hits + 1
+    assert answer_cache.misses.get(topic="counting") == misses + 1
+
+
+def test_answer_cache_backend_errors_are_misses():
+    """
+    Test that backend errors never fail the request, they're just treated as misses
+    """
+    backend = MagicMock()
+    backend.get.side_effect = Exception("disk full")
+    backend.set.side_effect = Exception("disk full")
+    answer_cache = AnswerCache(backend, ttl_seconds=60)
+
+    answer_cache.set("a", "default", TEST_RESPONSE)
+    assert answer_cache.get("a", "default") is None
+
+
+def test_answer_cache_key_changes_with_knowledge_version(answer_cache_enabled):
+    """
+    Test that re-storing knowledge for a topic changes the cache key
+    """
+    topic_config = {"system_prompt": "be helpful"}
+    key = AnswerCache.get_key("default", "Do you have COVID data?", topic_config)
+
+    assert key == AnswerCache.get_key("default", "do you have covid data", topic_config)
+    assert key != AnswerCache.get_key("bdc", "do you have covid data", topic_config)
+
+    assert get_knowledge_version("default") == ""
+    version = bump_knowledge_version("default")
+    assert get_knowledge_version("default") == version
+
+    assert key != AnswerCache.get_key(
+        "default", "Do you have COVID data?", topic_config
+    )
+
+
+def test_get_answer_cache(monkeypatch, tmp_path):
+    """
+    Test answer cache creation from configuration
+    """
+    monkeypatch.setattr(cache, "_answer_cache", None)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    assert get_answer_cache() is None
+
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_BACKEND", "sqlite")
+    monkeypatch.setattr(
+        config, "ANSWER_CACHE_SQLITE_PATH", str(tmp_path / "cache" / "answers.sqlite")
+    )
+    assert isinstance(get_answer_cache().backend, SQLiteCacheBackend)
+    assert get_answer_cache() is get_answer_cache()
+
+    monkeypatch.setattr(cache, "_answer_cache", None)
+    monkeypatch.setattr(config, "ANSWER_CACHE_BACKEND", "unknown")
+    with pytest.raises(ValueError):
+        get_answer_cache()
+
+
+def test_on_knowledge_updated_invalidates(answer_cache_enabled):
+    """
+    Test that storing new knowledge for a topic bumps the version and clears cached answers
+    """
+    answer_cache_enabled.set("a", "default", TEST_RESPONSE)
+
+    TopicChain(name="test", topic="default", chain=MagicMock()).on_knowledge_updated()
+
+    assert get_knowledge_version("default")
+    assert answer_cache_enabled.get("a", "default") is None
+
+
+@pytest.mark.parametrize("endpoint", ["/ask", "/ask/"])
+@patch("gen3discoveryai.routes.config")
+def test_ask_cached(mock_config, endpoint, answer_cache_enabled, client, monkeypatch):
+    """
+    Test that repeated (normalized) queries are answered from the cache and that
+    storing new knowledge invalidates the cached answer
+    """
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+
+    mock_topic_chain = MagicMock(NAME="SomeChain")
+    mock_topic_chain.arun = AsyncMock(
+        return_value={"result": "yes", "source_documents": []}
+    )
+    mock_config.topics = {
+        "default": {"topic_chain": mock_topic_chain, "model_name": "foo"}
+    }
+
+    responses = [
+        client.post(endpoint, json={"query": query})
+        for query in ["Do you have COVID data?", "do you have  covid data"]
+    ]
+
+    assert mock_topic_chain.arun.call_count == 1
+    assert [response.json()["cached"] for response in responses] == [False, True]
+    assert responses[0].json()["response"] == responses[1].json()["response"]
+    assert (
+        responses[0].json()["conversation_id"] != responses[1].json()["conversation_id"]
+    )
+
+    bump_knowledge_version("default")
+
+    response = client.post(endpoint, json={"query": "Do you have COVID data?"})
+    assert response.json()["cached"] is False
+    assert mock_topic_chain.arun.call_count == 2
+
+
+@patch("gen3discoveryai.routes.config")
+def test_ask_stream_cached(mock_config, answer_cache_enabled, client, monkeypatch):
+    """
+    Test that the streaming endpoint populates and serves from the answer cache
+    """
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+
+    calls = []
+
+    async def _astream(*args, **kwargs):
+        calls.append(kwargs)
+        yield "documents", []
+        yield "token", "yes"
+        yield "result", {"result": "yes", "source_documents": []}
+
+    mock_topic_chain = MagicMock(NAME="SomeChain")
+    mock_topic_chain.astream = _astream
+    mock_config.topics = {"default": {"topic_chain": mock_topic_chain}}
+
+    first = client.post("/ask/stream", json={"query": "do you have covid data?"})
+    second = client.post("/ask/stream", json={"query": "do you have covid data?"})
+
+    assert len(calls) == 1
+    assert '"cached": false' in first.text
+    assert '"cached": true' in second.text
+    assert 'data: {"token": "yes"}' in second.text
+
+    # non-streaming requests share the same cache
+    response = client.post("/ask", json={"query": "do you have covid data?"})
+    assert response.json()["cached"] is True
+    assert response.json()["response"] == "yes"
@@ -0,0 +1,303 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+
+from gen3discoveryai import concurrency, config
+from gen3discoveryai.concurrency import (
+    AdmissionController,
+    ConcurrencyLimiter,
+    QueueFullError,
+    QueueTimeoutError,
+    get_topic_limiter,
+)
+
+
+@pytest.fixture
+def fresh_limiters(monkeypatch):
+    """
+    Fresh global and topic limiters
+    """
+    monkeypatch.setattr(concurrency, "_topic_limiters", {})
+    monkeypatch.setattr(concurrency, "_global_limiter", None)
+
+
+@pytest.mark.asyncio
+async def test_limiter_queues_in_order():
+    """
+    Test that requests over the limit wait and are admitted first-in-first-out
+    """
+    limiter = ConcurrencyLimiter("test", max_concurrent=1, max_queued=10)
+    admitted = []
+
+    async def _request(name):
+        await limiter.acquire(timeout=1)
+        admitted.append(name)
+        await asyncio.sleep(0.01)
+        limiter.release()
+
+    await asyncio.gather(*[_request(name) for name in "abcd"])
+
+    assert admitted == ["a", "b", "c", "d"]
+    assert limiter.in_use == 0
+    assert limiter.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_queue_full():
+    """
+    Test that requests are rejected immediately when the wait queue is full
+    """
+    limiter = ConcurrencyLimiter("test", max_concurrent=1, max_queued=1)
+    await limiter.acquire(timeout=1)
+
+    waiting = asyncio.ensure_future(limiter.acquire(timeout=1))
+    await asyncio.sleep(0)
+    assert limiter.queued == 1
+
+    with pytest.raises(QueueFullError):
+        await limiter.acquire(timeout=1)
+
+    limiter.release()
+    await waiting
+    assert limiter.in_use == 1
+
+
+@pytest.mark.asyncio
+async def test_limiter_queue_timeout():
+    """
+    Test that waiting requests give up after the timeout and free their place in line
+    """
+    limiter = ConcurrencyLimiter("test", max_concurrent=1, max_queued=1)
+    await limiter.acquire(timeout=1)
+
+    with pytest.raises(QueueTimeoutError):
+        await limiter.acquire(timeout=0.01)
+
+    assert limiter.queued == 0
+    limiter.release()
+    assert limiter.in_use == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_cancelled_waiter():
+    """
+    Test that a cancelled waiter (e.g. client disconnected) doesn't leak a slot
+    """
+    limiter = ConcurrencyLimiter("test", max_concurrent=1, max_queued=5)
+    await limiter.acquire(timeout=1)
+
+    cancelled = asyncio.ensure_future(limiter.acquire(timeout=1))
+    waiting = asyncio.ensure_future(limiter.acquire(timeout=1))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+
+    limiter.release()
+    await waiting
+    limiter.release()
+
+    assert limiter.in_use == 0
+    assert limiter.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_unlimited():
+    """
+    Test that a max of 0 never waits
+    """
+    limiter = ConcurrencyLimiter("test", max_concurrent=0, max_queued=0)
+    for _ in range(100):
+        await limiter.acquire(timeout=0)
+    limiter.release()
+    assert limiter.in_use == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_topic_then_global(fresh_limiters, monkeypatch):
+    """
+    Test that a busy topic only uses its own slots, leaving global slots for other
+    topics, and that wait times and rejections are observable
+    """
+    monkeypatch.setattr(config, "ASK_MAX_CONCURRENT_REQUESTS", 2)
+    monkeypatch.setattr(config, "ASK_MAX_QUEUED_REQUESTS", 10)
+    monkeypatch.setattr(config, "ASK_MAX_QUEUE_SECONDS", 0.05)
+    busy_topic_config = {
+        "max_concurrent_requests": "1",
+        "max_queued_requests": "5",
+    }
+    controller = AdmissionController()
+    rejected = controller.rejected.get(topic="busy", reason="timeout")
+
+    async with controller.admit("busy", busy_topic_config):
+        # this waits on the busy topic's limiter, not a global slot
+        with pytest.raises(QueueTimeoutError):
+            async with controller.admit("busy", busy_topic_config):
+                pass
+
+        async with controller.admit("other", {}):
+            assert concurrency.get_global_limiter().in_use == 2
+
+    assert concurrency.get_global_limiter().in_use == 0
+    assert controller.rejected.get(topic="busy", reason="timeout") == rejected + 1
+    assert controller.wait_seconds.get_count(topic="other") >= 1
+
+
+@pytest.mark.asyncio
+async def test_admission_global_timeout_releases_topic_slot(
+    fresh_limiters, monkeypatch
+):
+    """
+    Test that the topic slot is released when waiting for a global slot times out
+    """
+    monkeypatch.setattr(config, "ASK_MAX_CONCURRENT_REQUESTS", 1)
+    monkeypatch.setattr(config, "ASK_MAX_QUEUE_SECONDS", 0.01)
+    controller = AdmissionController()
+
+    async with controller.admit("a", {}):
+        with pytest.raises(QueueTimeoutError):
+            async with controller.admit("b", {"max_concurrent_requests": "1"}):
+                pass
+
+    topic_limiter, _ = get_topic_limiter("b", {"max_concurrent_requests": "1"})
+    assert topic_limiter.in_use == 0
+
+
+def test_topic_limiter_rebuilt_on_config_change(fresh_limiters):
+    """
+    Test that topic limiters are reused until the topic's limits change
+    """
+    limiter, max_queue_seconds = get_topic_limiter(
+        "a", {"max_concurrent_requests": "2", "max_queue_seconds": "5"}
+    )
+    assert limiter.max_concurrent == 2
+    assert max_queue_seconds == 5
+    assert (
+        get_topic_limiter(
+            "a", {"max_concurrent_requests": "2", "max_queue_seconds": "5"}
+        )[0]
+        is limiter
+    )
+    assert get_topic_limiter("a", {"max_concurrent_requests": "3"})[0] is not limiter
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "max_queued_requests,expected_status_code", [("0", 429), ("5", 503)]
+)
+async def test_ask_admission_rejected(
+    max_queued_requests,
+    expected_status_code,
+    fresh_limiters,
+    client,
+    monkeypatch,
+    tmp_path,
+):
+    """
+    Test that requests over a topic's limit are rejected quickly with a 429 (asking
+    the client to retry after the topic's queue time) when the queue is full and a
+    503 when they waited too long
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "ASK_MAX_QUEUE_SECONDS", 30)
+
+    started = asyncio.Event()
+
+    async def _arun(*args, **kwargs):
+        started.set()
+        await asyncio.sleep(0.2)
+        return {"result": "yes", "source_documents": []}
+
+    mock_topic_chain = MagicMock(NAME="SomeChain")
+    mock_topic_chain.arun = _arun
+    monkeypatch.setattr(
+        config,
+        "topics",
+        {
+            "default": {
+                "topic_chain": mock_topic_chain,
+                "max_concurrent_requests": "1",
+                "max_queued_requests": max_queued_requests,
+                "max_queue_seconds": "0.05",
+            }
+        },
+    )
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=client.app), base_url="http://test"
+    ) as async_client:
+        first = asyncio.ensure_future(
+            async_client.post("/ask", json={"query": "first"})
+        )
+        await started.wait()
+        second = await async_client.post("/ask", json={"query": "second"})
+        first = await first
+
+    assert first.status_code == 200
+    assert second.status_code == expected_status_code
+    if expected_status_code == 429:
+        assert second.headers["Retry-After"] == "1"
+
+
+@pytest.mark.asyncio
+async def test_ask_unauthorized_not_admitted(
+    fresh_limiters, client, monkeypatch, tmp_path
+):
+    """
+    Test that unauthorized requests are rejected before they're admitted, so they
+    don't wait for (or take) a slot
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", False)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+
+    started = asyncio.Event()
+
+    async def _arun(*args, **kwargs):
+        started.set()
+        await asyncio.sleep(0.2)
+        return {"result": "yes", "source_documents": []}
+
+    mock_topic_chain = MagicMock(NAME="SomeChain")
+    mock_topic_chain.arun = _arun
+    topic_config = {
+        "topic_chain": mock_topic_chain,
+        "max_concurrent_requests": "1",
+        "max_queued_requests": "0",
+    }
+    monkeypatch.setattr(config, "topics", {"default": topic_config})
+
+    async def _auth_request(token, **kwargs):
+        return token == "good"
+
+    with (
+        patch("gen3discoveryai.auth.arborist", new_callable=AsyncMock) as arborist,
+        patch("gen3discoveryai.routes.get_user_id", AsyncMock(return_value="user")),
+    ):
+        arborist.auth_request.side_effect = _auth_request
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=client.app), base_url="http://test"
+        ) as async_client:
+            first = asyncio.ensure_future(
+                async_client.post(
+                    "/ask",
+                    json={"query": "first"},
+                    headers={"Authorization": "Bearer good"},
+                )
+            )
+            await started.wait()
+            second = await async_client.post(
+                "/ask",
+                json={"query": "second"},
+                headers={"Authorization": "Bearer of.bad.news"},
+            )
+            first = await first
+
+    assert first.status_code == 200
+    assert second.status_code == 403
+    topic_limiter, _ = get_topic_limiter("default", topic_config)
+    assert topic_limiter.in_use == 0
+    assert topic_limiter.queued == 0
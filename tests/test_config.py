@@ -1,12 +1,13 @@
 import importlib
 import os
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 
 from gen3discoveryai import config
 from gen3discoveryai.main import _override_generated_openapi_spec, lifespan
 from gen3discoveryai.topic_chains.utils import get_from_cfg_metadata
+from gen3discoveryai.topic_init import get_topic_initializer
 
 
 def test_bad_config_metadata():
@@ -23,12 +24,12 @@ def test_bad_config_metadata():
 
 
 @pytest.mark.asyncio
-@patch("gen3discoveryai.main._create_and_register_topic_chain")
-async def test_bad_config_default_topic(create_and_register_topic_chain, client):
+@patch("gen3discoveryai.main.get_topic_chain_factory")
+async def test_bad_config_default_topic(get_topic_chain_factory, client):
     """
     Test when config loading raises an error, it's reraised if it's the default topic
     """
-    create_and_register_topic_chain.side_effect = Exception("some exception")
+    get_topic_chain_factory.return_value.get.side_effect = Exception("some exception")
 
     with pytest.raises(Exception):
         async with lifespan(client.app, force_reload_config=True):
@@ -36,22 +37,26 @@ async def test_bad_config_default_topic(create_and_register_topic_chain, client)
 
 
 @pytest.mark.asyncio
-@patch("gen3discoveryai.main._create_and_register_topic_chain")
-async def test_bad_config_non_default_topic(create_and_register_topic_chain, client):
+@patch("gen3discoveryai.main.get_topic_chain_factory")
+async def test_bad_config_non_default_topic(get_topic_chain_factory, client):
     """
     Test when config loading raises an error, it's NOT reraised if it's not the default topic
     """
 
-    def _exception_if_default(*args, **kwargs):
+    def _exception_if_not_default(*args, **kwargs):
         # simulate default topic being okay, e.g. don't raise error here
-        if kwargs.get("topic") == "default":
-            pass
+        if kwargs.get("topic") != "default":
+            raise Exception("some exception")
+        return MagicMock()
 
-    create_and_register_topic_chain.side_effect = _exception_if_default
+    get_topic_chain_factory.return_value.get.side_effect = _exception_if_not_default
 
-    async with lifespan(client.app):
+    async with lifespan(client.app, force_reload_config=True):
         # we don't expect an exception for non default topics
-        assert True
+        statuses = get_topic_initializer().get_statuses()
+        assert statuses["default"]["status"] == "ready"
+        assert statuses["bdc"]["status"] == "failed"
+        assert "some exception" in statuses["bdc"]["error"]
 
 
 def test_metadata_cfg_util():
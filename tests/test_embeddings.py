@@ -0,0 +1,362 @@
+import sqlite3
+import threading
+from typing import List
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from gen3discoveryai import config, embeddings
+from gen3discoveryai.embeddings import (
+    EMBEDDING_ROLE_DOCUMENT,
+    CachedEmbeddings,
+    InMemoryVectorCache,
+    SQLiteVectorCache,
+    get_cached_embeddings,
+    get_embedding_model_id,
+)
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Fake embedding function which records every text it embeds
+    """
+
+    def __init__(self, model: str = "fake-model") -> None:
+        self.model = model
+        self.embedded = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.embedded.append(text)
+        return [float(len(text)), 0.5, 0.25]
+
+
+@pytest.fixture
+def embedding_cache_enabled(monkeypatch):
+    """
+    Fresh (memory only) embedding cache tiers
+    """
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_ENABLED", True)
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_MAX_ENTRIES", 100)
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_SQLITE_PATH", "")
+    monkeypatch.setattr(embeddings, "_memory_tier", None)
+    monkeypatch.setattr(embeddings, "_disk_tier", None)
+
+
+def test_embed_query_cached(embedding_cache_enabled):
+    """
+    Test that identical queries are only embedded once and hits/misses are counted
+    """
+    fake_embeddings = CountingEmbeddings()
+    cached_embeddings = get_cached_embeddings(fake_embeddings)
+    hits = cached_embeddings.hits.get(model="CountingEmbeddings:fake-model")
+
+    first = cached_embeddings.embed_query("covid")
+    second = cached_embeddings.embed_query("covid")
+
+    assert first == second == [5.0, 0.5, 0.25]
+    assert isinstance(second, list)
+    assert fake_embeddings.embedded == ["covid"]
+    assert cached_embeddings.hits.get(model="CountingEmbeddings:fake-model") == hits + 1
+
+
+@pytest.mark.asyncio
+async def test_async_embeddings_cached(embedding_cache_enabled):
+    """
+    Test that sync and async embedding share the same cache
+    """
+    fake_embeddings = CountingEmbeddings()
+    cached_embeddings = get_cached_embeddings(fake_embeddings)
+
+    cached_embeddings.embed_query("covid")
+    assert await cached_embeddings.aembed_query("covid") == [5.0, 0.5, 0.25]
+    assert await cached_embeddings.aembed_query("flu") == [3.0, 0.5, 0.25]
+    cached_embeddings.embed_documents(["covid"])
+    assert await cached_embeddings.aembed_documents(["covid", "flu", "hiv"]) == [
+        [5.0, 0.5, 0.25],
+        [3.0, 0.5, 0.25],
+        [3.0, 0.5, 0.25],
+    ]
+
+    assert fake_embeddings.embedded == ["covid", "flu", "covid", "flu", "hiv"]
+
+
+def test_embed_documents_only_embeds_missing(embedding_cache_enabled):
+    """
+    Test that only uncached (and unique) texts are embedded and the results stay in
+    order
+    """
+    fake_embeddings = CountingEmbeddings()
+    cached_embeddings = get_cached_embeddings(fake_embeddings)
+
+    cached_embeddings.embed_documents(["b"])
+    vectors = cached_embeddings.embed_documents(["aa", "b", "aa", "cccc"])
+
+    assert [vector[0] for vector in vectors] == [2.0, 1.0, 2.0, 4.0]
+    assert fake_embeddings.embedded == ["b", "aa", "cccc"]
+
+
+def test_models_do_not_share_vectors(embedding_cache_enabled):
+    """
+    Test that the same text embedded by different models is cached separately
+    """
+    model_a = CountingEmbeddings(model="a")
+    model_b = CountingEmbeddings(model="b")
+
+    get_cached_embeddings(model_a).embed_query("covid")
+    get_cached_embeddings(model_b).embed_query("covid")
+    get_cached_embeddings(model_a).embed_query("covid")
+
+    assert model_a.embedded == ["covid"]
+    assert model_b.embedded == ["covid"]
+
+
+class TaskTypeEmbeddings(Embeddings):
+    """
+    Fake embedding function which, like Vertex AI, embeds queries and documents with
+    different task types and so gives different vectors for the same text
+    """
+
+    def __init__(self, task_type: str = None) -> None:
+        self.model = "fake-model"
+        self.task_type = task_type
+        self.embedded = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(("document", self.task_type, text) for text in texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.embedded.append(("query", self.task_type, text))
+        return [float(len(text)), -1.0]
+
+
+def test_query_and_document_cached_separately(embedding_cache_enabled):
+    """
+    Test that the same text embedded as a query and as a document (or with different
+    task types) is cached separately, so neither is returned for the other
+    """
+    fake_embeddings = TaskTypeEmbeddings()
+    cached_embeddings = get_cached_embeddings(fake_embeddings)
+
+    assert cached_embeddings.embed_documents(["covid"]) == [[5.0, 1.0]]
+    assert cached_embeddings.embed_query("covid") == [5.0, -1.0]
+    assert cached_embeddings.embed_documents(["covid"]) == [[5.0, 1.0]]
+    assert cached_embeddings.embed_query("covid") == [5.0, -1.0]
+    assert fake_embeddings.embedded == [
+        ("document", None, "covid"),
+        ("query", None, "covid"),
+    ]
+
+    clustering_embeddings = TaskTypeEmbeddings(task_type="CLUSTERING")
+    get_cached_embeddings(clustering_embeddings).embed_query("covid")
+    assert clustering_embeddings.embedded == [("query", "CLUSTERING", "covid")]
+
+
+def test_memory_tier_lru():
+    """
+    Test that the least recently used vector is evicted and vectors are float32
+    """
+    tier = InMemoryVectorCache(max_entries=2)
+    cached_embeddings = CachedEmbeddings(CountingEmbeddings(), tier)
+
+    cached_embeddings.embed_documents(["a", "bb"])
+    cached_embeddings.embed_documents(["a"])
+    cached_embeddings.embed_documents(["ccc"])
+
+    assert len(tier) == 2
+    bb_key = cached_embeddings._get_key("bb", EMBEDDING_ROLE_DOCUMENT)
+    assert bb_key not in tier.get_many([bb_key])
+    a_key = cached_embeddings._get_key("a", EMBEDDING_ROLE_DOCUMENT)
+    assert tier.get_many([a_key])[a_key].dtype == np.float32
+
+
+def test_disk_tier(tmp_path):
+    """
+    Test that vectors persist in the disk tier (e.g. across restarts) and are promoted
+    into the memory tier
+    """
+    path = str(tmp_path / "cache" / "embeddings.sqlite")
+    fake_embeddings = CountingEmbeddings()
+
+    CachedEmbeddings(
+        fake_embeddings, InMemoryVectorCache(10), SQLiteVectorCache(path)
+    ).embed_documents(["a", "bb"])
+
+    memory_tier = InMemoryVectorCache(10)
+    restarted = CachedEmbeddings(fake_embeddings, memory_tier, SQLiteVectorCache(path))
+
+    assert restarted.embed_documents(["bb", "a"]) == [
+        [2.0, 0.5, 0.25],
+        [1.0, 0.5, 0.25],
+    ]
+    assert fake_embeddings.embedded == ["a", "bb"]
+    assert len(memory_tier) == 2
+    assert len(SQLiteVectorCache(path)) == 2
+
+
+@pytest.mark.asyncio
+async def test_async_disk_tier_off_event_loop(tmp_path):
+    """
+    Test that async embedding reads and writes the disk tier in another thread, so
+    SQLite doesn't block the event loop
+    """
+    disk_tier = SQLiteVectorCache(str(tmp_path / "embeddings.sqlite"))
+    cached_embeddings = CachedEmbeddings(
+        CountingEmbeddings(), InMemoryVectorCache(10), disk_tier
+    )
+    threads = []
+
+    def _record_thread(method):
+        def _method(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return method(*args, **kwargs)
+
+        return _method
+
+    with (
+        patch.object(disk_tier, "get_many", _record_thread(disk_tier.get_many)),
+        patch.object(disk_tier, "set_many", _record_thread(disk_tier.set_many)),
+    ):
+        assert await cached_embeddings.aembed_query("a") == [1.0, 0.5, 0.25]
+        assert await cached_embeddings.aembed_documents(["a", "bb"]) == [
+            [1.0, 0.5, 0.25],
+            [2.0, 0.5, 0.25],
+        ]
+
+    # the query, then the documents, were read and then written
+    assert len(threads) == 4
+    assert threading.current_thread() not in threads
+    assert len(disk_tier) == 3
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    """
+    Test that the disk tier evicts the least recently used vectors once it's over its
+    max entries, where reading a vector counts as using it
+    """
+    disk_tier = SQLiteVectorCache(str(tmp_path / "embeddings.sqlite"), max_entries=10)
+    vector = np.ones(3, dtype=np.float32)
+
+    with patch.object(embeddings.time, "time", return_value=1000):
+        disk_tier.set_many({f"old_{i}": vector for i in range(5)})
+    with patch.object(embeddings.time, "time", return_value=10000):
+        disk_tier.set_many({f"new_{i}": vector for i in range(5)})
+    assert len(disk_tier) == 10
+
+    # used again well after it was written
+    with patch.object(embeddings.time, "time", return_value=20000):
+        assert list(disk_tier.get_many(["old_0"])) == ["old_0"]
+        disk_tier.set_many({"newest": vector})
+
+    assert len(disk_tier) == 10
+    assert sorted(disk_tier.get_many(["old_0", "old_1", "new_0", "newest"])) == [
+        "new_0",
+        "newest",
+        "old_0",
+    ]
+
+    unlimited = SQLiteVectorCache(str(tmp_path / "unlimited.sqlite"))
+    unlimited.set_many({f"key_{i}": vector for i in range(20)})
+    assert unlimited.prune() == 0
+    assert len(unlimited) == 20
+
+
+def test_disk_tier_without_last_used(tmp_path):
+    """
+    Test that a disk tier created before vectors' last use was tracked is upgraded,
+    and its vectors are evicted first
+    """
+    path = str(tmp_path / "embeddings.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+    )
+    connection.executemany(
+        "INSERT INTO embeddings (key, vector) VALUES (?, ?)",
+        [(f"old_{i}", np.ones(3, dtype=np.float32).tobytes()) for i in range(3)],
+    )
+    connection.commit()
+    connection.close()
+
+    disk_tier = SQLiteVectorCache(path, max_entries=3)
+    assert list(disk_tier.get_many(["old_0"])) == ["old_0"]
+    disk_tier.set_many({"new": np.ones(3, dtype=np.float32)})
+
+    assert len(disk_tier) == 3
+    assert sorted(disk_tier.get_many(["old_0", "new"])) == ["new", "old_0"]
+
+    # evicted down to the max when opened
+    assert len(SQLiteVectorCache(path, max_entries=2)) == 2
+
+
+def test_disk_tier_errors_are_misses(tmp_path):
+    """
+    Test that a broken disk tier doesn't fail embedding
+    """
+    disk_tier = SQLiteVectorCache(str(tmp_path / "embeddings.sqlite"))
+    fake_embeddings = CountingEmbeddings()
+    cached_embeddings = CachedEmbeddings(
+        fake_embeddings, InMemoryVectorCache(10), disk_tier
+    )
+
+    with patch.object(disk_tier, "get_many", side_effect=Exception("failed")):
+        with patch.object(disk_tier, "set_many", side_effect=Exception("failed")):
+            assert cached_embeddings.embed_query("a") == [1.0, 0.5, 0.25]
+
+
+def test_get_cached_embeddings_disabled(monkeypatch):
+    """
+    Test that the embedding function is used as-is when caching is disabled
+    """
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_ENABLED", False)
+    fake_embeddings = CountingEmbeddings()
+
+    assert get_cached_embeddings(fake_embeddings) is fake_embeddings
+
+
+def test_get_cached_embeddings_shared_tiers(
+    embedding_cache_enabled, monkeypatch, tmp_path
+):
+    """
+    Test that all wrapped embedding functions share the same tiers
+    """
+    monkeypatch.setattr(
+        config, "EMBEDDING_CACHE_SQLITE_PATH", str(tmp_path / "embeddings.sqlite")
+    )
+    monkeypatch.setattr(config, "EMBEDDING_CACHE_SQLITE_MAX_ENTRIES", 50)
+
+    first = get_cached_embeddings(CountingEmbeddings())
+    second = get_cached_embeddings(CountingEmbeddings())
+
+    assert first.memory_tier is second.memory_tier
+    assert first.disk_tier is second.disk_tier
+    assert isinstance(first.disk_tier, SQLiteVectorCache)
+    assert first.disk_tier.max_entries == 50
+
+
+@pytest.mark.parametrize(
+    "attributes,expected",
+    [
+        ({"model": "text-embedding-3-small"}, "text-embedding-3-small"),
+        ({"model_name": "gemini-embedding-001"}, "gemini-embedding-001"),
+        ({}, ""),
+    ],
+)
+def test_get_embedding_model_id(attributes, expected):
+    """
+    Test identifying the embedding model from the common attribute names
+    """
+
+    class SomeEmbeddings:
+        pass
+
+    some_embeddings = SomeEmbeddings()
+    for name, value in attributes.items():
+        setattr(some_embeddings, name, value)
+
+    assert get_embedding_model_id(some_embeddings) == f"SomeEmbeddings:{expected}"
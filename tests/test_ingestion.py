@@ -0,0 +1,463 @@
+import math
+import operator
+import os
+import threading
+import time
+from typing import List
+from unittest.mock import MagicMock
+
+import chromadb
+import pytest
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from gen3discoveryai import config, ingestion
+from gen3discoveryai.embeddings import CachedEmbeddings, InMemoryVectorCache
+from gen3discoveryai.ingestion import (
+    AdaptiveRateLimiter,
+    IngestionManifest,
+    call_with_retries,
+    embed_and_store,
+    get_embedding_provider,
+    get_rate_limiter,
+    is_rate_limit_error,
+    is_retryable_error,
+    iter_prefetched,
+    map_in_processes,
+)
+from gen3discoveryai.knowledge import read_ingestion_manifest
+from gen3discoveryai.metrics import get_counter
+
+
+class FakeClock:
+    """
+    Clock which only moves when something sleeps
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimitError(Exception):
+    """
+    Same name as the OpenAI client's error
+    """
+
+
+class SlowEmbeddings(Embeddings):
+    """
+    Fake embedding function with latency which records how many requests overlap
+    """
+
+    def __init__(self, latency: float = 0.02, fail_first: int = 0) -> None:
+        self.latency = latency
+        self.fail_first = fail_first
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+            if self.calls <= self.fail_first:
+                raise RateLimitError("slow down")
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.latency)
+        with self._lock:
+            self.active -= 1
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float(len(text)), 1.0, 0.5]
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limiters(monkeypatch):
+    """
+    Rate limiters aren't shared between tests
+    """
+    monkeypatch.setattr(ingestion, "_rate_limiters", {})
+
+
+def test_rate_limiter_waits_for_tokens():
+    """
+    Test that requests beyond the tokens per minute wait for the bucket to refill
+    """
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(600, clock=clock, sleep=clock.sleep)
+
+    limiter.acquire(400)
+    limiter.acquire(200)
+    assert clock.sleeps == []
+
+    # 10 tokens per second
+    limiter.acquire(100)
+    assert sum(clock.sleeps) == pytest.approx(10)
+
+    # larger than the bucket, waits for a full one
+    clock.sleeps.clear()
+    limiter.acquire(1000)
+    assert sum(clock.sleeps) == pytest.approx(60)
+
+
+def test_rate_limiter_adapts():
+    """
+    Test that rate limiting lowers the rate (down to the minimum) and that successes
+    raise it back up to the configured rate
+    """
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(
+        10000, min_tokens_per_minute=3000, clock=clock, sleep=clock.sleep
+    )
+
+    limiter.on_rate_limited()
+    assert limiter.tokens_per_minute == 5000
+    limiter.on_rate_limited()
+    assert limiter.tokens_per_minute == 3000
+
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.tokens_per_minute == 8000
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.tokens_per_minute == 10000
+
+
+def test_unlimited_rate_limiter_learns_limit():
+    """
+    Test that without a configured rate, the rate is learned from recent usage when
+    the provider rate limits
+    """
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(0, clock=clock, sleep=clock.sleep)
+
+    for _ in range(10):
+        limiter.acquire(1000)
+    assert clock.sleeps == []
+
+    limiter.on_rate_limited()
+    assert limiter.tokens_per_minute == 5000
+
+    limiter.acquire(1000)
+    assert sum(clock.sleeps) == pytest.approx(12)
+
+
+def test_get_rate_limiter(monkeypatch):
+    """
+    Test that rate limiters are shared per provider and use the configured rates
+    """
+    monkeypatch.setattr(config, "OPENAI_EMBEDDING_TOKENS_PER_MINUTE", 5000)
+    monkeypatch.setattr(config, "GOOGLE_EMBEDDING_TOKENS_PER_MINUTE", 0)
+
+    assert get_rate_limiter("openai") is get_rate_limiter("openai")
+    assert get_rate_limiter("openai").tokens_per_minute == 5000
+    assert get_rate_limiter("google").tokens_per_minute is None
+    assert get_rate_limiter("unknown").tokens_per_minute is None
+
+
+def test_get_embedding_provider():
+    """
+    Test identifying providers, including through the embedding cache
+    """
+    OpenAIEmbeddings = type("OpenAIEmbeddings", (SlowEmbeddings,), {})
+    cached = CachedEmbeddings(OpenAIEmbeddings(), InMemoryVectorCache(10))
+
+    assert get_embedding_provider(cached) == "openai"
+    assert get_embedding_provider(SlowEmbeddings()) == "SlowEmbeddings"
+
+
+@pytest.mark.parametrize(
+    "error,rate_limited,retryable",
+    [
+        (RateLimitError(), True, True),
+        (type("APIStatusError", (Exception,), {"status_code": 429})(), True, True),
+        (type("ServerError", (Exception,), {"code": 503})(), False, True),
+        (TimeoutError(), False, True),
+        (type("APITimeoutError", (Exception,), {})(), False, True),
+        (type("BadRequestError", (Exception,), {"status_code": 400})(), False, False),
+        (ValueError(), False, False),
+    ],
+)
+def test_retryable_errors(error, rate_limited, retryable):
+    """
+    Test classifying provider errors
+    """
+    assert is_rate_limit_error(error) == rate_limited
+    assert is_retryable_error(error) == retryable
+
+
+def test_call_with_retries():
+    """
+    Test that transient errors are retried with growing, jittered delays and that
+    rate limits lower the provider's rate
+    """
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(10000, clock=clock, sleep=clock.sleep)
+    func = MagicMock(side_effect=[RateLimitError(), TimeoutError(), "vectors"])
+    retries = get_counter("ingestion_embedding_retries_total")
+    rate_limited_before = retries.get(rate_limited="true")
+
+    assert (
+        call_with_retries(
+            func, limiter, 10, max_retries=3, backoff_seconds=1, sleep=clock.sleep
+        )
+        == "vectors"
+    )
+    assert func.call_count == 3
+    assert 0 <= clock.sleeps[0] <= 1
+    assert 0 <= clock.sleeps[1] <= 2
+    assert retries.get(rate_limited="true") == rate_limited_before + 1
+    # lowered for the rate limit, then slightly raised for the success
+    assert limiter.tokens_per_minute == 5500
+
+
+def test_call_with_retries_gives_up():
+    """
+    Test that errors which aren't transient, or keep happening, are raised
+    """
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(0, clock=clock, sleep=clock.sleep)
+
+    func = MagicMock(side_effect=ValueError())
+    with pytest.raises(ValueError):
+        call_with_retries(func, limiter, 10, max_retries=3, sleep=clock.sleep)
+    assert func.call_count == 1
+
+    func = MagicMock(side_effect=TimeoutError())
+    with pytest.raises(TimeoutError):
+        call_with_retries(func, limiter, 10, max_retries=2, sleep=clock.sleep)
+    assert func.call_count == 3
+
+
+def test_embed_and_store_chroma(monkeypatch):
+    """
+    Test that documents are embedded in concurrent batches and all written to Chroma,
+    with and without metadata, retrying rate limited batches
+    """
+    monkeypatch.setattr(config, "INGESTION_MAX_RETRIES", 3)
+    monkeypatch.setattr(ingestion.random, "uniform", lambda low, high: 0)
+    monkeypatch.setattr(
+        ingestion, "_rate_limiters", {"SlowEmbeddings": AdaptiveRateLimiter(10**9)}
+    )
+    embeddings = SlowEmbeddings(fail_first=1)
+    vectorstore = Chroma(
+        collection_name="test",
+        embedding_function=embeddings,
+        client=chromadb.EphemeralClient(),
+    )
+    documents = [
+        Document(page_content=f"study {i}", metadata={"source": str(i)} if i else {})
+        for i in range(25)
+    ]
+    ids = [str(i) for i in range(25)]
+
+    assert (
+        embed_and_store(vectorstore, zip(ids, documents), batch_size=4, concurrency=3)
+        == 25
+    )
+
+    # 7 batches, one retried
+    assert embeddings.calls == 8
+    assert 1 < embeddings.max_active <= 3
+    stored = vectorstore.get(include=["documents", "embeddings", "metadatas"])
+    assert sorted(stored["ids"]) == sorted(ids)
+    by_id = dict(zip(stored["ids"], zip(stored["documents"], stored["metadatas"])))
+    assert by_id["7"] == ("study 7", {"source": "7"})
+    assert by_id["0"][0] == "study 0"
+    assert list(stored["embeddings"][0]) == [7.0, 1.0, 0.5]
+
+
+def test_embed_and_store_other_vectorstore():
+    """
+    Test that vectorstores other than Chroma are given each batch to embed themselves
+    """
+    vectorstore = MagicMock()
+    documents = [Document(page_content=f"study {i}") for i in range(5)]
+    ids = [str(i) for i in range(5)]
+
+    stored = []
+
+    embed_and_store(
+        vectorstore,
+        zip(ids, documents),
+        batch_size=2,
+        concurrency=2,
+        on_stored=stored.append,
+    )
+
+    assert sorted(stored) == [1, 2, 2]
+    batches = sorted(
+        call.kwargs["ids"] for call in vectorstore.add_documents.call_args_list
+    )
+    assert batches == [["0", "1"], ["2", "3"], ["4"]]
+
+
+def test_embed_and_store_error():
+    """
+    Test that an error embedding a batch is raised and stops further batches
+    """
+    vectorstore = MagicMock()
+    vectorstore.add_documents.side_effect = ValueError("bad document")
+    documents = ((str(i), Document(page_content=f"study {i}")) for i in range(50))
+
+    with pytest.raises(ValueError):
+        embed_and_store(vectorstore, documents, batch_size=1)
+
+    assert vectorstore.add_documents.call_count < 50
+
+
+def test_embed_and_store_streams_documents():
+    """
+    Test that documents are only read from the iterable as batches are stored,
+    rather than all up front
+    """
+    lock = threading.Lock()
+    read = 0
+    stored = 0
+    max_in_memory = 0
+
+    def _documents():
+        nonlocal read, max_in_memory
+        for i in range(100):
+            with lock:
+                read += 1
+                max_in_memory = max(max_in_memory, read - stored)
+            yield str(i), Document(page_content=f"study {i}")
+
+    def _add_documents(documents, ids):
+        nonlocal stored
+        with lock:
+            stored += len(ids)
+
+    vectorstore = MagicMock()
+    vectorstore.add_documents.side_effect = _add_documents
+
+    assert (
+        embed_and_store(vectorstore, _documents(), batch_size=5, concurrency=2) == 100
+    )
+
+    assert vectorstore.add_documents.call_count == 20
+    # at most the batches in flight (2 per concurrent request) and the next one
+    assert max_in_memory <= 5 * (2 * 2 + 1)
+
+
+def test_iter_prefetched():
+    """
+    Test that items are produced ahead of the consumer, but only up to the limit
+    """
+    produced = []
+
+    def _items():
+        for i in range(20):
+            produced.append(i)
+            yield i
+
+    items = iter_prefetched(_items(), max_items=3)
+    assert next(items) == 0
+    time.sleep(0.1)
+    # one consumed, 3 waiting in the queue, and one waiting to be put
+    assert len(produced) == 5
+
+    assert list(items) == list(range(1, 20))
+
+
+def test_iter_prefetched_error():
+    """
+    Test that errors producing items are raised to the consumer, and that production
+    stops when the consumer stops
+    """
+
+    def _failing():
+        yield 1
+        raise ValueError("bad row")
+
+    items = iter_prefetched(_failing())
+    assert next(items) == 1
+    with pytest.raises(ValueError):
+        next(items)
+
+    produced = []
+
+    def _endless():
+        i = 0
+        while True:
+            produced.append(i)
+            yield i
+            i += 1
+
+    items = iter_prefetched(_endless(), max_items=2)
+    assert next(items) == 0
+    items.close()
+    count = len(produced)
+    time.sleep(0.2)
+    assert len(produced) == count
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_map_in_processes(workers):
+    """
+    Test that results are in the same order as the items for any number of workers
+    """
+    results = map_in_processes(operator.neg, range(50), workers, max_pending=4)
+
+    assert list(results) == [-i for i in range(50)]
+
+
+def test_map_in_processes_error():
+    """
+    Test that errors in the worker processes are raised to the caller
+    """
+    with pytest.raises(ValueError):
+        list(map_in_processes(math.sqrt, [1, -1, 4], workers=2))
+
+
+def test_ingestion_manifest(monkeypatch, tmp_path):
+    """
+    Test that nothing is written before a load starts, that progress is written at
+    most every interval, and that the outcome is always written
+    """
+    monkeypatch.chdir(tmp_path)
+    input_file = tmp_path / "test.tsv"
+    input_file.write_text("guid\nrow 1\nrow 2\n")
+    manifest = IngestionManifest("test", save_interval_seconds=60)
+
+    manifest.record_file_read(str(input_file), 5)
+    assert read_ingestion_manifest("test") == {}
+
+    assert manifest.start() is None
+    manifest.set_version("v1")
+    assert read_ingestion_manifest("test")["files"] == {
+        str(input_file): {
+            "size": 17,
+            "mtime": os.stat(input_file).st_mtime,
+            "bytes_read": 5,
+        }
+    }
+
+    # throttled
+    manifest.record_file_read(str(input_file))
+    manifest.record_stored(3)
+    assert read_ingestion_manifest("test")["stored"] == 0
+
+    manifest.finish({"added": 3, "removed": 0, "unchanged": 0})
+    written = read_ingestion_manifest("test")
+    assert written["status"] == "complete"
+    assert written["version"] == "v1"
+    assert written["stored"] == 3
+    assert written["files"][str(input_file)]["bytes_read"] == 17
+    assert written["counts"] == {"added": 3, "removed": 0, "unchanged": 0}
+
+    # a completed load isn't resumed
+    assert IngestionManifest("test", resume=True).start() is None
+    assert read_ingestion_manifest("test")["attempts"] == 1
@@ -0,0 +1,395 @@
+import asyncio
+import os
+from unittest.mock import patch
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from gen3discoveryai import config
+from gen3discoveryai.ingestion import IngestionManifest
+from gen3discoveryai.knowledge import (
+    activate_knowledge_version,
+    bump_knowledge_version,
+    create_knowledge_version,
+    delete_knowledge_version,
+    get_document_id,
+    get_knowledge_directory,
+    get_knowledge_store_directory,
+    get_knowledge_version,
+    list_knowledge_versions,
+    read_ingestion_manifest,
+)
+from gen3discoveryai.main import watch_knowledge_versions
+from gen3discoveryai.topic_chains import base
+from gen3discoveryai.topic_chains.base import TopicChain
+from gen3discoveryai.topic_chains.question_answer_openai import (
+    TopicChainOpenAiQuestionAnswerRAG,
+)
+
+
+@pytest.fixture
+def versioned_topic_chain(monkeypatch, tmp_path):
+    """
+    OpenAI topic chain for the `test` topic with a knowledge store in a temporary
+    directory and fake embeddings
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "KNOWLEDGE_VERSIONS_TO_KEEP", 2)
+    topic_chain = TopicChainOpenAiQuestionAnswerRAG("test")
+    topic_chain.embeddings = DeterministicFakeEmbedding(size=8)
+    return topic_chain
+
+
+def _store(topic_chain, *contents):
+    topic_chain.store_knowledge(
+        [
+            Document(page_content=content, metadata={"source": content})
+            for content in contents
+        ]
+    )
+    return topic_chain.knowledge_version
+
+
+def _retrieved(topic_chain):
+    return sorted(
+        document.page_content
+        for document in topic_chain.chain.retriever.vectorstore.similarity_search(
+            "study", k=10
+        )
+    )
+
+
+def test_knowledge_versions(monkeypatch, tmp_path):
+    """
+    Test creating, activating, and pruning knowledge versions, starting from a store
+    persisted before versioning
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "KNOWLEDGE_VERSIONS_TO_KEEP", 1)
+    knowledge_directory = get_knowledge_directory("test")
+    os.makedirs(knowledge_directory)
+    with open(os.path.join(knowledge_directory, "chroma.sqlite3"), "w") as file_out:
+        file_out.write("legacy")
+    bump_knowledge_version("test")
+
+    # versions without their own directory use the store in the knowledge directory
+    assert get_knowledge_store_directory("test") == knowledge_directory
+
+    first = create_knowledge_version("test")
+    first_directory = get_knowledge_store_directory("test", first)
+    assert sorted(os.listdir(first_directory)) == ["chroma.sqlite3"]
+    # not active until activated
+    assert get_knowledge_store_directory("test") == knowledge_directory
+
+    activate_knowledge_version("test", first)
+    assert get_knowledge_version("test") == first
+    assert get_knowledge_store_directory("test") == first_directory
+
+    second = create_knowledge_version("test")
+    third = create_knowledge_version("test")
+    assert list_knowledge_versions("test") == [first, second, third]
+
+    # only the most recent previous version is kept
+    activate_knowledge_version("test", third)
+    assert list_knowledge_versions("test") == [second, third]
+
+    with pytest.raises(KeyError):
+        activate_knowledge_version("test", first)
+    with pytest.raises(ValueError):
+        delete_knowledge_version("test", third)
+
+
+def test_store_knowledge_version_discarded_on_error(versioned_topic_chain):
+    """
+    Test that a version which fails to build is removed and never activated
+    """
+    version = _store(versioned_topic_chain, "study a")
+
+    with pytest.raises(AttributeError):
+        versioned_topic_chain.store_knowledge(["not a document"])
+
+    assert list_knowledge_versions("test") == [version]
+    assert get_knowledge_version("test") == version
+
+
+def test_resume_failed_load(versioned_topic_chain, monkeypatch):
+    """
+    Test that a load which fails with a manifest keeps its partially built version,
+    and that resuming it only embeds what wasn't stored yet
+    """
+    monkeypatch.setattr(config, "INGESTION_BATCH_SIZE", 1)
+    monkeypatch.setattr(config, "INGESTION_CONCURRENCY", 1)
+    active = _store(versioned_topic_chain, "study a")
+    documents = [
+        Document(page_content=f"study {i}", metadata={"source": str(i)})
+        for i in range(10)
+    ]
+
+    def _failing():
+        yield from documents[:6]
+        raise ConnectionError("provider went away")
+
+    with pytest.raises(ConnectionError):
+        versioned_topic_chain.store_knowledge(
+            _failing(), manifest=IngestionManifest("test")
+        )
+
+    manifest = read_ingestion_manifest("test")
+    assert manifest["status"] == "failed"
+    assert "provider went away" in manifest["error"]
+    unfinished = manifest["version"]
+    assert list_knowledge_versions("test") == [active, unfinished]
+    assert get_knowledge_version("test") == active
+    stored = versioned_topic_chain.create_vectorstore(
+        get_knowledge_store_directory("test", unfinished)
+    ).get(include=[])["ids"]
+    # "study a" was copied from the active version
+    assert 0 < manifest["stored"] == len(stored) - 1 < 6
+
+    embeddings = versioned_topic_chain.embeddings
+    with patch.object(
+        type(embeddings), "embed_documents", side_effect=embeddings.embed_documents
+    ) as embed_documents:
+        counts = versioned_topic_chain.store_knowledge(
+            documents, manifest=IngestionManifest("test", resume=True)
+        )
+
+    # chunks stored before the failure are already in the version
+    assert counts == {
+        "added": 10 - manifest["stored"],
+        "removed": 1,
+        "unchanged": manifest["stored"],
+    }
+    assert embed_documents.call_count == 10 - manifest["stored"]
+    assert versioned_topic_chain.knowledge_version == unfinished
+    assert _retrieved(versioned_topic_chain) == sorted(
+        document.page_content for document in documents
+    )
+    manifest = read_ingestion_manifest("test")
+    assert manifest["status"] == "complete"
+    assert manifest["attempts"] == 2
+    assert manifest["stored"] == 10
+    assert manifest["counts"] == counts
+
+
+def test_unfinished_load_discarded(versioned_topic_chain):
+    """
+    Test that starting a load without resuming discards the previous unfinished one,
+    and that a full rebuild starts from an empty version
+    """
+    active = _store(versioned_topic_chain, "study a", "study b")
+
+    with pytest.raises(AttributeError):
+        versioned_topic_chain.store_knowledge(
+            ["not a document"], manifest=IngestionManifest("test")
+        )
+    unfinished = read_ingestion_manifest("test")["version"]
+    assert unfinished in list_knowledge_versions("test")
+
+    # resuming only continues the same kind of load
+    counts = versioned_topic_chain.store_knowledge(
+        [Document(page_content="study b", metadata={"source": "study b"})],
+        full_rebuild=True,
+        manifest=IngestionManifest("test", resume=True),
+    )
+
+    assert counts == {"added": 1, "removed": 2, "unchanged": 0}
+    assert unfinished not in list_knowledge_versions("test")
+    assert active in list_knowledge_versions("test")
+    assert _retrieved(versioned_topic_chain) == ["study b"]
+    assert read_ingestion_manifest("test")["full_rebuild"] is True
+
+
+def test_store_knowledge_streamed(versioned_topic_chain, monkeypatch):
+    """
+    Test storing documents from a generator, removing what's no longer provided in
+    batches
+    """
+    monkeypatch.setattr(base, "DELETE_BATCH_SIZE", 2)
+    _store(versioned_topic_chain, *[f"study {i}" for i in range(5)])
+
+    counts = versioned_topic_chain.store_knowledge(
+        Document(page_content=content, metadata={"source": content})
+        for content in ["study 0", "study 0", "study 5"]
+    )
+
+    assert counts == {"added": 1, "removed": 4, "unchanged": 1}
+    assert _retrieved(versioned_topic_chain) == ["study 0", "study 5"]
+
+
+def test_metadata_and_embedding_model_changes_stored(versioned_topic_chain):
+    """
+    Test that a document whose metadata changed, and every document after the
+    embedding model changed, is stored again instead of left unchanged
+    """
+    documents = [
+        Document(page_content=f"study {i}", metadata={"source": f"guid_{i}"})
+        for i in range(2)
+    ]
+    versioned_topic_chain.store_knowledge(documents)
+
+    documents[1] = Document(
+        page_content="study 1", metadata={"source": "guid_1", "title": "Study 1"}
+    )
+    counts = versioned_topic_chain.store_knowledge(documents)
+    assert counts == {"added": 1, "removed": 1, "unchanged": 1}
+    assert sorted(
+        versioned_topic_chain.vectorstore.get(include=["metadatas"])["metadatas"],
+        key=lambda metadata: metadata["source"],
+    ) == [{"source": "guid_0"}, {"source": "guid_1", "title": "Study 1"}]
+
+    class OtherFakeEmbedding(DeterministicFakeEmbedding):
+        pass
+
+    versioned_topic_chain.embeddings = OtherFakeEmbedding(size=8)
+    counts = versioned_topic_chain.store_knowledge(documents)
+    assert counts == {"added": 2, "removed": 2, "unchanged": 0}
+
+
+@pytest.mark.parametrize("vectorstore_backend", ["chroma", "numpy"])
+def test_topic_chain_with_only_embeddings(vectorstore_backend, monkeypatch, tmp_path):
+    """
+    Test that a topic chain only needs to provide its embeddings to store knowledge in
+    versions of its configured vectorstore backend, and that one without embeddings
+    doesn't support it
+    """
+    monkeypatch.chdir(tmp_path)
+    topic_chain = TopicChain(
+        name="SomeChain",
+        topic="test",
+        chain=None,
+        embeddings=DeterministicFakeEmbedding(size=8),
+        vectorstore_backend=vectorstore_backend,
+    )
+    assert topic_chain.supports_knowledge_versions
+
+    counts = topic_chain.store_knowledge([Document(page_content="study a")])
+
+    assert counts == {"added": 1, "removed": 0, "unchanged": 0}
+    assert topic_chain.knowledge_version == get_knowledge_version("test")
+    assert topic_chain.vectorstore.get(include=["documents"])["documents"] == [
+        "study a"
+    ]
+
+    topic_chain = TopicChain(name="SomeChain", topic="test", chain=None)
+    assert not topic_chain.supports_knowledge_versions
+    with pytest.raises(NotImplementedError):
+        topic_chain.store_knowledge([Document(page_content="study a")])
+
+
+def test_get_document_id():
+    """
+    Test that a document's id depends on its content, metadata (but not the order of
+    its keys), and the embedding model
+    """
+    document = Document(page_content="study", metadata={"source": "a", "row": 1})
+    document_id = get_document_id(document, "model")
+
+    assert document_id == get_document_id(
+        Document(page_content="study", metadata={"row": 1, "source": "a"}), "model"
+    )
+    assert document_id != get_document_id(document, "other model")
+    assert document_id != get_document_id(
+        Document(page_content="study", metadata={"source": "a", "row": 2}), "model"
+    )
+    assert document_id != get_document_id(
+        Document(page_content="study 2", metadata={"source": "a", "row": 1}), "model"
+    )
+
+
+def test_switch_knowledge_version(versioned_topic_chain):
+    """
+    Test that switching versions changes what's retrieved, and that vectorstores
+    switched away from are released after the grace period
+    """
+    first = _store(versioned_topic_chain, "study a", "study b")
+    second = _store(versioned_topic_chain, "study a", "study c")
+    assert _retrieved(versioned_topic_chain) == ["study a", "study c"]
+
+    assert versioned_topic_chain.switch_knowledge_version(first)
+    assert not versioned_topic_chain.switch_knowledge_version(first)
+    assert versioned_topic_chain.knowledge_version == first
+    assert _retrieved(versioned_topic_chain) == ["study a", "study b"]
+
+    # defaults to the active version on disk
+    assert versioned_topic_chain.switch_knowledge_version()
+    assert versioned_topic_chain.knowledge_version == second
+
+    retired = [
+        vectorstore for _, vectorstore in versioned_topic_chain._retired_vectorstores
+    ]
+    # the initial one, and one for each store or switch since
+    assert len(retired) == 4
+    versioned_topic_chain.release_retired_vectorstores(grace_seconds=60)
+    assert len(versioned_topic_chain._retired_vectorstores) == 4
+    versioned_topic_chain.release_retired_vectorstores(grace_seconds=0)
+    assert not versioned_topic_chain._retired_vectorstores
+    assert all(vectorstore._client._closed for vectorstore in retired)
+
+
+@pytest.mark.asyncio
+async def test_watch_knowledge_versions(versioned_topic_chain, monkeypatch):
+    """
+    Test that topics are switched to newly activated versions, and that topics
+    without versioned knowledge are skipped
+    """
+    first = _store(versioned_topic_chain, "study a")
+    _store(versioned_topic_chain, "study b")
+    activate_knowledge_version("test", first)
+
+    monkeypatch.setattr(
+        config,
+        "topics",
+        {
+            "test": {"topic_chain": versioned_topic_chain},
+            "other": {"topic_chain": TopicChain("other", "other", chain=None)},
+        },
+    )
+    watcher = asyncio.create_task(watch_knowledge_versions(poll_seconds=0.01))
+    try:
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if versioned_topic_chain.knowledge_version == first:
+                break
+    finally:
+        watcher.cancel()
+
+    assert versioned_topic_chain.knowledge_version == first
+    assert _retrieved(versioned_topic_chain) == ["study a"]
+
+
+def test_knowledge_version_routes(versioned_topic_chain, client, monkeypatch):
+    """
+    Test listing versions and rolling back to a previous one through the API
+    """
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    monkeypatch.setattr(
+        config,
+        "topics",
+        {
+            "test": {"topic_chain": versioned_topic_chain},
+            "other": {"topic_chain": TopicChain("other", "other", chain=None)},
+        },
+    )
+    first = _store(versioned_topic_chain, "study a")
+    second = _store(versioned_topic_chain, "study b")
+
+    response = client.get("/knowledge/test/versions")
+    assert response.status_code == 200
+    assert response.json() == {
+        "topic": "test",
+        "active_version": second,
+        "loaded_version": second,
+        "versions": [first, second],
+    }
+
+    response = client.post(f"/knowledge/test/versions/{first}/activate")
+    assert response.status_code == 200
+    assert response.json()["active_version"] == first
+    assert response.json()["loaded_version"] == first
+    assert _retrieved(versioned_topic_chain) == ["study a"]
+
+    assert client.post("/knowledge/test/versions/bad/activate").status_code == 404
+    assert client.get("/knowledge/missing/versions").status_code == 404
+    assert client.get("/knowledge/other/versions").status_code == 400
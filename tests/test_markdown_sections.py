@@ -0,0 +1,150 @@
+import pytest
+import tiktoken
+
+from gen3discoveryai.markdown_sections import (
+    iter_markdown_sections,
+    split_markdown,
+    split_markdown_file,
+)
+from gen3discoveryai.tokenization import get_encoding, get_text_splitter
+
+MARKDOWN = """---
+title: Front matter isn't content
+---
+
+Intro before any heading.
+
+# Gen3 Discovery AI #
+
+## Setup
+
+### Empty
+
+## Configuration
+Set these in `.env`:
+
+```bash
+# not a heading
+TOPICS=default
+```
+
+Topics
+------
+
+- a list item
+---
+
+Another Title
+=============
+
+Text under a setext heading.
+"""
+
+
+@pytest.fixture(autouse=True)
+def offline_encoding(monkeypatch):
+    """
+    Use an encoding with a token per byte instead of downloading one
+    """
+    encoding = tiktoken.Encoding(
+        name="test_bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    get_encoding.cache_clear()
+    get_text_splitter.cache_clear()
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: encoding)
+    yield
+    get_encoding.cache_clear()
+    get_text_splitter.cache_clear()
+
+
+def test_iter_markdown_sections():
+    """
+    Test splitting at ATX and setext (level 1 and 2) headings with nested
+    breadcrumbs, ignoring headings in code blocks, front matter, and sections with
+    only a heading
+    """
+    sections = list(iter_markdown_sections(MARKDOWN))
+
+    assert [titles for titles, _ in sections] == [
+        [],
+        ["Gen3 Discovery AI", "Configuration"],
+        ["Gen3 Discovery AI", "Topics"],
+        ["Another Title"],
+    ]
+    assert sections[0][1] == "Intro before any heading."
+    assert sections[1][1] == (
+        "## Configuration\n"
+        "Set these in `.env`:\n\n"
+        "```bash\n# not a heading\nTOPICS=default\n```"
+    )
+    # a list item isn't a setext heading, so the underline is just text
+    assert sections[2][1] == "Topics\n------\n\n- a list item\n---"
+    assert sections[3][1] == (
+        "Another Title\n=============\n\nText under a setext heading."
+    )
+
+
+def test_iter_markdown_sections_edge_cases():
+    """
+    Test Markdown without headings, an unclosed code block, and front matter which
+    is never closed (so it's content)
+    """
+    assert list(iter_markdown_sections("")) == []
+    assert list(iter_markdown_sections("just text\n")) == [([], "just text")]
+    assert list(iter_markdown_sections("# Code\n~~~\n# still code")) == [
+        (["Code"], "# Code\n~~~\n# still code")
+    ]
+    assert list(iter_markdown_sections("---\nnot: closed\n")) == [
+        ([], "---\nnot: closed")
+    ]
+
+
+def test_split_markdown():
+    """
+    Test that each section is a chunk with its breadcrumbs and source, and that
+    sections longer than the chunk size are split into token-bounded chunks
+    """
+    chunks = split_markdown(MARKDOWN, "docs/README.md", chunk_size=1000)
+
+    assert [chunk.metadata for chunk in chunks] == [
+        {"source": "docs/README.md", "headings": ""},
+        {
+            "source": "docs/README.md",
+            "headings": "Gen3 Discovery AI > Configuration",
+        },
+        {
+            "source": "docs/README.md",
+            "headings": "Gen3 Discovery AI > Topics",
+        },
+        {"source": "docs/README.md", "headings": "Another Title"},
+    ]
+
+    long_section = "# Long\n" + "word " * 100
+    long_chunks = split_markdown(long_section, "docs/README.md", chunk_size=64)
+
+    assert len(long_chunks) == 8
+    assert all(len(chunk.page_content.encode()) <= 64 for chunk in long_chunks)
+    assert "".join(chunk.page_content for chunk in long_chunks) == (
+        long_section.strip()
+    )
+    assert all(
+        chunk.metadata == {"source": "docs/README.md", "headings": "Long"}
+        for chunk in long_chunks
+    )
+
+
+def test_split_markdown_file(tmp_path):
+    """
+    Test that files are split with their path as the source
+    """
+    path = tmp_path / "README.md"
+    path.write_bytes(MARKDOWN.encode("utf-8") + b"\n# Bad bytes\n\xff\n")
+
+    chunks = split_markdown_file(str(path), chunk_size=1000)
+
+    assert len(chunks) == 5
+    assert {chunk.metadata["source"] for chunk in chunks} == {str(path)}
+    assert chunks[-1].page_content == "# Bad bytes\n�"
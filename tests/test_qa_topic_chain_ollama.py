@@ -1,7 +1,10 @@
 from unittest.mock import MagicMock, patch
 
 import pytest
+from langchain_core.documents import Document
 
+from gen3discoveryai.embeddings import get_embedding_model_id
+from gen3discoveryai.knowledge import get_document_id, get_knowledge_version
 from gen3discoveryai.topic_chains.question_answer_ollama import (
     TopicChainOllamaQuestionAnswerRAG,
 )
@@ -85,13 +88,14 @@ def test_qa_topic_chain_run(ollama, embeddings, _):
 @patch("gen3discoveryai.topic_chains.question_answer_ollama.OllamaEmbeddings")
 @patch("gen3discoveryai.topic_chains.question_answer_ollama.ChatOllama")
 @patch("gen3discoveryai.topic_chains.question_answer_ollama.RetrievalQA")
-@patch("gen3discoveryai.topic_chains.question_answer_ollama.Chroma")
+@patch("gen3discoveryai.vectorstores._get_chroma_vectorstore")
 def test_qa_topic_chain_store_knowledge(
-    chroma, _, ollama, embeddings, does_chroma_collection_exist
+    chroma, _, ollama, embeddings, does_chroma_collection_exist, monkeypatch, tmp_path
 ):
     """
     Test storing documents into the vectorstore
     """
+    monkeypatch.chdir(tmp_path)
     topic_chain = TopicChainOllamaQuestionAnswerRAG("test")
     topic_chain.vectorstore = MagicMock()
 
@@ -101,9 +105,27 @@ def test_qa_topic_chain_store_knowledge(
     if does_chroma_collection_exist:
         chroma.side_effect = Exception
 
-    topic_chain.store_knowledge(documents=["doc1", "doc2"])
-
-    topic_chain.vectorstore.add_documents.assert_called_with(["doc1", "doc2"])
+    # documents are stored in a new version of the knowledge store
+    new_vectorstore = MagicMock()
+    new_vectorstore.get.return_value = {"ids": ["old"]}
+    documents = [Document(page_content="doc1"), Document(page_content="doc2")]
+
+    with patch.object(topic_chain, "create_vectorstore", return_value=new_vectorstore):
+        counts = topic_chain.store_knowledge(documents=documents)
+
+    assert counts == {"added": 2, "removed": 1, "unchanged": 0}
+    new_vectorstore.delete.assert_called_with(ids=["old"])
+    new_vectorstore.add_documents.assert_called_with(
+        documents,
+        ids=[
+            get_document_id(
+                document, get_embedding_model_id(new_vectorstore.embeddings)
+            )
+            for document in documents
+        ],
+    )
+    assert topic_chain.vectorstore is new_vectorstore
+    assert topic_chain.knowledge_version == get_knowledge_version("test")
 
     assert ollama.called
     assert embeddings.called
@@ -1,8 +1,22 @@
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import chromadb
+import httpx
+import openai
 import pytest
+from fastapi import HTTPException
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
 
+from gen3discoveryai import config
+from gen3discoveryai.embeddings import get_embedding_model_id
+from gen3discoveryai.knowledge import (
+    get_document_id,
+    get_knowledge_store_directory,
+    get_knowledge_version,
+    list_knowledge_versions,
+)
 from gen3discoveryai.topic_chains.question_answer_openai import (
     TopicChainOpenAiQuestionAnswerRAG,
 )
@@ -61,13 +75,124 @@ def test_qa_topic_chain_run():
     )
 
 
+@pytest.mark.asyncio
+async def test_qa_topic_chain_arun_native_async():
+    """
+    Test that topic chain .arun awaits the chain's native async implementation
+    """
+    topic_chain = TopicChainOpenAiQuestionAnswerRAG("test")
+    topic_chain.chain = MagicMock()
+    topic_chain.chain.ainvoke = AsyncMock(return_value={"result": "async"})
+
+    query = "some query"
+    output = await topic_chain.arun(query, "an arg", another_thing="a kwarg")
+
+    assert output == {"result": "async"}
+    topic_chain.chain.ainvoke.assert_awaited_with(
+        {"query": query}, "an arg", include_run_info=True, another_thing="a kwarg"
+    )
+    assert not topic_chain.chain.invoke.called
+
+
+@pytest.mark.asyncio
+async def test_qa_topic_chain_arun_callbacks():
+    """
+    Test that callbacks are passed in the chain's config (where they're actually used)
+    """
+    topic_chain = TopicChainOpenAiQuestionAnswerRAG("test")
+    topic_chain.chain = MagicMock()
+    topic_chain.chain.ainvoke = AsyncMock(return_value={"result": "async"})
+    callbacks = [MagicMock()]
+
+    await topic_chain.arun("some query", callbacks=callbacks)
+
+    topic_chain.chain.ainvoke.assert_awaited_with(
+        {"query": "some query"},
+        include_run_info=True,
+        config={"callbacks": callbacks},
+    )
+
+
+@pytest.mark.asyncio
+async def test_qa_topic_chain_arun_sync_only_chain():
+    """
+    Test that topic chain .arun falls back to running sync-only chains in the thread pool
+    """
+    topic_chain = TopicChainOpenAiQuestionAnswerRAG("test")
+    topic_chain.chain = MagicMock()
+    topic_chain.chain.invoke.return_value = {"result": "sync"}
+
+    query = "some query"
+    output = await topic_chain.arun(query, another_thing="a kwarg")
+
+    assert output == {"result": "sync"}
+    topic_chain.chain.invoke.assert_called_with(
+        {"query": query}, include_run_info=True, another_thing="a kwarg"
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "error,expected_status_code",
+    [
+        (
+            openai.RateLimitError(
+                "limited",
+                response=httpx.Response(
+                    429, request=httpx.Request("POST", "https://example.com")
+                ),
+                body=None,
+            ),
+            429,
+        ),
+        (openai.OpenAIError("too much text"), 400),
+    ],
+)
+async def test_qa_topic_chain_arun_openai_errors(error, expected_status_code):
+    """
+    Test that OpenAI errors from the async path are converted to HTTP errors
+    """
+    topic_chain = TopicChainOpenAiQuestionAnswerRAG("test")
+    topic_chain.chain = MagicMock()
+    topic_chain.chain.ainvoke = AsyncMock(side_effect=error)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await topic_chain.arun("some query")
+
+    assert exc_info.value.status_code == expected_status_code
+
+
+@pytest.mark.asyncio
+async def test_qa_topic_chain_astream_openai_errors():
+    """
+    Test that OpenAI errors from the streaming path are converted to HTTP errors
+    """
+    topic_chain = TopicChainOpenAiQuestionAnswerRAG("test")
+
+    async def _astream_events(*args, **kwargs):
+        raise openai.OpenAIError("too much text")
+        yield  # pylint: disable=unreachable
+
+    topic_chain.chain = MagicMock()
+    topic_chain.chain.astream_events = _astream_events
+
+    with pytest.raises(HTTPException) as exc_info:
+        async for _ in topic_chain.astream("some query"):
+            pass
+
+    assert exc_info.value.status_code == 400
+
+
 @pytest.mark.parametrize("does_chroma_collection_exist", [True, False])
 @patch("gen3discoveryai.topic_chains.question_answer_openai.RetrievalQA")
-@patch("gen3discoveryai.topic_chains.question_answer_openai.Chroma")
-def test_qa_topic_chain_store_knowledge(chroma, _, does_chroma_collection_exist):
+@patch("gen3discoveryai.vectorstores._get_chroma_vectorstore")
+def test_qa_topic_chain_store_knowledge(
+    chroma, _, does_chroma_collection_exist, monkeypatch, tmp_path
+):
     """
     Test storing documents into the vectorstore
     """
+    monkeypatch.chdir(tmp_path)
     topic_chain = TopicChainOpenAiQuestionAnswerRAG("test")
     topic_chain.vectorstore = MagicMock()
 
@@ -77,6 +202,98 @@ def test_qa_topic_chain_store_knowledge(chroma, _, does_chroma_collection_exist)
     if does_chroma_collection_exist:
         chroma.side_effect = Exception
 
-    topic_chain.store_knowledge(documents=["doc1", "doc2"])
+    # documents are stored in a new version of the knowledge store
+    new_vectorstore = MagicMock()
+    new_vectorstore.get.return_value = {"ids": ["old"]}
+    documents = [Document(page_content="doc1"), Document(page_content="doc2")]
 
-    topic_chain.vectorstore.add_documents.assert_called_with(["doc1", "doc2"])
+    with patch.object(topic_chain, "create_vectorstore", return_value=new_vectorstore):
+        counts = topic_chain.store_knowledge(documents=documents)
+
+    assert counts == {"added": 2, "removed": 1, "unchanged": 0}
+    new_vectorstore.delete.assert_called_with(ids=["old"])
+    new_vectorstore.add_documents.assert_called_with(
+        documents,
+        ids=[
+            get_document_id(
+                document, get_embedding_model_id(new_vectorstore.embeddings)
+            )
+            for document in documents
+        ],
+    )
+    assert topic_chain.vectorstore is new_vectorstore
+    assert topic_chain.knowledge_version == get_knowledge_version("test")
+
+
+@pytest.mark.parametrize("full_rebuild", [True, False])
+@patch("gen3discoveryai.topic_chains.question_answer_openai.RetrievalQA")
+def test_qa_topic_chain_store_knowledge_incremental(
+    _, full_rebuild, monkeypatch, tmp_path
+):
+    """
+    Test that storing knowledge again only embeds new or changed documents and
+    removes vanished ones, unless doing a full rebuild
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "KNOWLEDGE_VERSIONS_TO_KEEP", 2)
+    topic_chain = TopicChainOpenAiQuestionAnswerRAG("test")
+    embeddings = DeterministicFakeEmbedding(size=8)
+    topic_chain.embeddings = embeddings
+
+    documents = [
+        Document(page_content=f"study {i}", metadata={"source": f"guid_{i}"})
+        for i in range(3)
+    ]
+    assert topic_chain.store_knowledge(documents) == {
+        "added": 3,
+        "removed": 0,
+        "unchanged": 0,
+    }
+    version = get_knowledge_version("test")
+
+    # nothing changed, so nothing is embedded and the knowledge version stays
+    with patch.object(
+        DeterministicFakeEmbedding,
+        "embed_documents",
+        side_effect=embeddings.embed_documents,
+    ) as embed_documents:
+        counts = topic_chain.store_knowledge(documents, full_rebuild=full_rebuild)
+    assert embed_documents.called is full_rebuild
+    if full_rebuild:
+        assert counts == {"added": 3, "removed": 3, "unchanged": 0}
+    else:
+        assert counts == {"added": 0, "removed": 0, "unchanged": 3}
+        assert get_knowledge_version("test") == version
+
+    # one changed, one removed, one added (and an exact duplicate)
+    documents = [
+        documents[0],
+        Document(page_content="study 1 (updated)", metadata={"source": "guid_1"}),
+        Document(page_content="study 3", metadata={"source": "guid_3"}),
+        Document(page_content="study 3", metadata={"source": "guid_3"}),
+    ]
+    counts = topic_chain.store_knowledge(documents)
+    assert counts == {"added": 2, "removed": 2, "unchanged": 1}
+    assert get_knowledge_version("test") != version
+
+    stored = topic_chain.vectorstore.get(include=["documents"])
+    assert sorted(stored["documents"]) == ["study 0", "study 1 (updated)", "study 3"]
+    model_id = get_embedding_model_id(embeddings)
+    assert sorted(stored["ids"]) == sorted(
+        get_document_id(document, model_id) for document in documents[:3]
+    )
+
+    # each change was built as a new version, previous versions are kept for rollback
+    versions = list_knowledge_versions("test")
+    assert len(versions) == (3 if full_rebuild else 2)
+    assert (
+        versions[-1] == topic_chain.knowledge_version == get_knowledge_version("test")
+    )
+    previous = topic_chain.create_vectorstore(
+        get_knowledge_store_directory("test", version)
+    )
+    assert sorted(previous.get(include=["documents"])["documents"]) == [
+        "study 0",
+        "study 1",
+        "study 2",
+    ]
@@ -0,0 +1,282 @@
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy as np
+import pytest
+
+from gen3discoveryai import config, semantic_cache
+from gen3discoveryai.knowledge import bump_knowledge_version
+from gen3discoveryai.semantic_cache import (
+    SemanticCache,
+    SemanticCacheIndex,
+    get_semantic_cache,
+    is_semantic_cache_enabled,
+    normalize_vector,
+)
+from gen3discoveryai.topic_chains.base import TopicChain
+
+TEST_RESPONSE = {
+    "response": "yes",
+    "documents": [{"page_content": "fooA", "metadata": {"source": "phs000001"}}],
+}
+
+# fake embeddings for queries, the first two are near-duplicates
+FAKE_EMBEDDINGS = {
+    "do you have covid data?": [1.0, 0.0, 0.0],
+    "is there any covid data?": [0.99, 0.1, 0.0],
+    "how do I download files?": [0.0, 0.0, 1.0],
+}
+
+
+@pytest.fixture
+def semantic_cache_enabled(monkeypatch, tmp_path):
+    """
+    Fresh semantic cache, isolated knowledge dir, and a topic config which enables it
+    with fake embeddings
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(semantic_cache, "_semantic_cache", None)
+
+    mock_topic_chain = MagicMock(NAME="SomeChain")
+    mock_topic_chain.vectorstore.embeddings.aembed_query = AsyncMock(
+        side_effect=lambda query: FAKE_EMBEDDINGS[query]
+    )
+    topic_config = {
+        "topic_chain": mock_topic_chain,
+        "semantic_cache": "true",
+        "semantic_cache_similarity_threshold": "0.95",
+        "semantic_cache_max_entries": "2",
+    }
+    yield topic_config
+
+
+def test_index_lookup_threshold():
+    """
+    Test that only previous queries above the similarity threshold are matched
+    """
+    index = SemanticCacheIndex(max_entries=10)
+    assert index.lookup(normalize_vector([1.0, 0.0]), 0.9) == (None, 0.0)
+
+    index.add(normalize_vector([1.0, 0.0]), TEST_RESPONSE, ttl=60)
+
+    answer, similarity = index.lookup(normalize_vector([1.0, 0.1]), 0.9)
+    assert answer == TEST_RESPONSE
+    assert similarity == pytest.approx(0.995, abs=1e-3)
+
+    answer, similarity = index.lookup(normalize_vector([0.0, 1.0]), 0.9)
+    assert answer is None
+    assert similarity == pytest.approx(0.0)
+
+    # different embedding function
+    assert index.lookup(normalize_vector([1.0, 0.0, 0.0]), 0.9) == (None, 0.0)
+
+
+def test_index_eviction():
+    """
+    Test that the least recently used (or expired) entry is replaced when full
+    """
+    index = SemanticCacheIndex(max_entries=2)
+    index.add(normalize_vector([1.0, 0.0, 0.0]), {"response": "a"}, ttl=60)
+    index.add(normalize_vector([0.0, 1.0, 0.0]), {"response": "b"}, ttl=60)
+
+    # use "a" so "b" is least recently used
+    time.sleep(0.01)
+    assert index.lookup(normalize_vector([1.0, 0.0, 0.0]), 0.9)[0] == {"response": "a"}
+
+    index.add(normalize_vector([0.0, 0.0, 1.0]), {"response": "c"}, ttl=60)
+
+    assert len(index) == 2
+    assert index.lookup(normalize_vector([0.0, 1.0, 0.0]), 0.9)[0] is None
+    assert index.lookup(normalize_vector([1.0, 0.0, 0.0]), 0.9)[0] == {"response": "a"}
+    assert index.lookup(normalize_vector([0.0, 0.0, 1.0]), 0.9)[0] == {"response": "c"}
+
+
+def test_index_expiry():
+    """
+    Test that expired entries are not matched and are replaced first
+    """
+    index = SemanticCacheIndex(max_entries=2)
+    index.add(normalize_vector([1.0, 0.0]), {"response": "a"}, ttl=-1)
+    index.add(normalize_vector([0.0, 1.0]), {"response": "b"}, ttl=60)
+
+    assert index.lookup(normalize_vector([1.0, 0.0]), 0.9)[0] is None
+
+    index.add(normalize_vector([1.0, 1.0]), {"response": "c"}, ttl=60)
+    assert index.lookup(normalize_vector([0.0, 1.0]), 0.9)[0] == {"response": "b"}
+
+
+@pytest.mark.parametrize(
+    "topic_config,expected",
+    [
+        ({}, False),
+        ({"semantic_cache": "false"}, False),
+        ({"semantic_cache": "true"}, True),
+        ({"semantic_cache": "True"}, True),
+    ],
+)
+def test_is_semantic_cache_enabled(topic_config, expected):
+    """
+    Test that semantic caching is opt-in per topic
+    """
+    assert is_semantic_cache_enabled(topic_config) is expected
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_get_set(semantic_cache_enabled):
+    """
+    Test that near-duplicate queries are answered from the cache and hits/misses are counted
+    """
+    cache = get_semantic_cache()
+    misses = cache.misses.get(topic="default")
+    hits = cache.hits.get(topic="default")
+
+    answer, vector = await cache.aget(
+        "default", "do you have covid data?", semantic_cache_enabled
+    )
+    assert answer is None
+    cache.set("default", vector, TEST_RESPONSE, semantic_cache_enabled)
+
+    answer, _ = await cache.aget(
+        "default", "is there any covid data?", semantic_cache_enabled
+    )
+    assert answer == TEST_RESPONSE
+
+    answer, _ = await cache.aget(
+        "default", "how do I download files?", semantic_cache_enabled
+    )
+    assert answer is None
+
+    assert cache.misses.get(topic="default") == misses + 2
+    assert cache.hits.get(topic="default") == hits + 1
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_disabled_for_topic(semantic_cache_enabled):
+    """
+    Test that topics which don't opt in never embed the query
+    """
+    semantic_cache_enabled["semantic_cache"] = "false"
+
+    assert await SemanticCache(ttl_seconds=60).aget(
+        "default", "do you have covid data?", semantic_cache_enabled
+    ) == (None, None)
+    assert not semantic_cache_enabled[
+        "topic_chain"
+    ].vectorstore.embeddings.aembed_query.called
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_embedding_errors_are_misses(semantic_cache_enabled):
+    """
+    Test that failing to embed the query doesn't fail the request
+    """
+    semantic_cache_enabled[
+        "topic_chain"
+    ].vectorstore.embeddings.aembed_query.side_effect = Exception("failed")
+
+    assert await SemanticCache(ttl_seconds=60).aget(
+        "default", "do you have covid data?", semantic_cache_enabled
+    ) == (None, None)
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_invalidation(semantic_cache_enabled):
+    """
+    Test that new knowledge or config for a topic clears its semantic cache
+    """
+    cache = get_semantic_cache()
+    vector = normalize_vector(FAKE_EMBEDDINGS["do you have covid data?"])
+
+    cache.set("default", vector, TEST_RESPONSE, semantic_cache_enabled)
+    assert (
+        await cache.aget("default", "is there any covid data?", semantic_cache_enabled)
+    )[0] == TEST_RESPONSE
+
+    bump_knowledge_version("default")
+    assert (
+        await cache.aget("default", "is there any covid data?", semantic_cache_enabled)
+    )[0] is None
+
+    cache.set("default", vector, TEST_RESPONSE, semantic_cache_enabled)
+    semantic_cache_enabled["model_name"] = "some-other-model"
+    assert (
+        await cache.aget("default", "is there any covid data?", semantic_cache_enabled)
+    )[0] is None
+
+    cache.set("default", vector, TEST_RESPONSE, semantic_cache_enabled)
+    TopicChain(name="test", topic="default", chain=MagicMock()).on_knowledge_updated()
+    assert (
+        await cache.aget("default", "is there any covid data?", semantic_cache_enabled)
+    )[0] is None
+
+
+@patch("gen3discoveryai.routes.config")
+def test_ask_semantic_cached(mock_config, semantic_cache_enabled, client, monkeypatch):
+    """
+    Test that paraphrased queries are answered from the semantic cache by /ask
+    and /ask/stream
+    """
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+
+    mock_topic_chain = semantic_cache_enabled["topic_chain"]
+    mock_topic_chain.arun = AsyncMock(
+        return_value={"result": "yes", "source_documents": []}
+    )
+    mock_config.topics = {"default": semantic_cache_enabled}
+
+    first = client.post("/ask", json={"query": "do you have covid data?"})
+    second = client.post("/ask", json={"query": "is there any covid data?"})
+    third = client.post("/ask", json={"query": "how do I download files?"})
+
+    assert mock_topic_chain.arun.call_count == 2
+    assert [response.json()["cached"] for response in [first, second, third]] == [
+        False,
+        True,
+        False,
+    ]
+    assert second.json()["response"] == "yes"
+
+    streamed = client.post("/ask/stream", json={"query": "is there any covid data?"})
+    assert '"cached": true' in streamed.text
+    assert 'data: {"token": "yes"}' in streamed.text
+
+
+@patch("gen3discoveryai.routes.config")
+def test_ask_semantic_hit_populates_exact_cache(
+    mock_config, semantic_cache_enabled, client, monkeypatch
+):
+    """
+    Test that a semantic hit is stored in the exact-match cache so a repeat of the
+    paraphrase doesn't need to be embedded again
+    """
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_BACKEND", "memory")
+    monkeypatch.setattr("gen3discoveryai.cache._answer_cache", None)
+
+    mock_topic_chain = semantic_cache_enabled["topic_chain"]
+    mock_topic_chain.arun = AsyncMock(
+        return_value={"result": "yes", "source_documents": []}
+    )
+    mock_config.topics = {"default": semantic_cache_enabled}
+    embed_query = mock_topic_chain.vectorstore.embeddings.aembed_query
+
+    client.post("/ask", json={"query": "do you have covid data?"})
+    client.post("/ask", json={"query": "is there any covid data?"})
+    assert embed_query.call_count == 2
+
+    response = client.post("/ask", json={"query": "is there any covid data?"})
+    assert response.json()["cached"] is True
+    assert embed_query.call_count == 2
+    assert mock_topic_chain.arun.call_count == 1
+
+
+def test_normalize_vector():
+    """
+    Test that vectors are unit length float32 (and zero vectors are left alone)
+    """
+    vector = normalize_vector([3.0, 4.0])
+    assert vector.dtype == np.float32
+    assert np.allclose(vector, [0.6, 0.8])
+    assert np.allclose(normalize_vector([0.0, 0.0]), [0.0, 0.0])
@@ -2,6 +2,8 @@ from unittest.mock import AsyncMock, patch
 
 import pytest
 
+from gen3discoveryai.metrics import get_counter, get_histogram
+
 
 @pytest.mark.parametrize("endpoint", ["/_version", "/_version/"])
 @patch("gen3discoveryai.routes.authorize_request")
@@ -70,3 +72,50 @@ def test_status_unauthorized(arborist, endpoint, client):
     headers = {"Authorization": "Bearer ofbadnews"}
     response = client.get(endpoint, headers=headers)
     assert response.status_code == 200
+
+
+@pytest.mark.parametrize("endpoint", ["/_metrics", "/_metrics/"])
+def test_metrics(endpoint, client):
+    """
+    Test that the metrics endpoint returns registered metrics
+    """
+    get_counter("test_metric_total", "a metric just for testing").inc(topic=endpoint)
+
+    response = client.get(endpoint)
+    response.raise_for_status()
+
+    metric = response.json()["metrics"]["test_metric_total"]
+    assert metric["type"] == "counter"
+    assert metric["description"] == "a metric just for testing"
+    assert {"labels": {"topic": endpoint}, "value": 1} in metric["values"]
+
+
+@pytest.mark.parametrize("endpoint", ["/_metrics", "/_metrics/"])
+def test_metrics_histogram(endpoint, client):
+    """
+    Test that histograms report cumulative buckets, sum, and count
+    """
+    histogram = get_histogram(
+        "test_histogram_seconds", "a histogram just for testing", buckets=(1, 5)
+    )
+    for value in [0.5, 1, 3, 10]:
+        histogram.observe(value, topic=endpoint)
+
+    response = client.get(endpoint)
+    response.raise_for_status()
+
+    metric = response.json()["metrics"]["test_histogram_seconds"]
+    assert metric["type"] == "histogram"
+    assert {
+        "labels": {"topic": endpoint},
+        "buckets": [
+            {"le": 1, "count": 2},
+            {"le": 5, "count": 3},
+            {"le": "+Inf", "count": 4},
+        ],
+        "sum": 14.5,
+        "count": 4,
+    } in metric["values"]
+
+    with pytest.raises(ValueError):
+        get_counter("test_histogram_seconds")
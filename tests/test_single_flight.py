@@ -0,0 +1,160 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import httpx
+import pytest
+
+from gen3discoveryai import config
+from gen3discoveryai.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces():
+    """
+    Test that concurrent calls with the same key share one execution while different
+    keys execute separately
+    """
+    single_flight = SingleFlight("test_coalesces")
+    executions = []
+
+    async def _work(value):
+        executions.append(value)
+        await asyncio.sleep(0.05)
+        return {"value": value}
+
+    results = await asyncio.gather(
+        *[single_flight.run("a", lambda: _work("a"), topic="t") for _ in range(5)],
+        single_flight.run("b", lambda: _work("b"), topic="t"),
+    )
+
+    assert sorted(executions) == ["a", "b"]
+    assert [result for result, _ in results] == [{"value": "a"}] * 5 + [{"value": "b"}]
+    assert [coalesced for _, coalesced in results] == [False] + [True] * 4 + [False]
+    assert single_flight.coalesced.get(topic="t") == 4
+    assert single_flight.executions.get(topic="t") == 2
+    assert single_flight.in_flight() == 0
+
+    # nothing in flight anymore, so this executes again
+    result, coalesced = await single_flight.run("a", lambda: _work("a"), topic="t")
+    assert not coalesced
+    assert len(executions) == 3
+
+
+@pytest.mark.asyncio
+async def test_single_flight_errors_raised_for_every_caller():
+    """
+    Test that when the shared execution fails, every caller gets the error
+    """
+    single_flight = SingleFlight("test_errors")
+    calls = []
+
+    async def _fail():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise ValueError("failed")
+
+    results = await asyncio.gather(
+        *[single_flight.run("a", _fail) for _ in range(3)], return_exceptions=True
+    )
+
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert single_flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_caller_cancelled():
+    """
+    Test that the first caller being cancelled (e.g. client disconnected) doesn't
+    cancel the execution for the others awaiting it
+    """
+    single_flight = SingleFlight("test_cancelled")
+
+    async def _work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    first = asyncio.ensure_future(single_flight.run("a", _work))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(single_flight.run("a", _work))
+    await asyncio.sleep(0)
+
+    first.cancel()
+
+    assert await second == ("done", True)
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fail", [False, True])
+@patch("gen3discoveryai.routes.config")
+async def test_ask_coalesced(mock_config, fail, client, monkeypatch, tmp_path):
+    """
+    Test that identical concurrent /ask queries share one chain execution (or its
+    error) while each still gets its own conversation_id
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    mock_config.ASK_COALESCING_ENABLED = True
+
+    calls = []
+
+    async def _arun(*args, **kwargs):
+        calls.append(kwargs["query"])
+        await asyncio.sleep(0.1)
+        if fail:
+            raise Exception("failed")
+        return {"result": "yes", "source_documents": []}
+
+    mock_topic_chain = MagicMock(NAME="SomeChain")
+    mock_topic_chain.arun = _arun
+    mock_config.topics = {"default": {"topic_chain": mock_topic_chain}}
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=client.app), base_url="http://test"
+    ) as async_client:
+        responses = await asyncio.gather(
+            *[
+                async_client.post("/ask", json={"query": query})
+                for query in [
+                    "Do you have COVID data?",
+                    "do you have covid data",
+                    "Do you have COVID data?",
+                    "how do I download files?",
+                ]
+            ]
+        )
+
+    assert sorted(calls) == ["Do you have COVID data?", "how do I download files?"]
+
+    if fail:
+        assert all(response.status_code == 503 for response in responses)
+        return
+
+    assert all(response.status_code == 200 for response in responses)
+    assert [response.json()["response"] for response in responses] == ["yes"] * 4
+    assert len({response.json()["conversation_id"] for response in responses}) == 4
+
+
+@patch("gen3discoveryai.routes.config")
+def test_ask_coalescing_disabled(mock_config, client, monkeypatch):
+    """
+    Test that queries are run directly when coalescing is disabled
+    """
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    mock_config.ASK_COALESCING_ENABLED = False
+
+    async def _arun(*args, **kwargs):
+        return {"result": "yes", "source_documents": []}
+
+    mock_topic_chain = MagicMock(NAME="SomeChain")
+    mock_topic_chain.arun = _arun
+    mock_config.topics = {"default": {"topic_chain": mock_topic_chain}}
+
+    response = client.post("/ask", json={"query": "Do you have COVID data?"})
+
+    assert response.status_code == 200
+    assert response.json()["response"] == "yes"
@@ -0,0 +1,243 @@
+import asyncio
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from langchain_classic.chains import RetrievalQA
+from langchain_core.documents import Document
+from langchain_core.language_models.fake import FakeListLLM
+from langchain_core.retrievers import BaseRetriever
+
+from gen3discoveryai import config, routes
+from gen3discoveryai.speculation import Speculation
+from gen3discoveryai.topic_chains.base import TopicChain
+
+
+class KeywordRetriever(BaseRetriever):
+    """
+    Returns a single document mentioning the query
+    """
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return [Document(page_content=f"about {query}", metadata={"row": 1})]
+
+
+class SlowRetrievalTopicChain(TopicChain):
+    """
+    Topic chain whose stages record when they run
+    """
+
+    def __init__(self, events):
+        super().__init__(
+            name="SlowRetrievalTopicChain",
+            topic="default",
+            chain=RetrievalQA.from_chain_type(
+                FakeListLLM(responses=["yes"] * 10),
+                retriever=KeywordRetriever(),
+                return_source_documents=True,
+            ),
+        )
+        self.events = events
+
+    async def aretrieve(self, query, callbacks=None):
+        self.events.append("retrieval started")
+        await asyncio.sleep(0.1)
+        self.events.append("retrieval finished")
+        return await super().aretrieve(query, callbacks=callbacks)
+
+    async def agenerate(self, query, documents, callbacks=None):
+        self.events.append("generation started")
+        return await super().agenerate(query, documents, callbacks=callbacks)
+
+    async def arun(self, query, *args, **kwargs):
+        self.events.append("run started")
+        return await super().arun(query, *args, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_speculation_used_and_discarded():
+    """
+    Test that claimed work is awaited, unclaimed work is cancelled, and errors from
+    discarded work are ignored
+    """
+
+    async def _work(value, fail=False):
+        await asyncio.sleep(0.01)
+        if fail:
+            raise ValueError("failed")
+        return value
+
+    used = Speculation("test", _work("a"), topic="t")
+    assert await used.result() == "a"
+    used.discard()
+    assert used.outcomes.get(outcome="used", topic="t") == 1
+
+    discarded = Speculation("test", _work("b"), topic="t")
+    discarded.discard()
+    await asyncio.sleep(0.02)
+    assert discarded._task.cancelled()
+    assert discarded.outcomes.get(outcome="discarded", topic="t") == 1
+
+    failed = Speculation("test", _work("c", fail=True), topic="t")
+    await asyncio.sleep(0.02)
+    failed.discard()
+
+
+@pytest.mark.asyncio
+async def test_topic_chain_stages():
+    """
+    Test that running retrieve and generate separately gives the same output as a
+    full run
+    """
+    topic_chain = SlowRetrievalTopicChain(events=[])
+    assert topic_chain.supports_stages
+
+    documents = topic_chain.retrieve("covid")
+    assert documents == await TopicChain.aretrieve(topic_chain, "covid")
+
+    full_output = await topic_chain.arun("covid")
+    staged_output = await topic_chain.agenerate("covid", documents)
+    assert staged_output["result"] == full_output["result"]
+    assert staged_output["source_documents"] == full_output["source_documents"]
+    assert topic_chain.generate("covid", documents)["result"] == "yes"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("is_cached", [False, True])
+async def test_ask_speculative_retrieval(is_cached, client, monkeypatch, tmp_path):
+    """
+    Test that retrieval starts while the semantic cache is being checked, and that
+    its result is discarded when the answer is cached
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "ASK_SPECULATIVE_RETRIEVAL_ENABLED", True)
+
+    events = []
+    topic_chain = SlowRetrievalTopicChain(events)
+    monkeypatch.setattr(config, "topics", {"default": {"topic_chain": topic_chain}})
+
+    class SlowSemanticCache:
+        async def aget(self, *args, **kwargs):
+            events.append("cache lookup started")
+            await asyncio.sleep(0.05)
+            events.append("cache lookup finished")
+            if is_cached:
+                return {"response": "cached", "documents": []}, None
+            return None, None
+
+    with patch(
+        "gen3discoveryai.routes.get_semantic_cache", return_value=SlowSemanticCache()
+    ):
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=client.app), base_url="http://test"
+        ) as async_client:
+            response = await async_client.post("/ask", json={"query": "covid"})
+
+    assert response.status_code == 200
+    # both started before either finished
+    assert sorted(events[:2]) == ["cache lookup started", "retrieval started"]
+    if is_cached:
+        assert response.json()["response"] == "cached"
+        await asyncio.sleep(0.1)
+        assert events[2:] == ["cache lookup finished"]
+    else:
+        assert response.json()["response"] == "yes"
+        assert response.json()["documents"][0]["page_content"] == "about covid"
+        assert events[2:] == [
+            "cache lookup finished",
+            "retrieval finished",
+            "generation started",
+        ]
+
+
+@pytest.mark.asyncio
+async def test_ask_speculative_retrieval_unauthorized(client, monkeypatch, tmp_path):
+    """
+    Test that retrieval isn't started for requests which aren't authorized
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "ASK_SPECULATIVE_RETRIEVAL_ENABLED", True)
+
+    events = []
+    topic_chain = SlowRetrievalTopicChain(events)
+    monkeypatch.setattr(config, "topics", {"default": {"topic_chain": topic_chain}})
+
+    async def _authorize_request(*args, **kwargs):
+        raise HTTPException(status_code=403)
+
+    with patch("gen3discoveryai.auth.authorize_request", _authorize_request):
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=client.app), base_url="http://test"
+        ) as async_client:
+            response = await async_client.post("/ask", json={"query": "covid"})
+
+    assert response.status_code == 403
+    await asyncio.sleep(0.1)
+    assert events == []
+
+
+def test_ask_speculative_retrieval_disabled(client, monkeypatch, tmp_path):
+    """
+    Test that the full chain is run when speculative retrieval is disabled
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "ASK_SPECULATIVE_RETRIEVAL_ENABLED", False)
+
+    events = []
+    topic_chain = SlowRetrievalTopicChain(events)
+    monkeypatch.setattr(config, "topics", {"default": {"topic_chain": topic_chain}})
+
+    response = client.post("/ask", json={"query": "covid"})
+
+    assert response.status_code == 200
+    assert events == ["run started"]
+
+
+@pytest.mark.asyncio
+async def test_ask_coalesced_after_leader_cancelled(monkeypatch):
+    """
+    Test that when the request whose chain execution is shared is cancelled (e.g. its
+    client disconnected) while retrieving, a request coalesced on the same execution
+    still gets the response, and only the coalesced request's own retrieval is
+    discarded
+    """
+    monkeypatch.setattr(config, "ASK_COALESCING_ENABLED", True)
+    events = []
+    topic_chain = SlowRetrievalTopicChain(events)
+    topic_config = {"topic_chain": topic_chain}
+    cache_context = {"topic": "default", "topic_config": topic_config}
+
+    async def _ask(retrieval):
+        # like `ask_route`
+        try:
+            return await routes._answer_query(
+                "default", "covid", topic_config, cache_context, retrieval=retrieval
+            )
+        finally:
+            retrieval.discard()
+
+    leader_retrieval = Speculation("test_leader", topic_chain.aretrieve("covid"))
+    leader = asyncio.ensure_future(_ask(leader_retrieval))
+    waiter_retrieval = Speculation("test_waiter", topic_chain.aretrieve("covid"))
+    waiter = asyncio.ensure_future(_ask(waiter_retrieval))
+    await asyncio.sleep(0)
+
+    # owned by the shared execution as soon as it's created, before it first runs
+    assert leader_retrieval.claimed
+    assert routes._ask_single_flight.in_flight() == 1
+    leader.cancel()
+    response, llm_tokens_used, is_coalesced = await waiter
+
+    assert leader.cancelled()
+    assert response["response"] == "yes"
+    assert response["documents"][0]["page_content"] == "about covid"
+    assert is_coalesced
+    assert llm_tokens_used == 0
+    assert not leader_retrieval._task.cancelled()
+    assert leader_retrieval.outcomes.get(outcome="used") == 1
+    assert waiter_retrieval.outcomes.get(outcome="discarded") == 1
@@ -0,0 +1,142 @@
+import os
+from unittest.mock import patch
+
+import pytest
+import tiktoken
+from langchain_classic.schema.document import Document
+from langchain_classic.text_splitter import TokenTextSplitter
+
+from gen3discoveryai import config, tokenization
+from gen3discoveryai.tokenization import (
+    BatchTokenTextSplitter,
+    cache_encoding,
+    configure_encoding_cache,
+    count_tokens,
+    get_encoding,
+    get_text_splitter,
+)
+
+# byte-level encoding with a few merges, so tests don't need to download one
+BYTE_ENCODING = tiktoken.Encoding(
+    name="test_bytes",
+    pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+    mergeable_ranks={
+        **{bytes([i]): i for i in range(256)},
+        b"st": 256,
+        b"stu": 257,
+        b" s": 258,
+    },
+    special_tokens={"<|endoftext|>": 259},
+)
+
+
+@pytest.fixture(autouse=True)
+def offline_encoding(monkeypatch):
+    """
+    Use the byte-level encoding instead of downloading one, with fresh registries
+    """
+    get_encoding.cache_clear()
+    get_text_splitter.cache_clear()
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: BYTE_ENCODING)
+    monkeypatch.delenv("TIKTOKEN_CACHE_DIR", raising=False)
+    monkeypatch.setattr(config, "TIKTOKEN_CACHE_DIR", "")
+    yield
+    get_encoding.cache_clear()
+    get_text_splitter.cache_clear()
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(5, 0), (8, 3), (1000, 0)])
+def test_batch_splitter_matches_token_text_splitter(chunk_size, chunk_overlap):
+    """
+    Test that splitting in a batch gives exactly the same chunks as splitting each
+    document, so chunk ids are unchanged
+    """
+    documents = [
+        Document(page_content="study of stuff " * 7, metadata={"source": "1"}),
+        Document(page_content="", metadata={"source": "2"}),
+        Document(page_content="dépistage 🧬 study", metadata={"source": "3"}),
+        Document(page_content="short", metadata={"source": "4", "row": 3}),
+    ]
+    expected = TokenTextSplitter.from_tiktoken_encoder(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    ).split_documents(documents)
+
+    with patch.object(
+        BYTE_ENCODING, "encode_batch", wraps=BYTE_ENCODING.encode_batch
+    ) as encode_batch:
+        chunks = get_text_splitter(chunk_size, chunk_overlap).split_documents(documents)
+
+    assert chunks == expected
+    assert encode_batch.call_count == 1
+    assert len(chunks) > len(documents) or chunk_size == 1000
+
+    # metadata isn't shared between chunks
+    chunks[0].metadata["changed"] = True
+    assert "changed" not in chunks[1].metadata
+
+
+def test_get_text_splitter_registry():
+    """
+    Test that splitters are built once per (chunk size, overlap, encoding)
+    """
+    splitter = get_text_splitter(100)
+
+    assert isinstance(splitter, BatchTokenTextSplitter)
+    assert get_text_splitter(100) is splitter
+    assert get_text_splitter(100, 0, "gpt2") is not splitter
+    assert get_text_splitter(100, 10) is not splitter
+    assert get_text_splitter(200) is not splitter
+
+
+def test_count_tokens():
+    """
+    Test counting tokens for many texts, with special tokens counted as text
+    """
+    assert count_tokens(["study", "", "ab", "<|endoftext|>"]) == [
+        len(BYTE_ENCODING.encode_ordinary("study")),
+        0,
+        2,
+        len("<|endoftext|>"),
+    ]
+
+
+def test_encoding_cache_dir(monkeypatch, tmp_path):
+    """
+    Test that the configured cache directory is used (and inherited by worker
+    processes through the environment), and that missing encodings are reported
+    """
+    monkeypatch.setattr(config, "TIKTOKEN_CACHE_DIR", str(tmp_path))
+
+    assert get_encoding() is BYTE_ENCODING
+    assert os.environ["TIKTOKEN_CACHE_DIR"] == str(tmp_path)
+
+    def _offline(name):
+        raise OSError("offline")
+
+    get_encoding.cache_clear()
+    monkeypatch.setattr(tiktoken, "get_encoding", _offline)
+    with patch.object(tokenization.logging, "error") as log_error:
+        with pytest.raises(OSError):
+            get_encoding("missing")
+    assert str(tmp_path) in log_error.call_args.args[0]
+
+
+def test_cache_encoding(monkeypatch, tmp_path):
+    """
+    Test that caching an encoding loads it into the provided directory
+    """
+    cache_dir = tmp_path / "tiktoken"
+    loaded = []
+
+    def _get_encoding(name):
+        loaded.append((name, os.environ.get("TIKTOKEN_CACHE_DIR")))
+        return BYTE_ENCODING
+
+    monkeypatch.setattr(tiktoken, "get_encoding", _get_encoding)
+    get_encoding("cl100k_base")
+
+    cache_encoding(str(cache_dir), "cl100k_base")
+
+    assert cache_dir.is_dir()
+    assert loaded[-1] == ("cl100k_base", str(cache_dir))
+    assert configure_encoding_cache() == str(cache_dir)
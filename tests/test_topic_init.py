@@ -0,0 +1,483 @@
+import asyncio
+import os
+import threading
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from gen3discoveryai import config
+from gen3discoveryai.factory import Factory
+from gen3discoveryai.main import lifespan, watch_topic_config
+from gen3discoveryai.topic_chains.base import TopicChain
+from gen3discoveryai.topic_init import (
+    TOPIC_FAILED,
+    TOPIC_INIT_BACKGROUND,
+    TOPIC_INIT_LAZY,
+    TOPIC_PENDING,
+    TOPIC_READY,
+    TopicInitializer,
+    preload_topics,
+    read_config,
+)
+
+
+class FakeTopicChain:
+    """
+    Topic chain which records how it was created and warmed up
+    """
+
+    NAME = "FakeTopicChain"
+    created = []
+    # waited on when created, if set
+    barrier = None
+    fail_topics = set()
+
+    def __init__(self, topic, metadata):
+        self.topic = topic
+        self.metadata = metadata
+        self.warmed_up = False
+        if self.barrier:
+            self.barrier.wait()
+        if topic in self.fail_topics:
+            raise ValueError(f"can't create {topic}")
+        self.created.append(topic)
+        self.arun = AsyncMock(return_value={"result": "yes", "source_documents": []})
+
+    def warm_up(self):
+        self.warmed_up = True
+
+
+@pytest.fixture
+def fake_chain():
+    FakeTopicChain.created = []
+    FakeTopicChain.barrier = None
+    FakeTopicChain.fail_topics = set()
+    yield FakeTopicChain
+
+
+def _initializer(topics, mode="eager", warm_up=True):
+    factory = Factory()
+    factory.register(FakeTopicChain.NAME, FakeTopicChain)
+    return TopicInitializer(
+        factory,
+        {topic: {"description": topic} for topic in topics},
+        {topic: FakeTopicChain.NAME for topic in topics},
+        mode=mode,
+        warm_up=warm_up,
+    )
+
+
+def test_initialize_all_concurrently(fake_chain):
+    """
+    Test that topics are created concurrently and warmed up, and that a topic which
+    fails doesn't stop the others
+    """
+    # every topic has to be created at the same time to get past the barrier
+    fake_chain.barrier = threading.Barrier(3, timeout=10)
+    fake_chain.fail_topics = {"broken"}
+    initializer = _initializer(["default", "bdc", "broken"])
+
+    assert not initializer.is_ready()
+
+    errors = initializer.initialize_all(concurrency=3)
+
+    assert list(errors) == ["broken"]
+    assert sorted(fake_chain.created) == ["bdc", "default"]
+    default_chain = initializer.config_topics["default"]["topic_chain"]
+    assert default_chain.warmed_up
+    assert default_chain.metadata == {
+        "description": "default",
+        "topic_chain": default_chain,
+    }
+    assert "topic_chain" not in initializer.config_topics["broken"]
+
+    statuses = initializer.get_statuses()
+    assert statuses["default"]["status"] == TOPIC_READY
+    assert statuses["default"]["seconds"] >= 0
+    assert statuses["broken"]["status"] == TOPIC_FAILED
+    assert "can't create broken" in statuses["broken"]["error"]
+    assert initializer.is_ready()
+
+
+@pytest.mark.asyncio
+async def test_ainitialize_creates_once_and_retries(fake_chain):
+    """
+    Test that concurrent requests for a topic share one creation, and that a topic
+    which failed is created on its next request
+    """
+    fake_chain.fail_topics = {"default"}
+    initializer = _initializer(["default"], mode=TOPIC_INIT_LAZY, warm_up=False)
+
+    with pytest.raises(ValueError):
+        await initializer.ainitialize("default")
+    assert initializer.get_statuses()["default"]["status"] == TOPIC_FAILED
+
+    fake_chain.fail_topics = set()
+    chains = await asyncio.gather(
+        *[initializer.ainitialize("default") for _ in range(5)]
+    )
+
+    assert fake_chain.created == ["default"]
+    assert all(chain is chains[0] for chain in chains)
+    assert not chains[0].warmed_up
+    assert initializer.get_statuses()["default"]["status"] == TOPIC_READY
+
+
+def test_invalid_init_mode():
+    """
+    Test that unknown modes are rejected
+    """
+    with pytest.raises(ValueError):
+        _initializer(["default"], mode="sometimes")
+
+
+@pytest.mark.parametrize(
+    "mode,initialized,expected_status_code,expected_status",
+    [
+        (TOPIC_INIT_BACKGROUND, False, 503, "INITIALIZING"),
+        (TOPIC_INIT_BACKGROUND, True, 200, "OK"),
+        (TOPIC_INIT_LAZY, False, 200, "OK"),
+    ],
+)
+def test_status_readiness(
+    mode,
+    initialized,
+    expected_status_code,
+    expected_status,
+    fake_chain,
+    client,
+    monkeypatch,
+):
+    """
+    Test that /_status reports each topic's readiness, and isn't ready until topics
+    are created unless they're created lazily
+    """
+    initializer = _initializer(["default", "bdc"], mode=mode)
+    if initialized:
+        initializer.initialize_all()
+    monkeypatch.setattr(
+        "gen3discoveryai.routes.get_topic_initializer", lambda: initializer
+    )
+
+    response = client.get("/_status")
+
+    assert response.status_code == expected_status_code
+    assert response.json()["status"] == expected_status
+    assert response.json()["topics"]["bdc"]["status"] == (
+        TOPIC_READY if initialized else TOPIC_PENDING
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", [TOPIC_INIT_LAZY, TOPIC_INIT_BACKGROUND])
+@patch("gen3discoveryai.main.get_topic_chain_factory")
+async def test_topics_created_after_startup(
+    get_topic_chain_factory, mode, fake_chain, client, monkeypatch
+):
+    """
+    Test that topics are created on their first request in lazy mode (or in the
+    background), and are listed with their chain before they're created
+    """
+    get_topic_chain_factory.return_value.get.side_effect = (
+        lambda name, **kwargs: FakeTopicChain(**kwargs)
+    )
+    monkeypatch.setattr(config, "TOPIC_INIT_MODE", mode)
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    # only create the topics when asked to
+    release = threading.Event()
+    monkeypatch.setattr(FakeTopicChain, "barrier", MagicMock(wait=release.wait))
+
+    async with lifespan(client.app, force_reload_config=True):
+        assert client.get("/_status").status_code == (
+            200 if mode == TOPIC_INIT_LAZY else 503
+        )
+        assert (
+            client.get("/topics/bdc").json()["topics"]["bdc"]["topic_chain"]
+            == config.BDC_CHAIN_NAME
+        )
+        assert fake_chain.created == []
+
+        release.set()
+        response = client.post(
+            "/ask", json={"query": "covid?"}, params={"topic": "bdc"}
+        )
+
+        assert response.status_code == 200
+        assert response.json()["response"] == "yes"
+        assert "bdc" in fake_chain.created
+        if mode == TOPIC_INIT_LAZY:
+            assert fake_chain.created == ["bdc"]
+
+
+def test_warm_up():
+    """
+    Test that warming up queries the vectorstore's index with a stored vector, and
+    does nothing for an empty (or missing) vectorstore
+    """
+    vectorstore = MagicMock()
+    vectorstore._collection.get.return_value = {"embeddings": [[0.1, 0.2]]}
+    TopicChain(
+        name="test", topic="default", chain=MagicMock(), vectorstore=vectorstore
+    ).warm_up()
+
+    vectorstore._collection.query.assert_called_once_with(
+        query_embeddings=[[0.1, 0.2]], n_results=1, include=["distances"]
+    )
+
+    vectorstore._collection.get.return_value = {"embeddings": []}
+    vectorstore._collection.query.reset_mock()
+    TopicChain(
+        name="test", topic="default", chain=MagicMock(), vectorstore=vectorstore
+    ).warm_up()
+    vectorstore._collection.query.assert_not_called()
+
+    TopicChain(name="test", topic="default", chain=MagicMock()).warm_up()
+
+
+def test_reload_rebuilds_only_changed_topics(fake_chain):
+    """
+    Test that a reload creates new chains for changed and added topics before
+    swapping them in, keeps the chains of unchanged topics, and removes topics which
+    are no longer configured
+    """
+    initializer = _initializer(["default", "bdc", "old"])
+    initializer.initialize_all()
+    config_topics = initializer.config_topics
+    default_chain = config_topics["default"]["topic_chain"]
+    # held by a request in progress
+    bdc_config = config_topics["bdc"]
+
+    result = initializer.reload(
+        {
+            "default": {"description": "default"},
+            "bdc": {"description": "new bdc"},
+            "new": {"description": "new"},
+        },
+        {topic: FakeTopicChain.NAME for topic in ["default", "bdc", "new"]},
+    )
+
+    assert result == {
+        "added": ["new"],
+        "changed": ["bdc"],
+        "removed": ["old"],
+        "unchanged": ["default"],
+        "errors": {},
+    }
+    assert initializer.config_topics is config_topics
+    assert list(config_topics) == ["default", "bdc", "new"]
+    assert config_topics["default"]["topic_chain"] is default_chain
+    assert config_topics["bdc"]["topic_chain"].metadata["description"] == "new bdc"
+    assert config_topics["bdc"]["topic_chain"].warmed_up
+    assert bdc_config["topic_chain"].metadata["description"] == "bdc"
+    assert sorted(fake_chain.created) == ["bdc", "bdc", "default", "new", "old"]
+    assert set(initializer.get_statuses()) == {"default", "bdc", "new"}
+    assert initializer.get_statuses()["new"]["status"] == TOPIC_READY
+
+
+def test_reload_keeps_topics_which_fail(fake_chain):
+    """
+    Test that a topic whose new chain can't be created keeps its current one, and
+    that topics which aren't created yet are left to be created on their first request
+    """
+    initializer = _initializer(["default", "bdc"], mode=TOPIC_INIT_LAZY)
+    initializer.initialize("default")
+    default_chain = initializer.config_topics["default"]["topic_chain"]
+    fake_chain.fail_topics = {"default"}
+
+    result = initializer.reload(
+        {
+            "default": {"description": "new default"},
+            "bdc": {"description": "new bdc"},
+            "new": {"description": "new"},
+        },
+        {topic: FakeTopicChain.NAME for topic in ["default", "bdc", "new"]},
+    )
+
+    assert result["changed"] == ["bdc"]
+    assert result["added"] == ["new"]
+    assert "can't create default" in result["errors"]["default"]
+    assert initializer.config_topics["default"] == {
+        "description": "default",
+        "topic_chain": default_chain,
+    }
+    assert initializer.config_topics["bdc"] == {"description": "new bdc"}
+    assert fake_chain.created == ["default"]
+    assert initializer.get_statuses()["new"]["status"] == TOPIC_PENDING
+
+    assert initializer.initialize("new").metadata["description"] == "new"
+
+
+@pytest.mark.parametrize("mode", ["eager", TOPIC_INIT_BACKGROUND])
+def test_reload_creates_changed_topics_which_failed(fake_chain, mode):
+    """
+    Test that, unless topics are created lazily, a reload creates a changed topic
+    whose chain failed to be created, so it's ready (instead of pending) afterwards
+    and the service stays ready, and that it stays failed if it fails again
+    """
+    initializer = _initializer(["default", "bdc"], mode=mode)
+    fake_chain.fail_topics = {"bdc"}
+    initializer.initialize_all()
+    assert initializer.get_statuses()["bdc"]["status"] == TOPIC_FAILED
+    chain_names = {topic: FakeTopicChain.NAME for topic in ["default", "bdc"]}
+
+    result = initializer.reload(
+        {"default": {"description": "default"}, "bdc": {"description": "still bad"}},
+        chain_names,
+    )
+
+    assert "can't create bdc" in result["errors"]["bdc"]
+    assert initializer.get_statuses()["bdc"]["status"] == TOPIC_FAILED
+    assert initializer.is_ready()
+
+    fake_chain.fail_topics = set()
+    result = initializer.reload(
+        {"default": {"description": "default"}, "bdc": {"description": "fixed"}},
+        chain_names,
+    )
+
+    assert result["changed"] == ["bdc"]
+    assert result["errors"] == {}
+    assert fake_chain.created == ["default", "bdc"]
+    assert (
+        initializer.config_topics["bdc"]["topic_chain"].metadata["description"]
+        == "fixed"
+    )
+    assert initializer.get_statuses()["bdc"]["status"] == TOPIC_READY
+    assert initializer.is_ready()
+
+
+def test_reload_topics_route(fake_chain, client, monkeypatch):
+    """
+    Test reloading the topic configuration through the API, and that the current
+    topics are unchanged if it can't be read
+    """
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    initializer = _initializer(["default", "bdc"])
+    initializer.initialize_all()
+    monkeypatch.setattr(
+        "gen3discoveryai.topic_init.get_topic_initializer", lambda: initializer
+    )
+    settings = SimpleNamespace(
+        TOPICS="default,bdc",
+        DEFAULT_CHAIN_NAME=FakeTopicChain.NAME,
+        DEFAULT_DESCRIPTION="default",
+        DEFAULT_SYSTEM_PROMPT="",
+        DEFAULT_METADATA={},
+        BDC_CHAIN_NAME=FakeTopicChain.NAME,
+        BDC_DESCRIPTION="bdc",
+        BDC_SYSTEM_PROMPT="",
+        BDC_METADATA={},
+    )
+    # restored after the test
+    for name in vars(settings):
+        monkeypatch.setattr(config, name, getattr(config, name, None), raising=False)
+    read_config = MagicMock(return_value=settings)
+    monkeypatch.setattr("gen3discoveryai.topic_init.read_config", read_config)
+    assert client.post("/topics/reload").status_code == 200
+    default_chain = initializer.config_topics["default"]["topic_chain"]
+
+    settings.BDC_SYSTEM_PROMPT = "new prompt"
+    settings.BDC_METADATA = {"model_temperature": "0.1"}
+    response = client.post("/topics/reload")
+
+    assert response.status_code == 200
+    assert response.json()["changed"] == ["bdc"]
+    assert response.json()["unchanged"] == ["default"]
+    assert initializer.config_topics["default"]["topic_chain"] is default_chain
+    bdc_chain = initializer.config_topics["bdc"]["topic_chain"]
+    assert bdc_chain.metadata["system_prompt"] == "new prompt"
+    assert bdc_chain.metadata["model_temperature"] == "0.1"
+    assert config.BDC_SYSTEM_PROMPT == "new prompt"
+
+    read_config.side_effect = ValueError("bad metadata")
+    assert client.post("/topics/reload").status_code == 500
+    assert initializer.config_topics["bdc"]["topic_chain"] is bdc_chain
+
+
+@pytest.mark.asyncio
+async def test_watch_topic_config(monkeypatch, tmp_path):
+    """
+    Test that topics are reloaded when the configuration file changes, and that a
+    reload which fails doesn't stop the watcher
+    """
+    env_file = tmp_path / ".env"
+    env_file.write_text("TOPICS=default")
+    monkeypatch.setattr(config, "ENV_FILE", str(env_file))
+    reload_topics = AsyncMock(side_effect=[ValueError("bad config"), {}])
+    monkeypatch.setattr("gen3discoveryai.main.reload_topics", reload_topics)
+
+    watcher = asyncio.create_task(watch_topic_config(0.01))
+    try:
+        await asyncio.sleep(0.05)
+        assert reload_topics.call_count == 0
+
+        for modified in (1, 2):
+            os.utime(env_file, ns=(modified, modified))
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if reload_topics.call_count == modified:
+                    break
+    finally:
+        watcher.cancel()
+
+    assert reload_topics.call_count == 2
+
+
+def test_read_config(monkeypatch):
+    """
+    Test that reading the configuration again doesn't change the one in use
+    """
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    monkeypatch.setenv("BDC_SYSTEM_PROMPT", "new prompt")
+
+    settings = read_config()
+
+    assert settings is not config
+    assert settings.TOPICS == "default,bdc,usedefault,ollama"
+    assert settings.BDC_SYSTEM_PROMPT == "new prompt"
+    assert settings.BDC_METADATA["model_name"] == "gpt-5-mini"
+    assert config.BDC_SYSTEM_PROMPT != "new prompt"
+
+
+@patch("gen3discoveryai.topic_init.gc")
+@patch("gen3discoveryai.topic_init.get_topic_chain_factory")
+def test_preload_topics(get_topic_chain_factory, gc, client):
+    """
+    Test that preloading imports the configured chains without creating them (even
+    when one can't be imported) and freezes what was imported
+    """
+    chain_factory = get_topic_chain_factory.return_value
+    chain_factory.get_class.side_effect = [ImportError("no provider"), MagicMock()]
+
+    preload_topics()
+
+    imported = [call.args[0] for call in chain_factory.get_class.call_args_list]
+    assert sorted(imported) == sorted(set(imported))
+    assert config.BDC_CHAIN_NAME in imported
+    chain_factory.get.assert_not_called()
+    gc.freeze.assert_called_once()
+
+
+def test_reset_after_fork():
+    """
+    Test that process-wide clients which can't be used after a fork are forgotten in
+    the child, so they're created again when needed
+    """
+    from chromadb.api.shared_system_client import SharedSystemClient
+
+    from gen3discoveryai import cache, embeddings, usage_limits
+    from gen3discoveryai.topic_chains import base
+
+    executor = base.get_sync_chain_executor()
+    SharedSystemClient._identifier_to_system["some path"] = MagicMock()
+
+    for module in (base, cache, embeddings, usage_limits):
+        module._reset_after_fork()
+
+    assert base.get_sync_chain_executor() is not executor
+    assert "some path" not in SharedSystemClient._identifier_to_system
+    assert cache._answer_cache is None
+    assert embeddings._disk_tier is None
+    assert usage_limits._usage_limiter is None
+    executor.shutdown()
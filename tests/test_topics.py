@@ -1,10 +1,12 @@
+from collections import OrderedDict
 from unittest.mock import AsyncMock, patch
 
 import pytest
 
-from gen3discoveryai import config
+from gen3discoveryai import config, topic_chains
 from gen3discoveryai.factory import Factory
 from gen3discoveryai.main import lifespan
+from gen3discoveryai.utils import TOPIC_CHAINS, get_topic_chain_factory
 
 
 @pytest.mark.asyncio
@@ -193,3 +195,34 @@ def test_topic_chain_factory_doesnt_exist():
 
     with pytest.raises(ValueError):
         factory.get("DOESNTEXIST", some_arg="foobar")
+
+
+def test_topic_chain_factory_dotted_path():
+    """
+    Test that classes registered by dotted path are imported on first use
+    """
+    factory = Factory()
+    factory.register("OrderedDict", "collections.OrderedDict")
+    factory.register("Missing", "collections.DoesntExist")
+    factory.register("MissingModule", "doesntexist.ClassName")
+
+    instance = factory.get("OrderedDict", a=1)
+
+    assert isinstance(instance, OrderedDict)
+    assert instance == {"a": 1}
+    assert factory.get_class("OrderedDict") is OrderedDict
+    with pytest.raises(ImportError):
+        factory.get("Missing")
+    with pytest.raises(ImportError):
+        factory.get("MissingModule")
+
+
+def test_topic_chain_factory_registers_chains():
+    """
+    Test that every topic chain is registered under its name
+    """
+    chain_factory = get_topic_chain_factory()
+
+    for chain_name in TOPIC_CHAINS:
+        assert chain_factory.get_class(chain_name).NAME == chain_name
+        assert getattr(topic_chains, chain_name) is chain_factory.get_class(chain_name)
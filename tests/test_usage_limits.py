@@ -0,0 +1,385 @@
+import sys
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from langchain_classic.schema import AIMessage, ChatGeneration, LLMResult
+
+from gen3discoveryai import config, usage_limits
+from gen3discoveryai.usage_limits import (
+    LLM_TOKENS,
+    REQUESTS,
+    InMemoryCounterStore,
+    LLMTokenUsageCallbackHandler,
+    RedisCounterStore,
+    SlidingWindowLimiter,
+    SQLiteCounterStore,
+    estimate_tokens,
+    get_usage_limiter,
+)
+
+
+class FakeRedisPipeline:
+    """
+    Queues commands and applies them to the fake's data on `execute`
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def incrby(self, key, amount):
+        self.commands.append(("incrby", key, amount))
+
+    def expire(self, key, ttl):
+        self.commands.append(("expire", key, ttl))
+
+    def get(self, key):
+        self.commands.append(("get", key))
+
+    def execute(self):
+        self.redis.round_trips += 1
+        results = []
+        for command, key, *args in self.commands:
+            value, expires_at = self.redis.data.get(key, (None, None))
+            if expires_at is not None and expires_at <= time.time():
+                value, expires_at = None, None
+            if command == "incrby":
+                value = int(value or 0) + args[0]
+                self.redis.data[key] = (str(value).encode(), expires_at)
+                results.append(value)
+            elif command == "expire":
+                if value is not None:
+                    self.redis.data[key] = (value, time.time() + args[0])
+                results.append(value is not None)
+            else:
+                results.append(value)
+        return results
+
+
+class FakeRedis:
+    """
+    Local stand-in for the parts of a Redis client we use
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    def pipeline(self):
+        return FakeRedisPipeline(self)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    """
+    Each counter store
+    """
+    if request.param == "memory":
+        return InMemoryCounterStore()
+    if request.param == "sqlite":
+        return SQLiteCounterStore(str(tmp_path / "usage.sqlite"))
+    return RedisCounterStore(FakeRedis())
+
+
+@pytest.fixture
+def fresh_usage_limiter(monkeypatch):
+    """
+    Enable usage limits with a fresh in-memory limiter
+    """
+    monkeypatch.setattr(config, "USER_LIMITS_ENABLED", True)
+    monkeypatch.setattr(config, "USER_LIMITS_BACKEND", "memory")
+    monkeypatch.setattr(usage_limits, "_usage_limiter", None)
+
+
+def test_store_sync(store):
+    """
+    Test that counters are incremented and read, and expire
+    """
+    assert store.sync({"a": 2}, ["b"], ttl=60) == {"a": 2, "b": 0}
+    assert store.sync({"a": 3, "b": 1}, [], ttl=60) == {"a": 5, "b": 1}
+    assert store.sync({}, ["a", "b"], ttl=60) == {"a": 5, "b": 1}
+    assert store.sync({"a": -1}, [], ttl=60) == {"a": 4}
+
+    store.sync({"c": 1}, [], ttl=-1)
+    assert store.sync({}, ["c"], ttl=60) == {"c": 0}
+
+
+def test_sqlite_store_shared_between_instances(tmp_path):
+    """
+    Test that separate connections (e.g. gunicorn workers) share counters
+    """
+    path = str(tmp_path / "usage.sqlite")
+    SQLiteCounterStore(path).sync({"a": 2}, [], ttl=60)
+    assert SQLiteCounterStore(path).sync({"a": 1}, [], ttl=60) == {"a": 3}
+
+
+def test_limiter_enforces_limit(store):
+    """
+    Test that usage within the limit is allowed, usage over it is rejected (without
+    consuming anything), and the remaining quota is reported
+    """
+    limiter = SlidingWindowLimiter(store, window_seconds=100, local_sync_seconds=0)
+    now = 1000.0
+
+    decisions = [limiter.check("user", limit=3, now=now) for _ in range(4)]
+
+    assert [decision.allowed for decision in decisions] == [True, True, True, False]
+    assert [decision.remaining for decision in decisions] == [2, 1, 0, 0]
+    assert decisions[-1].reset_seconds == pytest.approx(100)
+    assert store.sync({}, ["user:10"], ttl=60) == {"user:10": 3}
+
+
+def test_limiter_sliding_window():
+    """
+    Test that usage from the previous window counts less the further we are into
+    the current one
+    """
+    limiter = SlidingWindowLimiter(
+        InMemoryCounterStore(), window_seconds=100, local_sync_seconds=0
+    )
+    for _ in range(10):
+        assert limiter.check("user", limit=10, now=1050.0).allowed
+
+    # previous window is weighted 0.75, 10 * 0.75 + 1 > 8
+    rejected = limiter.check("user", limit=8, now=1125.0)
+    assert not rejected.allowed
+    # previous window weight needs to drop to 0.7
+    assert rejected.reset_seconds == pytest.approx(5)
+
+    # the rejection is remembered locally until then
+    assert not limiter.check("user", limit=8, now=1129.0).allowed
+    assert limiter.check("user", limit=8, now=1131.0).allowed
+
+
+def test_limiter_local_tier_avoids_store():
+    """
+    Test that users well under their limit are decided locally and their usage is
+    flushed to the store later, and rejected users don't hit the store at all
+    """
+    redis = FakeRedis()
+    limiter = SlidingWindowLimiter(
+        RedisCounterStore(redis), window_seconds=100, local_sync_seconds=10
+    )
+    now = 1000.0
+
+    for _ in range(5):
+        assert limiter.check("user", limit=10, now=now).allowed
+    # first check syncs, the rest were decided locally
+    assert redis.round_trips == 1
+
+    # close to the limit, every check goes to the store (flushing pending usage)
+    for _ in range(5):
+        assert limiter.check("user", limit=10, now=now).allowed
+    assert int(redis.data["user:10"][0]) == 10
+    round_trips = redis.round_trips
+
+    # rejected, which is remembered so the next checks don't need the store
+    for _ in range(5):
+        assert not limiter.check("user", limit=10, now=now).allowed
+    assert redis.round_trips == round_trips + 2
+    assert int(redis.data["user:10"][0]) == 10
+
+    # other workers see usage in the shared store
+    other_worker = SlidingWindowLimiter(
+        RedisCounterStore(redis), window_seconds=100, local_sync_seconds=10
+    )
+    assert not other_worker.check("user", limit=10, now=now).allowed
+
+
+def test_limiter_record():
+    """
+    Test that recorded usage is flushed to the store once close to the limit
+    """
+    store = InMemoryCounterStore()
+    limiter = SlidingWindowLimiter(store, window_seconds=100, local_sync_seconds=10)
+    now = 1000.0
+
+    assert limiter.check("tokens", limit=100, amount=0, now=now).allowed
+    limiter.record("tokens", limit=100, amount=10, now=now)
+    assert store.sync({}, ["tokens:10"], ttl=60) == {"tokens:10": 0}
+
+    limiter.record("tokens", limit=100, amount=95, now=now)
+    assert store.sync({}, ["tokens:10"], ttl=60) == {"tokens:10": 105}
+    assert not limiter.check("tokens", limit=100, amount=0, now=now).allowed
+
+
+def test_limiter_store_unavailable():
+    """
+    Test that the local view is used when the store is unavailable
+    """
+    store = MagicMock()
+    store.sync.side_effect = Exception("store unavailable")
+    limiter = SlidingWindowLimiter(store, window_seconds=100, local_sync_seconds=0)
+
+    assert limiter.check("user", limit=1, now=1000.0).allowed
+    assert not limiter.check("user", limit=1, now=1000.0).allowed
+
+
+def test_limiter_local_tier_pruned():
+    """
+    Test that the local state of counters which weren't used in the current or
+    previous window is dropped, so the local tier doesn't grow with every user seen
+    """
+    limiter = SlidingWindowLimiter(
+        InMemoryCounterStore(), window_seconds=100, local_sync_seconds=10
+    )
+    for user in range(100):
+        limiter.check(f"anonymous:{user}", limit=10, now=1050.0)
+    assert len(limiter._local) == 100
+
+    # still needed for the previous window's usage
+    limiter.check("user", limit=10, now=1150.0)
+    assert len(limiter._local) == 101
+
+    limiter.check("user", limit=10, now=1250.0)
+    assert list(limiter._local) == ["user"]
+
+
+def test_usage_limiter_checks_tokens_before_requests(fresh_usage_limiter, monkeypatch):
+    """
+    Test that a request isn't used up when there are no LLM tokens left, and that
+    topics can override the limits
+    """
+    monkeypatch.setattr(config, "USER_LLM_TOKEN_LIMIT", 100)
+    usage_limiter = get_usage_limiter()
+    topic_config = {"user_request_limit": "5"}
+
+    decisions = usage_limiter.check("user", "topic", topic_config)
+    assert decisions[REQUESTS].allowed
+    assert decisions[REQUESTS].limit == 5
+    assert decisions[LLM_TOKENS].limit == 100
+
+    usage_limiter.record_llm_tokens("user", "topic", topic_config, 100)
+    decisions = usage_limiter.check("user", "topic", topic_config)
+    assert not decisions[LLM_TOKENS].allowed
+    assert not decisions[REQUESTS].allowed
+    assert decisions[REQUESTS].remaining == 4
+
+    # separate budget per topic
+    assert usage_limiter.check("user", "other", {})[LLM_TOKENS].allowed
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "redis", "unknown"])
+def test_get_usage_limiter_backends(backend, monkeypatch, tmp_path):
+    """
+    Test selecting the store and that a missing `redis` package is a clear error
+    """
+    monkeypatch.setattr(config, "USER_LIMITS_ENABLED", True)
+    monkeypatch.setattr(config, "USER_LIMITS_BACKEND", backend)
+    monkeypatch.setattr(
+        config, "USER_LIMITS_SQLITE_PATH", str(tmp_path / "usage.sqlite")
+    )
+    monkeypatch.setattr(usage_limits, "_usage_limiter", None)
+    monkeypatch.setitem(sys.modules, "redis", None)
+
+    if backend == "sqlite":
+        assert isinstance(get_usage_limiter().limiter.store, SQLiteCounterStore)
+    else:
+        with pytest.raises(ValueError):
+            get_usage_limiter()
+
+
+def test_get_usage_limiter_disabled(monkeypatch):
+    """
+    Test that there's no limiter when usage limits are disabled
+    """
+    monkeypatch.setattr(config, "USER_LIMITS_ENABLED", False)
+    assert get_usage_limiter() is None
+
+
+def test_llm_token_usage_callback_handler():
+    """
+    Test adding up tokens from message usage metadata or the provider's LLM output
+    """
+    handler = LLMTokenUsageCallbackHandler()
+    message = AIMessage(
+        content="hi",
+        usage_metadata={"input_tokens": 10, "output_tokens": 5, "total_tokens": 15},
+    )
+    handler.on_llm_end(
+        LLMResult(generations=[[ChatGeneration(message=message)]], llm_output=None)
+    )
+    handler.on_llm_end(
+        LLMResult(generations=[[]], llm_output={"token_usage": {"total_tokens": 20}})
+    )
+
+    assert handler.total_tokens == 35
+    assert estimate_tokens("a" * 10, "b" * 6) == 4
+
+
+def test_ask_user_limits(fresh_usage_limiter, client, monkeypatch, tmp_path):
+    """
+    Test that users get remaining quota headers and a 429 once over the limit, and
+    that the LLM tokens used are counted
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "USER_REQUEST_LIMIT", 2)
+
+    async def _arun(*args, **kwargs):
+        return {"result": "a" * 40, "source_documents": []}
+
+    mock_topic_chain = MagicMock(NAME="SomeChain")
+    mock_topic_chain.arun = _arun
+    monkeypatch.setattr(
+        config, "topics", {"default": {"topic_chain": mock_topic_chain}}
+    )
+
+    first = client.post("/ask", json={"query": "a" * 40})
+    assert first.status_code == 200
+    assert first.headers["X-RateLimit-Limit-Requests"] == "2"
+    assert first.headers["X-RateLimit-Remaining-Requests"] == "1"
+
+    second = client.post("/ask", json={"query": "b" * 40})
+    assert second.status_code == 200
+    assert second.headers["X-RateLimit-Remaining-Requests"] == "0"
+    # estimated 20 tokens for the first request
+    assert int(second.headers["X-RateLimit-Remaining-Tokens"]) == (
+        config.USER_LLM_TOKEN_LIMIT - 20
+    )
+
+    third = client.post("/ask", json={"query": "c" * 40})
+    assert third.status_code == 429
+    assert third.headers["X-RateLimit-Remaining-Requests"] == "0"
+    assert int(third.headers["Retry-After"]) > 0
+
+    # unknown topics aren't counted (or limited), the route rejects them
+    unknown = client.post("/ask?topic=unknown", json={"query": "d" * 40})
+    assert unknown.status_code == 404
+    assert "X-RateLimit-Remaining-Requests" not in unknown.headers
+    local_keys = usage_limits.get_usage_limiter().limiter._local
+    assert not any(":unknown:" in key for key in local_keys)
+
+
+def test_ask_stream_user_limits(fresh_usage_limiter, client, monkeypatch, tmp_path):
+    """
+    Test that streaming responses get remaining quota headers and count LLM tokens
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "DEBUG_SKIP_AUTH", True)
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", False)
+
+    async def _astream(*args, **kwargs):
+        yield "documents", []
+        yield "token", "a" * 40
+        yield "result", {"result": "a" * 40}
+
+    mock_topic_chain = MagicMock(NAME="SomeChain")
+    mock_topic_chain.astream = _astream
+    monkeypatch.setattr(
+        config, "topics", {"default": {"topic_chain": mock_topic_chain}}
+    )
+
+    response = client.post("/ask/stream", json={"query": "a" * 40})
+    assert response.status_code == 200
+    assert "event: end" in response.text
+    assert response.headers["X-RateLimit-Remaining-Requests"] == str(
+        config.USER_REQUEST_LIMIT - 1
+    )
+
+    decisions = get_usage_limiter().check(
+        "anonymous:testclient", "default", config.topics["default"]
+    )
+    assert decisions[LLM_TOKENS].remaining == config.USER_LLM_TOKEN_LIMIT - 20
@@ -0,0 +1,281 @@
+import os
+from unittest.mock import patch
+
+import chromadb
+import numpy as np
+import pytest
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from gen3discoveryai import config, vectorstores
+from gen3discoveryai.topic_chains.question_answer_openai import (
+    TopicChainOpenAiQuestionAnswerRAG,
+)
+from gen3discoveryai.vectorstores import (
+    VECTORSTORE_CHROMA,
+    VECTORSTORE_NUMPY,
+    NumpyVectorStore,
+    close_vectorstore,
+    get_vectorstore,
+    get_vectorstore_backend,
+    warm_up_vectorstore,
+)
+
+TEXTS = [f"study {i} of {subject}" for i in range(10) for subject in ("heart", "lung")]
+
+
+@pytest.fixture
+def embeddings():
+    return DeterministicFakeEmbedding(size=16)
+
+
+def _numpy_vectorstore(directory, embeddings, texts=TEXTS):
+    return NumpyVectorStore.from_texts(
+        texts,
+        embeddings,
+        metadatas=[{"source": text} for text in texts],
+        ids=texts,
+        directory=str(directory),
+        collection_name="test",
+    )
+
+
+def test_scores_match_chroma(tmp_path, embeddings):
+    """
+    Test that searches return the same documents and scores as a Chroma collection
+    using the cosine space, including with a similarity score threshold
+    """
+    numpy_vectorstore = _numpy_vectorstore(tmp_path / "numpy", embeddings)
+    chroma_vectorstore = Chroma(
+        client=chromadb.PersistentClient(
+            path=str(tmp_path / "chroma"),
+            settings=chromadb.Settings(anonymized_telemetry=False),
+        ),
+        collection_name="test",
+        embedding_function=embeddings,
+        collection_metadata={"hnsw:space": "cosine"},
+    )
+    chroma_vectorstore.add_texts(
+        TEXTS, metadatas=[{"source": text} for text in TEXTS], ids=TEXTS
+    )
+
+    for query in ("study 3 of heart", "something else"):
+        numpy_results = numpy_vectorstore.similarity_search_with_relevance_scores(
+            query, k=5
+        )
+        chroma_results = chroma_vectorstore.similarity_search_with_relevance_scores(
+            query, k=5
+        )
+        assert [document.id for document, _ in numpy_results] == [
+            document.id for document, _ in chroma_results
+        ]
+        assert np.allclose(
+            [score for _, score in numpy_results],
+            [score for _, score in chroma_results],
+            atol=1e-5,
+        )
+        assert numpy_results[0][0].metadata == chroma_results[0][0].metadata
+
+    # a threshold between the best and second best matches only keeps the best
+    scores = [score for _, score in numpy_results]
+    search_kwargs = {"k": 5, "score_threshold": (scores[0] + scores[1]) / 2}
+    retrieved = [
+        vectorstore.as_retriever(
+            search_type="similarity_score_threshold", search_kwargs=search_kwargs
+        ).invoke("something else")
+        for vectorstore in (numpy_vectorstore, chroma_vectorstore)
+    ]
+    assert len(retrieved[0]) == 1
+    assert retrieved[0] == retrieved[1]
+
+
+def test_numpy_vectorstore_persistence(tmp_path, embeddings):
+    """
+    Test that added, replaced, and deleted documents are persisted, with new documents
+    appended to the existing files
+    """
+    vectorstore = _numpy_vectorstore(tmp_path, embeddings, TEXTS[:10])
+    vectors_path = tmp_path / "test.npy"
+    inode = os.stat(vectors_path).st_ino
+
+    vectorstore.add_texts(TEXTS[10:], ids=TEXTS[10:])
+    # appended in place
+    assert os.stat(vectors_path).st_ino == inode
+    # replaces the stored document with the same id
+    vectorstore.add_texts(["replaced"], metadatas=[{"new": True}], ids=[TEXTS[0]])
+    vectorstore.delete(ids=TEXTS[1:3])
+    vectorstore.delete(ids=[])
+
+    reopened = NumpyVectorStore(str(tmp_path), "test", embeddings)
+    assert len(reopened) == len(TEXTS) - 2
+    assert sorted(reopened.get(include=[])["ids"]) == sorted([TEXTS[0]] + TEXTS[3:])
+    assert reopened.get_by_ids([TEXTS[0], "missing"]) == [
+        Document(id=TEXTS[0], page_content="replaced", metadata={"new": True})
+    ]
+    assert reopened.similarity_search("replaced", k=1)[0].id == TEXTS[0]
+    assert np.allclose(np.linalg.norm(np.load(vectors_path), axis=1), 1.0, atol=1e-6)
+
+
+def test_numpy_vectorstore_interrupted_write(tmp_path, embeddings):
+    """
+    Test that documents written without their vectors (e.g. the process stopped
+    mid-write) are ignored and overwritten by the next write, and that vectors without
+    their documents are detected
+    """
+    _numpy_vectorstore(tmp_path, embeddings, TEXTS[:2])
+    with open(tmp_path / "test.jsonl", "a", encoding="utf-8") as documents_out:
+        documents_out.write('{"id": "partial", "document": "')
+
+    vectorstore = NumpyVectorStore(str(tmp_path), "test", embeddings)
+    assert vectorstore.get(include=[])["ids"] == TEXTS[:2]
+
+    vectorstore.add_texts([TEXTS[2]], ids=[TEXTS[2]])
+    assert NumpyVectorStore(str(tmp_path), "test", embeddings).get()["documents"] == (
+        TEXTS[:3]
+    )
+
+    with open(tmp_path / "test.jsonl", "w", encoding="utf-8") as documents_out:
+        documents_out.write("")
+    with pytest.raises(ValueError):
+        NumpyVectorStore(str(tmp_path), "test", embeddings)
+
+
+def test_numpy_vectorstore_get_and_search(tmp_path, embeddings):
+    """
+    Test getting stored documents like Chroma, and searching an empty store or with
+    more results than documents
+    """
+    empty = NumpyVectorStore(str(tmp_path / "empty"), "test", embeddings)
+    assert empty.similarity_search("study", k=3) == []
+    assert empty.get()["ids"] == []
+    empty.warm_up()
+
+    vectorstore = _numpy_vectorstore(tmp_path, embeddings)
+    stored = vectorstore.get(limit=2, offset=1, include=["embeddings", "documents"])
+    assert stored["ids"] == TEXTS[1:3]
+    assert stored["documents"] == TEXTS[1:3]
+    assert stored["metadatas"] is None
+    assert stored["embeddings"].shape == (2, 16)
+    assert vectorstore.get(ids=[TEXTS[4], "missing"])["metadatas"] == [
+        {"source": TEXTS[4]}
+    ]
+
+    results = vectorstore.similarity_search_with_score(TEXTS[5], k=100)
+    assert len(results) == len(TEXTS)
+    assert results[0][0].id == TEXTS[5]
+    assert results[0][1] == pytest.approx(0.0, abs=1e-6)
+    assert [score for _, score in results] == sorted(score for _, score in results)
+
+    vectorstore.warm_up()
+
+    with pytest.raises(ValueError):
+        vectorstore.similarity_search("study", filter={"source": TEXTS[0]})
+    with pytest.raises(ValueError):
+        vectorstore.add_vectors(["short"], [[1.0, 0.0]])
+    with pytest.raises(ValueError):
+        NumpyVectorStore.from_texts(TEXTS, embeddings)
+
+    vectorstore.close()
+    assert vectorstore.similarity_search("study") == []
+
+
+def test_numpy_vectorstore_in_other_backends_directory(tmp_path, embeddings):
+    """
+    Test that opening a directory which has other files but no vectors (e.g. a Chroma
+    knowledge store after switching the topic's backend) logs an error, while an
+    empty or new directory doesn't
+    """
+    with patch.object(vectorstores.logging, "error") as log_error:
+        NumpyVectorStore(str(tmp_path / "new"), "test", embeddings)
+        NumpyVectorStore(str(tmp_path), "test", embeddings)
+        assert not log_error.called
+
+        (tmp_path / "chroma.sqlite3").write_bytes(b"")
+        vectorstore = NumpyVectorStore(str(tmp_path), "test", embeddings)
+
+    assert len(vectorstore) == 0
+    assert log_error.call_count == 1
+    assert "test.npy" in log_error.call_args.args[0]
+
+
+def test_get_vectorstore_backend():
+    """
+    Test the backend configured in a topic's metadata, which defaults to Chroma
+    """
+    assert get_vectorstore_backend({}) == VECTORSTORE_CHROMA
+    assert get_vectorstore_backend({"vectorstore": "NumPy"}) == VECTORSTORE_NUMPY
+    with pytest.raises(ValueError):
+        get_vectorstore_backend({"vectorstore": "faiss"})
+
+
+@pytest.mark.parametrize("backend", [VECTORSTORE_CHROMA, VECTORSTORE_NUMPY])
+def test_get_vectorstore(backend, tmp_path, embeddings):
+    """
+    Test that the configured backend's vectorstore is created, persisted in the
+    directory, and can be warmed up and closed
+    """
+    vectorstore = get_vectorstore(
+        "test",
+        embeddings,
+        str(tmp_path),
+        backend,
+        chroma_collection_metadata={"hnsw:space": "cosine"},
+    )
+    vectorstore.add_texts(TEXTS, ids=TEXTS)
+    warm_up_vectorstore(vectorstore)
+
+    if backend == VECTORSTORE_NUMPY:
+        assert isinstance(vectorstore, NumpyVectorStore)
+        assert os.path.exists(tmp_path / "test.npy")
+    else:
+        assert isinstance(vectorstore, Chroma)
+        assert vectorstore._collection.metadata == {"hnsw:space": "cosine"}
+        assert os.path.exists(tmp_path / "chroma.sqlite3")
+    assert vectorstore.similarity_search(TEXTS[3], k=1)[0].page_content == TEXTS[3]
+
+    close_vectorstore(vectorstore)
+    reopened = get_vectorstore("test", embeddings, str(tmp_path), backend)
+    assert len(reopened.get(include=[])["ids"]) == len(TEXTS)
+    close_vectorstore(reopened)
+
+
+def test_topic_chain_with_numpy_vectorstore(monkeypatch, tmp_path):
+    """
+    Test storing knowledge in versions of a topic's NumPy vectorstore and retrieving
+    from it with the topic's similarity score threshold
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "KNOWLEDGE_VERSIONS_TO_KEEP", 2)
+    topic_chain = TopicChainOpenAiQuestionAnswerRAG(
+        "test", {"vectorstore": "numpy", "similarity_score_threshold": "0.99"}
+    )
+    topic_chain.embeddings = DeterministicFakeEmbedding(size=8)
+
+    documents = [
+        Document(page_content=text, metadata={"source": text}) for text in TEXTS
+    ]
+    counts = topic_chain.store_knowledge(documents[:15])
+    assert counts == {"added": 15, "removed": 0, "unchanged": 0}
+    first_version = topic_chain.knowledge_version
+
+    counts = topic_chain.store_knowledge(documents[5:])
+    assert counts == {"added": 5, "removed": 5, "unchanged": 10}
+    assert isinstance(topic_chain.vectorstore, NumpyVectorStore)
+    assert os.path.exists(
+        os.path.join("knowledge", "test", "versions", topic_chain.knowledge_version)
+        + "/test.npy"
+    )
+
+    # only the exact match is similar enough
+    assert [document.page_content for document in topic_chain.retrieve(TEXTS[7])] == [
+        TEXTS[7]
+    ]
+    assert topic_chain.retrieve(TEXTS[2]) == []
+    topic_chain.warm_up()
+
+    assert topic_chain.switch_knowledge_version(first_version)
+    assert [document.page_content for document in topic_chain.retrieve(TEXTS[2])] == [
+        TEXTS[2]
+    ]
+    topic_chain.release_retired_vectorstores(grace_seconds=0)